@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+Offline end-to-end benchmark for configure_nsx_manager.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Runs configure_nsx_manager.py against the nsx_sim_server.py NSX Manager stand-in and the vsphere_sim.py vCenter
+simulator, with no network, and reports the end-to-end wall time along with the time spent in and the number of
+requests made to each NSX API endpoint, and how many connections (TLS handshakes) those requests took.
+
+Arguments
+---------
+-hosts [hosts in the simulated cluster, defaults to 4]
+-controller_seconds [how long each simulated controller deployment takes, defaults to 10]
+-host_prep_seconds [how long simulated host prep and VXLAN prep take per cluster, defaults to 5]
+-latency [extra time added to every NSX request and vSphere call in seconds, defaults to 0.002]
+-record_file [also write every NSX request to this JSON lines file]
+-verbose [show the output of configure_nsx_manager.py]
+
+Example with parameters:
+python3 ./bench_configure_nsx_manager.py -hosts 16 -controller_seconds 30 -host_prep_seconds 10
+"""
+
+import argparse
+import contextlib
+import io
+import re
+import sys
+import time
+
+from collections import OrderedDict
+
+import nsx_sim_server
+import vsphere_sim
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to benchmark configure_nsx_manager.py against the simulators')
+
+    parser.add_argument('-hosts', '--hosts',
+                        type=int,
+                        default=4,
+                        help='hosts in the simulated cluster')
+    parser.add_argument('-controller_seconds', '--controller_seconds',
+                        type=float,
+                        default=10,
+                        help='how long each simulated controller deployment takes')
+    parser.add_argument('-host_prep_seconds', '--host_prep_seconds',
+                        type=float,
+                        default=5,
+                        help='how long simulated host prep and VXLAN prep take per cluster')
+    parser.add_argument('-latency', '--latency',
+                        type=float,
+                        default=0.002,
+                        help='extra time added to every NSX request and vSphere call in seconds')
+    parser.add_argument('-record_file', '--record_file',
+                        help='also write every NSX request to this JSON lines file')
+    parser.add_argument('-verbose', '--verbose',
+                        action='store_true',
+                        help='show the output of configure_nsx_manager.py')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    ''' The simulator has to be in place before configure_nsx_manager.py imports pyVmomi '''
+    sim = vsphere_sim.Simulator(num_hosts=args.hosts, latency=args.latency)
+    vsphere_sim.install(sim)
+    import configure_nsx_manager
+
+    state = nsx_sim_server.NSXState(args.controller_seconds, args.host_prep_seconds, args.latency,
+                                    record_file=args.record_file)
+    for cluster in sim.find(vsphere_sim.ClusterComputeResource):
+        state.inventory[cluster._moId] = [host._moId for host in cluster._props["host"]]
+    server = nsx_sim_server.start_server(state)
+    address = "%s:%d" % server.server_address[:2]
+
+    ''' the stand-in's certificate stands in for the vCenter and Lookup Service ones too, for their thumbprints.  The pool
+    addresses only exist in the stand-in, so they aren't probed on the real network '''
+    sys.argv = ["configure_nsx_manager.py", "-s", "127.0.0.1", "-o", str(server.server_address[1]),
+                "-u", "administrator@vsphere.local", "-p", "sim", "-S",
+                "-nsx_manager_address", address, "-nsx_manager_username", "admin", "-nsx_manager_password", "sim",
+                "-lookup_service_address", address, "-cluster_prep_list", "NetApp-HCI-Cluster-01",
+                "-VTEP_IP_Range", "10.10.0.10-10.10.0.250", "-VTEP_Mask", "/24", "-VTEP_Gateway", "10.10.0.1",
+                "-VTEP_DNS", "10.10.0.2", "-VTEP_domain", "hci.local", "-VTEP_VLAN_ID", "20",
+                "-Controller_IP_Range", "10.20.0.11-10.20.0.13", "-Controller_Mask", "/24",
+                "-Controller_Gateway", "10.20.0.1", "-Controller_Cluster", "NetApp-HCI-Cluster-01",
+                "-Controller_DNS", "10.20.0.2", "-Controller_domain", "hci.local",
+                "-Controller_Datastores", "NetApp-HCI-Datastore-01,NetApp-HCI-Datastore-02",
+                "-Controller_Network", "VM_Network", "-Controller_Password", "Sim-Password-123!",
+                "-DVS", "NetApp HCI VDS", "-key", "00000-00000-00000-00000-00000", "-skip_ip_scan"]
+
+    output = io.StringIO()
+    start = time.time()
+    try:
+        if args.verbose:
+            rc = configure_nsx_manager.main()
+        else:
+            with contextlib.redirect_stdout(output):
+                rc = configure_nsx_manager.main()
+    finally:
+        seconds = time.time() - start
+        server.shutdown()
+
+    if rc:
+        print("configure_nsx_manager.py failed:")
+        print(output.getvalue())
+        return 1
+
+    print_report(seconds, state.requests, sim.calls)
+    return 0
+
+
+def endpoint(path):
+    ''' Group request paths by endpoint, with object IDs replaced by <id> '''
+    return re.sub(r"/(jobdata|ipaddresspool|vdnscope|controller|virtualwire|domain-c)-?\d+", r"/<id>", path)
+
+
+def print_report(seconds, requests, vsphere_calls):
+    endpoints = OrderedDict()
+    for request in requests:
+        key = request["method"] + " " + endpoint(request["path"])
+        count, total, errors = endpoints.get(key, (0, 0.0, 0))
+        endpoints[key] = (count + 1, total + request["seconds"], errors + (1 if request["status"] >= 400 else 0))
+
+    print("")
+    print("configure_nsx_manager.py benchmark")
+    print("----------------------------------")
+    print("End-to-end time:     %.1f s" % seconds)
+    print("NSX requests:        %d" % len(requests))
+    print("NSX connections:     %d (%d with a resumed TLS session)" % (
+        sum(1 for request in requests if request.get("new_connection")),
+        sum(1 for request in requests if request.get("new_connection") and request.get("tls_resumed"))))
+    print("vSphere API calls:   %d" % sum(vsphere_calls.values()))
+    print("")
+    print("%-62s %6s %8s %6s" % ("endpoint", "calls", "time s", "errors"))
+    for key, (count, total, errors) in endpoints.items():
+        print("%-62s %6d %8.2f %6d" % (key, count, total, errors))
+
+
+if __name__ == "__main__":
+    exit(main())
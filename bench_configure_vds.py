@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmark for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Runs the full configure_vds.py split against the vsphere_sim.py simulator for clusters of several sizes and reports
+the wall time and the number of vSphere API calls of each run, so regressions and speedups can be measured on any Linux
+box without a vCenter.  pyVmomi doesn't need to be installed, the simulator stands in for it.
+
+Arguments
+---------
+-sizes [comma separated list of cluster sizes to run, defaults to 4,32,128,500]
+-latency [simulated round trip time of every API call in seconds, defaults to 0.002]
+-task_seconds [simulated duration of every task in seconds, defaults to 0.05]
+-vms_per_host [guest VMs on VM_Network on each host besides the C&C VMs, defaults to 0 as straight out of NDE.  The
+               source switch can't be removed while guest VMs are still on it]
+-max_parallel_ops [passed on to configure_vds.py, defaults to 8]
+-verbose [show the output of configure_vds.py]
+
+Example with parameters:
+python3 ./bench_configure_vds.py -sizes 4,32 -latency 0.01 -task_seconds 1
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import vsphere_sim
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to benchmark configure_vds.py against the vSphere simulator')
+
+    parser.add_argument('-sizes', '--sizes',
+                        default='4,32,128,500',
+                        help='comma separated list of cluster sizes to run')
+    parser.add_argument('-latency', '--latency',
+                        type=float,
+                        default=0.002,
+                        help='simulated round trip time of every API call in seconds')
+    parser.add_argument('-task_seconds', '--task_seconds',
+                        type=float,
+                        default=0.05,
+                        help='simulated duration of every task in seconds')
+    parser.add_argument('-vms_per_host', '--vms_per_host',
+                        type=int,
+                        default=0,
+                        help='guest VMs on VM_Network on each host besides the C&C VMs')
+    parser.add_argument('-max_parallel_ops', '--max_parallel_ops',
+                        type=int,
+                        default=8,
+                        help='passed on to configure_vds.py')
+    parser.add_argument('-verbose', '--verbose',
+                        action='store_true',
+                        help='show the output of configure_vds.py')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    ''' The simulator has to be in place before configure_vds.py imports pyVmomi '''
+    vsphere_sim.install(vsphere_sim.Simulator(num_hosts=0))
+    import configure_vds
+
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        sim = vsphere_sim.Simulator(num_hosts=size, latency=args.latency, task_seconds=args.task_seconds,
+                                    vms_per_host=args.vms_per_host)
+        result = run_configure_vds(configure_vds, sim, args.max_parallel_ops, args.verbose)
+        results.append(result)
+
+        if result["rc"]:
+            print("configure_vds.py failed on %d hosts:" % size)
+            print(result["output"])
+            return 1
+
+        print("%d hosts done in %.1f s" % (size, result["seconds"]))
+
+    print_report(results)
+    return 0
+
+
+def run_configure_vds(configure_vds, sim, max_parallel_ops, verbose=False):
+    """
+    Run configure_vds.main() against sim.
+    Returns a dictionary of hosts, rc, seconds, API call counts and the captured output
+    """
+    vsphere_sim.install(sim)
+    output = io.StringIO()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sys.argv = ["configure_vds.py", "-s", "vcsa.local", "-u", "administrator@vsphere.local", "-p", "sim", "-S",
+                    "-max_parallel_ops", str(max_parallel_ops), "-gate_timeout", "30",
+                    "-journal", os.path.join(workdir, "configure_vds.journal"),
+                    "-snapshot_file", os.path.join(workdir, "configure_vds.snapshot.json")]
+
+        start = time.time()
+        if verbose:
+            rc = configure_vds.main()
+        else:
+            with contextlib.redirect_stdout(output):
+                rc = configure_vds.main()
+        seconds = time.time() - start
+
+    return {"hosts": len(sim.find(vsphere_sim.HostSystem)),
+            "rc": rc,
+            "seconds": seconds,
+            "calls": dict(sim.calls),
+            "output": output.getvalue()}
+
+
+def print_report(results):
+    columns = ["PropertyRead", "RetrievePropertiesEx", "RetrieveContents", "UpdateNetworkConfig", "ReconfigVM_Task"]
+    tasks = ["CreateDVS_Task", "AddDVPortgroup_Task", "ReconfigureDvs_Task", "Rename", "Destroy_Task",
+             "ReconfigVM_Task"]
+
+    print("")
+    print("configure_vds.py benchmark")
+    print("--------------------------")
+    print("%6s %9s %10s %8s %14s %9s %9s %9s %7s" % ("hosts", "wall s", "API calls", "prop rd", "RetrievePropEx",
+                                                     "RetrCont", "UpdNetCfg", "VM reconf", "tasks"))
+
+    for result in results:
+        calls = result["calls"]
+        print("%6d %9.1f %10d %8d %14d %9d %9d %9d %7d" % (
+            result["hosts"], result["seconds"], sum(calls.values()),
+            *[calls.get(column, 0) for column in columns],
+            sum(calls.get(task, 0) for task in tasks)))
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+"""
+Bulk logical switch provisioning for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Creates VXLAN logical switches (virtualwires) in the transport zone configure_nsx_manager.py builds, from a CSV or
+JSON file of switch definitions, instead of one at a time by hand:
+
+    - the names of the switches already in the transport zone are read first, a page at a time with the pages after
+      the first fetched at the same time, and switches that already exist are skipped, so a rerun only creates what is
+      missing
+    - up to -max_in_flight creates are sent at the same time over the pooled NSX client
+    - a create NSX Manager answers with a 5xx or a 409 (another change to the transport zone got there first) is
+      retried with a backoff, and so is one whose connection failed.  A 5xx or a failed connection may have come
+      after the switch was created, so the retry waits for a check that it wasn't, and creates that fail together
+      share one re-read of the transport zone for that
+    - every switch created and every one that failed is printed, then the number created per second
+
+The switch file is either CSV with a header row or a JSON list of objects (or an object with a "switches" list).  Each
+switch needs a name and can have a description, tenantId, controlPlaneMode (UNICAST_MODE, HYBRID_MODE or
+MULTICAST_MODE, defaults to the transport zone's) and guestVlanAllowed (true or false).
+
+CSV example:
+name,description,tenantId
+web-tier,Web servers,tenant-a
+app-tier,App servers,tenant-a
+
+Arguments
+---------
+-nsx_manager_address [FQDN or IP of NSX Manager, optionally with :port]
+-nsx_manager_username [NSX admin account]
+-nsx_manager_password [password of the NSX admin account]
+-switches [CSV or JSON file of switch definitions]
+-transport_zone [name of the transport zone to create the switches in, defaults to Primary]
+-scope_id [ID of the transport zone, e.g. vdnscope-1, instead of looking it up by name]
+-max_in_flight [most creates sent at the same time, defaults to 8]
+-retries [times a create is retried after a 5xx, a 409 or a failed connection, defaults to 5]
+-nsx_request_timeout [seconds to wait for each NSX Manager request, defaults to 60]
+
+Example with parameters:
+python3 ./bulk_logical_switches.py -nsx_manager_address nsxmanager1.vmwpc.local -nsx_manager_username admin -nsx_manager_password NetApp123!NetApp123! -switches tenant-a.csv -max_in_flight 16
+"""
+
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import tracing
+
+from nsx_client import NSXClient
+from nsx_export import paged_records
+
+''' the fields a switch definition can have, in the order they go in the create spec '''
+SWITCH_FIELDS = ["name", "description", "tenantId", "controlPlaneMode", "guestVlanAllowed"]
+CONTROL_PLANE_MODES = ["UNICAST_MODE", "HYBRID_MODE", "MULTICAST_MODE"]
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to create logical switches in bulk')
+
+    parser.add_argument('-nsx_manager_address', '--nsx_manager_address',
+                        required=True,
+                        help='FQDN or IP of NSX Manager')
+    parser.add_argument('-nsx_manager_username', '--nsx_manager_username',
+                        required=True,
+                        help='An account in the NSX manager database that has admin rights')
+    parser.add_argument('-nsx_manager_password', '--nsx_manager_password',
+                        required=True,
+                        help='Password for the aforementioned NSX admin account')
+    parser.add_argument('-switches', '--switches',
+                        required=True,
+                        help='CSV or JSON file of switch definitions')
+    parser.add_argument('-transport_zone', '--transport_zone',
+                        default='Primary',
+                        help='name of the transport zone to create the switches in')
+    parser.add_argument('-scope_id', '--scope_id',
+                        help='ID of the transport zone, e.g. vdnscope-1, instead of looking it up by name')
+    parser.add_argument('-max_in_flight', '--max_in_flight',
+                        type=int,
+                        default=8,
+                        help='most creates sent at the same time')
+    parser.add_argument('-retries', '--retries',
+                        type=int,
+                        default=5,
+                        help='times a create is retried after a 5xx, a 409 or a failed connection')
+    parser.add_argument('-nsx_request_timeout', '--nsx_request_timeout',
+                        type=float,
+                        default=60,
+                        help='seconds to wait for each NSX Manager request')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    nsx = NSXClient(args.nsx_manager_address, args.nsx_manager_username, args.nsx_manager_password,
+                    pool_size=max(1, args.max_in_flight), timeout=args.nsx_request_timeout)
+    try:
+        switches = load_switches(args.switches)
+        scope_id = args.scope_id or find_scope_id(nsx, args.transport_zone)
+        failed = provision_switches(nsx, scope_id, switches, args.max_in_flight, args.retries)
+    except Exception as e:
+        print(e)
+        return 1
+    finally:
+        nsx.close()
+
+    return 1 if failed else 0
+
+
+def load_switches(path):
+    """
+    Read switch definitions from a CSV file with a header row, or a JSON file if path ends in .json.
+    Returns a list of dictionaries of field to value, empty values left out.  Raises an Exception listing every
+    problem found: switches with no name, names given twice, unknown fields and unknown control plane modes
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith(".json"):
+            rows = json.load(f)
+            if isinstance(rows, dict):
+                rows = rows.get("switches", [])
+        else:
+            rows = list(csv.DictReader(f))
+
+    switches, problems, seen, unknown = [], [], dict(), set()
+    for number, row in enumerate(rows, 1):
+        where = "%s switch %d" % (path, number)
+        if not isinstance(row, dict):
+            problems.append("%s: not a switch definition" % where)
+            continue
+
+        switch = dict()
+        for field, value in row.items():
+            if field is None or value is None:
+                continue
+            value = str(value).lower() if isinstance(value, bool) else str(value).strip()
+            if field.strip() not in SWITCH_FIELDS:
+                if field not in unknown:
+                    problems.append("%s: unknown field %s" % (where, field))
+                    unknown.add(field)
+            elif value:
+                switch[field.strip()] = value
+
+        if "name" not in switch:
+            problems.append("%s: has no name" % where)
+            continue
+        if switch["name"] in seen:
+            problems.append("%s: %s is already switch %d" % (where, switch["name"], seen[switch["name"]]))
+            continue
+        if switch.get("controlPlaneMode", CONTROL_PLANE_MODES[0]) not in CONTROL_PLANE_MODES:
+            problems.append("%s: controlPlaneMode must be one of %s" % (where, ", ".join(CONTROL_PLANE_MODES)))
+        if switch.get("guestVlanAllowed", "false") not in ("true", "false"):
+            problems.append("%s: guestVlanAllowed must be true or false" % where)
+
+        seen[switch["name"]] = number
+        switches.append(switch)
+
+    if problems:
+        raise Exception("%d problem(s) in %s:\n  %s" % (len(problems), path, "\n  ".join(problems)))
+    return switches
+
+
+def get_xml(nsx, path):
+    status, body = nsx.request('GET', path)
+    if status != 200:
+        raise Exception("%d reading %s: %s" % (status, path, body.decode('utf-8', 'replace')))
+    return ElementTree.fromstring(body)
+
+
+def find_scope_id(nsx, name="Primary"):
+    """
+    The ID of the transport zone called name, e.g. the "Primary" one create_transport_zone() makes.  Raises an
+    Exception if there isn't one
+    """
+    for scope in get_xml(nsx, '/api/2.0/vdn/scopes').iter('vdnScope'):
+        if scope.findtext('name') == name:
+            return scope.findtext('objectId')
+    raise Exception("NSX Manager has no transport zone called " + name)
+
+
+def index_switches(nsx, scope_id, page_size=100, max_workers=8):
+    """
+    Read the name and ID of every logical switch in the transport zone.  The first page says how many there are and
+    the rest of the pages are read at the same time.
+    Returns a dictionary of name to virtualwire ID
+    """
+    return dict((wire.get('name'), wire.get('objectId')) for wire in paged_records(
+        nsx, '/api/2.0/vdn/scopes/%s/virtualwires' % scope_id, 'virtualWire', page_size, max_workers))
+
+
+class SwitchIndex(object):
+    """
+    The logical switches of a transport zone, re-read when a failed create needs to know whether its switch was made
+    anyway.  Any read that started after the create was sent will show the switch if it was, so creates that fail
+    together wait for one read between them instead of each walking the transport zone
+    """
+    def __init__(self, nsx, scope_id, max_workers=8):
+        self.nsx = nsx
+        self.scope_id = scope_id
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.switches = dict()
+        ''' time.monotonic() when the read self.switches came from started, 0 before the first one '''
+        self.read_started = 0
+
+    def lookup(self, name, since):
+        """
+        The virtualwire ID of the switch called name, from a read that started after since (a time.monotonic() time),
+        reading the transport zone again if the last read is older.  Returns None if there is no such switch
+        """
+        with self.lock:
+            if self.read_started <= since:
+                started = time.monotonic()
+                self.switches = index_switches(self.nsx, self.scope_id, max_workers=self.max_workers)
+                self.read_started = started
+            return self.switches.get(name)
+
+
+def virtualwire_xml(switch):
+    return "<virtualWireCreateSpec>%s</virtualWireCreateSpec>" % "".join(
+        "<%s>%s</%s>" % (field, escape(switch[field]), field) for field in SWITCH_FIELDS if field in switch)
+
+
+def create_switch(nsx, scope_id, switch, retries=5, backoff=0.5, max_backoff=10, index=None):
+    """
+    Create one logical switch, retrying a 5xx, a 409 or a failed connection up to retries times with a backoff that
+    doubles each time, plus some jitter so retries sent together don't all land together again.  A 5xx or a failed
+    connection may have come after the switch was created (NSX Manager doesn't stop two switches having the same
+    name), so index, a SwitchIndex shared by the creates running together, is checked for it before that is retried.
+    Returns (0 and the virtualwire ID, or -1 and what went wrong, number of attempts)
+    """
+    path = '/api/2.0/vdn/scopes/%s/virtualwires' % scope_id
+    body = virtualwire_xml(switch)
+    delay = backoff
+    index = index or SwitchIndex(nsx, scope_id)
+
+    for attempt in range(1, retries + 2):
+        sent = time.monotonic()
+        try:
+            status, data = nsx.request('POST', path, body)
+            result = data.decode('utf-8', 'replace').strip()
+        except Exception as e:
+            status, result = None, "%s: %s" % (type(e).__name__, e)
+
+        if status in (200, 201):
+            return 0, result, attempt
+        if status is not None and status != 409 and status < 500:
+            return -1, "%d %s" % (status, result), attempt
+        if attempt > retries and status == 409:
+            break
+
+        ''' a 5xx or a failed connection on the last attempt is still checked for, after the same wait '''
+        tracing.sleep(delay + random.uniform(0, delay / 2), "retry backoff", switch["name"])
+        delay = min(delay * 2, max_backoff)
+
+        if status is None or status >= 500:
+            try:
+                created = index.lookup(switch["name"], sent)
+            except Exception:
+                created = None
+            if created:
+                return 0, created, attempt
+
+    return -1, result if status is None else "%d %s" % (status, result), attempt
+
+
+def create_switches(nsx, scope_id, switches, max_in_flight=8, retries=5):
+    """
+    Create every switch in the list with up to max_in_flight creates outstanding at once, printing each one as it
+    finishes.
+    Returns a list of (name, 0 or -1, virtualwire ID or what went wrong, attempts), in the order they finished
+    """
+    results = []
+    index = SwitchIndex(nsx, scope_id, max(1, max_in_flight))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        futures = dict((executor.submit(tracing.wrap(create_switch), nsx, scope_id, switch, retries, index=index),
+                        switch["name"]) for switch in switches)
+        for future in as_completed(futures):
+            name = futures[future]
+            status, result, attempts = future.result()
+            retried = " after %d attempts" % attempts if attempts > 1 else ""
+            if status == 0:
+                print("Logical switch %s created%s: %s" % (name, retried, result))
+            else:
+                print("Logical switch %s not created%s: %s" % (name, retried, result))
+            results.append((name, status, result, attempts))
+
+    return results
+
+
+def provision_switches(nsx, scope_id, switches, max_in_flight=8, retries=5):
+    """
+    Create the switches in the list that the transport zone doesn't already have, and print how it went.
+    Returns the names of the switches that couldn't be created
+    """
+    start = time.time()
+    existing = index_switches(nsx, scope_id, max_workers=max(1, max_in_flight))
+    print("Transport zone %s has %d logical switch(es), read in %.1f s" % (scope_id, len(existing),
+                                                                         time.time() - start))
+
+    wanted = [switch for switch in switches if switch["name"] not in existing]
+    skipped = len(switches) - len(wanted)
+
+    start = time.time()
+    results = create_switches(nsx, scope_id, wanted, max_in_flight, retries)
+    seconds = time.time() - start
+
+    created = [name for name, status, _, _ in results if status == 0]
+    failed = [name for name, status, _, _ in results if status != 0]
+    print("Created %d logical switch(es) in %.1f s, %.1f switches/s, %d retried.  %d already existed, %d failed" % (
+        len(created), seconds, len(created) / seconds if seconds else 0,
+        sum(1 for _, _, _, attempts in results if attempts > 1), skipped, len(failed)))
+    return failed
+
+
+if __name__ == "__main__":
+    exit(main())
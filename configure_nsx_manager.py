@@ -22,7 +22,32 @@ Assumptions and Design Decisions this script makes for you
 6.	Segment IDs for VXLAN will be 5000-10000
 7.	Replication type for VXLAN will be Unicast
 8.	CDO mode will not be enabled
-9.	No example DFW Rules, Logical Switches, ESGs, or DLRs will be created
+9.	No example DFW Rules, Logical Switches, ESGs, or DLRs will be created, unless -logical_switches or -dfw_rules name a file of them
+
+The work is split into named steps that each wait only for the steps they need, so steps that don't depend on each other
+(the registrations, the segment range, both IP pools, controller deployment and host prep) run at the same time.  The
+time each step took is printed at the end.  -only and -skip take comma separated step names to run just part of it.
+
+Run again with -reconcile to pick up where an earlier run left off.  The existing registrations, segment ranges, IP
+pools, controllers, host prep status and transport zones are read first, all at once, and only what is missing is
+created.  The IP pools, controllers and transport zone that are already there are reused rather than created again.
+
+Before anything changes, vCenter and NSX Manager are logged in to and the Lookup Service and vCenter certificates are
+fetched, all at the same time, and every cluster, datastore, network and switch named in the arguments is looked up in
+one read, so a typo is reported in seconds along with every other problem found.
+
+Before anything is created the VTEP and controller IP ranges are checked against their subnets and gateways, against
+each other, against the IP pools NSX Manager already has and against the vmk IPs of the hosts, and every address in
+them is probed for anything already using it (-skip_ip_scan turns that off).  Every clash found is printed.  Ranges can be start-end, single addresses or CIDR blocks, IPv4 or IPv6.
+
+With -logical_switches, the logical switches in a CSV or JSON file are created in the transport zone once it is there,
+several at a time, skipping any it already has (see bulk_logical_switches.py, which does the same on its own).
+With -dfw_rules, the DFW rules in a CSV or JSON lines file are imported a section at a time once the clusters are
+prepared for DFW (see dfw_import.py).
+
+With -trace, every vCenter call and task, every NSX Manager request and every wait is written to a JSON lines file as
+it finishes, and a summary of where the time went, phase by phase and step by step, is printed at the end (see
+tracing.py).
 
 Example with parameters:
 python ./configure_nsx_manager.py -nsx_manager_address nsxmanager1.vmwpc.local -nsx_manager_username admin -nsx_manager_password NetApp123!NetApp123! -s vmwpc-vcsa1.vmwpc.local -u administrator@vsphere.local -p NetApp123! -S -VTEP_IP_Range 10.193.138.104-10.193.138.113 -VTEP_Mask /24 -VTEP_Gateway 10.193.138.1 -VTEP_DNS 10.193.138.39 -VTEP_domain vmwpc.local -lookup_service_address vmwpc-vcsa1.vmwpc.local -VTEP_VLAN_ID 20 -Controller_IP_Range 10.193.138.101-10.193.138.103 -Controller_Mask /24 -Controller_Gateway 10.193.138.1 -Controller_Cluster Management -Controller_DNS 10.193.138.39 -Controller_domain vmwpc.local -Controller_Datastores Management_Cluster_Datastore_1,Management_Cluster_Datastore_2,Management_Cluster_Datastore_3 -Controller_Network Management_VMs -Controller_Password NetApp123!NetApp123! -DVS Compute_DVS -cluster_prep_list Compute -key XXXXX-XXXXX-XXXXX-XXXXX
@@ -35,20 +60,34 @@ import os.path
 import ssl
 import ipaddress
 import re
-import socket
-import hashlib
-import base64
 import time
 import argparse
 
-from http.client import HTTPSConnection
-
-from pyvim.connect import SmartConnectNoSSL, Disconnect
+from nsx_client import NSXClient, poll
+from bulk_logical_switches import find_scope_id, load_switches, provision_switches
+from dfw_import import scan_rules, import_rules, print_problems as print_dfw_problems
+from preflight import run_preflight, print_problems
+from step_scheduler import Step, run_steps, print_summary
+from thumbprint import ThumbprintCache, get_thumbprints, endpoint_key, split_endpoint
+from vtep_capacity import check_vtep_pool
+from ip_ranges import addresses_in, format_address, merge_ranges, parse_ranges, validate_pool
+from ip_scan import scan_ranges
+import tracing
+from vsphere_util import collect_properties
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from pyvim.connect import Disconnect
 from pyVmomi import vim, vmodl
 
 __author__ = 'hows@netapp.com'
 
-ip_mask_re = re.compile("/\d{1,2}")
+ip_mask_re = re.compile(r"/(\d{1,3})$")
+
+HOST_PREP_FEATURE = "com.vmware.vshield.vsm.nwfabric.hostPrep"
+VTEP_VMKNIC_COUNT = 2 # VTEP vmknics VXLAN prep gives every host, multi-vtep with route by src id
+VXLAN_FEATURE = "com.vmware.vshield.vsm.vxlan"
 
 def setup_args():
 
@@ -93,7 +132,7 @@ def setup_args():
     parser.add_argument('-nsx_manager_address', '--nsx_manager_address',
                         help='FQDN or IP of NSX Manager', required=True)
     parser.add_argument('-lookup_service_address', '--lookup_service_address',
-                        help='FQDN or IP of the Lookup Service host you want to register NSX Manager to - this is usually the vCenter itself unless you have an external PSC', required=True)
+                        help='FQDN or IP of the Lookup Service host you want to register NSX Manager to - this is usually the vCenter itself unless you have an external PSC.  Add :port if it isn\'t on 443', required=True)
     parser.add_argument('-cluster_prep_list', '--cluster_prep_list',
                         help='comma separated list of cluster names that you want prepared for NSX', required=True)
     parser.add_argument('-VTEP_IP_Range', '--VTEP_IP_Range',
@@ -106,6 +145,10 @@ def setup_args():
                         help='comma separated list of DNS servers you want the VTEPs to use', required=True)
     parser.add_argument('-VTEP_domain', '--VTEP_domain',
                         help='search domain you want the VTEPs to use, specified as something like mydomain.local', required=True)
+    parser.add_argument('-VTEP_headroom', '--VTEP_headroom',
+                        type=int,
+                        default=20,
+                        help='percent of spare addresses VTEP-Pool must have on top of 2 per host in the clusters being prepared, for hosts added later.  Defaults to 20')
     parser.add_argument('-VTEP_VLAN_ID', '--VTEP_VLAN_ID',
                         help='enter 0 if you wish to use the default VLAN', required=True)
     parser.add_argument('-Controller_IP_Range', '--Controller_IP_Range',
@@ -130,11 +173,85 @@ def setup_args():
                         help='name of the Distributed Virtual Switch you wish to bind the VXLAN transport zone to', required=True)
     parser.add_argument('-key', '--key',
                         help='NSX License Key in the format XXXXX-XXXXX-XXXXX-XXXXX-XXXXX', required=True)
+    parser.add_argument('-nsx_request_timeout', '--nsx_request_timeout',
+                        type=float,
+                        default=60,
+                        help='Seconds to wait for NSX Manager to answer any one API request.  Defaults to 60')
+    parser.add_argument('-controller_timeout', '--controller_timeout',
+                        type=float,
+                        default=1800,
+                        help='Seconds to wait for each NSX controller to come up before giving up.  Defaults to 1800')
+    parser.add_argument('-host_prep_timeout', '--host_prep_timeout',
+                        type=float,
+                        default=1800,
+                        help='Seconds to wait for DFW and for VXLAN prep to reach GREEN on every host before giving up.  Defaults to 1800')
+    parser.add_argument('-only', '--only',
+                        help='comma separated list of the only steps to run: register_sso, register_vcenter, add_license, segment_range, vtep_pool, controller_pool, deploy_controllers, prepare_dfw, prepare_vxlan, transport_zone, logical_switches, dfw_rules')
+    parser.add_argument('-skip', '--skip',
+                        help='comma separated list of steps not to run, from the same list as -only')
+    parser.add_argument('-thumbprint_timeout', '--thumbprint_timeout',
+                        type=float,
+                        default=10,
+                        help='Seconds to wait for vCenter and the Lookup Service to present their certificates.  Defaults to 10')
+    parser.add_argument('-thumbprint_retries', '--thumbprint_retries',
+                        type=int,
+                        default=2,
+                        help='Extra attempts at fetching a certificate after a failed one.  Defaults to 2')
+    parser.add_argument('-thumbprint_cache_file', '--thumbprint_cache_file',
+                        help='JSON file to keep certificate thumbprints in between runs, handy when configuring many NSX Managers against the same vCenter')
+    parser.add_argument('-thumbprint_cache_ttl', '--thumbprint_cache_ttl',
+                        type=float,
+                        default=3600,
+                        help='Seconds a cached thumbprint is good for.  Defaults to 3600')
+    parser.add_argument('-reconcile', '--reconcile',
+                        action='store_true',
+                        help='Read what NSX Manager already has first, and only create or update what is missing.  Existing IP pools, controllers and the transport zone are reused')
+    parser.add_argument('-max_parallel_steps', '--max_parallel_steps',
+                        type=int,
+                        default=4,
+                        help='Maximum number of independent steps to run at the same time.  Defaults to 4')
+    parser.add_argument('-logical_switches', '--logical_switches',
+                        help='CSV or JSON file of logical switches to create in the transport zone, see bulk_logical_switches.py')
+    parser.add_argument('-logical_switch_max_in_flight', '--logical_switch_max_in_flight',
+                        type=int,
+                        default=8,
+                        help='Most logical switch creates sent to NSX Manager at the same time.  Defaults to 8')
+    parser.add_argument('-logical_switch_retries', '--logical_switch_retries',
+                        type=int,
+                        default=5,
+                        help='Times a logical switch create is retried after a 5xx, a 409 or a failed connection.  Defaults to 5')
+    parser.add_argument('-dfw_rules', '--dfw_rules',
+                        help='CSV or JSON lines file of DFW rules to import once the clusters are prepared for DFW, see dfw_import.py')
+    parser.add_argument('-dfw_max_in_flight', '--dfw_max_in_flight',
+                        type=int,
+                        default=8,
+                        help='Most DFW sections written to NSX Manager at the same time.  Defaults to 8')
+    parser.add_argument('-dfw_overwrite_changed', '--dfw_overwrite_changed',
+                        action='store_true',
+                        help='Write DFW sections that someone else changed since they were read, instead of failing them')
+    parser.add_argument('-skip_ip_scan', '--skip_ip_scan',
+                        action='store_true',
+                        help="Don't probe the VTEP and controller addresses for hosts already using them before creating the IP pools")
+    parser.add_argument('-ip_scan_timeout', '--ip_scan_timeout',
+                        type=float,
+                        default=1,
+                        help='Seconds to wait for an answer from each VTEP and controller address when probing them.  Defaults to 1')
+    parser.add_argument('-ip_scan_concurrency', '--ip_scan_concurrency',
+                        type=int,
+                        default=4096,
+                        help='Most probes in flight at once when probing the VTEP and controller addresses.  Defaults to 4096, capped by the open file limit')
+    parser.add_argument('-trace', '--trace',
+                        help='JSON lines file to trace every vCenter call and task, NSX Manager request and wait to, with a summary of where the time went printed at the end')
     return(parser.parse_args())
 
 def main():
     args = setup_args()
 
+    #trace the run if asked to, the summary is printed on the way out after the sessions are closed
+    if args.trace:
+        tracing.start(args.trace)
+        atexit.register(tracing.stop)
+
     #disable SSL certificate verification since most customers aren't going to set their NSX Manager up with a trusted CA
 
     if (not os.environ.get('PYTHONHTTPSVERIFY', '') and
@@ -142,29 +259,36 @@ def main():
         ssl._create_default_https_context = ssl._create_unverified_context
 
     #set up common variables
-    credstring = (args.nsx_manager_username + ":" + args.nsx_manager_password)
-    creds = base64.b64encode(credstring.encode()).decode('ascii')
-
-    headers = {'Content-Type' : 'application/xml','Authorization' : 'Basic ' + creds }
-    nsx_manager_address = args.nsx_manager_address
+    #every call to NSX Manager shares one pooled keep-alive client, closed on the way out like the vCenter session
+    nsx = NSXClient(args.nsx_manager_address, args.nsx_manager_username, args.nsx_manager_password,
+                    pool_size=max(8, args.logical_switch_max_in_flight, args.dfw_max_in_flight), timeout=args.nsx_request_timeout)
+    atexit.register(nsx.close)
     nsx_license_key = args.key
 
-    #connect to vcenter via SOAP
-    try:
-        si = SmartConnectNoSSL(host=args.host,
-                                user=args.user,
-                                pwd=args.password,
-                                port=args.port)
+    #certificate thumbprints for the registrations, one handshake per endpoint even when vCenter is the lookup service too
+    thumbprint_cache = ThumbprintCache(args.thumbprint_cache_file, args.thumbprint_cache_ttl)
+
+    cluster_prep_list = args.cluster_prep_list.split(",")
+    controller_datastores = args.Controller_Datastores.split(",")
+
+    #pre-flight: connect to vcenter via SOAP, log in to NSX Manager and fetch both certificates at the same time, then look
+    #up every cluster, datastore, network and switch named in the arguments in one read.  Nothing changes until all of it checks out
+    wanted = [("-cluster_prep_list", vim.ClusterComputeResource, c) for c in cluster_prep_list]
+    wanted += [("-Controller_Cluster", vim.ClusterComputeResource, args.Controller_Cluster)]
+    wanted += [("-Controller_Datastores", vim.Datastore, d) for d in controller_datastores]
+    wanted += [("-Controller_Network", vim.Network, args.Controller_Network),
+               ("-DVS", vim.DistributedVirtualSwitch, args.DVS)]
+    checks = [("-lookup_service_address", lambda: get_thumbprints(args.lookup_service_address, args.thumbprint_timeout, args.thumbprint_retries, thumbprint_cache)),
+              ("vCenter certificate", lambda: get_thumbprints(endpoint_key(args.host, args.port), args.thumbprint_timeout, args.thumbprint_retries, thumbprint_cache))]
+
+    with tracing.phase("preflight"):
+        si, dc, found, problems = run_preflight(args.host, args.user, args.password, args.port, args.datacenter, wanted, nsx, checks, args.thumbprint_timeout)
+    if si is not None:
         atexit.register(Disconnect, si)
-    except:
-        print("Unable to connect to %s" % args.host)
+    if problems:
+        print_problems(problems)
         return 1
 
-    if args.datacenter:
-        dc = get_dc(si, args.datacenter)
-    else:
-        dc = si.content.rootFolder.childEntity[0]
-
     # this is a testing statement to be removed later
     # it just proves we successfully pulled something from vcenter via SOAP
     print("Datacenter in use:")
@@ -172,65 +296,249 @@ def main():
 
     # set up some more variables that require connection to vcenter to figure out
 
-    dvs_moref = str(get_dvs_moref(dc, args.DVS)).replace('vim.dvs.VmwareDistributedVirtualSwitch:', '')
-    dvs_moref = dvs_moref.replace("'", "")
+    dvs_moref = found[(vim.DistributedVirtualSwitch, args.DVS)]._moId
 
-    cluster_moref_list = []
-    cluster_prep_list = args.cluster_prep_list.split(",")
+    # size VTEP-Pool from the host counts of every cluster being prepared, before anything slow starts
+    try:
+        with tracing.phase("check_vtep_pool"):
+            host_counts, vtep_problems = check_vtep_pool(si, cluster_prep_list, args.VTEP_IP_Range, VTEP_VMKNIC_COUNT, args.VTEP_headroom, dc)
+    except Exception as e:
+        print(e)
+        return 1
+
+    for cluster_name, count in host_counts.items():
+        print("Cluster %s has %d host(s)" % (cluster_name, count))
+    if vtep_problems:
+        for problem in vtep_problems:
+            print(problem)
+        return 1
+    num_hosts = sum(host_counts.values())
+
+    # check both IP pools against their subnets, each other, the pools NSX Manager already has and the hosts' vmk IPs,
+    # and probe every address in them for anything on the network already using it
+    # with -reconcile an existing VTEP-Pool or Controller-Pool is reused, so it isn't checked against itself
+    pools_to_check = OrderedDict([("VTEP-Pool", (args.VTEP_IP_Range, args.VTEP_Mask, args.VTEP_Gateway)),
+                                  ("Controller-Pool", (args.Controller_IP_Range, args.Controller_Mask, args.Controller_Gateway))])
+    try:
+        with tracing.phase("check_ip_pools"):
+            pool_problems = check_ip_pools(nsx, si, dc, pools_to_check, args.reconcile, not args.skip_ip_scan, args.ip_scan_timeout, args.ip_scan_concurrency)
+    except Exception as e:
+        print(e)
+        return 1
+
+    if pool_problems:
+        for problem in pool_problems:
+            print(problem)
+        return 1
+
+    cluster_moref_list = [found[(vim.ClusterComputeResource, c)]._moId for c in cluster_prep_list]
 
-    for c in cluster_prep_list:
-        cluster_id = str(get_cluster_moref(dc, c)).replace('vim.ClusterComputeResource:', '')
-        cluster_id = cluster_id.replace("'", "")
-        cluster_moref_list.append(cluster_id)
+    # read the logical switch definitions now, so a mistake in the file is found before anything changes
+    switch_definitions = []
+    if args.logical_switches:
+        try:
+            switch_definitions = load_switches(args.logical_switches)
+        except Exception as e:
+            print(e)
+            return 1
+
+    # the DFW rule file is checked in full too, but only read again a section at a time when the rules are imported
+    dfw_sections = None
+    if args.dfw_rules:
+        try:
+            dfw_sections, dfw_problems = scan_rules(args.dfw_rules)
+        except Exception as e:
+            print(e)
+            return 1
+        if dfw_problems:
+            print_dfw_problems(args.dfw_rules, dfw_problems)
+            return 1
 
 
     # start the actual work here
+    # each step names the steps it needs first, and steps that don't need each other run side by side
 
-    # register with SSO
-    register_sso_status = register_nsx_with_lookup_service(headers, nsx_manager_address, args.lookup_service_address, args.user, args.password)
-    print(*register_sso_status)
-
-    # register with vCenter
-    register_vcenter_status = register_nsx_with_vcenter(headers, nsx_manager_address, args.host, args.user, args.password)
-    print(*register_vcenter_status)
-    
-    # Add NSX License Key and assign it to the NSX solution
-    add_nsx_license_key(dc, si, nsx_license_key)
-    
-    # set the segment id range
-    segment_id_status = set_segment_id_range(headers, nsx_manager_address)
-    print(*segment_id_status)
-   
-    # create the IP Pool VTEP-Pool
-    
-    num_hosts = 2 #hard set the num_hosts to 2 for now until I can create the function to figure that out
-
-    vtep_ip_pool_status = create_vtep_ip_pool(nsx_manager_address,headers,args.VTEP_IP_Range,args.VTEP_Mask,args.VTEP_Gateway,num_hosts,args.VTEP_DNS,args.VTEP_domain)
-    vtep_ip_pool_id = vtep_ip_pool_status[1]
-    print(*vtep_ip_pool_status)
-    print(vtep_ip_pool_id)
-
-    # create the IP Pool Controller-Pool
-    controller_ip_pool_status = create_controller_ip_pool(nsx_manager_address,headers,args.Controller_IP_Range,args.Controller_Mask,args.Controller_Gateway,args.Controller_DNS,args.Controller_domain)
-    controller_ip_pool_id = controller_ip_pool_status[1]
-    print(*controller_ip_pool_status)
-    print(controller_ip_pool_id)
+    # with -reconcile, read what NSX Manager already has first so a rerun only creates what is missing
+    existing = None
+    if args.reconcile:
+        try:
+            with tracing.phase("read_nsx_state"):
+                existing = read_nsx_state(nsx, cluster_moref_list)
+        except Exception as e:
+            print(e)
+            return 1
+        print_nsx_state(existing)
+
+    def register_sso(results):
+        if existing and existing["sso"]:
+            print("NSX Manager is already registered with the SSO Lookup Service")
+            return
+        # a failure here usually means it is already registered, so carry on
+        thumbprint = get_thumbprints(args.lookup_service_address, args.thumbprint_timeout, args.thumbprint_retries, thumbprint_cache)["sha1"]
+        register_sso_status = register_nsx_with_lookup_service(nsx, args.lookup_service_address, args.user, args.password, thumbprint)
+        print(*register_sso_status)
+
+    def register_vcenter(results):
+        if existing and existing["vcenter"]:
+            print("NSX Manager is already registered with vCenter")
+            return
+        thumbprint = get_thumbprints(endpoint_key(args.host, args.port), args.thumbprint_timeout, args.thumbprint_retries, thumbprint_cache)["sha256"]
+        register_vcenter_status = register_nsx_with_vcenter(nsx, args.host, args.user, args.password, thumbprint)
+        print(*register_vcenter_status)
+
+    def add_license(results):
+        # the nsx-netsec solution the key is assigned to only exists once NSX Manager is registered with vCenter
+        add_nsx_license_key(dc, si, nsx_license_key)
+
+    def segment_range(results):
+        if existing and existing["segments"]:
+            print("Segment ID Range already exists")
+            return
+        # a failure here means a segment ID range already exists
+        segment_id_status = set_segment_id_range(nsx)
+        print(*segment_id_status)
+
+    def vtep_pool(results):
+        vtep_ip_pool_id = existing_pool_id(existing, "VTEP-Pool")
+        if vtep_ip_pool_id:
+            print("IP Pool VTEP-Pool already exists: " + vtep_ip_pool_id.decode('utf-8'))
+            return vtep_ip_pool_id
+
+        vtep_ip_pool_status = create_vtep_ip_pool(nsx,args.VTEP_IP_Range,args.VTEP_Mask,args.VTEP_Gateway,num_hosts,args.VTEP_DNS,args.VTEP_domain)
+        print(*vtep_ip_pool_status)
+        return step_result(vtep_ip_pool_status, "IP Pool VTEP-Pool not created")
+
+    def controller_pool(results):
+        controller_ip_pool_id = existing_pool_id(existing, "Controller-Pool")
+        if controller_ip_pool_id:
+            print("IP Pool Controller-Pool already exists: " + controller_ip_pool_id.decode('utf-8'))
+            return controller_ip_pool_id
+
+        controller_ip_pool_status = create_controller_ip_pool(nsx,args.Controller_IP_Range,args.Controller_Mask,args.Controller_Gateway,args.Controller_DNS,args.Controller_domain)
+        print(*controller_ip_pool_status)
+        return step_result(controller_ip_pool_status, "IP Pool Controller-Pool not created")
+
+    def deploy_controllers(results):
+        running = []
+        if existing and existing["controllers"]:
+            controllers = wait_for_controllers_running(nsx, args.controller_timeout)
+            running = [id for id, status in controllers if status == 'RUNNING']
+            if len(running) >= 3:
+                print("NSX controllers already deployed: " + ", ".join(running))
+                return ",".join(running)
+            print("%d NSX controller(s) already RUNNING: %s" % (len(running), ", ".join(running)))
+
+        controller_ip_pool_id = required_result(results, "controller_pool", "the Controller-Pool ID", lambda: existing_pool_id(existing, "Controller-Pool"))
+        nsx_controller_status = deploy_nsx_controllers(nsx, found[(vim.ClusterComputeResource, args.Controller_Cluster)],
+                                                       [found[(vim.Datastore, d)] for d in controller_datastores],
+                                                       found[(vim.Network, args.Controller_Network)],
+                                                       args.Controller_Password, controller_ip_pool_id, args.controller_timeout, running)
+        print(*nsx_controller_status)
+        return step_result(nsx_controller_status, "NSX controller deployment failed")
+
+    def prepare_dfw(results):
+        clusters = cluster_moref_list
+        if existing:
+            clusters = [cluster for cluster in cluster_moref_list if existing["host_prep"][cluster] != 'GREEN']
+            if not clusters:
+                print("Clusters " + ", ".join(cluster_moref_list) + " are already prepared for DFW")
+                return
+        prepare_clusters_for_dfw_status = prepare_clusters_for_dfw(nsx, clusters, args.host_prep_timeout)
+        print(*prepare_clusters_for_dfw_status)
+        return step_result(prepare_clusters_for_dfw_status, "Preparing the clusters for DFW failed")
+
+    def prepare_vxlan(results):
+        clusters = cluster_moref_list
+        if existing:
+            clusters = [cluster for cluster in cluster_moref_list if existing["vxlan"][cluster] != 'GREEN']
+            if not clusters:
+                print("Clusters " + ", ".join(cluster_moref_list) + " are already prepared for VXLAN")
+                return
+        vtep_ip_pool_id = required_result(results, "vtep_pool", "the VTEP-Pool ID", lambda: existing_pool_id(existing, "VTEP-Pool"))
+        prepare_clusters_for_vxlan_status = prepare_clusters_for_vxlan(nsx, clusters, dvs_moref, args.VTEP_VLAN_ID, vtep_ip_pool_id, args.host_prep_timeout)
+        print(*prepare_clusters_for_vxlan_status)
+        return step_result(prepare_clusters_for_vxlan_status, "Preparing the clusters for VXLAN failed")
+
+    def transport_zone(results):
+        if existing and "Primary" in existing["scopes"]:
+            scope_id, scope_clusters = existing["scopes"]["Primary"]
+            missing = [cluster for cluster in cluster_moref_list if cluster not in scope_clusters]
+            if not missing:
+                print("Transport Zone Primary already exists with clusters " + ", ".join(cluster_moref_list) + ": " + scope_id)
+                return scope_id
+            expand_transport_zone_status = expand_transport_zone(nsx, scope_id, missing)
+            print(*expand_transport_zone_status)
+            return step_result(expand_transport_zone_status, "Clusters not added to Transport Zone Primary")
+
+        create_transport_zone_status = create_transport_zone(nsx, cluster_moref_list)
+        print(*create_transport_zone_status)
+        return step_result(create_transport_zone_status, "Transport Zone Primary not created").decode('utf-8').strip()
+
+    def logical_switches(results):
+        # reuse the scope ID the transport_zone step created or found, or look up Primary if that step wasn't run
+        scope_id = results.get("transport_zone") or find_scope_id(nsx, "Primary")
+        failed = provision_switches(nsx, scope_id, switch_definitions, args.logical_switch_max_in_flight, args.logical_switch_retries)
+        if failed:
+            raise Exception("%d logical switch(es) not created: %s" % (len(failed), ", ".join(failed)))
+        return scope_id
+
+    def dfw_rules(results):
+        failed = import_rules(nsx, args.dfw_rules, dfw_sections, args.dfw_max_in_flight, overwrite_changed=args.dfw_overwrite_changed)
+        if failed:
+            raise Exception("%d DFW section(s) not written: %s" % (len(failed), ", ".join(failed)))
+
+    steps = [Step("register_sso", register_sso),
+             Step("register_vcenter", register_vcenter),
+             Step("add_license", add_license, ["register_vcenter"]),
+             Step("segment_range", segment_range),
+             Step("vtep_pool", vtep_pool),
+             Step("controller_pool", controller_pool),
+             Step("deploy_controllers", deploy_controllers, ["register_vcenter", "controller_pool"]),
+             Step("prepare_dfw", prepare_dfw, ["register_vcenter"]),
+             Step("prepare_vxlan", prepare_vxlan, ["prepare_dfw", "vtep_pool"]),
+             Step("transport_zone", transport_zone, ["prepare_vxlan", "segment_range", "deploy_controllers"])]
+    if args.logical_switches:
+        steps.append(Step("logical_switches", logical_switches, ["transport_zone"]))
+    if args.dfw_rules:
+        # rules can name the logical switches, so those are made first
+        steps.append(Step("dfw_rules", dfw_rules, ["prepare_dfw"] + (["logical_switches"] if args.logical_switches else [])))
+
+    only = [name for name in (args.only or "").split(",") if name]
+    skip = [name for name in (args.skip or "").split(",") if name]
+
+    start = time.time()
+    try:
+        with tracing.phase("steps"):
+            outcome = run_steps(steps, only, skip, args.max_parallel_steps)
+    except Exception as e:
+        print(e)
+        return 1
+    print_summary(steps, outcome, time.time() - start)
+
+    if any(state in ("failed", "blocked") for state, _, _ in outcome.values()):
+        return 1
 
-    # Deploy three NSX controllers
-    nsx_controller_status = deploy_nsx_controllers(headers, nsx_manager_address, args.Controller_Cluster, args.Controller_Datastores, args.Controller_Network, args.Controller_Password, controller_ip_pool_id, dc, si)
-    print(*nsx_controller_status)
-    
-    # prepare the specified clusters for DFW
-    prepare_clusters_for_dfw_status = prepare_clusters_for_dfw(headers, nsx_manager_address, cluster_moref_list)
-    print(*prepare_clusters_for_dfw_status)
 
-    # prepare the specified clusters for VXLAN
-    prepare_clusters_for_vxlan_status = prepare_clusters_for_vxlan(headers, nsx_manager_address, cluster_moref_list, dvs_moref, args.VTEP_VLAN_ID, vtep_ip_pool_id)
-    print(*prepare_clusters_for_vxlan_status)
+def step_result(status, message):
+    """
+    Turn a (status, result) pair from one of the functions below into a step result, raising if status isn't 0
+    """
+    if status[0] != 0:
+        result = status[1].decode('utf-8', 'replace') if isinstance(status[1], bytes) else str(status[1])
+        raise Exception(message + ": " + result)
+    return status[1]
 
-    # Create Transport Zone "Primary"
-    create_transport_zone_status = create_transport_zone(headers, nsx_manager_address, cluster_moref_list)
-    print(*create_transport_zone_status)
+def required_result(results, step, what, fallback=None):
+    """
+    Get the result of an earlier step, which isn't there if that step was left out with -only or -skip.  fallback, if
+    given, is then called for a value to use instead, e.g. the ID of an object -reconcile found
+    """
+    if results.get(step) is not None:
+        return results[step]
+    existing = fallback() if fallback is not None else None
+    if existing is not None:
+        return existing
+    raise Exception("Needs " + what + " from the " + step + " step, which was not run")
 
 
 def add_nsx_license_key(dc, si, key):
@@ -243,7 +551,7 @@ def add_nsx_license_key(dc, si, key):
     LicenseManager.licenseAssignmentManager.UpdateAssignedLicense('nsx-netsec', key)
     return 0
 
-def set_segment_id_range(headers,nsx_manager_address):
+def set_segment_id_range(nsx):
 
     segment_begin=5000
     segment_end=10000
@@ -261,24 +569,22 @@ def set_segment_id_range(headers,nsx_manager_address):
 
     print("Setting the VNI Segment ID Range to 5000-10000...")
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/vdn/config/segments',xml_string,headers)
+    status, body = nsx.request('POST', '/api/2.0/vdn/config/segments', xml_string)
 
-    response = conn.getresponse()
-
-    if response.status != 201:
-        print (str(response.status) + " Segment ID Range not created, one must already exist")
-        return -1, response.read()
+    if status != 201:
+        print (str(status) + " Segment ID Range not created, one must already exist")
+        return -1, body
     else:
-        print (str(response.status) + " Segment ID Range created successfully")
-        return 0, response.read()
+        print (str(status) + " Segment ID Range created successfully")
+        return 0, body
 
 
-def register_nsx_with_lookup_service(headers, nsx_manager_address, lookup_service_address, vcenter_username, vcenter_password):
+def register_nsx_with_lookup_service(nsx, lookup_service_address, vcenter_username, vcenter_password, thumbprint):
 
-    thumbprint = get_sha1_thumbprint(lookup_service_address)
+    # thumbprint is the SHA-1 thumbprint of the lookup service certificate
+    # lookup_service_address can carry its own :port, otherwise 443
 
-    lookup_service_url = 'https://' + lookup_service_address + ':443/lookupservice/sdk'
+    lookup_service_url = 'https://' + endpoint_key(*split_endpoint(lookup_service_address)) + '/lookupservice/sdk'
 
     xml_string = """
         <ssoConfig>
@@ -291,22 +597,19 @@ def register_nsx_with_lookup_service(headers, nsx_manager_address, lookup_servic
 
     print("Registering NSX Manager with the SSO Lookup Service...")
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/services/ssoconfig', xml_string, headers)
-
-    response = conn.getresponse()
+    status, body = nsx.request('POST', '/api/2.0/services/ssoconfig', xml_string)
 
-    if response.status != 200:
-        print(str(response.status) + " Lookup service did not register.  Maybe it already is?")
-        return -1, response.read()
+    if status != 200:
+        print(str(status) + " Lookup service did not register.  Maybe it already is?")
+        return -1, body
     else:
-        print(str(response.status) + " Lookup service registered successfully")
-        return 0, response.read()
+        print(str(status) + " Lookup service registered successfully")
+        return 0, body
 
 
-def register_nsx_with_vcenter(headers, nsx_manager_address, vcenter_address, vcenter_username, vcenter_password):
+def register_nsx_with_vcenter(nsx, vcenter_address, vcenter_username, vcenter_password, thumbprint):
 
-    thumbprint = get_sha256_thumbprint(vcenter_address)
+    # thumbprint is the SHA-256 thumbprint of the vCenter certificate
 
     xml_string = """
         <vcInfo>
@@ -323,39 +626,35 @@ def register_nsx_with_vcenter(headers, nsx_manager_address, vcenter_address, vce
     print("Registering NSX Manager with vCenter...")
 
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('PUT', 'https://' + nsx_manager_address + '/api/2.0/services/vcconfig', xml_string, headers)
-
-    response = conn.getresponse()
+    status, body = nsx.request('PUT', '/api/2.0/services/vcconfig', xml_string)
 
-    if response.status != 200:
-        print(str(response.status) + " vCenter not registered.  Maybe it already is?")
-        return -1, response.read()
+    if status != 200:
+        print(str(status) + " vCenter not registered.  Maybe it already is?")
+        return -1, body
     else:
-        print(str(response.status) + " vCenter server registered successfully")
-        return 0, response.read()
+        print(str(status) + " vCenter server registered successfully")
+        return 0, body
 
-def deploy_nsx_controllers(headers, nsx_manager_address, controller_cluster, controller_datastores, controller_network, controller_password, controller_ip_pool_id, dc, si):
+def deploy_nsx_controllers(nsx, controller_cluster, controller_datastores, controller_network, controller_password, controller_ip_pool_id, controller_timeout=1800, existing_controller_ids=()):
 
-    # deploy 3 NSX controllers to whatever datacenter and cluster you specified by name, error out if it can't find it
+    # deploy 3 NSX controllers to the cluster, datastores and network pre-flight looked up, passed in as vim objects
     # deploy controller 1 to the first datastore in the controller_datastores list, 2 to the second, 3 to the third
     # let the api name the controllers, because for some reason it insists on appending the moref to the end of whatever
     # name you assign which will be confusing to end users.
     # use the IP pool called "Controller-Pool", created by the create_controller_pool function [obv this must be called later]
     # connect all three controllers to the controller_network specified
-    # wait for 10 minutes between each controller deployment (it won't let you do multiple in parallel)
+    # NSX won't deploy controllers in parallel, so each one is submitted as soon as the one before it is RUNNING
+    # controllers that are already RUNNING (existing_controller_ids) count towards the three
 
 
-    controller_network_id = str(get_network(si, dc, controller_network)).replace('vim.dvs.DistributedVirtualPortgroup:','')
-    controller_network_id = controller_network_id.replace("'","")
-    resource_pool_id = str(get_cluster_rp(dc, controller_cluster)).replace('vim.ResourcePool:','')
-    resource_pool_id = resource_pool_id.replace("'","")
+    controller_network_id = controller_network._moId
+    resource_pool_id = controller_cluster.resourcePool._moId
     controller_ip_pool_id = controller_ip_pool_id.decode('utf-8')
 
     print(controller_ip_pool_id)
 
     controller_datastore_ids = []
-    controller_datastore_list = controller_datastores.split(',')
+    controller_datastore_list = list(controller_datastores)
 
     if len(controller_datastore_list) == 1 :
         firstdatastore = controller_datastore_list[0]
@@ -367,127 +666,148 @@ def deploy_nsx_controllers(headers, nsx_manager_address, controller_cluster, con
         controller_datastore_list.append(seconddatastore)
 
     for datastore in controller_datastore_list:
-        datastore_id = str(get_ds(dc,datastore)).replace('vim.Datastore:','')
-        datastore_id = datastore_id.replace("'","")
+        datastore_id = datastore._moId
         print("->" + datastore_id + "<-")
 
         controller_datastore_ids.append(datastore_id)
 
+    controller_ids = list(existing_controller_ids)
 
-    xml_string= """
-    <controllerSpec>
-      <name>{0}</name>
-      <description>nsx-controller</description>
-      <ipPoolId>{1}</ipPoolId>
-      <resourcePoolId>{2}</resourcePoolId>
-        <datastoreId>{3}</datastoreId>
-      <networkId>{4}</networkId>
-      <password>{5}</password>
-     </controllerSpec>
-    """.format('HCI',controller_ip_pool_id,resource_pool_id,controller_datastore_ids[0],controller_network_id,controller_password)
-
-
-    print("Beginning first NSX controller deployment.  This may take a while...")
-    print(xml_string)
-
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/vdn/controller', xml_string, headers)
-
-    response = conn.getresponse()
-    jobid = (response.read()).decode('utf-8')
-    print (">" + jobid + "<")
-
-    print("waiting 10 minutes...")
-    time.sleep(600)
+    for ordinal, datastore_id in list(zip(["first", "second", "third"], controller_datastore_ids))[len(controller_ids):]:
 
+        xml_string= """
+        <controllerSpec>
+          <name>{0}</name>
+          <description>nsx-controller</description>
+          <ipPoolId>{1}</ipPoolId>
+          <resourcePoolId>{2}</resourcePoolId>
+            <datastoreId>{3}</datastoreId>
+          <networkId>{4}</networkId>
+          <password>{5}</password>
+         </controllerSpec>
+        """.format('HCI',controller_ip_pool_id,resource_pool_id,datastore_id,controller_network_id,controller_password)
 
+        print("Beginning " + ordinal + " NSX controller deployment.  This may take a while...")
+        print(xml_string)
 
-    xml_string = """
-       <controllerSpec>
-         <name>{0}</name>
-         <description>nsx-controller</description>
-         <ipPoolId>{1}</ipPoolId>
-         <resourcePoolId>{2}</resourcePoolId>
-           <datastoreId>{3}</datastoreId>
-         <networkId>{4}</networkId>
-         <password>{5}</password>
-        </controllerSpec>
-       """.format('HCI', controller_ip_pool_id, resource_pool_id, controller_datastore_ids[1], controller_network_id, controller_password)
-
-    print("Beginning second NSX controller deployment.  This may take a while...")
-    print(xml_string)
-
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/vdn/controller', xml_string, headers)
+        status, body = nsx.request('POST', '/api/2.0/vdn/controller', xml_string)
 
-    response = conn.getresponse()
-    jobid = (response.read()).decode('utf-8')
-    print(">" + jobid + "<")
+        if status not in (200, 201):
+            print(str(status) + " " + ordinal.capitalize() + " NSX controller deployment not accepted")
+            return -1, body
 
-    print("waiting 10 minutes...")
-    time.sleep(600)
+        jobid = body.decode('utf-8').strip()
+        print(">" + jobid + "<")
 
+        try:
+            controller_id = wait_for_controller(nsx, jobid, controller_timeout)
+        except Exception as e:
+            print(str(e))
+            return -1, str(e)
 
+        print(controller_id + " is RUNNING")
+        controller_ids.append(controller_id)
 
-    xml_string = """
-           <controllerSpec>
-             <name>{0}</name>
-             <description>nsx-controller</description>
-             <ipPoolId>{1}</ipPoolId>
-             <resourcePoolId>{2}</resourcePoolId>
-               <datastoreId>{3}</datastoreId>
-             <networkId>{4}</networkId>
-             <password>{5}</password>
-            </controllerSpec>
-           """.format('HCI', controller_ip_pool_id, resource_pool_id, controller_datastore_ids[2], controller_network_id, controller_password)
-
-    print("Beginning third NSX controller deployment.  This may take a while...")
-    print(xml_string)
+    return 0, ",".join(controller_ids)
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/vdn/controller', xml_string, headers)
 
-    response = conn.getresponse()
-    jobid = (response.read()).decode('utf-8')
-    print(">" + jobid + "<")
+def wait_for_controller(nsx, jobid, timeout=1800):
+    """
+    Wait for the controller deployment job jobid until its controller is RUNNING and return the controller's ID.
+    Polls the deployment progress, then the controller list, backing off from 2 to 30 seconds between polls.
+    Raises an Exception as soon as NSX reports the deployment failed, or after timeout seconds.
+    """
+    started = time.time()
+    state = {"vmId": None}
+
+    def check():
+        if state["vmId"] is None:
+            status, body = nsx.request('GET', '/api/2.0/vdn/controller/progress/' + jobid)
+            if status != 200:
+                raise Exception(str(status) + " Could not read the progress of controller deployment " + jobid)
+            progress = ElementTree.fromstring(body)
+            progress_status = xml_text(progress, 'status')
+
+            if progress_status.lower() in ('failure', 'failed', 'error'):
+                raise Exception("Controller deployment " + jobid + " failed: " + job_failure_detail(nsx, jobid))
+            if progress_status.lower() != 'success':
+                print("  controller deployment %s %s after %d seconds" % (jobid, progress_status, time.time() - started))
+                return None
+            state["vmId"] = xml_text(progress, 'vmId')
+
+        status, body = nsx.request('GET', '/api/2.0/vdn/controller')
+        if status != 200:
+            raise Exception(str(status) + " Could not list the NSX controllers")
+        for controller in ElementTree.fromstring(body).iter('controller'):
+            if xml_text(controller, 'virtualMachineInfo/objectId') == state["vmId"]:
+                controller_status = xml_text(controller, 'status')
+                if controller_status == 'RUNNING':
+                    return xml_text(controller, 'id')
+                if controller_status in ('REMOVING', 'UNKNOWN'):
+                    raise Exception("Controller " + xml_text(controller, 'id') + " deployed but is " + controller_status)
+                print("  controller %s %s after %d seconds" % (xml_text(controller, 'id'), controller_status,
+                                                                time.time() - started))
+        return None
+
+    return poll(check, timeout, what="controller deployment " + jobid)
+
+
+def job_failure_detail(nsx, jobid):
+    """
+    Get whatever the task service has to say about a failed job
+    """
+    status, body = nsx.request('GET', '/api/2.0/services/taskservice/job/' + jobid)
+    if status != 200:
+        return "no details available (" + str(status) + ")"
+    job = ElementTree.fromstring(body)
+    detail = xml_text(job, './/message') or xml_text(job, './/statusMessage') or xml_text(job, './/status')
+    return detail or "no details available"
 
 
-    return 0, response.read()
+def xml_text(element, path, default=""):
+    """
+    Text of the first element matching path under element, or default
+    """
+    found = element.find(path)
+    if found is None or found.text is None:
+        return default
+    return found.text.strip()
 
 
-def prepare_clusters_for_dfw(headers, nsx_manager_address, cluster_moref_list):
+def prepare_clusters_for_dfw(nsx, cluster_moref_list, host_prep_timeout=1800):
 
+    # submit host prep for every cluster in one request, NSX installs the VIBs on all of their hosts at once
+    # then follow the clusters and their hosts through the nwfabric status API until they are all GREEN
 
+    xml_string = "<nwFabricFeatureConfig>\n"
     for moref in cluster_moref_list:
-        xml_string = """
-            <nwFabricFeatureConfig>
+        xml_string += """
                 <resourceConfig>
                     <resourceId>{0}</resourceId>
                 </resourceConfig>
-            </nwFabricFeatureConfig>
             """.format(moref)
+    xml_string += "</nwFabricFeatureConfig>\n"
 
-        print("Preparing cluster " + moref + "...")
-
-        conn = HTTPSConnection(nsx_manager_address)
-        conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/nwfabric/configure', xml_string, headers)
+    print("Preparing clusters " + ", ".join(cluster_moref_list) + "...")
 
-        response = conn.getresponse()
+    status, body = nsx.request('POST', '/api/2.0/nwfabric/configure', xml_string)
 
-        if response.status != 200:
-            print(str(response.status) + " Preparing specified clusters for DFW failed.")
-            return -1, response.read()
+    if status != 200:
+        print(str(status) + " Preparing specified clusters for DFW failed.")
+        return -1, body
 
+    wait_status = wait_for_host_prep(nsx, cluster_moref_list, HOST_PREP_FEATURE, host_prep_timeout)
 
-        print("waiting 5 minutes...")
-        time.sleep(300)
+    if wait_status[0] != 0:
+        print("Preparing specified clusters for DFW failed.")
+        return wait_status
 
     print("Preparing specified clusters for DFW succeeded.")
-    return 0, response.read()
+    return 0, body
 
-def prepare_clusters_for_vxlan(headers, nsx_manager_address, cluster_moref_list, dvs_moref, vtep_vlan_id, vtep_ip_pool_id):
+def prepare_clusters_for_vxlan(nsx, cluster_moref_list, dvs_moref, vtep_vlan_id, vtep_ip_pool_id, host_prep_timeout=1800):
 
-    # configure VXLAN on the specified clusters
+    # configure VXLAN on the specified clusters, all of them in one request
     # use the IP pool called VTEP-Pool
     # use multi-vtep / route by src id teaming policy
     vtep_ip_pool_id = vtep_ip_pool_id.decode('utf-8')
@@ -495,52 +815,322 @@ def prepare_clusters_for_vxlan(headers, nsx_manager_address, cluster_moref_list,
     print('DVS moref: ' + dvs_moref)
     print('VTEP VLAN ID: ' + vtep_vlan_id)
 
+    xml_string = """
+            <nwFabricFeatureConfig>
+             <featureId>com.vmware.vshield.vsm.vxlan</featureId>"""
+
     for moref in cluster_moref_list:
         print('CLUSTER MOREF: ' + moref)
 
-        xml_string = """
-            <nwFabricFeatureConfig>
-             <featureId>com.vmware.vshield.vsm.vxlan</featureId>
+        xml_string += """
              <resourceConfig>
                <resourceId>{0}</resourceId>
                <configSpec class="clusterMappingSpec">
                  <switch>
                    <objectId>{1}</objectId></switch>
                    <vlanId>{2}</vlanId>
-                   <vmknicCount>2</vmknicCount>
+                   <vmknicCount>{4}</vmknicCount>
                    <ipPoolId>{3}</ipPoolId>
                </configSpec>
-             </resourceConfig>
+             </resourceConfig>""".format(moref,dvs_moref,vtep_vlan_id,vtep_ip_pool_id,VTEP_VMKNIC_COUNT)
+
+    xml_string += """
              <resourceConfig>
-               <resourceId>{1}</resourceId>
+               <resourceId>{0}</resourceId>
                <configSpec class="vdsContext">
                  <switch>
-                     <objectId>{1}</objectId>
+                     <objectId>{0}</objectId>
                  </switch>
                  <mtu>9000</mtu>
                  <teaming>LOADBALANCE_SRCID</teaming>
                </configSpec>
              </resourceConfig>
-            </nwFabricFeatureConfig>""".format(moref,dvs_moref,vtep_vlan_id,vtep_ip_pool_id)
+            </nwFabricFeatureConfig>""".format(dvs_moref)
 
-        print("Preparing cluster " + moref + " for VXLAN...")
+    print("Preparing clusters " + ", ".join(cluster_moref_list) + " for VXLAN...")
 
-        conn = HTTPSConnection(nsx_manager_address)
-        conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/nwfabric/configure', xml_string, headers)
+    status, body = nsx.request('POST', '/api/2.0/nwfabric/configure', xml_string)
 
-        response = conn.getresponse()
+    if status != 200:
+        print(str(status) + " Preparing specified clusters for VXLAN failed.")
+        return -1, body
 
-        if response.status != 200:
-            print(str(response.status) + " Preparing specified clusters for VXLAN failed.")
-            return -1, response.read()
+    wait_status = wait_for_host_prep(nsx, cluster_moref_list, VXLAN_FEATURE, host_prep_timeout)
 
-        print("waiting 5 minutes...")
-        time.sleep(300)
+    if wait_status[0] != 0:
+        print("Preparing specified clusters for VXLAN failed.")
+        return wait_status
 
     print("Preparing specified clusters for VXLAN succeeded.")
-    return 0, response.read()
+    return 0, body
+
+def wait_for_host_prep(nsx, cluster_moref_list, feature, timeout=1800):
+    """
+    Follow feature on every cluster in cluster_moref_list, and on each of their hosts, until they are all GREEN.
+    A cluster that goes RED stops being followed and its RED hosts are reported, the others are still waited for.
+    A status read that fails, or doesn't have the cluster in it yet, counts as not GREEN yet and is tried again.
+    Returns (0, "") or (-1, the failed hosts and their messages)
+    """
+    started = time.time()
+    pending = list(cluster_moref_list)
+    failures = []
+
+    def check():
+        for cluster in list(pending):
+            try:
+                cluster_status, cluster_message = nwfabric_status(nsx, '/api/2.0/nwfabric/status?resource=' + cluster,
+                                                                  feature).get(cluster, ("UNKNOWN", ""))
+                hosts = nwfabric_status(nsx, '/api/2.0/nwfabric/status/child/' + cluster, feature)
+            except Exception as e:
+                print("  cluster %s status not read after %d seconds, trying again: %s" % (cluster, time.time() - started,
+                                                                                           e))
+                continue
+            green = [host for host, (status, message) in hosts.items() if status == 'GREEN']
+            red = [(host, message) for host, (status, message) in hosts.items() if status == 'RED']
+
+            if red or cluster_status == 'RED':
+                pending.remove(cluster)
+                for host, message in red or [(cluster, cluster_message)]:
+                    failures.append("%s %s: %s" % (cluster, host, message or "RED"))
+                print("  cluster %s is RED, %d of %d hosts failed" % (cluster, len(red), len(hosts)))
+            elif cluster_status == 'GREEN' and len(green) == len(hosts):
+                pending.remove(cluster)
+                print("  cluster %s is GREEN on all %d hosts after %d seconds" % (cluster, len(hosts),
+                                                                                  time.time() - started))
+            else:
+                print("  cluster %s %s, %d of %d hosts GREEN after %d seconds" % (cluster, cluster_status, len(green),
+                                                                                 len(hosts), time.time() - started))
+        return True if not pending else None
+
+    try:
+        poll(check, timeout, what=feature + " on " + ", ".join(pending))
+    except Exception as e:
+        print(str(e))
+        failures.extend("%s: not GREEN after %d seconds" % (cluster, timeout) for cluster in pending)
+
+    if failures:
+        for failure in failures:
+            print("  FAILED " + failure)
+        return -1, "\n".join(failures)
+
+    return 0, ""
+
+def nwfabric_status(nsx, path, feature):
+    """
+    Read feature's status from an nwfabric status API path.
+    Returns a dictionary of resource ID to (status, message)
+    """
+    return OrderedDict((resource_id, features.get(feature, ("UNKNOWN", "")))
+                       for resource_id, features in nwfabric_statuses(nsx, path).items())
+
+def nwfabric_statuses(nsx, path):
+    """
+    Read every feature's status from an nwfabric status API path.
+    Returns a dictionary of resource ID to a dictionary of feature ID to (status, message)
+    """
+    status, body = nsx.request('GET', path)
+    if status != 200:
+        raise Exception(str(status) + " Could not read " + path)
+
+    statuses = OrderedDict()
+    for resource in ElementTree.fromstring(body).iter('resourceStatus'):
+        features = statuses.setdefault(xml_text(resource, 'resource/objectId'), dict())
+        for feature_status in resource.iter('nwFabricFeatureStatus'):
+            features[xml_text(feature_status, 'featureId')] = (xml_text(feature_status, 'status', "UNKNOWN"),
+                                                               xml_text(feature_status, 'message'))
+    return statuses
+
+def read_nsx_state(nsx, cluster_moref_list, max_workers=8):
+    """
+    Read what NSX Manager already has, every GET running in parallel, so a rerun only creates what is missing.
+    Returns a dictionary of
+        sso, vcenter: whether NSX Manager is registered
+        segments: list of (begin, end) segment ID ranges
+        pools: IP pool name to list of pool IDs, in case earlier runs created duplicates
+        controllers: list of (controller ID, status)
+        host_prep, vxlan: cluster moref to feature status
+        scopes: transport zone name to (scope ID, list of cluster morefs)
+    Raises an Exception if any of it can't be read
+    """
+    def get_xml(path):
+        status, body = nsx.request('GET', path)
+        if status != 200:
+            raise Exception(str(status) + " Could not read " + path)
+        return ElementTree.fromstring(body)
+
+    def sso():
+        return xml_text(get_xml('/api/2.0/services/ssoconfig/status'), '.').lower() == 'true'
+
+    def vcenter():
+        return xml_text(get_xml('/api/2.0/services/vcconfig/status'), 'connected').lower() == 'true'
+
+    def segments():
+        return [(int(xml_text(segment, 'begin')), int(xml_text(segment, 'end')))
+                for segment in get_xml('/api/2.0/vdn/config/segments').iter('segmentRange')]
+
+    def pools():
+        return OrderedDict((name, [pool_id for pool_id, _ in found]) for name, found in read_ip_pools(nsx).items())
+
+    def controllers():
+        return [(xml_text(controller, 'id'), xml_text(controller, 'status'))
+                for controller in get_xml('/api/2.0/vdn/controller').iter('controller')]
+
+    def scopes():
+        found = OrderedDict()
+        for scope in get_xml('/api/2.0/vdn/scopes').iter('vdnScope'):
+            found[xml_text(scope, 'name')] = (xml_text(scope, 'objectId'),
+                                              [xml_text(cluster, 'objectId') for cluster in scope.iter('cluster')
+                                               if xml_text(cluster, 'objectId')])
+        return found
+
+    def cluster_status(cluster):
+        features = nwfabric_statuses(nsx, '/api/2.0/nwfabric/status?resource=' + cluster).get(cluster, dict())
+        return features.get(HOST_PREP_FEATURE, ("UNKNOWN", ""))[0], features.get(VXLAN_FEATURE, ("UNKNOWN", ""))[0]
+
+    readers = [("sso", sso), ("vcenter", vcenter), ("segments", segments), ("pools", pools),
+               ("controllers", controllers), ("scopes", scopes)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(name, executor.submit(tracing.wrap(reader))) for name, reader in readers]
+        cluster_futures = [(cluster, executor.submit(tracing.wrap(cluster_status), cluster)) for cluster in cluster_moref_list]
+
+    existing = dict((name, future.result()) for name, future in futures)
+    existing["host_prep"] = OrderedDict((cluster, future.result()[0]) for cluster, future in cluster_futures)
+    existing["vxlan"] = OrderedDict((cluster, future.result()[1]) for cluster, future in cluster_futures)
+    return existing
+
+def read_ip_pools(nsx):
+    """
+    Read the IP pools NSX Manager has.
+    Returns an OrderedDict of pool name to list of (pool ID, ranges as a start-end,start-end spec)
+    """
+    status, body = nsx.request('GET', '/api/2.0/services/ipam/pools/scope/globalroot-0')
+    if status != 200:
+        raise Exception(str(status) + " Could not read the IP pools")
 
-def create_transport_zone(headers, nsx_manager_address, cluster_moref_list):
+    found = OrderedDict()
+    for pool in ElementTree.fromstring(body).iter('ipamAddressPool'):
+        spec = ",".join(xml_text(r, 'startAddress') + "-" + xml_text(r, 'endAddress') for r in pool.iter('ipRangeDto'))
+        found.setdefault(xml_text(pool, 'name'), []).append((xml_text(pool, 'objectId'), spec))
+    return found
+
+def host_vmk_addresses(si, container=None):
+    """
+    IP addresses of every host vmknic under container, read with one batched call.  VXLAN vmknics are left out, their
+    addresses come from VTEP-Pool in the first place.
+    Returns a dictionary of address to "vmk on host"
+    """
+    addresses = dict()
+    for _, props in collect_properties(si, vim.HostSystem, ["name", "config.network.vnic"], container):
+        for vnic in props.get("config.network.vnic") or []:
+            if getattr(vnic.spec, "netStackInstanceKey", None) == "vxlan":
+                continue
+            address = getattr(vnic.spec.ip, "ipAddress", None)
+            if address:
+                addresses[address] = "%s on %s" % (vnic.device, props["name"])
+    return addresses
+
+def check_ip_pools(nsx, si, dc, pools, reuse_existing=False, scan=True, scan_timeout=1, scan_concurrency=4096):
+    """
+    Check the IP pools about to be created, an OrderedDict of pool name to (ranges, mask, gateway), before any of them
+    is: each on its own and against its subnet, against each other, against the pools NSX Manager already has and
+    against the vmk IPs of the hosts.  With scan, every address is also probed (see ip_scan.py) and one that answers
+    is in use.  With reuse_existing a pool that already exists will be reused, not created, so it is left out.
+    Returns a list of problems.  Raises an Exception if a pool's ranges can't be parsed
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        nsx_pools = executor.submit(tracing.wrap(read_ip_pools), nsx)
+        vmk_addresses = executor.submit(tracing.wrap(host_vmk_addresses), si, dc)
+        # the sweep doesn't wait to hear which pools are reused, their results are dropped afterwards
+        if scan:
+            swept = executor.submit(tracing.wrap(scan_ranges), ",".join(spec for spec, _, _ in pools.values()), timeout=scan_timeout,
+                                    concurrency=scan_concurrency)
+    nsx_pools, vmk_addresses = nsx_pools.result(), vmk_addresses.result()
+    live = swept.result()[0] if scan else dict()
+
+    others = OrderedDict()
+    for name, found in nsx_pools.items():
+        if reuse_existing and name in pools:
+            continue
+        for pool_id, spec in found:
+            others["IP pool %s (%s)" % (name, pool_id)] = spec
+
+    problems = []
+    for name, (spec, mask, gateway) in pools.items():
+        if reuse_existing and name in nsx_pools:
+            continue
+        prefix_length = ip_mask_prefix_length(mask, gateway)
+        if prefix_length is None:
+            problems.append("%s: %s is not a valid mask for gateway %s" % (name, mask, gateway))
+        problems += validate_pool(spec, prefix_length, gateway, others, vmk_addresses, name)[1]
+        others[name] = spec
+        for address, evidence in addresses_in(parse_ranges(spec), live).items():
+            problems.append("%s: %s is already live on the network, it %s" % (name, address, evidence))
+    return problems
+
+def existing_pool_id(existing, name):
+    """
+    ID of the existing IP pool called name, as the bytes the create_*_ip_pool functions return, or None
+    """
+    if not existing or not existing["pools"].get(name):
+        return None
+    pool_ids = existing["pools"][name]
+    if len(pool_ids) > 1:
+        print("There are %d IP pools called %s (%s), using %s" % (len(pool_ids), name, ", ".join(pool_ids), pool_ids[0]))
+    return pool_ids[0].encode('utf-8')
+
+def print_nsx_state(existing):
+    print("NSX Manager already has:")
+    print("  SSO Lookup Service registration: " + ("yes" if existing["sso"] else "no"))
+    print("  vCenter registration: " + ("yes" if existing["vcenter"] else "no"))
+    print("  segment ID ranges: " + (", ".join("%d-%d" % segment for segment in existing["segments"]) or "none"))
+    print("  IP pools: " + (", ".join(name + " " + ",".join(ids) for name, ids in existing["pools"].items()) or "none"))
+    print("  controllers: " + (", ".join(id + " " + status for id, status in existing["controllers"]) or "none"))
+    for cluster in existing["host_prep"]:
+        print("  cluster %s: host prep %s, VXLAN %s" % (cluster, existing["host_prep"][cluster], existing["vxlan"][cluster]))
+    print("  transport zones: " + (", ".join(existing["scopes"]) or "none"))
+
+def expand_transport_zone(nsx, scope_id, cluster_moref_list):
+
+    # add clusters to an existing transport zone
+
+    xml_string = "<vdnScope>\n <objectId>{0}</objectId>\n <clusters>\n".format(scope_id)
+    for r in cluster_moref_list:
+        xml_string += "  <cluster><cluster><objectId>{0}</objectId></cluster></cluster>\n".format(r)
+    xml_string += " </clusters>\n</vdnScope>\n"
+
+    print("Adding clusters " + ", ".join(cluster_moref_list) + " to Transport Zone Primary...")
+
+    status, body = nsx.request('POST', '/api/2.0/vdn/scopes/' + scope_id + '?action=expand', xml_string)
+
+    if status != 200:
+        print(str(status) + " Clusters not added to Transport Zone Primary")
+        return -1, body
+    else:
+        print(str(status) + " Clusters added to Transport Zone Primary successfully.")
+        return 0, scope_id
+
+def wait_for_controllers_running(nsx, timeout=1800):
+    """
+    Wait until none of the existing controllers is still deploying.
+    Returns the list of (controller ID, status)
+    """
+    def check():
+        status, body = nsx.request('GET', '/api/2.0/vdn/controller')
+        if status != 200:
+            raise Exception(str(status) + " Could not list the NSX controllers")
+        controllers = [(xml_text(controller, 'id'), xml_text(controller, 'status'))
+                       for controller in ElementTree.fromstring(body).iter('controller')]
+        if any(controller_status == 'DEPLOYING' for _, controller_status in controllers):
+            print("  waiting for " + ", ".join(id for id, controller_status in controllers
+                                              if controller_status == 'DEPLOYING') + " to finish deploying")
+            return None
+        return controllers
+
+    return poll(check, timeout, what="the controllers already deploying")
+
+
+def create_transport_zone(nsx, cluster_moref_list):
 
     # create a local transport zone called "Primary"
     # set replication type to Unicast
@@ -568,20 +1158,17 @@ def create_transport_zone(headers, nsx_manager_address, cluster_moref_list):
 
     print("Creating Transport Zone Primary...")
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/vdn/scopes', xml_string, headers)
+    status, body = nsx.request('POST', '/api/2.0/vdn/scopes', xml_string)
 
-    response = conn.getresponse()
-
-    if response.status != 201:
-        print(str(response.status) + " Transport Zone not created.  Maybe it already exists?")
-        return -1, response.read()
+    if status != 201:
+        print(str(status) + " Transport Zone not created.  Maybe it already exists?")
+        return -1, body
     else:
-        print(str(response.status) + " Transport Zone Primary created successfully.")
-        return 0, response.read()
+        print(str(status) + " Transport Zone Primary created successfully.")
+        return 0, body
 
 
-def create_vtep_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_pool_mask, ip_pool_gateway, number_of_hosts, ip_pool_dns, dns_suffix):
+def create_vtep_ip_pool(nsx, ip_pool_list, ip_pool_mask, ip_pool_gateway, number_of_hosts, ip_pool_dns, dns_suffix):
 
     # get list of dns addresses
     vtep_dns_list = ip_pool_dns.split(",")
@@ -591,38 +1178,33 @@ def create_vtep_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_pool_mask
         if not ip_valid(r):
             return -1, "Invalid DNS address in ip_pool_dns {0}".format(r)
 
-    # get pool list ranges
-    vtep_range = ip_pool_list.split(',')
-
-    # count of ip addresses
-    host_count = 0
+    # validate gateway
+    try:
+        vtep_gateway = ipaddress.ip_address(ip_pool_gateway)
+    except ValueError:
+        return -1, "Invalid ip_pool_gateway {0}".format(ip_pool_gateway)
 
-    # validate pool ranges and compute number of addresses
-    for r in vtep_range:
-        try:
-            ip = r.split("-")
-            ip_start = int(ipaddress.IPv4Address(ip[0]))  # start address
-            ip_end = int(ipaddress.IPv4Address(ip[1]))  # end address
-            host_count += (ip_end - ip_start) + 1  # increment host count
-        except ipaddress.AddressValueError:
-            return -1, "invalid IP range in ip_pool_list {0}".format(r)
+    # validate the mask, up to /32 for an IPv4 gateway and /128 for an IPv6 one
+    vtep_mask = ip_mask_prefix_length(ip_pool_mask, ip_pool_gateway)
+    if vtep_mask is None:
+        return -1, "Invalid ip_pool_mask {0}".format(ip_pool_mask)
 
-    # validate number of hosts vs number_of_hosts argument
-    if host_count < (2 * number_of_hosts):
-        return -1, "count of ip addresses ({0}) < (number_of_hosts ({1}) * 2)".format(host_count, number_of_hosts)
+    # validate pool ranges against each other and the subnet, and compute number of addresses
+    # ranges can be start-end, single addresses or CIDR blocks, IPv4 or IPv6
+    try:
+        host_count, range_problems = validate_pool(ip_pool_list, vtep_mask, ip_pool_gateway, name="VTEP-Pool")
+    except Exception as e:
+        return -1, "invalid IP range in ip_pool_list: {0}".format(e)
+    if range_problems:
+        return -1, "; ".join(range_problems)
 
-    # validate the mask
-    if not ip_mask_valid(ip_pool_mask):
-        return -1, "Invalid ip_pool_mask {0}".format(ip_pool_mask)
-    else:
-        # remove the leading /
-        vtep_mask = ip_pool_mask[1:]
+    # NSX wants ranges that don't overlap, so send them merged
+    vtep_range = ["{0}-{1}".format(format_address(version, first), format_address(version, last))
+                  for version, first, last in merge_ranges(parse_ranges(ip_pool_list))]
 
-    # validate gateway
-    if ip_valid(ip_pool_gateway):
-        vtep_gateway = ipaddress.IPv4Address(ip_pool_gateway)
-    else:
-        return -1, "Invalid ip_pool_gateway {0}".format(ip_pool_gateway)
+    # validate number of hosts vs number_of_hosts argument
+    if host_count < (VTEP_VMKNIC_COUNT * number_of_hosts):
+        return -1, "count of ip addresses ({0}) < (number_of_hosts ({1}) * {2})".format(host_count, number_of_hosts, VTEP_VMKNIC_COUNT)
 
     # format xml string header
     xml_string = """
@@ -653,20 +1235,17 @@ def create_vtep_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_pool_mask
     print("Creating IP pool VTEP-Pool...")
 
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/services/ipam/pools/scope/globalroot-0', xml_string, headers)
-
-    response = conn.getresponse()
+    status, body = nsx.request('POST', '/api/2.0/services/ipam/pools/scope/globalroot-0', xml_string)
 
-    if response.status != 201:
-        print(str(response.status) + " IP Pool VTEP-Pool not created")
-        return -1, response.read()
+    if status != 201:
+        print(str(status) + " IP Pool VTEP-Pool not created")
+        return -1, body
     else:
-        print(str(response.status) + " IP Pool VTEP-Pool created successfully")
-        return 0, response.read()
+        print(str(status) + " IP Pool VTEP-Pool created successfully")
+        return 0, body
 
 
-def create_controller_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_pool_mask, ip_pool_gateway, ip_pool_dns, ip_pool_suffix):
+def create_controller_ip_pool(nsx, ip_pool_list, ip_pool_mask, ip_pool_gateway, ip_pool_dns, ip_pool_suffix):
 
     # same deal as the create_vtep_ip_pool, but we just need 3 for the controllers
 
@@ -678,39 +1257,34 @@ def create_controller_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_poo
         if not ip_valid(r):
             return -1, "Invalid DNS address in ip_pool_dns {0}".format(r)
 
-    # get pool list ranges
-    vtep_range = ip_pool_list.split(',')
+    # validate gateway
+    try:
+        vtep_gateway = ipaddress.ip_address(ip_pool_gateway)
+    except ValueError:
+        return -1, "Invalid ip_pool_gateway {0}".format(ip_pool_gateway)
 
-    # count of ip addresses
-    host_count = 0
+    # validate the mask, up to /32 for an IPv4 gateway and /128 for an IPv6 one
+    vtep_mask = ip_mask_prefix_length(ip_pool_mask, ip_pool_gateway)
+    if vtep_mask is None:
+        return -1, "Invalid ip_pool_mask {0}".format(ip_pool_mask)
 
-    # validate pool ranges and compute number of addresses
-    for r in vtep_range:
-        try:
-            ip = r.split("-")
-            ip_start = int(ipaddress.IPv4Address(ip[0]))  # start address
-            ip_end = int(ipaddress.IPv4Address(ip[1]))  # end address
-            host_count += (ip_end - ip_start) + 1  # increment host count
-        except ipaddress.AddressValueError:
-            return -1, "invalid IP range in ip_pool_list {0}".format(r)
+    # validate pool ranges against each other and the subnet, and compute number of addresses
+    # ranges can be start-end, single addresses or CIDR blocks, IPv4 or IPv6
+    try:
+        host_count, range_problems = validate_pool(ip_pool_list, vtep_mask, ip_pool_gateway, name="Controller-Pool")
+    except Exception as e:
+        return -1, "invalid IP range in ip_pool_list: {0}".format(e)
+    if range_problems:
+        return -1, "; ".join(range_problems)
+
+    # NSX wants ranges that don't overlap, so send them merged
+    vtep_range = ["{0}-{1}".format(format_address(version, first), format_address(version, last))
+                  for version, first, last in merge_ranges(parse_ranges(ip_pool_list))]
 
     # validate number of hosts vs number_of_hosts argument
     if host_count < 3:
         return -1, "count of ip addresses ({0}) < 3".format(host_count)
 
-    # validate the mask
-    if not ip_mask_valid(ip_pool_mask):
-        return -1, "Invalid ip_pool_mask {0}".format(ip_pool_mask)
-    else:
-        # remove the leading /
-        vtep_mask = ip_pool_mask[1:]
-
-    # validate gateway
-    if ip_valid(ip_pool_gateway):
-        vtep_gateway = ipaddress.IPv4Address(ip_pool_gateway)
-    else:
-        return -1, "Invalid ip_pool_gateway {0}".format(ip_pool_gateway)
-
     # format xml string header
     xml_string = """
        <ipamAddressPool>
@@ -739,29 +1313,32 @@ def create_controller_ip_pool(nsx_manager_address, headers, ip_pool_list, ip_poo
 
     print("Creating IP pool Controller-Pool...")
 
-    conn = HTTPSConnection(nsx_manager_address)
-    conn.request('POST', 'https://' + nsx_manager_address + '/api/2.0/services/ipam/pools/scope/globalroot-0',
-                 xml_string, headers)
+    status, body = nsx.request('POST', '/api/2.0/services/ipam/pools/scope/globalroot-0', xml_string)
 
-    response = conn.getresponse()
-
-    if response.status != 201:
-        print(str(response.status) + " IP Pool Controller-Pool not created")
-        return -1, response.read()
+    if status != 201:
+        print(str(status) + " IP Pool Controller-Pool not created")
+        return -1, body
     else:
-        print(str(response.status) + " IP Pool Controller-Pool created successfully")
-        return 0, response.read()
+        print(str(status) + " IP Pool Controller-Pool created successfully")
+        return 0, body
 
 
 
-def ip_mask_valid(mask):
+def ip_mask_prefix_length(mask, gateway):
     """
-    validate an ip CIDR mask
-    :param mask:
-    :return: boolean true if valid
+    validate an ip CIDR mask against the IP version of its gateway
+    :param mask: /0 to /32 for an IPv4 gateway, /0 to /128 for an IPv6 one
+    :param gateway:
+    :return: the prefix length as an int, None if the mask or the gateway isn't valid
     """
-    # must match / and 1 or 2 digits, and not longer than 3 characters
-    return ip_mask_re.match(mask) and (len(mask) <= 3)
+    match = ip_mask_re.match(mask or "")
+    try:
+        max_prefix_length = ipaddress.ip_address(gateway).max_prefixlen
+    except ValueError:
+        return None
+    if not match or int(match.group(1)) > max_prefix_length:
+        return None
+    return int(match.group(1))
 
 def ip_valid(ip_address):
     """
@@ -771,131 +1348,10 @@ def ip_valid(ip_address):
     :return:
     """
     try:
-        ipaddress.IPv4Address(ip_address)
+        ipaddress.ip_address(ip_address)
         return True
-    except ipaddress.AddressValueError:
+    except ValueError:
         return False
 
-def get_sha1_thumbprint(vcenter_address):
-
-    thumbprint = "not found"
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(1)
-    wrappedSocket = ssl.wrap_socket(sock)
-
-    try:
-        wrappedSocket.connect((vcenter_address, 443))
-    except:
-        response = False
-    else:
-
-        thumb_sha1 = hashlib.sha1(wrappedSocket.getpeercert(True)).hexdigest()
-        thumbprint = (':'.join(thumb_sha1[i:i + 2] for i in range(0, len(thumb_sha1), 2))).upper()
-
-    wrappedSocket.close()
-
-    return thumbprint
-
-def get_sha256_thumbprint(vcenter_address):
-
-    thumbprint = "not found"
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(1)
-    wrappedSocket = ssl.wrap_socket(sock)
-
-    try:
-        wrappedSocket.connect((vcenter_address, 443))
-    except:
-        response = False
-    else:
-
-        thumb_sha256 = hashlib.sha256(wrappedSocket.getpeercert(True)).hexdigest()
-        thumbprint = (':'.join(thumb_sha256[i:i + 2] for i in range(0, len(thumb_sha256), 2))).upper()
-
-    wrappedSocket.close()
-
-    return thumbprint
-
-
-def get_cluster_rp(dc, name):
-    """
-    Get a cluster by its name
-    """
-    cluster_list = dc.hostFolder.childEntity
-    cluster_obj = get_obj_in_list(name, cluster_list)
-
-    return cluster_obj.resourcePool
-
-def get_cluster_moref(dc, name):
-    """
-    Get a cluster moref by its name
-    """
-    cluster_list = dc.hostFolder.childEntity
-    cluster_obj = get_obj_in_list(name, cluster_list)
-    cluster_obj_moid = cluster_obj
-
-    return cluster_obj_moid
-
-def get_dvs_moref(dc, name):
-    """
-    Get a dvs moref by its name
-    """
-    dvs_list = dc.networkFolder.childEntity
-    dvs_obj = get_obj_in_list(name, dvs_list)
-    dvs_obj_moid = dvs_obj
-
-    return dvs_obj_moid
-
-def get_network(si, dc, name):
-    """
-    Get a network by its name
-    """
-    viewManager = si.content.viewManager
-    containerView = viewManager.CreateContainerView(dc, [vim.Network],
-                                                    True)
-    try:
-        for network in containerView.view:
-            print(network.name)
-            if network.name == name:
-                return network
-    finally:
-        containerView.Destroy()
-    raise Exception("Failed to find network %s in datacenter %s" %
-                    (name, dc.name))
-
-def get_dc(si, name):
-    """
-    Get a datacenter by its name.
-    """
-    for dc in si.content.rootFolder.childEntity:
-        if dc.name == name:
-            return dc
-    raise Exception('Failed to find datacenter named %s' % name)
-
-def get_ds(dc, name):
-    """
-    Pick a datastore by its name.
-    """
-    for ds in dc.datastore:
-        try:
-            if ds.name == name:
-                return ds
-        except:  # Ignore datastores that have issues
-            pass
-    raise Exception("Failed to find %s on datacenter %s" % (name, dc.name))
-
-def get_obj_in_list(obj_name, obj_list):
-    """
-    Gets an object out of a list (obj_list) whos name matches obj_name.
-    """
-    for o in obj_list:
-        if o.name == obj_name:
-            return o
-    print("Unable to find object by the name of %s in list:\n%s" %
-          (o.name, map(lambda o: o.name, obj_list)))
-    exit(1)
-
 if __name__ == "__main__":
     exit(main())
\ No newline at end of file
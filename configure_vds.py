@@ -9,6 +9,15 @@ https://github.com/seanhowardnetapp/pyNSXdeploy/
 This script will only work right if run immediately after NDE on a 6 cable setup.  The idea is to break up the single
 big vswitch into 3 separate ones each with 2 cables.
 
+More than one cluster can be split in the same run with -clusters.  Clusters that share a source switch share one set
+of new switches.  When the run covers more than one source switch, each set of new switches and port groups takes the
+suffix of its source switch, e.g. "NetApp HCI VDS 02" is split into "NetApp HCI Storage 02" with "iSCSI-A 02" and so
+on.  Each cluster's hosts are then migrated by their own pipeline, all clusters in parallel, with -max_parallel_ops
+capping how many vCenter operations are in progress at once across all of them.
+
+Before anything changes the vCenter login, the datacenter and every cluster in -clusters are checked in one go, and
+every problem found is reported together.
+
 Arguments
 ---------
 -s [vcenter FQDN or IP]
@@ -16,17 +25,87 @@ Arguments
 -p [vcenter administrator password]
 -S [tells it to ignore SSL errors, you probably want this]
 -d [datacenter you want to use.  optional - it will just use the first one if you don't specify]
+-clusters [comma separated list of clusters to split.  optional if there is only one cluster]
+-max_parallel_ops [maximum number of vCenter operations in progress at once across all clusters, defaults to 8]
+-state_file [JSON or YAML desired-state file, see vds_layout.json.  optional - when given the inventory is compared
+             against the file and only the missing changes are applied, so the script can safely be re-run]
+-dry_run [with -state_file, only print the change set]
+-journal [path of the checkpoint journal, defaults to configure_vds.journal in the current directory]
+-resume [carry on from the journal of an interrupted run.  Every journaled step is checked against vCenter first]
+-max_wave_size [largest number of hosts per cluster migrated at once.  Hosts go in waves of 1 (canary), 1, 2, 4, 8...
+                with health gates checked after each wave.  optional - waves keep doubling if you don't specify]
+-gate_timeout [seconds a wave has to pass its health gates before the rollout is stopped, defaults to 300]
+-snapshot_file [where the pre-change snapshot used by -rollback is written, defaults to configure_vds.snapshot.json]
+-rollback [put the hosts, VMs and port groups back the way the snapshot recorded them and remove the new switches]
+-keep_source_switch [don't remove the source switch at the end, so the run can still be rolled back]
+-trace [JSON lines file to trace every vCenter call, task and wait of the run to, with a summary of where the time went
+        printed at the end.  optional]
 
 """
 
 import atexit
 import argparse
-import time
-import re
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from pyvim.connect import SmartConnectNoSSL, Disconnect
+from pyvim.connect import Disconnect
 from pyVmomi import vim, vmodl
 
+import tracing
+
+from preflight import run_preflight, print_problems
+from vds_journal import Journal
+from vds_rollback import take_rollback_snapshot, save_snapshot, load_snapshot, rollback
+from vds_planner import read_host_network_state, plan_host_migration, apply_host_stage, switch_set_layout
+from vds_specs import dvswitch_create_spec, portgroup_config_spec, vm_nic_config_spec
+from vds_state import load_desired_state, reconcile
+from vds_waves import run_waves
+from vsphere_util import run_tasks_bounded, wait_for_tasks
+
+
+SOURCE_DVSWITCH_NAME = "NetApp HCI VDS"
+
+''' Port groups a source switch has straight out of NDE '''
+NDE_PORTGROUPS = ["NetApp HCI Uplinks", "VM_Network", "HCI_Internal_vCenter_Network", "HCI_Internal_OTS_Network",
+                  "HCI_Internal_mNode_Network", "vMotion", "Management Network", "iSCSI-A", "iSCSI-B",
+                  "vCenter_Recovery_PG"]
+
+''' Port groups that move to the new switches, temporarily renamed to <name>_1 on the source switch '''
+MOVED_PORTGROUPS = ["iSCSI-A", "iSCSI-B", "vMotion", "VM_Network", "HCI_Internal_vCenter_Network",
+                    "HCI_Internal_OTS_Network", "HCI_Internal_mNode_Network", "Management Network"]
+
+''' new port group -> (new switch, source port group the VLAN ID is copied from) '''
+NEW_PORTGROUPS = OrderedDict([
+    ("iSCSI-A", ("NetApp HCI Storage", "iSCSI-A")),
+    ("iSCSI-B", ("NetApp HCI Storage", "iSCSI-A")),
+    ("vMotion", ("NetApp HCI Compute", "vMotion")),
+    ("VM_Network", ("NetApp HCI Compute", "VM_Network")),
+    ("Management Network", ("NetApp HCI Management", "Management Network")),
+    ("HCI_Internal_vCenter_Network", ("NetApp HCI Management", "HCI_Internal_vCenter_Network")),
+    ("HCI_Internal_OTS_Network", ("NetApp HCI Management", "HCI_Internal_OTS_Network")),
+    ("HCI_Internal_mNode_Network", ("NetApp HCI Management", "HCI_Internal_mNode_Network")),
+])
+
+''' new port group -> (teaming policy, vmnics it keeps active, number of ports), as in vds_layout.json '''
+PORTGROUP_POLICIES = {
+    "iSCSI-A": ("failover_explicit", ["vmnic5"], 32),
+    "iSCSI-B": ("failover_explicit", ["vmnic1"], 32),
+    "vMotion": ("loadbalance_loadbased", [], 32),
+    "VM_Network": ("loadbalance_loadbased", [], 512),
+    "Management Network": ("loadbalance_loadbased", [], 512),
+    "HCI_Internal_vCenter_Network": ("loadbalance_loadbased", [], 32),
+    "HCI_Internal_OTS_Network": ("loadbalance_loadbased", [], 32),
+    "HCI_Internal_mNode_Network": ("loadbalance_loadbased", [], 32),
+}
+
+''' C&C VMs and the port group they move to '''
+VMS_TO_RELOCATE = [("NetApp-Management-Node", "HCI_Internal_mNode_Network"),
+                   ("vCenter-Server-Appliance", "HCI_Internal_vCenter_Network"),
+                   ("File Services powered by ONTAP-01", "HCI_Internal_OTS_Network")]
+
 
 def setup_args():
     parser = argparse.ArgumentParser(
@@ -64,297 +143,205 @@ def setup_args():
                         help='Name of datacenter to use. '
                              'Defaults to first.')
 
-    return (parser.parse_args())
-
-
-def main():
-    args = setup_args()
-    try:
-        si = SmartConnectNoSSL(host=args.host,
-                               user=args.user,
-                               pwd=args.password,
-                               port=args.port)
-        atexit.register(Disconnect, si)
-    except:
-        print("Unable to connect to %s" % args.host)
-        return 1
-
-    ''' Obtain DVS, cluster, and DC information and set up variables '''
-
-    if args.datacenter:
-        dc = get_dc(si, args.datacenter)
-    else:
-        dc = si.content.rootFolder.childEntity[0]
-
-    dvswitchinfo = list_dvswitches(si)
-    number_of_dvswitches = dvswitchinfo[0]
-    dvswitchname = dvswitchinfo[1]
-
-    clusterinfo = list_clusters(si)
-    number_of_clusters = clusterinfo[0]
-    clustername = clusterinfo[1]
-
-    network_folder = dc.networkFolder
+    parser.add_argument('-clusters', '--clusters',
+                        help='comma separated list of cluster names to split.  Optional if there is only one cluster')
 
-    ''' Check to see if there is more than one DVS, if so, cancel execution.  This means it is not a fresh environment 
-    out of NDE '''
-
-    if number_of_dvswitches > 1:
-        print(
-            "More than one Distributed Virtual Switch is detected in this environment.  This script is meant to be run "
-            "immediately after NDE.  Exiting...")
-        return 1
-
-    ''' Check to see if there is more than one Cluster, if so, cancel execution.  This means it is not a fresh 
-    environment out of NDE '''
-
-    if number_of_clusters > 1:
-        print(
-            "More than one Cluster is detected in this environment.  This script is meant to be run immediately after "
-            "NDE.  Exiting...")
-        return 1
-
-    ''' Build a dictionary of the objects for all the port groups '''
-    portgroup_info = list_portgroups_initial(si)
-    portgroup_moref_dict = portgroup_info[0]
-    portgroup_name_flag = portgroup_info[1]
-
-    ''' Check to see if the portgroup_name_flag is nonzero.  If so, it means list_portgroups() found a portgroup name 
-    that shouldn't exist.  Again this means its not a fresh from NDE setup '''
-
-    if portgroup_name_flag == 1:
-        print(
-            "Found a portgroup name that should not exist.  This script is meant to be run immediately after NDE.  "
-            "Exiting...")
-        print("Offending Portgroup: " + portgroup_info[2])
-        return 1
-
-    ''' Get the VLAN ID from iSCSI-A'''
-    vlan_id_from_iscsi_a = obtain_vlan_id_from_portgroup(portgroup_moref_dict.get("iSCSI-A"))
-
-    ''' Temporarily rename the iSCSI port Groups on the Management DVS '''
-    temporary_rename_of_iscsi_portgroups(si)
-
-    ''' Get the VLAN ID from vMotion'''
-    vlan_id_from_vmotion = obtain_vlan_id_from_portgroup(portgroup_moref_dict.get("vMotion"))
+    parser.add_argument('-max_parallel_ops', '--max_parallel_ops',
+                        type=int,
+                        default=8,
+                        help='maximum number of vCenter operations in progress at once across all clusters')
 
-    ''' Temporarily rename the vMotion port group on the Management DVS '''
-    temporary_rename_of_vmotion_portgroup(si)
+    parser.add_argument('-state_file', '--state_file',
+                        help='JSON or YAML desired-state file describing the layout, see vds_layout.json')
 
-    ''' Get the VLAN ID from VM Network'''
-    vlan_id_from_vm = obtain_vlan_id_from_portgroup(portgroup_moref_dict.get("VM_Network"))
+    parser.add_argument('-dry_run', '--dry_run',
+                        action='store_true',
+                        help='with -state_file, only print the changes that would be made')
 
-    ''' Temporarily rename the VM_Network port group on the Management DVS '''
-    temporary_rename_of_vm_portgroup(si)
+    parser.add_argument('-journal', '--journal',
+                        default='configure_vds.journal',
+                        help='path of the checkpoint journal of completed steps')
 
-    ''' Get the VLAN ID from the C&C PGs'''
-    vlan_id_from_Management_Network = obtain_vlan_id_from_portgroup(portgroup_moref_dict.get("Management Network"))
-    vlan_id_from_HCI_Internal_vCenter_Network = obtain_vlan_id_from_portgroup(
-        portgroup_moref_dict.get("HCI_Internal_vCenter_Network"))
-    vlan_id_from_HCI_Internal_mNode_Network = obtain_vlan_id_from_portgroup(
-        portgroup_moref_dict.get("HCI_Internal_mNode_Network"))
-    vlan_id_from_HCI_Internal_OTS_Network = obtain_vlan_id_from_portgroup(
-        portgroup_moref_dict.get("HCI_Internal_OTS_Network"))
+    parser.add_argument('-resume', '--resume',
+                        action='store_true',
+                        help='carry on from the journal of an interrupted run')
 
-    ''' Temporarily rename the C&C port groups on the Management DVS '''
-    temporary_rename_of_cc_portgroups(si)
+    parser.add_argument('-max_wave_size', '--max_wave_size',
+                        type=int,
+                        help='largest number of hosts per cluster migrated at once')
 
-    ''' Create a dvs called "NetApp HCI Management" and attach it to the cluster '''
-    management_dvswitch_object = create_dvSwitch(si, network_folder, clusterinfo[2], "NetApp HCI Management")
+    parser.add_argument('-gate_timeout', '--gate_timeout',
+                        type=int,
+                        default=300,
+                        help='seconds a wave has to pass its health gates before the rollout is stopped')
 
-    ''' Create a dvs called "NetApp HCI Storage" and attach it to the cluster '''
-    storage_dvswitch_object = create_dvSwitch(si, network_folder, clusterinfo[2], "NetApp HCI Storage")
+    parser.add_argument('-snapshot_file', '--snapshot_file',
+                        default='configure_vds.snapshot.json',
+                        help='path of the pre-change snapshot used by -rollback')
 
-    ''' Create a dvs called "NetApp HCI Compute" and attach it to the cluster '''
-    compute_dvswitch_object = create_dvSwitch(si, network_folder, clusterinfo[2], "NetApp HCI Compute")
+    parser.add_argument('-rollback', '--rollback',
+                        action='store_true',
+                        help='restore the layout recorded in the snapshot file')
 
-    ''' Rename the uplink portgroups '''
-    rename_uplink_portgroups(si)
+    parser.add_argument('-keep_source_switch', '--keep_source_switch',
+                        action='store_true',
+                        help='leave the source switch in place so the run can still be rolled back')
 
-    ''' Add iSCSI-A and iSCSI-B to the storage DVS '''
-    add_dvPort_group(si, storage_dvswitch_object, "iSCSI-A", vlan_id_from_iscsi_a)
-    add_dvPort_group(si, storage_dvswitch_object, "iSCSI-B", vlan_id_from_iscsi_a)
+    parser.add_argument('-trace', '--trace',
+                        help='JSON lines file to trace every vCenter call, task and wait to')
 
-    ''' Add vMotion to the Compute DVS '''
-    add_dvPort_group(si, compute_dvswitch_object, "vMotion", vlan_id_from_vmotion)
+    return (parser.parse_args())
 
-    ''' Add VM_Network to the Compute DVS '''
-    add_dvPort_group(si, compute_dvswitch_object, "VM_Network", vlan_id_from_vm)
 
-    ''' Add Management Network to the Management DVS'''
-    add_dvPort_group(si, management_dvswitch_object, "Management Network", vlan_id_from_Management_Network)
+def main():
+    args = setup_args()
 
-    ''' Add C&C port groups '''
-    add_dvPort_group(si, management_dvswitch_object, "HCI_Internal_vCenter_Network",
-                     vlan_id_from_HCI_Internal_vCenter_Network)
-    add_dvPort_group(si, management_dvswitch_object, "HCI_Internal_OTS_Network", vlan_id_from_HCI_Internal_OTS_Network)
-    add_dvPort_group(si, management_dvswitch_object, "HCI_Internal_mNode_Network",
-                     vlan_id_from_HCI_Internal_mNode_Network)
+    if args.trace:
+        tracing.start(args.trace)
+        atexit.register(tracing.stop)
 
-    ''' Now its time to move the VMkernel IPs over to the new port groups'''
+    ''' Pre-flight: connect to vCenter and look up the datacenter and every cluster to split in one read, so a typo is
+    reported before anything changes '''
 
+    cluster_names = []
+    if args.clusters and not args.state_file and not args.rollback:
+        cluster_names = [clustername.strip() for clustername in args.clusters.split(",")]
 
+    with tracing.phase("preflight"):
+        si, dc, found, problems = run_preflight(args.host, args.user, args.password, args.port, args.datacenter,
+                                                [("-clusters", vim.ClusterComputeResource, name)
+                                                 for name in cluster_names])
+    if si is not None:
+        atexit.register(Disconnect, si)
+    if problems:
+        print_problems(problems)
+        return 1
 
-    """ move vmnic3 to the new Management DVS """
     content = si.RetrieveContent()
-    source_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI VDS")
-    target_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI Management")
-
-    for entity in dc.hostFolder.childEntity:
-        for host in entity.host:
-            print("Migrating vmnic3 on host:", host.name)
-            unassign_pnic_list = []
-
-            s = str(host.config.network.proxySwitch)
-
-            result = find_pnic_spec(s)
-
-            # get one or more pnic specs
-            for g in result:
-                v = get_vmnic(g)
-                x = v.split(':')
-
-                if x[0] != "vmnic3":
-                    unassign_pnic_list.append(v)
-
-            unassign_pnic(source_dvswitch, host, unassign_pnic_list)
-            time.sleep(10)
-            assign_pnic_list = ["vmnic3"]
-            assign_pnic(target_dvswitch, host, assign_pnic_list)
-            time.sleep(10)
-
-    ''' relocate the c&c vms '''
-    list_of_vms_to_relocate = ["NetApp-Management-Node", "vCenter-Server-Appliance",
-                               "File Services powered by ONTAP-01"]
-
-    for vmname in list_of_vms_to_relocate:
-        vm = get_obj(content, [vim.VirtualMachine], vmname)
-        vmtype = str(type(vm))
-
-        if vmtype == "<class 'pyVmomi.VmomiSupport.vim.VirtualMachine'>" and vmname == "vCenter-Server-Appliance":
-            network = get_obj(content, [vim.DistributedVirtualPortgroup], "HCI_Internal_vCenter_Network")
-            move_vm(vm, network)
-            print("Successfully moved", vmname, "to new Management DVS")
-
-        if vmtype == "<class 'pyVmomi.VmomiSupport.vim.VirtualMachine'>" and vmname == "NetApp-Management-Node":
-            network = get_obj(content, [vim.DistributedVirtualPortgroup], "HCI_Internal_mNode_Network")
-            move_vm(vm, network)
-            print("Successfully moved", vmname, "to new Management DVS")
-
-        if vmtype == "<class 'pyVmomi.VmomiSupport.vim.VirtualMachine'>" and vmname == "File Services powered by ONTAP-01":
-            network = get_obj(content, [vim.DistributedVirtualPortgroup], "HCI_Internal_OTS_Network")
-            move_vm(vm, network)
-            print("Successfully moved", vmname, "to new Management DVS")
-
-        time.sleep(5)
-
-    target_portgroup = get_obj(content, [vim.DistributedVirtualPortgroup], "Management Network")
-
-    for entity in dc.hostFolder.childEntity:
-        for host in entity.host:
-            print("Migrating vmnic2 / vmk0 on host:", host.name)
-            migrate_vmk(host, target_portgroup, target_dvswitch, "vmk0")
-            time.sleep(10)
-            unassign_pnic_list = []
-
-            s = str(host.config.network.proxySwitch)
-
-            result = find_pnic_spec(s)
-
-            # get one or more pnic specs
-            for g in result:
-                v = get_vmnic(g)
-                x = v.split(':')
-
-                if x[0] != "vmnic2" and x[0] !="vmnic3":
-                    unassign_pnic_list.append(v)
-
-            unassign_pnic(source_dvswitch, host, unassign_pnic_list)
-            time.sleep(10)
-            assign_pnic_list = ["vmnic2", "vmnic3"]
-            assign_pnic(target_dvswitch, host, assign_pnic_list)
-            time.sleep(10)
-
-    ''' Move vmnic5 and its associated vmk to the storage dvs'''
-
-    source_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI VDS")
-    target_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI Storage")
-    target_portgroup = get_obj(content, [vim.DistributedVirtualPortgroup], "iSCSI-A")
-
-    for entity in dc.hostFolder.childEntity:
-        for host in entity.host:
-            print("Migrating vmnic5 / vmk1 on host:", host.name)
-            migrate_vmk(host, target_portgroup, target_dvswitch, "vmk1")
-            time.sleep(10)
-            unassign_pnic_list = []
-
-            s = str(host.config.network.proxySwitch)
-
-            result = find_pnic_spec(s)
-
-            # get one or more pnic specs
-            for g in result:
-                v = get_vmnic(g)
-                x = v.split(':')
-
-                if x[0] != "vmnic5" and x[0] != "vmnic2" and x[0] !="vmnic3":
-                    unassign_pnic_list.append(v)
-
-            unassign_pnic(source_dvswitch, host, unassign_pnic_list)
-            time.sleep(10)
-            assign_pnic_list = ["vmnic5"]
-            assign_pnic(target_dvswitch, host, assign_pnic_list)
-            time.sleep(10)
 
-    ''' Move vmnic1 and its associated vmk to the storage dvs'''
-
-    source_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI VDS")
-    target_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI Storage")
-    target_portgroup = get_obj(content, [vim.DistributedVirtualPortgroup], "iSCSI-B")
+    ''' With a desired-state file, diff it against the inventory and apply only what is missing '''
+
+    if args.state_file:
+        try:
+            desired = load_desired_state(args.state_file)
+            with tracing.phase("reconcile"):
+                reconcile(si, dc, desired, args.dry_run)
+        except Exception as e:
+            print(e)
+            return 1
+        print("DVS reconfiguration complete.")
+        return 0
+
+    ''' Roll back to the layout recorded in the snapshot taken before the split '''
+
+    if args.rollback:
+        created_switches = []
+        if os.path.exists(args.journal):
+            journal = Journal(args.journal)
+            created_switches = [detail["uuid"] for _, detail in journal.details("created_switch")]
+            journal.close()
+        try:
+            with tracing.phase("rollback"):
+                rollback(si, load_snapshot(args.snapshot_file), args.max_parallel_ops, created_switches)
+        except Exception as e:
+            print(e)
+            return 1
+        if os.path.exists(args.journal):
+            os.rename(args.journal, args.journal + ".rolled_back")
+            print("Journal moved to " + args.journal + ".rolled_back")
+        return 0
+
+    ''' Every completed step goes into the journal so that an interrupted run can be picked up with -resume '''
+
+    if args.resume and not os.path.exists(args.journal):
+        print("No journal found at " + args.journal + ", nothing to resume.  Exiting...")
+        return 1
 
-    for entity in dc.hostFolder.childEntity:
-        for host in entity.host:
-            print("Migrating vmnic1 / vmk2 on host:", host.name)
-            migrate_vmk(host, target_portgroup, target_dvswitch, "vmk2")
-            time.sleep(10)
-            unassign_pnic_list = []
+    if not args.resume and os.path.exists(args.journal):
+        print("A journal from an earlier run exists at " + args.journal + ".  Use -resume to carry on from it, or "
+              "remove it to start over.  Exiting...")
+        return 1
 
-            s = str(host.config.network.proxySwitch)
+    journal = Journal(args.journal)
+    atexit.register(journal.close)
 
-            result = find_pnic_spec(s)
+    if args.resume:
+        if journal.done("run", "all", "complete"):
+            print("The journal shows this run already completed.  Nothing to do.")
+            return 0
+        print("Resuming from " + args.journal + " with " + str(len(journal)) + " completed steps")
 
-            # get one or more pnic specs
-            for g in result:
-                v = get_vmnic(g)
-                x = v.split(':')
+    ''' Work out which clusters to split.  Without -clusters there must be exactly one, as straight out of NDE '''
 
-                if x[0] != "vmnic1" and x[0] != "vmnic5" and x[0] != "vmnic2" and x[0] !="vmnic3":
-                    unassign_pnic_list.append(v)
+    if cluster_names:
+        clusters = [found[(vim.ClusterComputeResource, name)] for name in cluster_names]
+    else:
+        clusterinfo = list_clusters(si)
 
-            unassign_pnic(source_dvswitch, host, unassign_pnic_list)
-            time.sleep(10)
-            assign_pnic_list = ["vmnic5", "vmnic1"]
-            assign_pnic(target_dvswitch, host, assign_pnic_list)
-            time.sleep(10)
+        if clusterinfo[0] > 1:
+            print(
+                "More than one Cluster is detected in this environment.  Use -clusters to choose the clusters to "
+                "split.  Exiting...")
+            return 1
 
-    """ Move vmnic0/vmnic4 and the vmotion vmk to the compute dvs"""
+        clusters = [clusterinfo[2]]
 
-    source_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI VDS")
-    target_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], "NetApp HCI Compute")
-    target_portgroup = get_obj(content, [vim.DistributedVirtualPortgroup], "vMotion")
+    ''' Group the clusters by the switch their management vmk is on today, each group gets its own new switches '''
 
-    for entity in dc.hostFolder.childEntity:
-        for host in entity.host:
-            print("Migrating vmnic0 / vmnic4 / vmk3 on host:", host.name)
-            migrate_vmk(host, target_portgroup, target_dvswitch, "vmk3")
-            time.sleep(10)
-            unassign_pnic_list = []
-            unassign_pnic(source_dvswitch, host, unassign_pnic_list)
-            time.sleep(10)
-            assign_pnic_list = ["vmnic0", "vmnic4"]
-            assign_pnic(target_dvswitch, host, assign_pnic_list)
-            time.sleep(10)
+    switch_groups = group_clusters_by_source_dvs(content, clusters, journal)
+    if switch_groups is None:
+        return 1
 
+    ''' Record the original layout before anything changes, a resumed run keeps the snapshot of the first run '''
+
+    if not (args.resume and os.path.exists(args.snapshot_file)):
+        with tracing.phase("snapshot"):
+            save_snapshot(take_rollback_snapshot(si, clusters, list(switch_groups)), args.snapshot_file)
+        print("Saved the original layout to " + args.snapshot_file + ", use -rollback to restore it")
+
+    switch_sets = []
+    for source_dvswitch, switch_clusters in switch_groups.items():
+        if len(switch_groups) > 1:
+            suffix = switch_suffix(source_dvswitch.name)
+        else:
+            suffix = ""
+
+        with tracing.phase("prepare_switches"):
+            switch_set = prepare_switch_set(si, dc, source_dvswitch, switch_clusters, suffix, journal)
+        if switch_set is None:
+            return 1
+        switch_sets.append(switch_set)
+
+    ''' Now its time to move the uplinks and VMkernel IPs over to the new switches.  Every cluster runs as its own
+    pipeline in parallel.  Each host is planned from its current state and moved in two UpdateNetworkConfig calls:
+    "split" puts one uplink on each new switch and moves the vmks that can already follow it, "finish" moves the rest.
+    The C&C VMs are moved in between, while both the old and the new switches still have uplinks.  Within a cluster
+    each stage is rolled out in waves of hosts, a canary first, and a wave that fails its health gates stops that
+    cluster. '''
+
+    limiter = threading.BoundedSemaphore(args.max_parallel_ops)
+    wave_options = {"max_wave_size": args.max_wave_size, "gate_timeout": args.gate_timeout}
+    pipelines = []
+
+    with tracing.phase("migrate"), ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        for switch_set in switch_sets:
+            for cluster in switch_set["clusters"]:
+                pipelines.append((cluster.name,
+                                  executor.submit(tracing.wrap(migrate_cluster), si, content, cluster, switch_set,
+                                                  limiter, journal, wave_options)))
+
+    failed = False
+    for clustername, pipeline in pipelines:
+        try:
+            pipeline.result()
+            print("Cluster " + clustername + " migrated.")
+        except Exception as e:
+            print("Cluster " + clustername + " failed: " + str(e))
+            failed = True
+
+    if failed:
+        print("Not removing any source switches because at least one cluster failed.")
+        return 1
 
     """
     clean up the old port groups
@@ -367,220 +354,347 @@ def main():
         print("Deleted portgroup", pgname)
     """
 
-    delete_dvs(dvswitchinfo[2])
+    ''' Only remove a source switch once every host on it has been migrated.  This is the point of no return, the
+    snapshot can't be rolled back without the source switch '''
 
-    print("DVS reconfiguration complete.")
+    for switch_set in switch_sets:
+        if args.keep_source_switch:
+            print("Leaving " + switch_set["source"].name + " in place, -rollback can still restore it")
+            continue
 
-def find_pnic_spec(s):
-    s = s.replace('\n',' ')
-    pat = '\(vim\.dvs\.HostMember\.PnicSpec\)\s*\{.*?\},'
-    r1 = re.compile(pat)
-    r = r1.findall(s)
+        source_dvswitch = switch_set["source"]
+        migrated_hosts = set(host for cluster in switch_set["clusters"] for host in cluster.host)
+        remaining = [member.config.host.name for member in source_dvswitch.config.host
+                     if member.config.host not in migrated_hosts]
 
-    return r
+        if remaining:
+            print("Leaving " + source_dvswitch.name + " in place, still used by: " + ", ".join(remaining))
+        else:
+            with tracing.phase("cleanup"):
+                wait_for_tasks(si, [delete_dvs(source_dvswitch)])
+            journal.record("cleanup", source_dvswitch.name, "delete_switch")
 
+    journal.record("run", "all", "complete")
+    print("DVS reconfiguration complete.")
 
-def get_vmnic(s):
-    pat = '\(vim\.dvs\.HostMember\.PnicSpec\)\s*\{.*?\},'
-    r1 = re.compile(pat)
-    r2 = re.compile('pnicDevice = \'(vmnic\d)\'')
-    r3 = re.compile('uplinkPortKey = \'(\d+)\'')
-    device = r2.search(s).group(1)
-    key = r3.search(s).group(1)
 
-    return device + ':' + key
+def switch_suffix(source_dvswitchname):
+    """
+    Suffix for the new switches and port groups split out of a source switch, " 02" for "NetApp HCI VDS 02"
+    """
+    if source_dvswitchname.startswith(SOURCE_DVSWITCH_NAME):
+        return source_dvswitchname[len(SOURCE_DVSWITCH_NAME):]
+    return " " + source_dvswitchname
 
 
-def delete_portgroup(pg):
-    task = pg.Destroy_Task()
+def group_clusters_by_source_dvs(content, clusters, journal):
+    """
+    Group clusters by the DVS carrying vmk0 on their first host.  The answer is journaled, as vmk0 will have moved by
+    the time a resumed run asks again.
+    Returns an OrderedDict of source DVS -> list of clusters, or None if a cluster has no usable source switch.
+    """
+    switch_groups = OrderedDict()
 
+    for cluster in clusters:
+        if not cluster.host:
+            print("Cluster " + cluster.name + " has no hosts.  Exiting...")
+            return None
 
-def delete_dvs(dvs):
-    task = dvs.Destroy_Task()
+        if journal.done("plan", cluster.name, "source"):
+            source_dvswitchname = journal.detail("plan", cluster.name, "source")["switch"]
+        else:
+            state = read_host_network_state(cluster.host[0])
+            source_dvswitchname = state["vmks"].get("vmk0", (None, None))[0]
 
+            if source_dvswitchname is None:
+                print("vmk0 on cluster " + cluster.name + " is not on a Distributed Virtual Switch.  Exiting...")
+                return None
 
-def obtain_vlan_id_from_portgroup(portgroup_object):
-    return portgroup_object.config.defaultPortConfig.vlan.vlanId
+            journal.record("plan", cluster.name, "source", switch=source_dvswitchname)
 
+        source_dvswitch = get_obj(content, [vim.DistributedVirtualSwitch], source_dvswitchname)
+        if source_dvswitch is None:
+            print("Source switch " + source_dvswitchname + " for cluster " + cluster.name + " no longer exists.  "
+                  "Exiting...")
+            return None
 
-def rename_uplink_portgroups(si):
-    content = si.RetrieveContent()
+        switch_groups.setdefault(source_dvswitch, []).append(cluster)
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name[:16] == "NetApp HCI Compu":
-            task = portgroup.Rename("NetApp HCI Compute Uplinks")
-            print("Changing Uplink Port Group Name to 'NetApp HCI Compute Uplinks'")
+    return switch_groups
 
-        if portgroup.name[:16] == "NetApp HCI Stora":
-            task = portgroup.Rename("NetApp HCI Storage Uplinks")
-            print("Changing Uplink Port Group Name to 'NetApp HCI Storage Uplinks'")
 
-        if portgroup.name[:16] == "NetApp HCI Manag":
-            task = portgroup.Rename("NetApp HCI Management Uplinks")
-            print("Changing Uplink Port Group Name to 'NetApp HCI Management Uplinks'")
+def step_done(journal, phase, target, step, verify):
+    """
+    True if a step is in the journal and verify() confirms it against the live inventory.  A journaled step that
+    can't be confirmed is run again, all the steps only act on what is still missing.
+    """
+    if not journal.done(phase, target, step):
+        return False
 
+    if verify():
+        print("Resume: " + step + " for " + target + " already done")
+        return True
 
-def temporary_rename_of_iscsi_portgroups(si):
-    content = si.RetrieveContent()
+    print("Resume: " + step + " for " + target + " is in the journal but not reflected in vCenter, running it again")
+    return False
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "iSCSI-A":
-            task = portgroup.Rename("iSCSI-A_1")
-            print("Temporarily renaming portgroup iSCSI-A to iSCSI-A_1")
 
-        if portgroup.name == "iSCSI-B":
-            task = portgroup.Rename("iSCSI-B_1")
-            print("Temporarily renaming portgroup iSCSI-B to iSCSI-B_1")
+def prepare_switch_set(si, dc, source_dvswitch, clusters, suffix, journal):
+    """
+    Check the source switch is fresh out of NDE, copy its VLAN IDs, temporarily rename its port groups, and create the
+    three new switches and their port groups for the given clusters.  Each step is journaled as it completes.
+    Returns a dictionary describing the switch set, or None if the source switch is not in the expected state.
+    """
+    content = si.RetrieveContent()
+    target_uplinks, target_vmks = switch_set_layout(suffix)
+    phase = "prepare"
+    target = source_dvswitch.name
 
+    if journal.done(phase, target, "check"):
+        print("Resume: NDE checks and VLAN IDs for " + target + " taken from the journal")
+        vlan_ids = journal.detail(phase, target, "check")["vlan_ids"]
+    else:
+        ''' Check to see if any of the new switches already exist.  This means it is not a fresh environment out of
+        NDE '''
+
+        for dvswitchname in target_uplinks:
+            if get_obj(content, [vim.DistributedVirtualSwitch], dvswitchname) is not None:
+                print(
+                    "Distributed Virtual Switch " + dvswitchname + " already exists.  This script is meant to be run "
+                    "immediately after NDE.  Exiting...")
+                return None
+
+        ''' Build a dictionary of the objects for all the port groups on the source switch '''
+        portgroup_info = list_portgroups_initial(source_dvswitch, suffix)
+        portgroup_moref_dict = portgroup_info[0]
+        portgroup_name_flag = portgroup_info[1]
+
+        ''' Check to see if the portgroup_name_flag is nonzero.  If so, it means list_portgroups() found a portgroup
+        name that shouldn't exist.  Again this means its not a fresh from NDE setup '''
+
+        if portgroup_name_flag == 1:
+            print(
+                "Found a portgroup name that should not exist.  This script is meant to be run immediately after "
+                "NDE.  Exiting...")
+            print("Offending Portgroup: " + portgroup_info[2])
+            return None
+
+        ''' Get the VLAN IDs from the source port groups before they are renamed '''
+        vlan_ids = dict()
+        for portgroupname, (dvswitchname, vlan_source) in NEW_PORTGROUPS.items():
+            vlan_ids[portgroupname] = obtain_vlan_id_from_portgroup(portgroup_moref_dict.get(vlan_source + suffix))
+
+        journal.record(phase, target, "check", vlan_ids=vlan_ids)
+
+    ''' Temporarily rename the port groups that are moving on the source switch '''
+    moved = [name + suffix for name in MOVED_PORTGROUPS]
+    source_portgroups = dict((portgroup.name, portgroup) for portgroup in source_dvswitch.portgroup)
+
+    if not step_done(journal, phase, target, "rename_portgroups",
+                     lambda: not any(name in source_portgroups for name in moved)):
+        temporary_rename_of_portgroups(si, source_portgroups, moved)
+        journal.record(phase, target, "rename_portgroups")
+
+    ''' Create the "NetApp HCI Management", "NetApp HCI Storage" and "NetApp HCI Compute" switches together and
+    attach them to every host in the clusters.  On resume only the missing ones are created '''
+    new_dvswitches = dict((dvswitchname, get_obj(content, [vim.DistributedVirtualSwitch], dvswitchname))
+                          for dvswitchname in target_uplinks)
+
+    if not step_done(journal, phase, target, "create_switches",
+                     lambda: all(dvswitch is not None for dvswitch in new_dvswitches.values())):
+        hosts = [host for cluster in clusters for host in cluster.host]
+        missing = dict((dvswitchname, pnics) for dvswitchname, pnics in target_uplinks.items()
+                       if new_dvswitches[dvswitchname] is None)
+        new_dvswitches.update(create_dvSwitches(si, dc.networkFolder, hosts, missing, journal))
+        journal.record(phase, target, "create_switches")
 
-def temporary_rename_of_vmotion_portgroup(si):
-    content = si.RetrieveContent()
+    ''' Rename the uplink portgroups '''
+    if not step_done(journal, phase, target, "rename_uplinks",
+                     lambda: all(portgroup.name == dvswitch.name + " Uplinks" for dvswitch in new_dvswitches.values()
+                                 for portgroup in dvswitch.config.uplinkPortgroup)):
+        rename_uplink_portgroups(si, new_dvswitches.values())
+        journal.record(phase, target, "rename_uplinks")
+
+    ''' Add the port groups to the new switches '''
+    existing = set(portgroup.name for dvswitch in new_dvswitches.values() for portgroup in dvswitch.portgroup)
+
+    if not step_done(journal, phase, target, "create_portgroups",
+                     lambda: all(name + suffix in existing for name in NEW_PORTGROUPS)):
+        portgroup_tasks = []
+        for portgroupname, (dvswitchname, vlan_source) in NEW_PORTGROUPS.items():
+            if portgroupname + suffix in existing:
+                continue
+            portgroup_tasks.append(add_dvPort_group(si, new_dvswitches[dvswitchname + suffix],
+                                                    portgroupname + suffix, vlan_ids[portgroupname], portgroupname))
+        wait_for_tasks(si, portgroup_tasks)
+
+        for portgroupname in NEW_PORTGROUPS:
+            if portgroupname + suffix not in existing:
+                print("Successfully created DV Port Group", portgroupname + suffix)
+
+        journal.record(phase, target, "create_portgroups")
+
+    dvswitches = dict(new_dvswitches)
+    dvswitches[source_dvswitch.name] = source_dvswitch
+
+    portgroups = dict()
+    for dvswitch in new_dvswitches.values():
+        for portgroup in dvswitch.portgroup:
+            portgroups[portgroup.name] = portgroup
+
+    return {"source": source_dvswitch,
+            "clusters": clusters,
+            "suffix": suffix,
+            "dvswitches": dvswitches,
+            "portgroups": portgroups,
+            "target_uplinks": target_uplinks,
+            "target_vmks": target_vmks}
+
+
+def migrate_cluster(si, content, cluster, switch_set, limiter, journal, wave_options):
+    """
+    Migration pipeline for one cluster: split every host, move any C&C VMs running in the cluster, finish every host.
+    Hosts are planned from their live state, so on resume anything already moved is simply not in the plan.
+    """
+    with limiter:
+        host_plans = [(host, plan_host_migration(read_host_network_state(host), switch_set["source"].name,
+                                                 switch_set["target_uplinks"], switch_set["target_vmks"]))
+                      for host in cluster.host]
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "vMotion":
-            task = portgroup.Rename("vMotion_1")
-            print("Temporarily renaming portgroup vMotion to vMotion_1")
+    migrate_hosts(si, cluster, host_plans, "split", switch_set, limiter, journal, wave_options)
 
+    ''' relocate the c&c vms that run in this cluster, skipping any that are already on their new port group '''
+    cluster_hosts = set(cluster.host)
+    vm_jobs = []
 
-def temporary_rename_of_vm_portgroup(si):
-    content = si.RetrieveContent()
+    for vmname, networkname in VMS_TO_RELOCATE:
+        vm = get_obj(content, [vim.VirtualMachine], vmname)
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "VM_Network":
-            task = portgroup.Rename("VM_Network_1")
-            print("Temporarily renaming VM_Network to VM_Network_1")
+        if isinstance(vm, vim.VirtualMachine) and vm.runtime.host in cluster_hosts:
+            network = switch_set["portgroups"][networkname + switch_set["suffix"]]
+            if vm_on_network(vm, network):
+                continue
+            vm_jobs.append((vmname, lambda vm=vm, network=network: move_vm(vm, network)))
 
+    ''' each move holds its limiter slot until the ReconfigVM task has finished, not just while it is submitted '''
+    results = run_tasks_bounded(si, vm_jobs, max(1, len(vm_jobs)), limiter=limiter)
+    for vmname, state, error, seconds in results:
+        if state == vim.TaskInfo.State.error:
+            raise error
 
-def temporary_rename_of_cc_portgroups(si):
-    content = si.RetrieveContent()
+    for vmname, state, error, seconds in results:
+        print("[" + cluster.name + "] Successfully moved", vmname, "to new Management DVS")
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "HCI_Internal_vCenter_Network":
-            task = portgroup.Rename("HCI_Internal_vCenter_Network_1")
-            print("Temporarily renaming HCI_Internal_vCenter_Network to HCI_Internal_vCenter_Network_1")
+    journal.record("migrate", cluster.name, "move_vms")
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "HCI_Internal_OTS_Network":
-            task = portgroup.Rename("HCI_Internal_OTS_Network_1")
-            print("Temporarily renaming HCI_Internal_OTS_Network to HCI_Internal_OTS_Network_1")
+    migrate_hosts(si, cluster, host_plans, "finish", switch_set, limiter, journal, wave_options)
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "HCI_Internal_mNode_Network":
-            task = portgroup.Rename("HCI_Internal_mNode_Network_1")
-            print("Temporarily renaming HCI_Internal_mNode_Network to HCI_Internal_mNode_Network_1")
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
-        if portgroup.name == "Management Network":
-            task = portgroup.Rename("Management Network_1")
-            print("Temporarily renaming Management Network to Management Network_1")
+def migrate_hosts(si, cluster, host_plans, stage_name, switch_set, limiter, journal, wave_options):
+    ''' Apply the named stage of each host's migration plan in waves, journaling each host as it completes '''
+    stages = dict()
+    for host, plan in host_plans:
+        for stage in plan:
+            if stage[0] == stage_name:
+                stages[host] = stage
 
+    def apply(host):
+        stage = stages[host]
+        if journal.done("migrate", host.name, stage_name):
+            print("Resume: " + stage_name + " for " + host.name + " is in the journal but not reflected in "
+                  "vCenter, running it again")
+        vmks = ", ".join(sorted(stage[2].keys())) or "no vmks"
+        print("[" + cluster.name + "] Migrating uplinks and " + vmks + " (" + stage_name + ") on host:", host.name)
+        with limiter:
+            apply_host_stage(host, stage, switch_set["dvswitches"], switch_set["portgroups"])
+        journal.record("migrate", host.name, stage_name)
 
-def create_dvSwitch(si, network_folder, cluster, dvswitchname):
-    content = si.RetrieveContent()
-    dvs_host_configs = []
-    uplink_port_names = []
-    dvs_create_spec = vim.DistributedVirtualSwitch.CreateSpec()
-    dvs_config_spec = vim.VmwareDistributedVirtualSwitch.ConfigSpec()
-    dvs_config_spec.name = dvswitchname
-    dvs_config_spec.maxMtu = 9000
-    dvs_config_spec.uplinkPortPolicy = vim.DistributedVirtualSwitch.NameArrayUplinkPortPolicy()
+    prefix = "[" + cluster.name + "] (" + stage_name + ") "
+    run_waves(si, [host for host, plan in host_plans if host in stages], apply, cluster,
+              wave_options["max_wave_size"], wave_options["gate_timeout"], prefix, limiter)
 
-    hosts = cluster.host
 
-    if dvswitchname == "NetApp HCI Storage":
-        uplink_port_names.append("NetApp_HCI_Storage_vmnic5")
-        uplink_port_names.append("NetApp_HCI_Storage_vmnic1")
+def vm_on_network(vm, network):
+    ''' True if every NIC of the VM is already on the given port group '''
+    for device in vm.config.hardware.device:
+        if isinstance(device, vim.vm.device.VirtualEthernetCard):
+            port = getattr(device.backing, "port", None)
+            if port is None or port.portgroupKey != network.key:
+                return False
+    return True
 
-    if dvswitchname == "NetApp HCI Compute":
-        uplink_port_names.append("NetApp_HCI_Compute_vmnic0")
-        uplink_port_names.append("NetApp_HCI_Compute_vmnic4")
 
-    if dvswitchname == "NetApp HCI Management":
-        uplink_port_names.append("NetApp_HCI_Management_vmnic2")
-        uplink_port_names.append("NetApp_HCI_Management_vmnic3")
+def delete_portgroup(pg):
+    task = pg.Destroy_Task()
 
-    for host in hosts:
-        dvs_config_spec.uplinkPortPolicy.uplinkPortName = uplink_port_names
-        dvs_config_spec.maxPorts = 60000
-        dvs_host_config = vim.dvs.HostMember.ConfigSpec()
-        dvs_host_config.operation = vim.ConfigSpecOperation.add
-        dvs_host_config.host = host
-        dvs_host_configs.append(dvs_host_config)
-        dvs_config_spec.host = dvs_host_configs
 
-    dvs_create_spec.configSpec = dvs_config_spec
-    dvs_create_spec.productInfo = vim.dvs.ProductSpec(version='6.5.0')
+def delete_dvs(dvs):
+    return dvs.Destroy_Task()
 
-    task = network_folder.CreateDVS_Task(dvs_create_spec)
-    print("Creating new DVS", dvswitchname)
 
-    time.sleep(5)
+def obtain_vlan_id_from_portgroup(portgroup_object):
+    return portgroup_object.config.defaultPortConfig.vlan.vlanId
 
-    return get_obj(content, [vim.DistributedVirtualSwitch], dvswitchname)
 
+def rename_uplink_portgroups(si, dvswitches):
+    tasks = []
 
-def add_dvPort_group(si, dv_switch, portgroupname, vlanid):
-    dv_pg_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
-    dv_pg_spec.name = portgroupname
-    dv_pg_spec.numPorts = 32
-    dv_pg_spec.type = vim.dvs.DistributedVirtualPortgroup.PortgroupType.earlyBinding
+    for dvswitch in dvswitches:
+        for portgroup in dvswitch.config.uplinkPortgroup:
+            uplink_portgroup_name = dvswitch.name + " Uplinks"
+            if portgroup.name == uplink_portgroup_name:
+                continue
+            tasks.append(portgroup.Rename(uplink_portgroup_name))
+            print("Changing Uplink Port Group Name to '" + uplink_portgroup_name + "'")
 
-    dv_pg_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
-    dv_pg_spec.defaultPortConfig.securityPolicy = vim.dvs.VmwareDistributedVirtualSwitch.SecurityPolicy()
+    wait_for_tasks(si, tasks)
 
-    dv_pg_spec.defaultPortConfig.vlan = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec()
-    dv_pg_spec.defaultPortConfig.vlan.vlanId = vlanid
-    dv_pg_spec.defaultPortConfig.securityPolicy.allowPromiscuous = vim.BoolPolicy(value=False)
-    dv_pg_spec.defaultPortConfig.securityPolicy.forgedTransmits = vim.BoolPolicy(value=False)
 
-    dv_pg_spec.defaultPortConfig.vlan.inherited = False
-    dv_pg_spec.defaultPortConfig.securityPolicy.macChanges = vim.BoolPolicy(value=False)
-    dv_pg_spec.defaultPortConfig.securityPolicy.inherited = False
+def temporary_rename_of_portgroups(si, portgroup_moref_dict, portgroupnames):
+    tasks = []
 
-    if portgroupname == "iSCSI-A":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="failover_explicit")
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortOrderPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder.activeUplinkPort = "NetApp_HCI_Storage_vmnic5"
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder.standbyUplinkPort = []
+    for portgroupname in portgroupnames:
+        portgroup = portgroup_moref_dict.get(portgroupname)
+        if portgroup is not None:
+            tasks.append(portgroup.Rename(portgroupname + "_1"))
+            print("Temporarily renaming portgroup " + portgroupname + " to " + portgroupname + "_1")
 
-    if portgroupname == "iSCSI-B":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="failover_explicit")
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortOrderPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder.activeUplinkPort = "NetApp_HCI_Storage_vmnic1"
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.uplinkPortOrder.standbyUplinkPort = []
+    wait_for_tasks(si, tasks)
 
-    if portgroupname == "vMotion":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
 
-    if portgroupname == "HCI_Internal_vCenter_Network":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
+def create_dvSwitches(si, network_folder, hosts, switch_uplinks, journal=None):
+    ''' Submit one CreateDVS task per switch in switch_uplinks (name -> vmnics), wait for all of them, and return a
+    dict of name -> new DVS.  The switch references come straight from the task results so there is no race with
+    the inventory.  Every switch that was created, even if another one failed, is journaled with its UUID, which is
+    how -rollback knows which switches it may remove. '''
+    tasks = []
 
-    if portgroupname == "HCI_Internal_OTS_Network":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
+    for dvswitchname, pnics in switch_uplinks.items():
+        tasks.append((dvswitchname, network_folder.CreateDVS_Task(dvswitch_create_spec(dvswitchname, pnics, hosts))))
+        print("Creating new DVS", dvswitchname)
 
-    if portgroupname == "HCI_Internal_mNode_Network":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
+    try:
+        wait_for_tasks(si, [task for dvswitchname, task in tasks])
+    finally:
+        if journal is not None:
+            for dvswitchname, task in tasks:
+                if task.info.state == vim.TaskInfo.State.success:
+                    journal.record("prepare", dvswitchname, "created_switch", uuid=task.info.result.uuid,
+                                   moId=task.info.result._moId)
 
-    if portgroupname == "Management Network":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
-        dv_pg_spec.numPorts = 512
+    return dict((dvswitchname, task.info.result) for dvswitchname, task in tasks)
 
-    if portgroupname == "VM_Network":
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
-        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy.policy = vim.StringPolicy(value="loadbalance_loadbased")
-        dv_pg_spec.numPorts = 512
 
-    task = dv_switch.AddDVPortgroup_Task([dv_pg_spec])
-    time.sleep(5)
+def add_dvPort_group(si, dv_switch, portgroupname, vlanid, role=None):
+    ''' Submit the AddDVPortgroup task for a new port group and return it.  role is the NDE name of the port group
+    and decides its teaming policy, it defaults to portgroupname '''
+    if role is None:
+        role = portgroupname
 
-    print("Successfully created DV Port Group", portgroupname)
+    teaming, active_uplinks, ports = PORTGROUP_POLICIES.get(role, (None, [], 32))
+    dv_pg_spec = portgroup_config_spec(portgroupname, vlanid, dv_switch.name if active_uplinks else None, teaming,
+                                       active_uplinks, ports)
+    return dv_switch.AddDVPortgroup_Task([dv_pg_spec])
 
 
 def get_obj(content, vimtype, name):
@@ -594,38 +708,24 @@ def get_obj(content, vimtype, name):
     return obj
 
 
-def list_portgroups_initial(si):
-    content = si.RetrieveContent()
+def list_portgroups_initial(dvswitch, suffix=""):
     portgroup_moref_dict = dict()
     portgroup_name_flag = 0
     offending_portgroup = "none"
+    expected = [name + suffix for name in NDE_PORTGROUPS]
 
-    for portgroup in _get_vim_objects(content, vim.dvs.DistributedVirtualPortgroup):
+    for portgroup in dvswitch.portgroup:
 
         portgroup_moref_dict[portgroup.name] = portgroup
 
         ''' Check to see that the port group is one that should exist, if you find a weird one, set the flag'''
-        if portgroup.name != "NetApp HCI Uplinks" and portgroup.name != "VM_Network" and portgroup.name != "HCI_Internal_vCenter_Network" and portgroup.name != "HCI_Internal_OTS_Network" and portgroup.name != "HCI_Internal_mNode_Network" and portgroup.name != "vMotion" and portgroup.name != "Management Network" and portgroup.name != "iSCSI-A" and portgroup.name != "iSCSI-B" and portgroup.name != "vCenter_Recovery_PG":
+        if portgroup.name not in expected:
             portgroup_name_flag = 1
             offending_portgroup = portgroup.name
 
     return (portgroup_moref_dict, portgroup_name_flag, offending_portgroup)
 
 
-def list_dvswitches(si):
-    content = si.RetrieveContent()
-
-    number_of_dvswitches = len(_get_vim_objects(content, vim.dvs.VmwareDistributedVirtualSwitch))
-    dvswitchname = ""
-    dvswitchmorefraw = ""
-
-    for dvswitch in _get_vim_objects(content, vim.dvs.VmwareDistributedVirtualSwitch):
-        dvswitchname = dvswitch.name
-        dvswitchmorefraw = dvswitch
-
-    return (number_of_dvswitches, dvswitchname, dvswitchmorefraw)
-
-
 def list_clusters(si):
     content = si.RetrieveContent()
 
@@ -647,101 +747,9 @@ def _get_vim_objects(content, vim_type):
     ).view]
 
 
-def get_dc(si, name):
-    """
-    Get a datacenter by its name.
-    """
-    for dc in si.content.rootFolder.childEntity:
-        if dc.name == name:
-            return dc
-
-
-def create_host_vnic_config(target_portgroup, target_dvswitch, vmk):
-    host_vnic_config = vim.host.VirtualNic.Config()
-    host_vnic_config.spec = vim.host.VirtualNic.Specification()
-
-    host_vnic_config.changeOperation = "edit"
-    host_vnic_config.device = vmk
-    host_vnic_config.portgroup = ""
-    host_vnic_config.spec.distributedVirtualPort = vim.dvs.PortConnection()
-    host_vnic_config.spec.distributedVirtualPort.switchUuid = target_dvswitch.uuid
-    host_vnic_config.spec.distributedVirtualPort.portgroupKey = target_portgroup.key
-
-    '''
-    if vmk == "vmk3":
-        host_vnic_config.spec.netStackInstanceKey = "vmotion"
-    '''
-
-    return host_vnic_config
-
-
-def migrate_vmk(host, target_portgroup, target_dvswitch, vmk):
-    host_network_system = host.configManager.networkSystem
-    config = vim.host.NetworkConfig()
-    config.vnic = [create_host_vnic_config(target_portgroup, target_dvswitch, vmk)]
-    host_network_system.UpdateNetworkConfig(config, "modify")
-
-
-def assign_pnic(dvs, host, pnic_device_list):
-    dvs_config_spec = vim.DistributedVirtualSwitch.ConfigSpec()
-    dvs_config_spec.configVersion = dvs.config.configVersion
-    dvs_host_configs = []
-    dvs_host_config = vim.dvs.HostMember.ConfigSpec()
-    dvs_host_config.operation = vim.ConfigSpecOperation.edit
-    dvs_host_config.backing = vim.dvs.HostMember.PnicBacking()
-
-    for pnic in pnic_device_list:
-        dvs_host_config.backing.pnicSpec.append(vim.dvs.HostMember.PnicSpec(pnicDevice=pnic))
-
-    dvs_host_config.host = host
-    dvs_host_configs.append(dvs_host_config)
-    dvs_config_spec.host = dvs_host_configs
-    task = dvs.ReconfigureDvs_Task(dvs_config_spec)
-
-
-def unassign_pnic(dvs, host, pnic_device_list):
-    dvs_config_spec = vim.DistributedVirtualSwitch.ConfigSpec()
-    dvs_config_spec.configVersion = dvs.config.configVersion
-    dvs_host_configs = []
-    dvs_host_config = vim.dvs.HostMember.ConfigSpec()
-    dvs_host_config.operation = vim.ConfigSpecOperation.edit
-    dvs_host_config.backing = vim.dvs.HostMember.PnicBacking()
-
-    for pnic in pnic_device_list:
-        pnic = pnic.split(':')
-        dvs_host_config.backing.pnicSpec.append(vim.dvs.HostMember.PnicSpec(pnicDevice=pnic[0],uplinkPortKey=pnic[1]))
-
-    dvs_host_config.host = host
-    dvs_host_configs.append(dvs_host_config)
-    dvs_config_spec.host = dvs_host_configs
-    task = dvs.ReconfigureDvs_Task(dvs_config_spec)
-
-
 def move_vm(vm, network):
-    device_change = []
-
-    for device in vm.config.hardware.device:
-        if isinstance(device, vim.vm.device.VirtualEthernetCard):
-            nicspec = vim.vm.device.VirtualDeviceSpec()
-            nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-            nicspec.device = device
-            nicspec.device.wakeOnLanEnabled = True
-
-            dvs_port_connection = vim.dvs.PortConnection()
-            dvs_port_connection.portgroupKey = network.key
-            dvs_port_connection.switchUuid = network.config.distributedVirtualSwitch.uuid
-            nicspec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-            nicspec.device.backing.port = dvs_port_connection
-
-            nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-            nicspec.device.connectable.connected = True
-            nicspec.device.connectable.startConnected = True
-            nicspec.device.connectable.allowGuestControl = True
-            device_change.append(nicspec)
-
-            config_spec = vim.vm.ConfigSpec(deviceChange=device_change)
-            task = vm.ReconfigVM_Task(config_spec)
-
+    ''' one reconfig per VM covering all of its NICs '''
+    return vm.ReconfigVM_Task(vm_nic_config_spec(vm, network.key, network.config.distributedVirtualSwitch.uuid))
 
 
 if __name__ == "__main__":
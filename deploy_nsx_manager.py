@@ -17,6 +17,7 @@ Modified deploy_nsx_manager.py version as follows
     2. added the ability to map the deployed VM to a network specified by name (it just went to the default network before)
     3. now allows you to specify the VM name in the inventory, before it just got "NSX Manager" from the OVF file
     4. changed it so you now specify the cluster to deploy NSX manager to, not the resource pool
+    5. checks the vCenter login, the OVA and every cluster, network and datastore named before deploying, and reports every problem at once
     
     
 Arguments
@@ -37,6 +38,7 @@ Arguments
 -vsm_ntp_0 [NTP Server NSX manager should use]
 -vsm_dns1_0 [comma separated list of DNS servers for NSX manager to use]
 -map_eth0_to_network [name of network the NSX manager's management interface should bind to]
+-trace [JSON lines file to trace every vCenter call, disk upload and wait to, with a summary of where the time went printed at the end.  optional]
 
 
 Example with parameters:
@@ -50,16 +52,18 @@ import os.path
 import ssl
 import sys
 import tarfile
-import time
 import argparse
 
 from threading import Timer
 
 from six.moves.urllib.request import Request, urlopen
 
-from pyvim.connect import SmartConnectNoSSL, Disconnect
+from pyvim.connect import Disconnect
 from pyVmomi import vim, vmodl
 
+from preflight import run_preflight, print_problems
+import tracing
+
 
 def setup_args():
 
@@ -122,32 +126,43 @@ def setup_args():
                         help='Name of port group to bind NSX Managers IPV4 interface to')
     parser.add_argument('-cluster','--cluster',
                         help='Name of the cluster you wish to deploy NSX Manager to')
+    parser.add_argument('-trace','--trace',
+                        help='JSON lines file to trace every vCenter call, disk upload and wait to')
     return (parser.parse_args())
 
 
 def main():
     args = setup_args()
-    try:
-        si = SmartConnectNoSSL(host=args.host,
-                               user=args.user,
-                               pwd=args.password,
-                               port=args.port)
+
+    # trace the run if asked to, the summary is printed on the way out
+    if args.trace:
+        tracing.start(args.trace)
+        atexit.register(tracing.stop)
+
+    # pre-flight: connect to vCenter and open the OVA at the same time, then look up the cluster, network and datastore
+    # in one read.  Nothing is deployed until all of it checks out
+    wanted = [("-cluster", vim.ClusterComputeResource, args.cluster),
+              ("-map_eth0_to_network", vim.Network, args.map_eth0_to_network)]
+    if args.datastore:
+        wanted.append(("-ds", vim.Datastore, args.datastore))
+    ovf_handles = []
+    checks = [("--ova-path", lambda: ovf_handles.append(OvfHandler(args.ova_path)))]
+
+    with tracing.phase("preflight"):
+        si, dc, found, problems = run_preflight(args.host, args.user, args.password, args.port, args.datacenter, wanted,
+                                                checks=checks)
+    if si is not None:
         atexit.register(Disconnect, si)
-    except:
-        print("Unable to connect to %s" % args.host)
+    if problems:
+        print_problems(problems)
         return 1
 
-    if args.datacenter:
-        dc = get_dc(si, args.datacenter)
-    else:
-        dc = si.content.rootFolder.childEntity[0]
-
     if args.datastore:
-        ds = get_ds(dc, args.datastore)
+        ds = found[(vim.Datastore, args.datastore)]
     else:
         ds = get_largest_free_ds(dc)
 
-    ovf_handle = OvfHandler(args.ova_path)
+    ovf_handle = ovf_handles[0]
 
     ovfManager = si.content.ovfManager
 
@@ -158,8 +173,8 @@ def main():
         v = propertyMappingDict[k]
         mapping.append(vim.KeyValue(key=k, value=v))
 
-    network = get_network(si, dc, args.map_eth0_to_network)
-    cluster_rp = get_cluster(si, dc, args.cluster)
+    network = found[(vim.Network, args.map_eth0_to_network)]
+    cluster_rp = found[(vim.ClusterComputeResource, args.cluster)].resourcePool
 
     network_map = vim.OvfManager.NetworkMapping()
     network_map.name = 'Management Network'
@@ -169,8 +184,9 @@ def main():
     cisp = vim.OvfManager.CreateImportSpecParams(propertyMapping=mapping,entityName=vmname)
     cisp.networkMapping.append(network_map)
 
-    cisr = ovfManager.CreateImportSpec(ovf_handle.get_descriptor(),
-                                       cluster_rp, ds, cisp)
+    with tracing.phase("import_spec"):
+        cisr = ovfManager.CreateImportSpec(ovf_handle.get_descriptor(),
+                                           cluster_rp, ds, cisp)
 
     # These errors might be handleable by supporting the parameters in
     # CreateImportSpecParams
@@ -182,11 +198,12 @@ def main():
 
     ovf_handle.set_spec(cisr)
 
-    lease = cluster_rp.ImportVApp(cisr.importSpec, dc.vmFolder)
+    with tracing.phase("import_vapp"):
+        lease = cluster_rp.ImportVApp(cisr.importSpec, dc.vmFolder)
 
-    while lease.state == vim.HttpNfcLease.State.initializing:
-        print("Waiting for lease to be ready...")
-        time.sleep(1)
+        while lease.state == vim.HttpNfcLease.State.initializing:
+            print("Waiting for lease to be ready...")
+            tracing.sleep(1, "wait for lease")
 
     if lease.state == vim.HttpNfcLease.State.error:
         print("Lease error: %s" % lease.error)
@@ -196,75 +213,26 @@ def main():
 
     print("Starting deploy...")
 
-    ovf_handle.upload_disks(lease, args.host)
+    with tracing.phase("upload_disks"):
+        ovf_handle.upload_disks(lease, args.host)
 
     # Wait a little bit then try to power nsx manager on
 
-    time.sleep(60)
-    vmnames = vmname
-    content = si.content
-    objView = content.viewManager.CreateContainerView(content.rootFolder,
-                                                      [vim.VirtualMachine],
-                                                      True)
-    vmList = objView.view
-    objView.Destroy()
+    with tracing.phase("power_on"):
+        tracing.sleep(60, "wait before power on")
+        vmnames = vmname
+        content = si.content
+        objView = content.viewManager.CreateContainerView(content.rootFolder,
+                                                          [vim.VirtualMachine],
+                                                          True)
+        vmList = objView.view
+        objView.Destroy()
 
-    tasks = [vm.PowerOn() for vm in vmList if vm.name in vmnames]
+        tasks = [vm.PowerOn() for vm in vmList if vm.name in vmnames]
 
     print("NSX Manager appliance is deployed.  Please wait 10-15 minutes before running the configure_nsx_manager.py script as it can take a while for the services to fully start.")
     
     
-def get_cluster(si, dc, name):
-    """
-    Get a cluster by its name
-    """
-    cluster_list = dc.hostFolder.childEntity
-    cluster_obj = get_obj_in_list(name, cluster_list)
-    
-    return cluster_obj.resourcePool
-
-
-def get_network(si, dc, name):
-    """
-    Get a network by its name
-    """
-    viewManager = si.content.viewManager
-    containerView = viewManager.CreateContainerView(dc, [vim.Network],
-                                                    True)
-    try:
-        for network in containerView.view:
-            print(network.name)
-            if network.name == name:
-                return network
-    finally:
-        containerView.Destroy()
-    raise Exception("Failed to find network %s in datacenter %s" %
-                    (name, dc.name))
-
-
-def get_dc(si, name):
-    """
-    Get a datacenter by its name.
-    """
-    for dc in si.content.rootFolder.childEntity:
-        if dc.name == name:
-            return dc
-    raise Exception('Failed to find datacenter named %s' % name)
-
-
-def get_ds(dc, name):
-    """
-    Pick a datastore by its name.
-    """
-    for ds in dc.datastore:
-        try:
-            if ds.name == name:
-                return ds
-        except:  # Ignore datastores that have issues
-            pass
-    raise Exception("Failed to find %s on datacenter %s" % (name, dc.name))
-
-
 def get_largest_free_ds(dc):
     """
     Pick the datastore that is accessible with the largest free space.
@@ -296,17 +264,6 @@ def get_tarfile_size(tarfile):
     tarfile.seek(0, 0)
     return size
 
-def get_obj_in_list(obj_name, obj_list):
-    """
-    Gets an object out of a list (obj_list) whos name matches obj_name.
-    """
-    for o in obj_list:
-        if o.name == obj_name:
-            return o
-    print("Unable to find object by the name of %s in list:\n%s" %
-          (o.name, map(lambda o: o.name, obj_list)))
-    exit(1)
-
 class OvfHandler(object):
     """
     OvfHandler handles most of the OVA operations.
@@ -397,7 +354,8 @@ class OvfHandler(object):
         else:
             sslContext = None
         req = Request(url, ovffile, headers)
-        urlopen(req, context=sslContext)
+        with tracing.span("upload", "upload disk", host, bytes_out=headers['Content-length']) as span:
+            span["status"] = urlopen(req, context=sslContext).status
 
     def start_timer(self):
         """
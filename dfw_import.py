@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+
+"""
+Bulk distributed firewall rule import for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Imports thousands of DFW rules, once configure_nsx_manager.py has prepared the clusters for DFW, a section at a time
+rather than a rule at a time:
+
+    - the rule file is read twice and never held in memory whole.  The first pass checks every rule and that each
+      section's rules are together in the file, and reports every problem before anything changes.  The second pass
+      reads one section at a time and hands it off to be written
+    - each section is written with one request holding all of its rules.  A section that already exists, found by
+      name, has its rules replaced and keeps its place.  New sections are created empty first, one after another so
+      they end up at the top of the layer 3 rules in the same order as the file, then filled like the rest
+    - up to -max_in_flight sections are written at the same time, which also caps how many sections are in memory
+    - every write carries the section's own ETag in If-Match, so NSX Manager turns down a write to a section that
+      was changed since it was read.  That section is reported as failed rather than overwritten, unless
+      -overwrite_changed is given, when its ETag is read again and it is written anyway.  Each section is only
+      written by one request at a time, so writes to different sections never fight over an ETag
+    - a create or a write NSX Manager answers with a 5xx or a 409, or whose connection failed, is retried with a
+      backoff.  A new section that still can't be created is reported as failed and the other sections go on
+
+The rule file is CSV with a header row, or JSON lines (.jsonl, one rule object per line).  The fields are:
+
+    section       name of the section the rule goes in (required).  A section's rules must be together in the file
+    name          the rule's name
+    action        allow, deny or reject (required)
+    sources       IP addresses, ranges and CIDR blocks, or object IDs like securitygroup-10, ipset-3 or
+    destinations  virtualwire-7.  Empty or any for any.  In CSV several are separated with ;
+    services      tcp/443, udp/53, tcp/8000-8080, icmp, application-12.  Empty or any for any
+    applied_to    object IDs the rule is applied to, defaults to the whole distributed firewall
+    direction     in, out or inout (the default)
+    logged        true or false (the default)
+    disabled      true or false (the default)
+    notes         free text
+
+CSV example:
+section,name,action,sources,destinations,services
+Web,allow-https,allow,any,securitygroup-10,tcp/443
+Web,block-rest,deny,any,securitygroup-10,any
+
+Arguments
+---------
+-nsx_manager_address [FQDN or IP of NSX Manager, optionally with :port]
+-nsx_manager_username [NSX admin account]
+-nsx_manager_password [password of the NSX admin account]
+-rules [CSV or JSON lines file of DFW rules]
+-max_in_flight [most sections written at the same time, defaults to 8]
+-retries [times a section create or write is retried after a 5xx, a 409 or a failed connection, defaults to 5]
+-overwrite_changed [write sections that were changed by someone else since they were read, instead of failing them]
+-nsx_request_timeout [seconds to wait for each NSX Manager request, defaults to 120]
+-check_only [only check the rule file]
+
+Example with parameters:
+python3 ./dfw_import.py -nsx_manager_address nsxmanager1.vmwpc.local -nsx_manager_username admin -nsx_manager_password NetApp123!NetApp123! -rules tenant-a-rules.csv
+"""
+
+import argparse
+import csv
+import functools
+import json
+import random
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from ip_ranges import parse_range
+from nsx_client import NSXClient
+
+import tracing
+
+SECTIONS_PATH = '/api/4.0/firewall/globalroot-0/config/layer3sections'
+
+RULE_FIELDS = ["section", "name", "action", "sources", "destinations", "services", "applied_to", "direction", "logged",
+               "disabled", "notes"]
+ACTIONS = ["allow", "deny", "reject"]
+DIRECTIONS = ["inout", "in", "out"]
+PROTOCOLS = {"tcp": 6, "udp": 17, "icmp": 1, "ipv6-icmp": 58}
+
+''' object ID prefixes and the type NSX Manager gives them '''
+OBJECT_TYPES = [("securitygroup-", "SecurityGroup"), ("ipset-", "IPSet"), ("macset-", "MACSet"),
+                ("virtualwire-", "VirtualWire"), ("dvportgroup-", "DistributedVirtualPortgroup"),
+                ("domain-c", "ClusterComputeResource"), ("host-", "HostSystem"), ("vm-", "VirtualMachine"),
+                ("datacenter-", "Datacenter"), ("edge-", "Edge")]
+SERVICE_TYPES = [("applicationgroup-", "ApplicationGroup"), ("application-", "Application")]
+
+PORTS_RE = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to import DFW rules in bulk')
+
+    parser.add_argument('-nsx_manager_address', '--nsx_manager_address',
+                        required=True,
+                        help='FQDN or IP of NSX Manager')
+    parser.add_argument('-nsx_manager_username', '--nsx_manager_username',
+                        required=True,
+                        help='An account in the NSX manager database that has admin rights')
+    parser.add_argument('-nsx_manager_password', '--nsx_manager_password',
+                        required=True,
+                        help='Password for the aforementioned NSX admin account')
+    parser.add_argument('-rules', '--rules',
+                        required=True,
+                        help='CSV or JSON lines file of DFW rules')
+    parser.add_argument('-max_in_flight', '--max_in_flight',
+                        type=int,
+                        default=8,
+                        help='most sections written at the same time')
+    parser.add_argument('-retries', '--retries',
+                        type=int,
+                        default=5,
+                        help='times a section create or write is retried after a 5xx, a 409 or a failed connection')
+    parser.add_argument('-overwrite_changed', '--overwrite_changed',
+                        action='store_true',
+                        help='write sections that were changed by someone else since they were read, instead of '
+                             'failing them')
+    parser.add_argument('-nsx_request_timeout', '--nsx_request_timeout',
+                        type=float,
+                        default=120,
+                        help='seconds to wait for each NSX Manager request')
+    parser.add_argument('-check_only', '--check_only',
+                        action='store_true',
+                        help='only check the rule file')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    try:
+        sections, problems = scan_rules(args.rules)
+    except Exception as e:
+        print(e)
+        return 1
+    if problems:
+        print_problems(args.rules, problems)
+        return 1
+    print("%s has %d rule(s) in %d section(s)" % (args.rules, sum(sections.values()), len(sections)))
+    if args.check_only:
+        return 0
+
+    nsx = NSXClient(args.nsx_manager_address, args.nsx_manager_username, args.nsx_manager_password,
+                    pool_size=max(1, args.max_in_flight), timeout=args.nsx_request_timeout)
+    try:
+        failed = import_rules(nsx, args.rules, sections, args.max_in_flight, args.retries, args.overwrite_changed)
+    except Exception as e:
+        print(e)
+        return 1
+    finally:
+        nsx.close()
+
+    return 1 if failed else 0
+
+
+''' reading the rule file '''
+
+
+def read_rules(path):
+    """
+    Read the rule file one rule at a time.
+    Yields (line number, dictionary of field to value or None, error or None)
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line), None
+                except ValueError as e:
+                    yield number, None, "not valid JSON: %s" % e
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+
+
+def split_values(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).split(";") if v.strip()]
+
+
+@functools.lru_cache(maxsize=65536)
+def object_ref(value):
+    """
+    (value, type) for a source, destination or applied to, or None for any.  Raises an Exception if it is neither an
+    address nor an object ID.  Rule files name the same groups and networks over and over, so answers are cached
+    """
+    if value.lower() == "any":
+        return None
+    for prefix, object_type in OBJECT_TYPES:
+        if value.startswith(prefix):
+            return value, object_type
+    try:
+        first, _ = parse_range(value)
+    except Exception:
+        raise Exception("%s is neither an address, a range, a CIDR block nor an object ID" % value)
+    return value, "Ipv4Address" if first.version == 4 else "Ipv6Address"
+
+
+@functools.lru_cache(maxsize=65536)
+def service_ref(value):
+    """
+    A tuple of (field, value) for a service, or None for any.  Raises an Exception if it isn't one.  Cached like
+    object_ref()
+    """
+    lowered = value.lower()
+    if lowered == "any":
+        return None
+    for prefix, service_type in SERVICE_TYPES:
+        if lowered.startswith(prefix):
+            return ("type", service_type), ("value", value)
+
+    protocol, _, ports = lowered.partition("/")
+    if protocol not in PROTOCOLS:
+        raise Exception("%s is not a service.  Use %s/<ports> or an application ID" % (value, "|".join(PROTOCOLS)))
+    service = {"protocol": str(PROTOCOLS[protocol]), "subProtocol": str(PROTOCOLS[protocol])}
+    if ports:
+        if protocol not in ("tcp", "udp"):
+            raise Exception("%s: only tcp and udp have ports" % value)
+        if not PORTS_RE.match(ports) or any(int(port) > 65535 for port in re.split("[-,]", ports)):
+            raise Exception("%s: ports must be numbers up to 65535, ranges like 8000-8080 or lists like 80,443" %
+                            value)
+        service["destinationPort"] = ports
+    return tuple(sorted(service.items()))
+
+
+def parse_rule(row):
+    """
+    Check one rule from the rule file and turn it into the fields rule_xml() needs.  Fields that aren't in
+    RULE_FIELDS are left for scan_rules() to report.
+    Returns the rule.  Raises an Exception naming every problem with it
+    """
+    if not isinstance(row, dict):
+        raise Exception("not a rule object")
+
+    row = dict((str(field).strip(), value) for field, value in row.items() if field is not None)
+    problems = []
+
+    def flag(field):
+        value = str(row.get(field) or "false").strip().lower()
+        if value not in ("true", "false"):
+            problems.append("%s must be true or false" % field)
+        return value == "true"
+
+    def refs(field, make):
+        found = []
+        for value in split_values(row.get(field)):
+            try:
+                ref = make(value)
+            except Exception as e:
+                problems.append("%s: %s" % (field, e))
+                continue
+            if ref is not None:
+                found.append(ref)
+        return found
+
+    rule = {"section": str(row.get("section") or "").strip(),
+            "name": str(row.get("name") or "").strip(),
+            "action": str(row.get("action") or "").strip().lower(),
+            "direction": str(row.get("direction") or "inout").strip().lower(),
+            "notes": str(row.get("notes") or "").strip(),
+            "logged": flag("logged"),
+            "disabled": flag("disabled"),
+            "sources": refs("sources", object_ref),
+            "destinations": refs("destinations", object_ref),
+            "applied_to": refs("applied_to", object_ref),
+            "services": refs("services", service_ref)}
+
+    if not rule["section"]:
+        problems.append("has no section")
+    if rule["action"] not in ACTIONS:
+        problems.append("action must be one of " + ", ".join(ACTIONS))
+    if rule["direction"] not in DIRECTIONS:
+        problems.append("direction must be one of " + ", ".join(DIRECTIONS))
+
+    if problems:
+        raise Exception("; ".join(problems))
+    return rule
+
+
+def scan_rules(path):
+    """
+    First pass over the rule file: check every rule and that each section's rules are together.
+    Returns (OrderedDict of section name to number of rules, in file order, list of problems)
+    """
+    sections, ended, problems, unknown = OrderedDict(), dict(), [], set()
+    current, last_number = None, 0
+
+    for number, row, error in read_rules(path):
+        ''' unknown fields are reported once, not on every line of a CSV file '''
+        for field in (row if isinstance(row, dict) else ()):
+            if field is not None and str(field).strip() not in RULE_FIELDS and field not in unknown:
+                problems.append("line %d: unknown field %s" % (number, field))
+                unknown.add(field)
+        try:
+            if error:
+                raise Exception(error)
+            rule = parse_rule(row)
+        except Exception as e:
+            problems.append("line %d: %s" % (number, e))
+            continue
+
+        section = rule["section"]
+        if section != current:
+            if current is not None:
+                ended[current] = last_number
+            if section in ended:
+                problems.append("line %d: section %s already ended at line %d, a section's rules must be together" %
+                                (number, section, ended[section]))
+            current = section
+        sections[section] = sections.get(section, 0) + 1
+        last_number = number
+
+    if not sections and not problems:
+        problems.append("no rules")
+    return sections, problems
+
+
+def iter_sections(path):
+    """
+    Second pass over a rule file scan_rules() passed: read it one section at a time.
+    Yields (section name, list of rules)
+    """
+    name, rules = None, []
+    for number, row, _ in read_rules(path):
+        rule = parse_rule(row)
+        if rule["section"] != name and rules:
+            yield name, rules
+            rules = []
+        name = rule["section"]
+        rules.append(rule)
+    if rules:
+        yield name, rules
+
+
+def print_problems(path, problems, limit=50):
+    print("%d problem(s) in %s, nothing has been changed:" % (len(problems), path))
+    for problem in problems[:limit]:
+        print("  " + problem)
+    if len(problems) > limit:
+        print("  ... and %d more" % (len(problems) - limit))
+
+
+''' building the requests '''
+
+
+def refs_xml(tag, item_tag, refs):
+    if not refs:
+        return ""
+    return '<%s excluded="false">%s</%s>' % (tag, "".join(
+        "<%s><value>%s</value><type>%s</type><isValid>true</isValid></%s>" % (item_tag, escape(value), object_type,
+                                                                             item_tag)
+        for value, object_type in refs), tag)
+
+
+def rule_xml(rule):
+    if rule["applied_to"]:
+        applied_to = "".join("<appliedTo><value>%s</value><type>%s</type><isValid>true</isValid></appliedTo>" % (
+            escape(value), object_type) for value, object_type in rule["applied_to"])
+    else:
+        applied_to = "<appliedTo><name>DISTRIBUTED_FIREWALL</name><value>DISTRIBUTED_FIREWALL</value>" \
+                     "<type>DISTRIBUTED_FIREWALL</type><isValid>true</isValid></appliedTo>"
+
+    services = ""
+    if rule["services"]:
+        services = "<services>%s</services>" % "".join(
+            "<service>%s</service>" % "".join("<%s>%s</%s>" % (field, escape(value), field)
+                                              for field, value in service)
+            for service in rule["services"])
+
+    return '<rule disabled="%s" logged="%s"><name>%s</name><action>%s</action><appliedToList>%s</appliedToList>' \
+           '%s%s%s<direction>%s</direction><packetType>any</packetType><notes>%s</notes></rule>' % (
+               str(rule["disabled"]).lower(), str(rule["logged"]).lower(), escape(rule["name"]), rule["action"],
+               applied_to, refs_xml("sources", "source", rule["sources"]),
+               refs_xml("destinations", "destination", rule["destinations"]), services, rule["direction"],
+               escape(rule["notes"]))
+
+
+def section_xml(name, rules, section_id=None):
+    section_id = ' id="%s"' % section_id if section_id is not None else ""
+    return '<section%s name=%s>%s</section>' % (section_id, quoteattr(name), "".join(rule_xml(rule)
+                                                                                      for rule in rules))
+
+
+''' talking to NSX Manager '''
+
+
+def section_answer(status, body, headers, what):
+    """
+    (section ID, ETag) from an answer with a section in it.  Raises an Exception if status isn't 200 or 201
+    """
+    if status not in (200, 201):
+        raise Exception("%s: %d %s" % (what, status, body.decode('utf-8', 'replace')))
+    return ElementTree.fromstring(body).get('id'), headers.get('ETag')
+
+
+def find_section(nsx, name):
+    """
+    (section ID, ETag) of the layer 3 section called name, or None if there isn't one
+    """
+    status, body, headers = nsx.request_with_headers('GET', SECTIONS_PATH + '?name=' + quote(name))
+    if status == 404:
+        return None
+    return section_answer(status, body, headers, "Reading section " + name)
+
+
+def read_etag(nsx, section_id):
+    status, body, headers = nsx.request_with_headers('GET', SECTIONS_PATH + '/' + str(section_id))
+    return section_answer(status, body, headers, "Reading section " + str(section_id))[1]
+
+
+def create_section(nsx, name, retries=5, backoff=0.5, max_backoff=10):
+    """
+    Create an empty layer 3 section at the top, retrying a 5xx, a 409 or a failed connection like write_section().  A
+    5xx or a failed connection may have come after the section was created, so it is looked for by name before that
+    is retried.
+    Returns (0 and (section ID, ETag), or -1 and what went wrong, number of attempts)
+    """
+    body = section_xml(name, [])
+    delay = backoff
+
+    for attempt in range(1, retries + 2):
+        try:
+            status, data, headers = nsx.request_with_headers('POST', SECTIONS_PATH, body)
+            result = data.decode('utf-8', 'replace').strip()
+        except Exception as e:
+            status, result = None, "%s: %s" % (type(e).__name__, e)
+
+        if status in (200, 201):
+            return 0, section_answer(status, data, headers, "Creating section " + name), attempt
+        if status is not None and status != 409 and status < 500:
+            return -1, "%d %s" % (status, result), attempt
+        if attempt > retries and status == 409:
+            break
+
+        tracing.sleep(delay + random.uniform(0, delay / 2), "retry backoff", name)
+        delay = min(delay * 2, max_backoff)
+
+        if status is None or status >= 500:
+            try:
+                found = find_section(nsx, name)
+            except Exception:
+                found = None
+            if found is not None:
+                return 0, found, attempt
+
+    return -1, result if status is None else "%d %s" % (status, result), attempt
+
+
+def write_section(nsx, section_id, etag, name, rules, retries=5, backoff=0.5, max_backoff=10, overwrite_changed=False):
+    """
+    Replace the rules of a section with one PUT, sending etag in If-Match.  A 412 means someone else changed the
+    section since etag was read, which fails the write unless overwrite_changed is True, when its ETag is read again
+    and the write retried straight away.  A 5xx, a 409 or a failed connection is retried after a backoff that doubles
+    each time.  The section is replaced whole, so writing it twice does no harm.
+    Returns (0 and the new ETag, or -1 and what went wrong, number of attempts, number of 412s)
+    """
+    path = SECTIONS_PATH + '/' + str(section_id)
+    body = section_xml(name, rules, section_id)
+    delay = backoff
+    stale = 0
+
+    for attempt in range(1, retries + 2):
+        try:
+            status, data, headers = nsx.request_with_headers('PUT', path, body, {'If-Match': etag})
+            result = data.decode('utf-8', 'replace').strip()
+        except Exception as e:
+            status, result = None, "%s: %s" % (type(e).__name__, e)
+
+        if status == 200:
+            return 0, headers.get('ETag'), attempt, stale
+        if status is not None and status not in (409, 412) and status < 500:
+            return -1, "%d %s" % (status, result), attempt, stale
+        if status == 412 and not overwrite_changed:
+            return -1, "412 the section was changed by someone else since it was read, not overwritten", attempt, \
+                stale + 1
+        if attempt > retries:
+            break
+
+        if status == 412:
+            stale += 1
+            try:
+                etag = read_etag(nsx, section_id)
+            except Exception as e:
+                return -1, str(e), attempt, stale
+            continue
+
+        tracing.sleep(delay + random.uniform(0, delay / 2), "retry backoff", name)
+        delay = min(delay * 2, max_backoff)
+
+    return -1, result if status is None else "%d %s" % (status, result), attempt, stale
+
+
+def import_rules(nsx, path, sections, max_in_flight=8, retries=5, overwrite_changed=False):
+    """
+    Second pass: write every section in the rule file, up to max_in_flight at the same time, printing each one as it
+    finishes.  sections is what scan_rules() found.  A section that can't be created or written is reported and the
+    rest go on.
+    Returns the names of the sections that couldn't be created or written
+    """
+    workers = max(1, max_in_flight)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        found = dict(zip(sections, executor.map(tracing.wrap(lambda name: find_section(nsx, name)), sections)))
+    targets = dict((name, section) for name, section in found.items() if section is not None)
+    print("%d of %d section(s) already exist, read in %.1f s" % (len(targets), len(sections), time.time() - start))
+
+    failed, counts, lock = [], {"rules": 0, "stale": 0}, threading.Lock()
+
+    ''' one at a time and last first, so the new sections end up at the top in file order '''
+    new = [name for name in sections if name not in targets]
+    if new:
+        start = time.time()
+        for name in reversed(new):
+            try:
+                status, result, attempts = create_section(nsx, name, retries)
+            except Exception as e:
+                status, result, attempts = -1, str(e), 1
+            if status == 0:
+                targets[name] = result
+            else:
+                failed.append(name)
+                retried = " after %d attempts" % attempts if attempts > 1 else ""
+                print("Section %s: not created%s: %s" % (name, retried, result))
+        print("Created %d new section(s) at the top of the DFW in %.1f s" % (len(new) - len(failed),
+                                                                             time.time() - start))
+
+    slots = threading.BoundedSemaphore(workers)
+
+    def finished(name, count, future):
+        slots.release()
+        try:
+            status, result, attempts, stale_count = future.result()
+        except Exception as e:
+            status, result, attempts, stale_count = -1, str(e), 1, 0
+        retried = " after %d attempts" % attempts if attempts > 1 else ""
+        with lock:
+            counts["stale"] += stale_count
+            if status == 0:
+                counts["rules"] += count
+                print("Section %s: %d rule(s) written%s" % (name, count, retried))
+            else:
+                failed.append(name)
+                print("Section %s: not written%s: %s" % (name, retried, result))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ''' the next section is only read once a write has finished, so at most max_in_flight + 1 are in memory '''
+        for name, section_rules in iter_sections(path):
+            if name not in targets:
+                continue
+            slots.acquire()
+            section_id, etag = targets[name]
+            future = executor.submit(tracing.wrap(write_section), nsx, section_id, etag, name, section_rules, retries,
+                                     overwrite_changed=overwrite_changed)
+            future.add_done_callback(lambda f, name=name, count=len(section_rules): finished(name, count, f))
+    seconds = time.time() - start
+
+    print("Imported %d rule(s) in %d section(s) in %.1f s, %.0f rules/s.  %d write(s) found a section changed since it "
+          "was read, %d section(s) failed" % (counts["rules"], len(sections) - len(failed), seconds,
+                                                      counts["rules"] / seconds if seconds else 0, counts["stale"],
+                                                      len(failed)))
+    return failed
+
+
+if __name__ == "__main__":
+    exit(main())
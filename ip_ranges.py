@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+IP range engine for the pyNSXdeploy IP pools
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Pool specs like 10.0.0.10-10.0.0.250,10.0.1.0/25,2001:db8::10-2001:db8::ff are parsed into ranges of integers, never
+expanded into single addresses, so pools of tens of thousands of addresses cost no more than small ones.  Ranges are
+sorted once and then swept, which keeps every check O(n log n):
+
+    - ranges that overlap each other within a spec
+    - ranges that stray outside the subnet of the gateway and prefix length, or that hold the gateway itself, the
+      network address or the broadcast address
+    - ranges that clash with existing IP pools
+    - addresses already in use, e.g. the vmk IPs of the hosts
+
+Run on its own it validates one pool spec.
+
+Arguments
+---------
+-ranges [the pool spec, comma separated start-end ranges, single addresses or CIDR blocks]
+-prefix_length [prefix length of the pool's subnet, e.g. 24]
+-gateway [the pool's gateway]
+-existing_pools [JSON file of existing pool name to pool spec]
+-used_addresses [file of addresses already in use, one per line, optionally followed by what uses it]
+
+Example with parameters:
+python3 ./ip_ranges.py -ranges 10.193.138.104-10.193.138.113 -prefix_length 24 -gateway 10.193.138.1
+"""
+
+import argparse
+import bisect
+import ipaddress
+import json
+
+from collections import OrderedDict
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to validate an IP pool spec')
+
+    parser.add_argument('-ranges', '--ranges',
+                        required=True,
+                        help='the pool spec, comma separated start-end ranges, single addresses or CIDR blocks')
+    parser.add_argument('-prefix_length', '--prefix_length',
+                        type=int,
+                        help="prefix length of the pool's subnet, e.g. 24")
+    parser.add_argument('-gateway', '--gateway',
+                        help="the pool's gateway")
+    parser.add_argument('-existing_pools', '--existing_pools',
+                        help='JSON file of existing pool name to pool spec')
+    parser.add_argument('-used_addresses', '--used_addresses',
+                        help='file of addresses already in use, one per line, optionally followed by what uses it')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    existing = dict()
+    if args.existing_pools:
+        with open(args.existing_pools) as f:
+            existing = json.load(f)
+
+    used = dict()
+    if args.used_addresses:
+        with open(args.used_addresses) as f:
+            for line in f:
+                fields = line.split(None, 1)
+                if fields:
+                    used[fields[0]] = fields[1].strip() if len(fields) > 1 else "in use"
+
+    try:
+        size, problems = validate_pool(args.ranges, args.prefix_length, args.gateway, existing, used)
+    except Exception as e:
+        print(e)
+        return 1
+
+    for problem in problems:
+        print(problem)
+    print("%d addresses, %d problem(s)" % (size, len(problems)))
+    return 1 if problems else 0
+
+
+def parse_range(text):
+    """
+    Parse start-end, a single address or a CIDR block.
+    Returns (first, last) as ipaddress objects.  Raises an Exception if text isn't any of those
+    """
+    text = text.strip()
+    try:
+        if "/" in text:
+            network = ipaddress.ip_network(text, strict=False)
+            return network.network_address, network.broadcast_address
+        if "-" in text:
+            first, last = [ipaddress.ip_address(address.strip()) for address in text.split("-")]
+        else:
+            first = last = ipaddress.ip_address(text)
+    except ValueError:
+        raise Exception("Invalid IP range " + text)
+
+    if first.version != last.version:
+        raise Exception("IP range " + text + " mixes IPv4 and IPv6")
+    if last < first:
+        raise Exception("IP range " + text + " ends before it starts")
+    return first, last
+
+
+def parse_ranges(spec):
+    """
+    Parse a comma separated pool spec.
+    Returns a list of (version, first, last, text) with first and last as integers, in the order given
+    """
+    ranges = []
+    for text in spec.split(","):
+        if text.strip():
+            first, last = parse_range(text)
+            ranges.append((first.version, int(first), int(last), text.strip()))
+    if not ranges:
+        raise Exception("No IP ranges in " + repr(spec))
+    return ranges
+
+
+def format_address(version, number):
+    """
+    The address number stands for.  ipaddress.ip_address() alone would read a small IPv6 number as IPv4
+    """
+    return str(ipaddress.IPv4Address(number) if version == 4 else ipaddress.IPv6Address(number))
+
+
+def merge_ranges(ranges):
+    """
+    Sort ranges and merge the ones that overlap or touch.
+    Returns a sorted list of (version, first, last)
+    """
+    merged = []
+    for version, first, last in sorted((r[0], r[1], r[2]) for r in ranges):
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            merged[-1] = (version, merged[-1][1], max(merged[-1][2], last))
+        else:
+            merged.append((version, first, last))
+    return merged
+
+
+def range_size(ranges):
+    """
+    Addresses in ranges, counting addresses that more than one range holds only once
+    """
+    return sum(last - first + 1 for _, first, last in merge_ranges(ranges))
+
+
+def find_overlaps(labelled):
+    """
+    Find overlapping ranges in a list of (label, (version, first, last, text)).  Each range that overlaps an earlier
+    one (in address order) is reported once, against the earlier range that reaches furthest.
+    Returns a list of ((label, text), (label, text))
+    """
+    overlaps = []
+    reach = None
+    for label, r in sorted(labelled, key=lambda item: (item[1][0], item[1][1], item[1][2])):
+        if reach is not None and reach[1][0] == r[0] and r[1] <= reach[1][2]:
+            overlaps.append(((reach[0], reach[1][3]), (label, r[3])))
+        if reach is None or reach[1][0] != r[0] or r[2] > reach[1][2]:
+            reach = (label, r)
+    return overlaps
+
+
+def addresses_in(ranges, addresses):
+    """
+    Pick out the addresses that fall inside ranges, with a binary search of the merged ranges for each.
+    addresses is a dictionary of address string to whatever uses it.
+    Returns an OrderedDict of the addresses found, sorted, to what uses them
+    """
+    merged = merge_ranges(ranges)
+    starts = [(version, first) for version, first, _ in merged]
+
+    found = []
+    for text, user in addresses.items():
+        try:
+            address = ipaddress.ip_address(text)
+        except ValueError:
+            continue
+        i = bisect.bisect_right(starts, (address.version, int(address))) - 1
+        if i >= 0 and merged[i][0] == address.version and merged[i][1] <= int(address) <= merged[i][2]:
+            found.append((address, text, user))
+
+    return OrderedDict((text, user) for _, text, user in sorted(found, key=lambda f: (f[0].version, f[0])))
+
+
+def validate_pool(spec, prefix_length=None, gateway=None, existing_pools=None, used_addresses=None, name="the pool"):
+    """
+    Check a pool spec on its own, against its subnet, against existing pools (a dictionary of name to spec) and
+    against addresses already in use (a dictionary of address to what uses it).
+    Returns (number of addresses, list of problems).  Raises an Exception if spec can't be parsed
+    """
+    ranges = parse_ranges(spec)
+    problems = []
+
+    for (_, a), (_, b) in find_overlaps([(name, r) for r in ranges]):
+        problems.append("%s: ranges %s and %s overlap" % (name, a, b))
+
+    if gateway and prefix_length is not None:
+        try:
+            network = ipaddress.ip_network("%s/%d" % (gateway, prefix_length), strict=False)
+        except ValueError:
+            raise Exception("Invalid gateway %s/%s" % (gateway, prefix_length))
+        gateway_address = ipaddress.ip_address(gateway)
+
+        ''' the network and broadcast addresses are only usable on point to point links '''
+        reserved = dict()
+        if network.num_addresses > 2:
+            reserved[str(network.network_address)] = "the network address"
+            if network.version == 4:
+                reserved[str(network.broadcast_address)] = "the broadcast address"
+
+        for version, first, last, text in ranges:
+            if version != network.version or first < int(network.network_address) or \
+                    last > int(network.broadcast_address):
+                problems.append("%s: range %s is outside %s" % (name, text, network))
+        for address, what in addresses_in(ranges, dict(reserved, **{str(gateway_address): "the gateway"})).items():
+            problems.append("%s: %s is %s" % (name, address, what))
+
+    for other, other_spec in (existing_pools or dict()).items():
+        try:
+            other_ranges = parse_ranges(other_spec)
+        except Exception:
+            continue
+        labelled = [(name, r) for r in ranges] + [(other, r) for r in other_ranges]
+        for (label_a, a), (label_b, b) in find_overlaps(labelled):
+            if label_a != label_b:
+                problems.append("%s: %s %s overlaps %s %s" % (name, label_a, a, label_b, b))
+
+    for address, user in addresses_in(ranges, used_addresses or dict()).items():
+        problems.append("%s: %s is already used by %s" % (name, address, user))
+
+    return range_size(ranges), problems
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""
+IP conflict scanner for the pyNSXdeploy IP pools
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Probes every address in a pool spec (see ip_ranges.py) to find the ones something is already using, before NSX hands
+them out to controllers or VTEPs.  Every address is probed at the same time, up to a limit on open sockets, with asyncio:
+
+    - a TCP connect to each of a few common ports.  A connection, or a refusal, means a host answered
+    - an ICMP echo alongside, where the process is allowed to send one (an unprivileged ping socket, or a raw socket
+      when running as root), so hosts that drop every probed port are found too
+
+An address that answers nothing within the timeout is taken to be free.  With the defaults a /22 is swept in a few
+seconds.
+
+Arguments
+---------
+-ranges [the pool spec to sweep, comma separated start-end ranges, single addresses or CIDR blocks]
+-ports [comma separated TCP ports to probe, defaults to 22,80,443,902]
+-timeout [seconds to wait for an answer from each address, defaults to 1]
+-concurrency [most TCP probes in flight at once, defaults to 4096 or what the open file limit allows]
+-no_icmp [only probe with TCP]
+
+Example with parameters:
+python3 ./ip_scan.py -ranges 10.193.136.0/22 -timeout 0.5
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import itertools
+import os
+import socket
+import struct
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from collections import OrderedDict
+
+from ip_ranges import format_address, merge_ranges, parse_ranges
+
+''' ssh, http, https and the ESXi/vCenter console, which between them most hosts on a management network answer '''
+COMMON_PORTS = [22, 80, 443, 902]
+
+''' ICMP echo request and reply types by IP version '''
+ECHO_REQUEST = {4: 8, 6: 128}
+ECHO_REPLY = {4: 0, 6: 129}
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to sweep an IP pool spec for addresses already in use')
+
+    parser.add_argument('-ranges', '--ranges',
+                        required=True,
+                        help='the pool spec to sweep, comma separated start-end ranges, single addresses or CIDR blocks')
+    parser.add_argument('-ports', '--ports',
+                        default=",".join(str(port) for port in COMMON_PORTS),
+                        help='comma separated TCP ports to probe')
+    parser.add_argument('-timeout', '--timeout',
+                        type=float,
+                        default=1,
+                        help='seconds to wait for an answer from each address')
+    parser.add_argument('-concurrency', '--concurrency',
+                        type=int,
+                        default=4096,
+                        help='most TCP probes in flight at once, capped by the open file limit')
+    parser.add_argument('-no_icmp', '--no_icmp',
+                        action='store_true',
+                        help='only probe with TCP')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    try:
+        ports = [int(port) for port in args.ports.split(",")]
+        live, swept, seconds = scan_ranges(args.ranges, ports, args.timeout, args.concurrency, not args.no_icmp)
+    except Exception as e:
+        print(e)
+        return 1
+
+    for address, evidence in live.items():
+        print("%s is in use (%s)" % (address, evidence))
+    print("Swept %d addresses in %.1f s, %d in use" % (swept, seconds, len(live)))
+    return 1 if live else 0
+
+
+def pool_addresses(spec, max_addresses=65536):
+    """
+    Every address in a pool spec, each once, in order.  Raises an Exception if there are more than max_addresses,
+    so an IPv6 /64 isn't swept by mistake
+    """
+    merged = merge_ranges(parse_ranges(spec))
+    total = sum(last - first + 1 for _, first, last in merged)
+    if total > max_addresses:
+        raise Exception("%s holds %d addresses, more than the %d that will be swept" % (spec, total, max_addresses))
+    return [format_address(version, n) for version, first, last in merged for n in range(first, last + 1)]
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+class Pinger(object):
+    """
+    ICMP echo over one socket per IP version, shared by every probe, with replies matched to their requests by source
+    address and sequence number.  Unprivileged ping sockets are used where the system allows them, raw sockets
+    otherwise.  If neither is allowed ping() returns None straight away.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.sockets = dict()
+        self.waiting = dict()
+        self.sequence = itertools.count(1)
+        self.ident = os.getpid() & 0xffff
+
+    def open(self, version):
+        ''' (socket, raw) for version, or None if this process may not send ICMP '''
+        if version not in self.sockets:
+            family, protocol = (socket.AF_INET, socket.IPPROTO_ICMP) if version == 4 else \
+                (socket.AF_INET6, socket.IPPROTO_ICMPV6)
+            self.sockets[version] = None
+            for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+                try:
+                    sock = socket.socket(family, kind, protocol)
+                except OSError:
+                    continue
+                sock.setblocking(False)
+                self.sockets[version] = (sock, kind == socket.SOCK_RAW)
+                self.loop.add_reader(sock.fileno(), self.readable, version)
+                break
+        return self.sockets[version]
+
+    def readable(self, version):
+        sock, raw = self.sockets[version]
+        while True:
+            try:
+                data, source = sock.recvfrom(2048)
+            except OSError:
+                return
+            ''' raw IPv4 sockets hand over the IP header too '''
+            if raw and version == 4:
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 8:
+                continue
+            kind, _, _, ident, sequence = struct.unpack("!BBHHH", data[:8])
+            if kind != ECHO_REPLY[version] or (raw and ident != self.ident):
+                continue
+            address = str(ipaddress.ip_address(source[0].split("%")[0]))
+            future = self.waiting.pop((address, sequence), None)
+            if future is not None and not future.done():
+                future.set_result(True)
+
+    async def ping(self, address, timeout):
+        version = ipaddress.ip_address(address).version
+        opened = self.open(version)
+        if opened is None:
+            return None
+        sock, raw = opened
+
+        sequence = next(self.sequence) & 0xffff
+        header = struct.pack("!BBHHH", ECHO_REQUEST[version], 0, 0, self.ident, sequence)
+        payload = b"pyNSXdeploy"
+        ''' the kernel works out ICMPv6 checksums itself '''
+        if version == 4:
+            header = struct.pack("!BBHHH", ECHO_REQUEST[version], 0, checksum(header + payload), self.ident, sequence)
+
+        future = self.loop.create_future()
+        self.waiting[(address, sequence)] = future
+        try:
+            sock.sendto(header + payload, (address, 0))
+            await asyncio.wait_for(future, timeout)
+            return "answered ICMP echo"
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self.waiting.pop((address, sequence), None)
+
+    def close(self):
+        for opened in self.sockets.values():
+            if opened is not None:
+                self.loop.remove_reader(opened[0].fileno())
+                opened[0].close()
+
+
+async def probe_port(address, port, timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+    except ConnectionRefusedError:
+        return "refused TCP %d" % port
+    except (asyncio.TimeoutError, OSError):
+        return None
+    writer.close()
+    return "accepted TCP %d" % port
+
+
+async def probe_address(address, ports, timeout, pinger=None):
+    """
+    Probe every port, and ping, at the same time.  Returns what answered first, or None if nothing did
+    """
+    probes = [asyncio.ensure_future(probe_port(address, port, timeout)) for port in ports]
+    if pinger is not None:
+        probes.append(asyncio.ensure_future(pinger.ping(address, timeout)))
+
+    evidence = None
+    try:
+        for finished in asyncio.as_completed(probes):
+            evidence = await finished
+            if evidence:
+                break
+    finally:
+        for probe in probes:
+            probe.cancel()
+        await asyncio.gather(*probes, return_exceptions=True)
+    return evidence
+
+
+def socket_budget(concurrency):
+    """
+    concurrency, capped so the sockets fit under the open file limit.  Running out of file descriptors would make
+    addresses look free
+    """
+    if resource is None:
+        return concurrency
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return concurrency
+    return max(1, min(concurrency, soft - 64))
+
+
+async def sweep(addresses, ports=COMMON_PORTS, timeout=1.0, concurrency=4096, icmp=True):
+    """
+    Probe addresses with enough workers to keep about concurrency TCP probes in flight.  Pings share one socket so
+    they don't count.
+    Returns an OrderedDict of address to what answered, for the addresses in use, in the order given
+    """
+    loop = asyncio.get_running_loop()
+    pinger = Pinger(loop) if icmp else None
+    pending = iter(addresses)
+    found = dict()
+
+    async def worker():
+        for address in pending:
+            evidence = await probe_address(address, ports, timeout, pinger)
+            if evidence:
+                found[address] = evidence
+
+    workers = max(1, min(len(addresses), socket_budget(concurrency) // max(1, len(ports))))
+    try:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+    finally:
+        if pinger is not None:
+            pinger.close()
+
+    return OrderedDict((address, found[address]) for address in addresses if address in found)
+
+
+def scan_ranges(spec, ports=COMMON_PORTS, timeout=1.0, concurrency=4096, icmp=True, max_addresses=65536):
+    """
+    Sweep every address in a pool spec.
+    Returns (OrderedDict of address in use to what answered, number of addresses swept, seconds taken)
+    """
+    addresses = pool_addresses(spec, max_addresses)
+    start = time.time()
+    live = asyncio.run(sweep(addresses, ports, timeout, concurrency, icmp))
+    return live, len(addresses), time.time() - start
+
+
+if __name__ == "__main__":
+    exit(main())
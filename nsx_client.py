@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+"""
+Shared NSX Manager REST client for the pyNSXdeploy scripts
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Each call used to open its own HTTPSConnection, with a full TLS handshake and Basic authentication every time, and
+never closed it.  NSXClient keeps a pool of keep-alive connections to NSX Manager instead:
+
+    - connections are reused across calls and threads, up to pool_size of them open at once
+    - new connections resume the TLS session of an earlier one rather than doing a full handshake
+    - after the first call the client authenticates with an NSX auth token (/api/2.0/services/auth/token) instead of
+      sending the password with every request, and falls back to Basic authentication if tokens aren't available
+    - every request has a timeout
+    - stream() hands back a response before its body is read, so answers too big to hold in memory can be parsed as
+      they arrive
+    - close() closes every pooled connection, and the client can be used as a context manager
+
+poll() waits on NSX jobs with a backoff that starts short and stretches out, instead of a fixed sleep.
+
+With tracing on (see tracing.py) every request is recorded with its status, the bytes sent and received and how long
+it took, and every wait in poll() as a sleep.
+"""
+
+import base64
+import contextlib
+import http.client
+import queue
+import re
+import socket
+import ssl
+import threading
+import time
+
+import tracing
+
+
+''' errors that mean a pooled keep-alive connection was closed by the other end while it sat idle '''
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError,
+                           ConnectionResetError, ConnectionAbortedError)
+
+
+class NSXConnection(http.client.HTTPSConnection):
+    """
+    HTTPSConnection that offers the client's last TLS session when it connects, so the handshake can be resumed, and
+    that turns off Nagle's algorithm
+    """
+    def __init__(self, nsx_client, host, port=None, timeout=None, context=None):
+        http.client.HTTPSConnection.__init__(self, host, port, timeout=timeout, context=context)
+        self.nsx_client = nsx_client
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        ''' headers and body go out in separate writes, which Nagle would hold back for the server's delayed ACK '''
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server_hostname = self.host if self._context.check_hostname else None
+        self.sock = self._context.wrap_socket(sock, server_hostname=server_hostname,
+                                              session=self.nsx_client.tls_session)
+        self.nsx_client.handshakes += 1
+        if self.sock.session_reused:
+            self.nsx_client.resumed_handshakes += 1
+
+
+class NSXClient(object):
+    """
+    Pooled keep-alive client for the NSX Manager REST API.  address is the NSX Manager FQDN or IP, optionally with a
+    :port.  Requests return (status, body) with the body as bytes, or (status, body, response headers) from
+    request_with_headers() for callers that need an ETag or a Location.
+    """
+    def __init__(self, address, username, password, pool_size=8, timeout=60, verify=False, use_tokens=True):
+        self.address = address
+        self.username = username
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.use_tokens = use_tokens
+
+        credstring = (username + ":" + password)
+        self.basic_auth = 'Basic ' + base64.b64encode(credstring.encode()).decode('ascii')
+        self.token = None
+
+        if verify:
+            self.context = ssl.create_default_context()
+        else:
+            self.context = ssl._create_unverified_context()
+
+        self.tls_session = None
+        self.handshakes = 0
+        self.resumed_handshakes = 0
+        self.requests = 0
+
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.lock = threading.Lock()
+        self.login_lock = threading.Lock()
+        self.open = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        ''' Close every connection the client has opened '''
+        with self.lock:
+            connections, self.open = self.open, []
+        for connection in connections:
+            connection.close()
+        while True:
+            try:
+                self.idle.get_nowait()
+            except queue.Empty:
+                break
+
+    def get(self, path, timeout=None):
+        return self.request('GET', path, timeout=timeout)
+
+    def post(self, path, body, timeout=None):
+        return self.request('POST', path, body, timeout=timeout)
+
+    def put(self, path, body, timeout=None):
+        return self.request('PUT', path, body, timeout=timeout)
+
+    def delete(self, path, timeout=None):
+        return self.request('DELETE', path, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None, timeout=None, content_type='application/xml'):
+        """
+        Send one request over a pooled connection.
+        Returns (status, body)
+        """
+        return self.request_with_headers(method, path, body, headers, timeout, content_type)[:2]
+
+    def request_with_headers(self, method, path, body=None, headers=None, timeout=None,
+                             content_type='application/xml'):
+        """
+        Send one request over a pooled connection.
+        Returns (status, body, response headers)
+        """
+        if self.use_tokens and self.token is None and path != '/api/2.0/services/auth/token':
+            self.login()
+
+        status, data, response_headers = self.send(method, path, body, self.request_headers(headers, content_type),
+                                                   timeout)
+
+        ''' an expired token gets one retry with a fresh token '''
+        if status in (401, 403) and self.token is not None:
+            self.login(stale_token=self.token)
+            status, data, response_headers = self.send(method, path, body, self.request_headers(headers, content_type),
+                                                       timeout)
+
+        return status, data, response_headers
+
+    @contextlib.contextmanager
+    def stream(self, method, path, body=None, headers=None, timeout=None, content_type='application/xml'):
+        """
+        Send one request and hand back the response before its body has been read, for answers too big to hold in
+        memory:
+
+            with nsx.stream('GET', path) as response:
+                for event, element in ElementTree.iterparse(response): ...
+
+        The connection is held until the with block ends.  Whatever the caller didn't read is then drained so the
+        connection can go back in the pool.
+        """
+        if self.use_tokens and self.token is None:
+            self.login()
+
+        stale_token = None
+        for attempt in (1, 2):
+            if stale_token is not None:
+                self.login(stale_token=stale_token)
+            self.slots.acquire()
+            connection = None
+            try:
+                with tracing.nsx_span(method, path, self.address, body) as span:
+                    connection, response = self.start(method, path, body,
+                                                      self.request_headers(headers, content_type), timeout)
+                    span["status"] = response.status
+                    span["bytes_in"] = response.length
+                    ''' an expired token gets one retry with a fresh token, like request() '''
+                    if attempt == 1 and response.status in (401, 403) and self.token is not None:
+                        stale_token = self.token
+                        response.read()
+                    else:
+                        stale_token = None
+                        yield response
+                        response.read()
+                self.checkin(connection, response)
+                connection = None
+            finally:
+                if connection is not None:
+                    self.discard(connection)
+                self.slots.release()
+            if stale_token is None:
+                return
+
+    def request_headers(self, headers, content_type):
+        request_headers = {'Content-Type': content_type, 'Accept': 'application/xml',
+                           'Authorization': self.authorization()}
+        if headers:
+            request_headers.update(headers)
+        return request_headers
+
+    def authorization(self):
+        if self.token is not None:
+            return 'AUTHTOKEN ' + self.token
+        return self.basic_auth
+
+    def login(self, stale_token=None):
+        """
+        Swap the password for an NSX auth token.  If NSX Manager won't hand one out, stay on Basic authentication.
+        Threads that need a token at the same time share one login, and so do threads replacing the same stale_token.
+        """
+        with self.login_lock:
+            if self.token is not None and self.token != stale_token:
+                return
+            status, data, _ = self.send('POST', '/api/2.0/services/auth/token', None,
+                                        {'Content-Type': 'application/xml', 'Authorization': self.basic_auth}, None)
+            match = re.search(r"<value>([^<]+)</value>", data.decode('utf-8', 'replace'))
+            if status == 200 and match:
+                self.token = match.group(1)
+            else:
+                self.token = None
+                self.use_tokens = False
+
+    def send(self, method, path, body, headers, timeout):
+        with tracing.nsx_span(method, path, self.address, body) as span:
+            self.slots.acquire()
+            try:
+                connection, response = self.start(method, path, body, headers, timeout)
+                span["status"] = response.status
+                try:
+                    data = response.read()
+                except Exception:
+                    self.discard(connection)
+                    raise
+                span["bytes_in"] = len(data)
+                self.checkin(connection, response)
+                return response.status, data, response.msg
+            finally:
+                self.slots.release()
+
+    def start(self, method, path, body, headers, timeout):
+        """
+        Send a request over a pooled connection and read the status and headers of the answer, trying once more on a
+        new connection if a pooled one turns out to have been closed.  The caller holds a slot.
+        Returns (connection, response)
+        """
+        timeout = timeout or self.timeout
+        connection, reused = self.checkout()
+        while True:
+            try:
+                return connection, self.exchange(connection, method, path, body, headers, timeout)
+            except STALE_CONNECTION_ERRORS:
+                self.discard(connection)
+                if not reused:
+                    raise
+                connection, reused = self.new_connection(), False
+            except Exception:
+                self.discard(connection)
+                raise
+
+    def exchange(self, connection, method, path, body, headers, timeout):
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        else:
+            connection.timeout = timeout
+
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+
+        with self.lock:
+            self.requests += 1
+            if connection.sock is not None and self.tls_session is None:
+                self.tls_session = connection.sock.session
+        return response
+
+    def checkin(self, connection, response):
+        ''' Put a connection back in the pool once its response has been read '''
+        if response.will_close:
+            connection.close()
+        self.idle.put(connection)
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self.new_connection(), False
+
+    def new_connection(self):
+        connection = NSXConnection(self, self.address, timeout=self.timeout, context=self.context)
+        with self.lock:
+            self.open.append(connection)
+        return connection
+
+    def discard(self, connection):
+        connection.close()
+        with self.lock:
+            if connection in self.open:
+                self.open.remove(connection)
+
+
+def poll(check, timeout, initial_interval=2, max_interval=30, backoff=1.5, what="NSX Manager"):
+    """
+    Call check() until it returns something other than None and return that.  Waits initial_interval seconds after
+    the first call and backoff times longer after each one after that, up to max_interval.  check() raises to give up
+    straight away.  Raises an Exception if nothing has come back after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    interval = initial_interval
+    while True:
+        result = check()
+        if result is not None:
+            return result
+        if time.time() + interval > deadline:
+            raise Exception("Timed out after %d seconds waiting for %s" % (timeout, what))
+        tracing.sleep(interval, "poll", what)
+        interval = min(interval * backoff, max_interval)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+"""
+NSX inventory exporter for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Dumps what NSX Manager holds to JSON lines, one object per line, so it can be searched, diffed or loaded somewhere
+else:
+
+    virtualwires    every logical switch, read a page at a time (startindex / pagesize) with the pages after the
+                    first fetched at the same time
+    controllers     the NSX controllers
+    ip_allocations  every address each IP pool has handed out, with the pools read at the same time
+    host_prep       host prep and VXLAN status of every host in the clusters, with the clusters read at the same time
+    dfw_rules       every rule of every DFW section
+
+Answers are parsed with iterparse as they come off the connection, and each object is written out and dropped from the
+parsed tree as soon as it has been read, so memory stays flat however big the inventory is.  Pages and pools fetched
+at the same time are only read ahead by -max_in_flight, and objects are written in the order NSX Manager lists them.
+
+Each line is {"kind": "virtualwire", ...}, followed by the fields of the object's XML: child elements and attributes
+become keys, repeated child elements become lists.  DFW rules also get the section they are in, IP allocations the
+pool and host prep statuses the cluster and host.
+
+Arguments
+---------
+-nsx_manager_address [FQDN or IP of NSX Manager, optionally with :port]
+-nsx_manager_username [NSX admin account]
+-nsx_manager_password [password of the NSX admin account]
+-objects [comma separated kinds of object to export, defaults to all of virtualwires, controllers, ip_allocations,
+          host_prep, dfw_rules]
+-output [JSON lines file to write, defaults to standard output]
+-clusters [comma separated cluster morefs for host_prep, defaults to the clusters of every transport zone]
+-page_size [objects asked for in each page, defaults to 1000]
+-max_in_flight [most pages or pools fetched at the same time, defaults to 8]
+-nsx_request_timeout [seconds to wait for each NSX Manager request, defaults to 120]
+
+Example with parameters:
+python3 ./nsx_export.py -nsx_manager_address nsxmanager1.vmwpc.local -nsx_manager_username admin -nsx_manager_password NetApp123!NetApp123! -objects virtualwires,dfw_rules -output nsx_inventory.jsonl
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import tracing
+
+from nsx_client import NSXClient
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to export the NSX inventory to JSON lines')
+
+    parser.add_argument('-nsx_manager_address', '--nsx_manager_address',
+                        required=True,
+                        help='FQDN or IP of NSX Manager')
+    parser.add_argument('-nsx_manager_username', '--nsx_manager_username',
+                        required=True,
+                        help='An account in the NSX manager database that has admin rights')
+    parser.add_argument('-nsx_manager_password', '--nsx_manager_password',
+                        required=True,
+                        help='Password for the aforementioned NSX admin account')
+    parser.add_argument('-objects', '--objects',
+                        default=",".join(EXPORTERS),
+                        help='comma separated kinds of object to export: ' + ", ".join(EXPORTERS))
+    parser.add_argument('-output', '--output',
+                        default='-',
+                        help='JSON lines file to write, defaults to standard output')
+    parser.add_argument('-clusters', '--clusters',
+                        help='comma separated cluster morefs for host_prep, defaults to the clusters of every '
+                             'transport zone')
+    parser.add_argument('-page_size', '--page_size',
+                        type=int,
+                        default=1000,
+                        help='objects asked for in each page')
+    parser.add_argument('-max_in_flight', '--max_in_flight',
+                        type=int,
+                        default=8,
+                        help='most pages or pools fetched at the same time')
+    parser.add_argument('-nsx_request_timeout', '--nsx_request_timeout',
+                        type=float,
+                        default=120,
+                        help='seconds to wait for each NSX Manager request')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    kinds = [kind for kind in args.objects.split(",") if kind]
+    unknown = [kind for kind in kinds if kind not in EXPORTERS]
+    if unknown:
+        print("Unknown object kind(s) %s, choose from %s" % (", ".join(unknown), ", ".join(EXPORTERS)),
+              file=sys.stderr)
+        return 1
+    clusters = [cluster for cluster in (args.clusters or "").split(",") if cluster] or None
+
+    nsx = NSXClient(args.nsx_manager_address, args.nsx_manager_username, args.nsx_manager_password,
+                    pool_size=max(1, args.max_in_flight), timeout=args.nsx_request_timeout)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        counts = export(nsx, output, kinds, clusters, args.page_size, args.max_in_flight)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        nsx.close()
+        if output is not sys.stdout:
+            output.close()
+
+    return 0 if counts else 1
+
+
+''' parsing '''
+
+
+def element_record(element):
+    """
+    An element as a dictionary: attributes and child elements become keys, a child with children of its own becomes a
+    dictionary and a child element that is repeated becomes a list
+    """
+    record = OrderedDict(element.attrib)
+    lists = set()
+    for child in element:
+        value = element_record(child) if len(child) or child.attrib else (child.text or "").strip()
+        if child.tag not in record:
+            record[child.tag] = value
+        elif child.tag in lists:
+            record[child.tag].append(value)
+        else:
+            record[child.tag] = [record[child.tag], value]
+            lists.add(child.tag)
+    return record
+
+
+def iter_elements(source, tags):
+    """
+    Parse XML from the file-like source with iterparse, yielding (element, list of the elements it is inside) for
+    every element whose tag is in tags once it has been read whole.  Each one is removed from the tree once the caller
+    is done with it, so the tree never holds more than the element being read.
+    """
+    ancestors = []
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            ancestors.append(element)
+            continue
+        ancestors.pop()
+        if element.tag in tags:
+            yield element, ancestors
+            if ancestors:
+                ancestors[-1].remove(element)
+            else:
+                element.clear()
+
+
+def check_status(response, path):
+    if response.status != 200:
+        raise Exception("%d reading %s: %s" % (response.status, path, response.read().decode('utf-8', 'replace')))
+
+
+def stream_records(nsx, path, tag):
+    """
+    GET path and yield every <tag> in the answer as a record, as it is read
+    """
+    with nsx.stream('GET', path) as response:
+        check_status(response, path)
+        for element, _ in iter_elements(response, (tag,)):
+            yield element_record(element)
+
+
+def read_ahead(function, items, max_in_flight=8):
+    """
+    Yield function(item) for every item, in order, running up to max_in_flight of them at the same time.  No more than
+    max_in_flight results are ever waiting to be used
+    """
+    items, function = iter(items), tracing.wrap(function)
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        pending = deque(executor.submit(function, item) for _, item in zip(range(max(1, max_in_flight)), items))
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(executor.submit(function, item))
+                break
+            yield result
+
+
+def paged_records(nsx, path, tag, page_size=1000, max_in_flight=8):
+    """
+    Walk a paged NSX list (startindex / pagesize with a pagingInfo in each answer) and yield every <tag> in it as a
+    record, in order.  The first page says how many there are, then up to max_in_flight of the rest are fetched at the
+    same time.  Objects created or deleted during the walk may be missed or seen twice
+    """
+    separator = '&' if '?' in path else '?'
+
+    def page(start):
+        page_path = '%s%sstartindex=%d&pagesize=%d' % (path, separator, start, page_size)
+        total, records = 0, []
+        with nsx.stream('GET', page_path) as response:
+            check_status(response, page_path)
+            for element, _ in iter_elements(response, (tag, 'pagingInfo')):
+                if element.tag == 'pagingInfo':
+                    total = int(element.findtext('totalCount') or 0)
+                else:
+                    records.append(element_record(element))
+        return total, records
+
+    total, records = page(0)
+    for record in records:
+        yield record
+    for _, records in read_ahead(page, range(page_size, total, page_size), max_in_flight):
+        for record in records:
+            yield record
+
+
+''' exporters, each yielding the records of one kind of object '''
+
+
+def export_virtualwires(nsx, clusters=None, page_size=1000, max_in_flight=8):
+    for record in paged_records(nsx, '/api/2.0/vdn/virtualwires', 'virtualWire', page_size, max_in_flight):
+        yield "virtualwire", record
+
+
+def export_controllers(nsx, clusters=None, page_size=1000, max_in_flight=8):
+    for record in stream_records(nsx, '/api/2.0/vdn/controller', 'controller'):
+        yield "controller", record
+
+
+def export_ip_allocations(nsx, clusters=None, page_size=1000, max_in_flight=8):
+    pools = list(stream_records(nsx, '/api/2.0/services/ipam/pools/scope/globalroot-0', 'ipamAddressPool'))
+
+    def allocations(pool):
+        return pool, list(stream_records(nsx, '/api/2.0/services/ipam/pools/%s/ipaddresses' % pool['objectId'],
+                                         'allocatedIpAddress'))
+
+    for pool, records in read_ahead(allocations, pools, max_in_flight):
+        for record in records:
+            yield "ip_allocation", OrderedDict([("poolId", pool['objectId']), ("poolName", pool.get('name'))],
+                                               **record)
+
+
+def transport_zone_clusters(nsx):
+    clusters = []
+    with nsx.stream('GET', '/api/2.0/vdn/scopes') as response:
+        check_status(response, '/api/2.0/vdn/scopes')
+        for element, ancestors in iter_elements(response, ('objectId',)):
+            if ancestors and ancestors[-1].tag == 'cluster' and element.text not in clusters:
+                clusters.append(element.text)
+    return clusters
+
+
+def export_host_prep(nsx, clusters=None, page_size=1000, max_in_flight=8):
+    if clusters is None:
+        clusters = transport_zone_clusters(nsx)
+
+    def host_statuses(cluster):
+        return cluster, list(stream_records(nsx, '/api/2.0/nwfabric/status/child/' + cluster, 'resourceStatus'))
+
+    for cluster, statuses in read_ahead(host_statuses, clusters, max_in_flight):
+        for status in statuses:
+            features = status.get('nwFabricFeatureStatus') or []
+            for feature in features if isinstance(features, list) else [features]:
+                yield "host_prep", OrderedDict([("cluster", cluster),
+                                                ("host", status.get('resource', {}).get('objectId'))], **feature)
+
+
+def export_dfw_rules(nsx, clusters=None, page_size=1000, max_in_flight=8):
+    path = '/api/4.0/firewall/globalroot-0/config'
+    with nsx.stream('GET', path) as response:
+        check_status(response, path)
+        for element, ancestors in iter_elements(response, ('rule',)):
+            section = next((a for a in reversed(ancestors) if a.tag == 'section'), None)
+            layer = next((a.tag for a in reversed(ancestors) if a.tag.endswith('Sections')), None)
+            context = [("layer", layer)]
+            if section is not None:
+                context += [("sectionId", section.get('id')), ("sectionName", section.get('name'))]
+            yield "dfw_rule", OrderedDict(context, **element_record(element))
+
+
+EXPORTERS = OrderedDict([("virtualwires", export_virtualwires),
+                         ("controllers", export_controllers),
+                         ("ip_allocations", export_ip_allocations),
+                         ("host_prep", export_host_prep),
+                         ("dfw_rules", export_dfw_rules)])
+
+
+def export(nsx, output, kinds, clusters=None, page_size=1000, max_in_flight=8):
+    """
+    Write every object of the given kinds to output as JSON lines, printing how many of each there were to standard
+    error.
+    Returns an OrderedDict of kind of record to number written
+    """
+    counts = OrderedDict()
+    for kind in kinds:
+        start = time.time()
+        written = 0
+        for record_kind, record in EXPORTERS[kind](nsx, clusters, page_size, max_in_flight):
+            output.write(json.dumps(OrderedDict([("kind", record_kind)], **record)) + "\n")
+            counts[record_kind] = counts.get(record_kind, 0) + 1
+            written += 1
+        seconds = time.time() - start
+        print("%s: %d record(s) in %.1f s, %.0f/s" % (kind, written, seconds, written / seconds if seconds else 0),
+              file=sys.stderr)
+    return counts
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,878 @@
+#!/usr/bin/env python3
+
+"""
+Local NSX-v REST API stand-in for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+An HTTPS server that answers the NSX Manager API calls configure_nsx_manager.py makes, so the configuration flow can be
+run and timed with no NSX Manager and no network:
+
+    POST /api/2.0/services/auth/token                         exchange Basic credentials for an auth token
+    POST /api/2.0/services/ssoconfig                          register with the lookup service
+    GET  /api/2.0/services/ssoconfig/status
+    PUT  /api/2.0/services/vcconfig                           register with vCenter
+    GET  /api/2.0/services/vcconfig/status
+    POST /api/2.0/vdn/config/segments                         segment ID range
+    POST /api/2.0/services/ipam/pools/scope/globalroot-0      IP pools, returns the pool ID
+    GET  /api/2.0/services/ipam/pools/scope/globalroot-0
+    GET  /api/2.0/services/ipam/pools/<pool ID>/ipaddresses   addresses handed to controllers and VTEPs
+    POST /api/2.0/vdn/controller                              controller deployment, returns a job ID
+    GET  /api/2.0/vdn/controller
+    GET  /api/2.0/vdn/controller/progress/<job ID>
+    POST /api/2.0/nwfabric/configure                          host prep / VXLAN prep, returns a job ID
+    GET  /api/2.0/nwfabric/status?resource=<cluster>
+    GET  /api/2.0/nwfabric/status/child/<cluster>             per-host status of the cluster's hosts
+    GET  /api/2.0/services/taskservice/job/<job ID>
+    POST /api/2.0/vdn/scopes                                  transport zone, returns the scope ID
+    GET  /api/2.0/vdn/scopes
+    POST /api/2.0/vdn/scopes/<scope ID>?action=expand         add clusters to a transport zone
+    POST /api/2.0/vdn/scopes/<scope ID>/virtualwires          logical switch, returns the virtualwire ID
+    GET  /api/2.0/vdn/scopes/<scope ID>/virtualwires          ?startindex=&pagesize= pages through them
+    GET  /api/2.0/vdn/virtualwires                            every transport zone's logical switches
+    GET  /api/4.0/firewall/globalroot-0/config                the whole DFW configuration
+    POST /api/4.0/firewall/globalroot-0/config/layer3sections  DFW section, added at the top
+    GET  /api/4.0/firewall/globalroot-0/config/layer3sections?name=<name>
+    GET  /api/4.0/firewall/globalroot-0/config/layer3sections/<section ID>
+    PUT  /api/4.0/firewall/globalroot-0/config/layer3sections/<section ID>   needs If-Match
+
+Answers are XML in the same shape NSX Manager uses.  Controller deployments and host prep run as jobs that take a
+configurable time, and like NSX Manager only one controller can be deployed at a time, VXLAN needs the cluster's host
+prep to have finished and a transport zone needs VXLAN on its clusters.  The hosts of a cluster finish prep one after
+another over the prep time, and hosts named with -fail_hosts go RED instead of GREEN.  Each logical switch takes the
+next free segment ID, and -virtualwire_error_rate makes that fraction of logical switch creates fail with a 503 or a
+409.  DFW sections carry an ETag that changes with every write, and like NSX Manager a section is only replaced if
+If-Match has its current ETag.
+
+Connections are kept alive (HTTP/1.1) and TLS sessions can be resumed.  Every request is recorded, along with whether it
+opened a new connection and whether that connection's TLS handshake was resumed.  The recording can be read back from
+GET /sim/requests (no authentication) or written to a JSON lines file with -record_file.
+
+Without -certfile / -keyfile a self-signed certificate is generated with the openssl command.
+
+Arguments
+---------
+-address [address to listen on, defaults to 127.0.0.1]
+-port [port to listen on, defaults to 8443]
+-username [NSX admin user name the server accepts, defaults to admin]
+-password [NSX admin password the server accepts, defaults to accepting any password]
+-controller_seconds [how long each controller deployment takes, defaults to 10]
+-host_prep_seconds [how long host prep and VXLAN prep take per cluster, defaults to 5]
+-latency [extra time added to every request in seconds, defaults to 0]
+-hosts_per_cluster [hosts each cluster has, defaults to 4.  They are named <cluster>-host-<n>]
+-fail_hosts [comma separated list of hosts whose host prep and VXLAN prep fail]
+-virtualwire_error_rate [fraction of logical switch creates that fail with a 503 or a 409, defaults to 0]
+-certfile / -keyfile [PEM certificate and key to serve with]
+-record_file [append every request to this JSON lines file]
+
+Example with parameters:
+python3 ./nsx_sim_server.py -port 8443 -controller_seconds 30 -host_prep_seconds 10 -record_file nsx_requests.jsonl
+python3 ./configure_nsx_manager.py -nsx_manager_address 127.0.0.1:8443 ...
+"""
+
+import argparse
+import base64
+import ipaddress
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+HOST_PREP_FEATURE = "com.vmware.vshield.vsm.nwfabric.hostPrep"
+VXLAN_FEATURE = "com.vmware.vshield.vsm.vxlan"
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to run the NSX Manager stand-in')
+
+    parser.add_argument('-address', '--address',
+                        default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('-port', '--port',
+                        type=int,
+                        default=8443,
+                        help='port to listen on')
+    parser.add_argument('-username', '--username',
+                        default='admin',
+                        help='NSX admin user name the server accepts')
+    parser.add_argument('-password', '--password',
+                        help='NSX admin password the server accepts.  Any password is accepted if not given')
+    parser.add_argument('-controller_seconds', '--controller_seconds',
+                        type=float,
+                        default=10,
+                        help='how long each controller deployment takes')
+    parser.add_argument('-host_prep_seconds', '--host_prep_seconds',
+                        type=float,
+                        default=5,
+                        help='how long host prep and VXLAN prep take per cluster')
+    parser.add_argument('-latency', '--latency',
+                        type=float,
+                        default=0,
+                        help='extra time added to every request in seconds')
+    parser.add_argument('-hosts_per_cluster', '--hosts_per_cluster',
+                        type=int,
+                        default=4,
+                        help='hosts each cluster has')
+    parser.add_argument('-fail_hosts', '--fail_hosts',
+                        default='',
+                        help='comma separated list of hosts whose host prep and VXLAN prep fail')
+    parser.add_argument('-virtualwire_error_rate', '--virtualwire_error_rate',
+                        type=float,
+                        default=0,
+                        help='fraction of logical switch creates that fail with a 503 or a 409 and create nothing')
+    parser.add_argument('-certfile', '--certfile',
+                        help='PEM certificate to serve with')
+    parser.add_argument('-keyfile', '--keyfile',
+                        help='PEM key to serve with')
+    parser.add_argument('-record_file', '--record_file',
+                        help='append every request to this JSON lines file')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    state = NSXState(args.controller_seconds, args.host_prep_seconds, args.latency, args.username, args.password,
+                     args.record_file, args.hosts_per_cluster, [host for host in args.fail_hosts.split(",") if host],
+                     args.virtualwire_error_rate)
+
+    try:
+        server = make_server(state, args.address, args.port, args.certfile, args.keyfile)
+    except Exception as e:
+        print(e)
+        return 1
+
+    print("NSX Manager stand-in listening on https://%s:%d" % server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+    print("Served %d requests" % len(state.requests))
+    return 0
+
+
+class Job(object):
+    """
+    A job that finishes a fixed time after it starts
+    """
+    def __init__(self, job_id, name, seconds):
+        self.id = job_id
+        self.name = name
+        self.started = time.time()
+        self.finish = self.started + seconds
+
+    def done(self):
+        return time.time() >= self.finish
+
+
+class NSXState(object):
+    """
+    Everything the stand-in knows about, plus the recording of every request it has served
+    """
+    def __init__(self, controller_seconds=10, host_prep_seconds=5, latency=0, username="admin", password=None,
+                 record_file=None, hosts_per_cluster=4, failed_hosts=(), virtualwire_error_rate=0):
+        self.controller_seconds = controller_seconds
+        self.host_prep_seconds = host_prep_seconds
+        self.latency = latency
+        self.username = username
+        self.password = password
+        self.record_file = record_file
+        self.hosts_per_cluster = hosts_per_cluster
+        self.failed_hosts = set(failed_hosts)
+        self.virtualwire_error_rate = virtualwire_error_rate
+
+        ''' cluster ID to host IDs, for callers that want the hosts to match a real or simulated vCenter '''
+        self.inventory = dict()
+
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.generations = itertools.count(int(time.time() * 1000))
+        self.tokens = set()
+        self.requests = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.sso = None
+            self.vcenter = None
+            self.segments = []
+            self.pools = dict()
+            self.controllers = []
+            self.jobs = dict()
+            self.features = dict()
+            self.vtep_pools = dict()
+            self.scopes = dict()
+            self.virtualwires = dict()
+            default_rule = ElementTree.fromstring('<rule id="1001" disabled="false" logged="false"><name>Default Rule'
+                                                  '</name><action>allow</action><direction>inout</direction>'
+                                                  '<packetType>any</packetType></rule>')
+            self.sections = [{"id": 1001, "name": "Default Section Layer3", "generation": self.next_generation(),
+                              "rules": [default_rule]}]
+            self.requests = []
+
+    def next_id(self, prefix):
+        return "%s-%d" % (prefix, next(self.ids))
+
+    def record(self, entry):
+        with self.lock:
+            self.requests.append(entry)
+            if self.record_file:
+                with open(self.record_file, "a") as f:
+                    f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def authorized(self, header):
+        if header and header.startswith("AUTHTOKEN "):
+            return header[10:] in self.tokens
+        if not header or not header.startswith("Basic "):
+            return False
+        try:
+            username, password = base64.b64decode(header[6:]).decode("utf-8").split(":", 1)
+        except ValueError:
+            return False
+        return username == self.username and (self.password is None or password == self.password)
+
+    def start_job(self, name, seconds):
+        job = Job(self.next_id("jobdata"), name, seconds)
+        self.jobs[job.id] = job
+        return job
+
+    def allocations(self, pool_id):
+        """
+        The addresses pool_id has handed out, in order: one for each controller deployed from it, then vmknicCount for
+        each host of every cluster whose VXLAN prep uses it.
+        Returns a list of (address, what it is allocated to)
+        """
+        users = ["controller " + controller["id"] for controller in self.controllers
+                 if controller["ipPoolId"] == pool_id]
+        for cluster, (pool, vmknic_count) in self.vtep_pools.items():
+            if pool == pool_id:
+                users += ["%s vmknic %d" % (host, n) for host in self.cluster_hosts(cluster)
+                          for n in range(vmknic_count)]
+
+        addresses = []
+        for start, end in self.pools[pool_id]["ranges"]:
+            first, last = ipaddress.ip_address(start), ipaddress.ip_address(end)
+            while first <= last and len(addresses) < len(users):
+                addresses.append(str(first))
+                first += 1
+        return list(zip(addresses, users))
+
+    def next_generation(self):
+        return str(next(self.generations))
+
+    def find_section(self, section_id):
+        for section in self.sections:
+            if str(section["id"]) == str(section_id):
+                return section
+        return None
+
+    def next_vdn_id(self):
+        ''' the lowest segment ID in the segment ranges that no logical switch has, or None '''
+        used = set(wire["vdnId"] for wire in self.virtualwires.values())
+        for segment in self.segments:
+            for vdn_id in range(segment["begin"], segment["end"] + 1):
+                if vdn_id not in used:
+                    return vdn_id
+        return None
+
+    def controller_busy(self):
+        return any(not self.jobs[controller["job"]].done() for controller in self.controllers)
+
+    def cluster_hosts(self, cluster):
+        if cluster in self.inventory:
+            return self.inventory[cluster]
+        return ["%s-host-%d" % (cluster, n) for n in range(1, self.hosts_per_cluster + 1)]
+
+    def host_feature_status(self, cluster, host, feature):
+        ''' the hosts of a cluster finish one after another over the length of the job '''
+        job = self.features.get((cluster, feature))
+        if job is None:
+            return "UNKNOWN"
+        hosts = self.cluster_hosts(cluster)
+        finish = job.started + (job.finish - job.started) * (hosts.index(host) + 1) / len(hosts)
+        if time.time() < finish:
+            return "NOT_READY"
+        return "RED" if host in self.failed_hosts else "GREEN"
+
+    def feature_status(self, cluster, feature):
+        job = self.features.get((cluster, feature))
+        if job is None:
+            return "UNKNOWN"
+        if not job.done():
+            return "NOT_READY"
+        if any(host in self.failed_hosts for host in self.cluster_hosts(cluster)):
+            return "RED"
+        return "GREEN"
+
+
+def text(element, path, default=""):
+    found = element.find(path)
+    if found is None or found.text is None:
+        return default
+    return found.text.strip()
+
+
+def error_xml(details, code):
+    return XML_HEADER + "<error><details>%s</details><errorCode>%d</errorCode><moduleName>core-services</moduleName>" \
+                        "</error>" % (details, code)
+
+
+class NSXRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes each request to a handle_* method by method and path.  Handlers return (status, body, content type) or
+    (status, body, content type, dictionary of extra response headers)
+    """
+    server_version = "NSX-Manager-Stand-In/6.4"
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("POST", r"/api/2\.0/services/auth/token$", "handle_auth_token"),
+        ("POST", r"/api/2\.0/services/ssoconfig$", "handle_ssoconfig"),
+        ("GET", r"/api/2\.0/services/ssoconfig/status$", "handle_ssoconfig_status"),
+        ("PUT", r"/api/2\.0/services/vcconfig$", "handle_vcconfig"),
+        ("GET", r"/api/2\.0/services/vcconfig/status$", "handle_vcconfig_status"),
+        ("POST", r"/api/2\.0/vdn/config/segments$", "handle_create_segments"),
+        ("GET", r"/api/2\.0/vdn/config/segments$", "handle_list_segments"),
+        ("POST", r"/api/2\.0/services/ipam/pools/scope/(?P<scope>[^/]+)$", "handle_create_pool"),
+        ("GET", r"/api/2\.0/services/ipam/pools/scope/(?P<scope>[^/]+)$", "handle_list_pools"),
+        ("GET", r"/api/2\.0/services/ipam/pools/(?P<pool>[^/]+)/ipaddresses$", "handle_list_allocations"),
+        ("POST", r"/api/2\.0/vdn/controller$", "handle_deploy_controller"),
+        ("GET", r"/api/2\.0/vdn/controller$", "handle_list_controllers"),
+        ("GET", r"/api/2\.0/vdn/controller/progress/(?P<job>[^/]+)$", "handle_controller_progress"),
+        ("POST", r"/api/2\.0/nwfabric/configure$", "handle_nwfabric_configure"),
+        ("GET", r"/api/2\.0/nwfabric/status$", "handle_nwfabric_status"),
+        ("GET", r"/api/2\.0/nwfabric/status/child/(?P<parent>[^/]+)$", "handle_nwfabric_child_status"),
+        ("GET", r"/api/2\.0/services/taskservice/job/(?P<job>[^/]+)$", "handle_job"),
+        ("POST", r"/api/2\.0/vdn/scopes$", "handle_create_scope"),
+        ("GET", r"/api/2\.0/vdn/scopes$", "handle_list_scopes"),
+        ("POST", r"/api/2\.0/vdn/scopes/(?P<scope>[^/]+)$", "handle_update_scope"),
+        ("POST", r"/api/2\.0/vdn/scopes/(?P<scope>[^/]+)/virtualwires$", "handle_create_virtualwire"),
+        ("GET", r"/api/2\.0/vdn/scopes/(?P<scope>[^/]+)/virtualwires$", "handle_list_virtualwires"),
+        ("GET", r"/api/2\.0/vdn/virtualwires$", "handle_list_virtualwires"),
+        ("GET", r"/api/4\.0/firewall/globalroot-0/config$", "handle_firewall_config"),
+        ("POST", r"/api/4\.0/firewall/globalroot-0/config/layer3sections$", "handle_create_section"),
+        ("GET", r"/api/4\.0/firewall/globalroot-0/config/layer3sections$", "handle_find_section"),
+        ("GET", r"/api/4\.0/firewall/globalroot-0/config/layer3sections/(?P<section>[^/]+)$", "handle_get_section"),
+        ("PUT", r"/api/4\.0/firewall/globalroot-0/config/layer3sections/(?P<section>[^/]+)$", "handle_update_section"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.served = 0
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        start = time.time()
+        state = self.server.state
+
+        ''' the scripts send the full https://address/path URL as the request path '''
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        if path.startswith("/sim/"):
+            status, reply, content_type = self.handle_sim(method, path)
+            extra_headers = dict()
+        elif not state.authorized(self.headers.get("Authorization")):
+            status, reply, content_type = 403, error_xml("The credentials were incorrect.", 403), "application/xml"
+            extra_headers = dict()
+        else:
+            status, reply, content_type = 404, error_xml("No such API " + method + " " + path, 404), "application/xml"
+            extra_headers = dict()
+            for route_method, pattern, handler in self.routes:
+                match = re.match(pattern, path)
+                if route_method == method and match:
+                    try:
+                        with state.lock:
+                            answer = getattr(self, handler)(body, query, **match.groupdict())
+                        status, reply, content_type = answer[:3]
+                        extra_headers = answer[3] if len(answer) > 3 else dict()
+                    except ElementTree.ParseError as e:
+                        status, reply, content_type = 400, error_xml("Malformed XML: " + str(e), 400), "application/xml"
+                    break
+
+        data = reply.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for header, value in extra_headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+        self.served += 1
+        if not path.startswith("/sim/"):
+            state.record({"time": start, "method": method, "path": path, "query": url.query, "status": status,
+                          "seconds": time.time() - start, "request": body, "response": reply,
+                          "new_connection": self.served == 1, "tls_resumed": self.connection.session_reused})
+
+    ''' stand-in control '''
+
+    def handle_sim(self, method, path):
+        state = self.server.state
+        if method == "GET" and path == "/sim/requests":
+            with state.lock:
+                return 200, json.dumps(state.requests), "application/json"
+        if method == "POST" and path == "/sim/reset":
+            state.reset()
+            return 200, "{}", "application/json"
+        return 404, "{}", "application/json"
+
+    ''' authentication '''
+
+    def handle_auth_token(self, body, query):
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            return 403, error_xml("An auth token can only be issued for user name and password.", 403), \
+                "application/xml"
+        token = base64.b64encode(os.urandom(24)).decode("ascii")
+        self.server.state.tokens.add(token)
+        expires = int((time.time() + 30 * 60) * 1000)
+        return 200, XML_HEADER + "<authToken><value>%s</value><expiresOn>%d</expiresOn></authToken>" % (
+            token, expires), "application/xml"
+
+    ''' registration '''
+
+    def handle_ssoconfig(self, body, query):
+        xml = ElementTree.fromstring(body)
+        self.server.state.sso = text(xml, "ssoLookupServiceUrl")
+        return 200, "", "application/xml"
+
+    def handle_ssoconfig_status(self, body, query):
+        return 200, XML_HEADER + "<boolean>%s</boolean>" % ("true" if self.server.state.sso else "false"), \
+            "application/xml"
+
+    def handle_vcconfig(self, body, query):
+        xml = ElementTree.fromstring(body)
+        self.server.state.vcenter = text(xml, "ipAddress")
+        return 200, "", "application/xml"
+
+    def handle_vcconfig_status(self, body, query):
+        connected = "true" if self.server.state.vcenter else "false"
+        return 200, XML_HEADER + "<vcConfigStatus><connected>%s</connected><lastInventorySyncTime>%d" \
+                                 "</lastInventorySyncTime></vcConfigStatus>" % (connected, time.time() * 1000), \
+            "application/xml"
+
+    ''' segment IDs and IP pools '''
+
+    def handle_create_segments(self, body, query):
+        state = self.server.state
+        xml = ElementTree.fromstring(body)
+        begin, end = int(text(xml, "begin", "0")), int(text(xml, "end", "0"))
+
+        for segment in state.segments:
+            if begin <= segment["end"] and end >= segment["begin"]:
+                return 400, error_xml("Segment range %d-%d overlaps with existing range %s" % (begin, end,
+                                                                                             segment["name"]), 202), \
+                    "application/xml"
+
+        segment = {"id": next(state.ids), "name": text(xml, "name"), "begin": begin, "end": end}
+        state.segments.append(segment)
+        return 201, XML_HEADER + segment_xml(segment), "application/xml"
+
+    def handle_list_segments(self, body, query):
+        return 200, XML_HEADER + "<segmentRanges>%s</segmentRanges>" % "".join(
+            segment_xml(segment) for segment in self.server.state.segments), "application/xml"
+
+    def handle_create_pool(self, body, query, scope):
+        state = self.server.state
+        xml = ElementTree.fromstring(body)
+        name = text(xml, "name")
+
+        if any(pool["name"] == name for pool in state.pools.values()):
+            return 400, error_xml("IP pool %s already exists" % name, 120031), "application/xml"
+
+        pool = {"id": state.next_id("ipaddresspool"), "name": name, "scope": scope,
+                "prefixLength": text(xml, "prefixLength"), "gateway": text(xml, "gateway"),
+                "dnsSuffix": text(xml, "dnsSuffix"),
+                "ranges": [(text(r, "startAddress"), text(r, "endAddress")) for r in xml.iter("ipRangeDto")]}
+        state.pools[pool["id"]] = pool
+        return 201, pool["id"], "text/plain"
+
+    def handle_list_pools(self, body, query, scope):
+        pools = [pool for pool in self.server.state.pools.values() if pool["scope"] == scope]
+        return 200, XML_HEADER + "<ipamAddressPools>%s</ipamAddressPools>" % "".join(pool_xml(pool)
+                                                                                    for pool in pools), \
+            "application/xml"
+
+    def handle_list_allocations(self, body, query, pool):
+        state = self.server.state
+        if pool not in state.pools:
+            return 404, error_xml("IP pool %s not found" % pool, 120030), "application/xml"
+        allocated = "".join("<allocatedIpAddress><id>%d</id><ipAddress>%s</ipAddress><gateway>%s</gateway>"
+                            "<prefixLength>%s</prefixLength><allocationNote>%s</allocationNote>"
+                            "</allocatedIpAddress>" % (n, address, state.pools[pool]["gateway"],
+                                                       state.pools[pool]["prefixLength"], note)
+                            for n, (address, note) in enumerate(state.allocations(pool), 1))
+        return 200, XML_HEADER + "<allocatedIpAddresses>%s</allocatedIpAddresses>" % allocated, "application/xml"
+
+    ''' controllers '''
+
+    def handle_deploy_controller(self, body, query):
+        state = self.server.state
+        xml = ElementTree.fromstring(body)
+
+        if text(xml, "ipPoolId") not in state.pools:
+            return 400, error_xml("IP pool %s not found" % text(xml, "ipPoolId"), 202), "application/xml"
+        if state.controller_busy():
+            return 400, error_xml("Another controller deployment is in progress, try again once it has finished",
+                                  100002), "application/xml"
+        if len(state.controllers) >= 3:
+            return 400, error_xml("A maximum of 3 controllers is supported", 100003), "application/xml"
+
+        job = state.start_job("Controller deployment", state.controller_seconds)
+        controller_id = state.next_id("controller")
+        state.controllers.append({"id": controller_id, "name": text(xml, "name") + "-" + controller_id,
+                                  "job": job.id, "ipPoolId": text(xml, "ipPoolId"),
+                                  "datastoreId": text(xml, "datastoreId"), "vmId": state.next_id("vm")})
+        return 201, job.id, "text/plain"
+
+    def handle_list_controllers(self, body, query):
+        state = self.server.state
+        controllers = ""
+        for controller in state.controllers:
+            status = "RUNNING" if state.jobs[controller["job"]].done() else "DEPLOYING"
+            controllers += "<controller><id>%s</id><name>%s</name><status>%s</status><virtualMachineInfo><objectId>" \
+                           "%s</objectId></virtualMachineInfo><datastoreInfo><objectId>%s</objectId></datastoreInfo>" \
+                           "</controller>" % (controller["id"], controller["name"], status, controller["vmId"],
+                                              controller["datastoreId"])
+        return 200, XML_HEADER + "<controllers>%s</controllers>" % controllers, "application/xml"
+
+    def handle_controller_progress(self, body, query, job):
+        state = self.server.state
+        for controller in state.controllers:
+            if controller["job"] == job:
+                status = "Success" if state.jobs[job].done() else "InProgress"
+                return 200, XML_HEADER + "<controllerDeploymentInfo><vmId>%s</vmId><status>%s</status>" \
+                                         "</controllerDeploymentInfo>" % (controller["vmId"], status), \
+                    "application/xml"
+        return 404, error_xml("Job %s not found" % job, 202), "application/xml"
+
+    ''' host and VXLAN prep '''
+
+    def handle_nwfabric_configure(self, body, query):
+        state = self.server.state
+        xml = ElementTree.fromstring(body)
+        feature = text(xml, "featureId", HOST_PREP_FEATURE)
+        resources = [text(resource, "resourceId") for resource in xml.findall("resourceConfig")]
+        clusters = [resource for resource in resources if resource.startswith("domain-")]
+
+        if feature == VXLAN_FEATURE:
+            for cluster in clusters:
+                if state.feature_status(cluster, HOST_PREP_FEATURE) != "GREEN":
+                    return 400, error_xml("Cluster %s is not prepared for network virtualization" % cluster, 301), \
+                        "application/xml"
+
+        job = state.start_job(feature, state.host_prep_seconds)
+        for cluster in clusters:
+            state.features[(cluster, feature)] = job
+        for resource in xml.findall("resourceConfig"):
+            if text(resource, "configSpec/ipPoolId"):
+                state.vtep_pools[text(resource, "resourceId")] = (text(resource, "configSpec/ipPoolId"),
+                                                                  int(text(resource, "configSpec/vmknicCount", "1")))
+        return 200, job.id, "text/plain"
+
+    def handle_nwfabric_status(self, body, query):
+        state = self.server.state
+        resource = query.get("resource", [""])[0]
+        features = ""
+        for feature in (HOST_PREP_FEATURE, VXLAN_FEATURE):
+            features += "<nwFabricFeatureStatus><featureId>%s</featureId><status>%s</status>" \
+                        "</nwFabricFeatureStatus>" % (feature, state.feature_status(resource, feature))
+        return 200, XML_HEADER + "<resourceStatuses><resourceStatus><resource><objectId>%s</objectId></resource>%s" \
+                                 "</resourceStatus></resourceStatuses>" % (resource, features), "application/xml"
+
+    def handle_nwfabric_child_status(self, body, query, parent):
+        state = self.server.state
+        if not parent.startswith("domain-"):
+            return 400, error_xml("%s is not a cluster" % parent, 202), "application/xml"
+        statuses = ""
+        for host in state.cluster_hosts(parent):
+            features = ""
+            for feature in (HOST_PREP_FEATURE, VXLAN_FEATURE):
+                status = state.host_feature_status(parent, host, feature)
+                message = "Installation of the NSX VIBs failed on %s" % host if status == "RED" else ""
+                features += "<nwFabricFeatureStatus><featureId>%s</featureId><status>%s</status><message>%s</message>" \
+                            "</nwFabricFeatureStatus>" % (feature, status, message)
+            statuses += "<resourceStatus><resource><objectId>%s</objectId><objectTypeName>HostSystem</objectTypeName>" \
+                        "</resource>%s</resourceStatus>" % (host, features)
+        return 200, XML_HEADER + "<resourceStatuses>%s</resourceStatuses>" % statuses, "application/xml"
+
+    def handle_job(self, body, query, job):
+        found = self.server.state.jobs.get(job)
+        if found is None:
+            return 404, error_xml("Job %s not found" % job, 202), "application/xml"
+        status = "COMPLETED" if found.done() else "RUNNING"
+        return 200, XML_HEADER + "<jobInstances><jobInstance><id>jobinstance-%s</id><name>%s</name><status>%s" \
+                                 "</status><jobId>%s</jobId><startTime>%d</startTime></jobInstance></jobInstances>" % (
+                                     job.split("-")[-1], found.name, status, job, found.started * 1000), \
+            "application/xml"
+
+    ''' transport zones '''
+
+    def handle_create_scope(self, body, query):
+        state = self.server.state
+        xml = ElementTree.fromstring(body)
+        name = text(xml, "name")
+        clusters = [text(cluster, "cluster/objectId") for cluster in xml.findall("clusters/cluster")]
+
+        if any(scope["name"] == name for scope in state.scopes.values()):
+            return 400, error_xml("Transport zone %s already exists" % name, 210), "application/xml"
+        for cluster in clusters:
+            if state.feature_status(cluster, VXLAN_FEATURE) != "GREEN":
+                return 400, error_xml("Cluster %s is not configured for VXLAN" % cluster, 301), "application/xml"
+
+        scope = {"id": state.next_id("vdnscope"), "name": name, "clusters": clusters,
+                 "controlPlaneMode": text(xml, "controlPlaneMode", "UNICAST_MODE")}
+        state.scopes[scope["id"]] = scope
+        return 201, scope["id"], "text/plain"
+
+    def handle_update_scope(self, body, query, scope):
+        state = self.server.state
+        if scope not in state.scopes:
+            return 404, error_xml("Transport zone %s not found" % scope, 210), "application/xml"
+        if query.get("action", [""])[0] != "expand":
+            return 400, error_xml("Unsupported action %s" % query.get("action", [""])[0], 210), "application/xml"
+
+        xml = ElementTree.fromstring(body)
+        clusters = [text(cluster, "cluster/objectId") for cluster in xml.findall("clusters/cluster")]
+        for cluster in clusters:
+            if state.feature_status(cluster, VXLAN_FEATURE) != "GREEN":
+                return 400, error_xml("Cluster %s is not configured for VXLAN" % cluster, 301), "application/xml"
+        state.scopes[scope]["clusters"].extend(cluster for cluster in clusters
+                                               if cluster not in state.scopes[scope]["clusters"])
+        return 200, "", "application/xml"
+
+    def handle_list_scopes(self, body, query):
+        scopes = ""
+        for scope in self.server.state.scopes.values():
+            clusters = "".join("<cluster><cluster><objectId>%s</objectId></cluster></cluster>" % cluster
+                               for cluster in scope["clusters"])
+            scopes += "<vdnScope><objectId>%s</objectId><name>%s</name><clusters>%s</clusters><controlPlaneMode>%s" \
+                      "</controlPlaneMode></vdnScope>" % (scope["id"], scope["name"], clusters,
+                                                          scope["controlPlaneMode"])
+        return 200, XML_HEADER + "<vdnScopes>%s</vdnScopes>" % scopes, "application/xml"
+
+    ''' logical switches '''
+
+    def handle_create_virtualwire(self, body, query, scope):
+        state = self.server.state
+        if scope not in state.scopes:
+            return 404, error_xml("Transport zone %s not found" % scope, 210), "application/xml"
+        if random.random() < state.virtualwire_error_rate:
+            if random.random() < 0.5:
+                return 409, error_xml("Transport zone %s was changed by another request" % scope, 220), \
+                    "application/xml"
+            return 503, error_xml("NSX Manager is busy, try again later", 503), "application/xml"
+
+        xml = ElementTree.fromstring(body)
+        name = text(xml, "name")
+        if not name:
+            return 400, error_xml("A logical switch needs a name", 212), "application/xml"
+        vdn_id = state.next_vdn_id()
+        if vdn_id is None:
+            return 400, error_xml("No free segment ID for logical switch %s" % name, 211), "application/xml"
+
+        wire = {"id": state.next_id("virtualwire"), "name": name, "scope": scope, "vdnId": vdn_id,
+                "description": text(xml, "description"), "tenantId": text(xml, "tenantId", "virtual wire tenant"),
+                "controlPlaneMode": text(xml, "controlPlaneMode", state.scopes[scope]["controlPlaneMode"])}
+        state.virtualwires[wire["id"]] = wire
+        return 201, wire["id"], "text/plain"
+
+    def handle_list_virtualwires(self, body, query, scope=None):
+        state = self.server.state
+        if scope is not None and scope not in state.scopes:
+            return 404, error_xml("Transport zone %s not found" % scope, 210), "application/xml"
+
+        wires = [wire for wire in state.virtualwires.values() if scope is None or wire["scope"] == scope]
+        start = int(query.get("startindex", ["0"])[0])
+        size = int(query.get("pagesize", ["20"])[0])
+        paging = "<pagingInfo><pageSize>%d</pageSize><startIndex>%d</startIndex><totalCount>%d</totalCount>" \
+                 "<sortOrderAscending>true</sortOrderAscending></pagingInfo>" % (size, start, len(wires))
+        return 200, XML_HEADER + "<virtualWires><dataPage>%s%s</dataPage></virtualWires>" % (
+            paging, "".join(virtualwire_xml(wire) for wire in wires[start:start + size])), "application/xml"
+
+    ''' distributed firewall '''
+
+    def section_answer(self, status, section):
+        return status, XML_HEADER + section_xml(section), "application/xml", {"ETag": section["generation"]}
+
+    def read_section(self, body):
+        ''' (name, rules) from a section in a request, or an error answer '''
+        xml = ElementTree.fromstring(body)
+        rules = xml.findall("rule")
+        for rule in rules:
+            if text(rule, "action") not in ("allow", "deny", "reject"):
+                return None, None, error_xml("Rule %s has no valid action" % text(rule, "name"), 100)
+            if not rule.get("id"):
+                rule.set("id", str(next(self.server.state.ids)))
+        return xml.get("name"), rules, None
+
+    def handle_firewall_config(self, body, query):
+        state = self.server.state
+        generation = max(section["generation"] for section in state.sections)
+        return 200, XML_HEADER + "<firewallConfiguration><generationNumber>%s</generationNumber><layer3Sections>%s" \
+                                 "</layer3Sections></firewallConfiguration>" % (
+                                     generation, "".join(section_xml(section) for section in state.sections)), \
+            "application/xml", {"ETag": generation}
+
+    def handle_create_section(self, body, query):
+        state = self.server.state
+        name, rules, error = self.read_section(body)
+        if error is None and not name:
+            error = error_xml("A section needs a name", 100)
+        if error is None and any(section["name"] == name for section in state.sections):
+            error = error_xml("Section %s already exists" % name, 100)
+        if error is not None:
+            return 400, error, "application/xml"
+
+        section = {"id": next(state.ids) + 1001, "name": name, "generation": state.next_generation(), "rules": rules}
+        state.sections.insert(0, section)
+        return self.section_answer(201, section)
+
+    def handle_find_section(self, body, query):
+        name = query.get("name", [""])[0]
+        for section in self.server.state.sections:
+            if section["name"] == name:
+                return self.section_answer(200, section)
+        return 404, error_xml("No section called %s" % name, 100), "application/xml"
+
+    def handle_get_section(self, body, query, section):
+        found = self.server.state.find_section(section)
+        if found is None:
+            return 404, error_xml("Section %s not found" % section, 100), "application/xml"
+        return self.section_answer(200, found)
+
+    def handle_update_section(self, body, query, section):
+        state = self.server.state
+        found = state.find_section(section)
+        if found is None:
+            return 404, error_xml("Section %s not found" % section, 100), "application/xml"
+        if_match = (self.headers.get("If-Match") or "").strip('"')
+        if if_match != found["generation"]:
+            return 412, error_xml("If-Match %s does not match the section's generation number %s" % (
+                if_match or "(none)", found["generation"]), 100), "application/xml"
+
+        name, rules, error = self.read_section(body)
+        if error is not None:
+            return 400, error, "application/xml"
+        found.update(name=name or found["name"], rules=rules, generation=state.next_generation())
+        return self.section_answer(200, found)
+
+
+def section_xml(section):
+    return '<section id="%s" name="%s" generationNumber="%s">%s</section>' % (
+        section["id"], escape(section["name"], {'"': "&quot;"}), section["generation"],
+        "".join(ElementTree.tostring(rule, encoding="unicode") for rule in section["rules"]))
+
+
+def segment_xml(segment):
+    return "<segmentRange><id>%d</id><name>%s</name><begin>%d</begin><end>%d</end></segmentRange>" % (
+        segment["id"], segment["name"], segment["begin"], segment["end"])
+
+
+def pool_xml(pool):
+    ranges = "".join("<ipRangeDto><startAddress>%s</startAddress><endAddress>%s</endAddress></ipRangeDto>" % r
+                     for r in pool["ranges"])
+    return "<ipamAddressPool><objectId>%s</objectId><name>%s</name><prefixLength>%s</prefixLength><gateway>%s" \
+           "</gateway><dnsSuffix>%s</dnsSuffix><ipRanges>%s</ipRanges></ipamAddressPool>" % (
+               pool["id"], pool["name"], pool["prefixLength"], pool["gateway"], pool["dnsSuffix"], ranges)
+
+
+def virtualwire_xml(wire):
+    return "<virtualWire><objectId>%s</objectId><name>%s</name><description>%s</description><tenantId>%s</tenantId>" \
+           "<vdnScopeId>%s</vdnScopeId><vdnId>%d</vdnId><controlPlaneMode>%s</controlPlaneMode></virtualWire>" % (
+               wire["id"], escape(wire["name"]), escape(wire["description"]), escape(wire["tenantId"]), wire["scope"],
+               wire["vdnId"], wire["controlPlaneMode"])
+
+
+def self_signed_certificate(directory):
+    """
+    Generate a throwaway self-signed certificate and key with the openssl command.
+    Returns (certfile, keyfile)
+    """
+    certfile = os.path.join(directory, "nsx_sim.crt")
+    keyfile = os.path.join(directory, "nsx_sim.key")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30", "-subj",
+                    "/CN=nsxmanager.sim.local", "-keyout", keyfile, "-out", certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+class NSXServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer with a listen backlog big enough for a client opening a whole pool of connections at once.
+    The default of 5 drops the rest of the connection attempts, which then wait a second to try again
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(state, address="127.0.0.1", port=8443, certfile=None, keyfile=None):
+    """
+    Build the HTTPS server for state.  Port 0 picks a free port, see server.server_address.
+    """
+    if certfile is None:
+        certfile, keyfile = self_signed_certificate(tempfile.mkdtemp(prefix="nsx_sim_"))
+
+    server = NSXServer((address, port), NSXRequestHandler)
+    server.state = state
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    return server
+
+
+def start_server(state, address="127.0.0.1", port=0, certfile=None, keyfile=None):
+    """
+    Start the stand-in on a background thread, for benchmarks that drive it in-process.
+    Returns the server, its address is "%s:%d" % server.server_address[:2].  Stop it with server.shutdown()
+    """
+    server = make_server(state, address, port, certfile, keyfile)
+    thread = threading.Thread(target=server.serve_forever, name="nsx-sim", daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Pre-flight checks for deploy_nsx_manager.py, configure_nsx_manager.py and configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Everything a run depends on is checked before it changes anything, so a typo in a cluster or datastore name turns up in
+a few seconds instead of after the registrations and IP pools are already done.  vCenter is connected to, NSX Manager
+is logged in to and any extra checks a script has (a reachable Lookup Service, a readable OVA) run at the same time.
+Then every inventory object named in the arguments is looked up in the datacenter with one batched PropertyCollector
+read.  Every problem found is reported together rather than one at a time.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyvim.connect import SmartConnectNoSSL
+from pyVmomi import vim
+
+import tracing
+
+from vsphere_util import collect_properties
+
+''' how each kind of inventory object is named in the problems found '''
+KINDS = [(vim.ClusterComputeResource, "cluster"),
+         (vim.Datastore, "datastore"),
+         (vim.DistributedVirtualSwitch, "distributed switch"),
+         (vim.Network, "network"),
+         (vim.VirtualMachine, "VM")]
+
+
+def kind_of(vim_type):
+    return dict(KINDS).get(vim_type, getattr(vim_type, "__name__", str(vim_type)))
+
+
+def connect_vcenter(host, user, password, port=443):
+    """
+    Log in to vCenter, with the session's calls traced if tracing is on.  Raises an Exception saying why if it can't
+    """
+    try:
+        return tracing.trace_vsphere(SmartConnectNoSSL(host=host, user=user, pwd=password, port=port))
+    except vim.fault.InvalidLogin:
+        raise Exception("vCenter %s rejected the credentials for %s" % (host, user))
+    except Exception as e:
+        raise Exception("Unable to connect to vCenter %s: %s" % (host, e))
+
+
+def check_nsx_manager(nsx, timeout=10):
+    """
+    Log in to NSX Manager and read its vCenter registration, which needs working credentials.
+    Raises an Exception saying why if it can't
+    """
+    try:
+        status, body = nsx.request('GET', '/api/2.0/services/vcconfig/status', timeout=timeout)
+    except Exception as e:
+        raise Exception("Unable to connect to NSX Manager %s: %s" % (nsx.address, e))
+    if status in (401, 403):
+        raise Exception("NSX Manager %s rejected the credentials for %s" % (nsx.address, nsx.username))
+    if status != 200:
+        raise Exception("NSX Manager %s answered %d to a status check" % (nsx.address, status))
+
+
+def find_datacenter(si, name=None):
+    """
+    The datacenter called name, or the first one if no name is given.  Raises an Exception if there isn't one
+    """
+    datacenters = [entity for entity in si.content.rootFolder.childEntity if isinstance(entity, vim.Datacenter)]
+    for dc in datacenters:
+        if name is None or dc.name == name:
+            return dc
+    if name is None:
+        raise Exception("vCenter has no datacenter")
+    raise Exception("-datacenter: no datacenter called %s.  There is %s" % (
+        name, ", ".join(dc.name for dc in datacenters) or "none"))
+
+
+def resolve_names(si, dc, wanted):
+    """
+    Look up every named object in dc with one batched read.
+    wanted is a list of (argument, vim type, name), the argument being what the name came from.
+    Returns (dictionary of (vim type, name) to object, list of problems)
+    """
+    vim_types = list(dict.fromkeys(vim_type for _, vim_type, _ in wanted))
+    if not vim_types:
+        return dict(), []
+
+    by_name = dict()
+    for obj, props in collect_properties(si, vim_types, ["name"], dc):
+        for vim_type in vim_types:
+            if isinstance(obj, vim_type):
+                by_name.setdefault((vim_type, props.get("name")), []).append(obj)
+
+    found, problems = dict(), []
+    for argument, vim_type, name in wanted:
+        matches = by_name.get((vim_type, name), [])
+        if not matches:
+            problems.append("%s: no %s called %s in datacenter %s" % (argument, kind_of(vim_type), name, dc.name))
+        elif len(matches) > 1:
+            problems.append("%s: %d %ss are called %s in datacenter %s" % (argument, len(matches), kind_of(vim_type),
+                                                                           name, dc.name))
+        else:
+            found[(vim_type, name)] = matches[0]
+    return found, problems
+
+
+def run_preflight(host, user, password, port=443, datacenter=None, wanted=(), nsx=None, checks=(), timeout=10):
+    """
+    Connect to vCenter, check NSX Manager (if nsx is given) and run checks, a list of (description, function) where
+    the function raises if the check fails, all at the same time.  Then look up the datacenter and everything in
+    wanted (see resolve_names) in it.
+    Returns (si or None, dc or None, dictionary of (vim type, name) to object, list of problems)
+    """
+    problems = []
+
+    with ThreadPoolExecutor(max_workers=2 + len(checks)) as executor:
+        vcenter = executor.submit(tracing.wrap(connect_vcenter), host, user, password, port)
+        nsx_check = executor.submit(tracing.wrap(check_nsx_manager), nsx, timeout) if nsx is not None else None
+        check_futures = [(description, executor.submit(tracing.wrap(function))) for description, function in checks]
+
+        ''' the inventory lookups only need vCenter, so they go ahead while the other checks are still running '''
+        si, dc, found = None, None, dict()
+        try:
+            si = vcenter.result()
+            dc = find_datacenter(si, datacenter)
+            found, name_problems = resolve_names(si, dc, wanted)
+            problems += name_problems
+        except Exception as e:
+            problems.append(str(e))
+
+    if nsx_check is not None and nsx_check.exception() is not None:
+        problems.append(str(nsx_check.exception()))
+    for description, future in check_futures:
+        if future.exception() is not None:
+            problems.append("%s: %s" % (description, future.exception()))
+
+    return si, dc, found, problems
+
+
+def print_problems(problems):
+    print("Pre-flight found %d problem(s), nothing has been changed:" % len(problems))
+    for problem in problems:
+        print("  " + problem)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""
+Bulk VM network remap for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Moves every VM NIC that is connected to one of the "old" port groups onto the matching "new" port group.  Affected VMs
+are found with a single property fetch over the whole inventory, each VM gets exactly one ReconfigVM_Task carrying all
+of its NIC changes, and the reconfigs are run with a bounded number of tasks in flight.  A throughput report is printed
+at the end.
+
+A distributed port group can also be named as "switch/port group", which is needed when more than one switch has a
+port group of that name.  A plain name that more than one network goes by is refused rather than guessed at.
+
+Arguments
+---------
+-s [vcenter FQDN or IP]
+-u [vcenter administrator username - usually administrator@vsphere.local]
+-p [vcenter administrator password]
+-S [tells it to ignore SSL errors, you probably want this]
+-map [comma separated list of old=new port group names, each either a name or switch/port group]
+-map_file [JSON file containing a {"old port group": "new port group"} dictionary, used in addition to -map]
+-max_in_flight [maximum number of ReconfigVM tasks outstanding at once, defaults to 16]
+-dry_run [only report what would be changed]
+
+Example with parameters:
+python3 ./remap_vm_networks.py -s vcsa.local -u administrator@vsphere.local -p Password@123 -S -map VM_Network_1=VM_Network,Tenant_A_Old=Tenant_A -max_in_flight 32
+"""
+
+import atexit
+import argparse
+import json
+import time
+
+from pyvim.connect import SmartConnectNoSSL, Disconnect
+from pyVmomi import vim, vmodl
+
+from vsphere_util import collect_properties, run_tasks_bounded
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to remap VM networks')
+
+    # because -h is reserved for 'help' we use -s for service
+    parser.add_argument('-s', '--host',
+                        required=True,
+                        action='store',
+                        help='vSphere service to connect to')
+
+    # because we want -p for password, we use -o for port
+    parser.add_argument('-o', '--port',
+                        type=int,
+                        default=443,
+                        action='store',
+                        help='Port to connect on')
+
+    parser.add_argument('-u', '--user',
+                        required=True,
+                        action='store',
+                        help='User name to use when connecting to host')
+
+    parser.add_argument('-p', '--password',
+                        required=True,
+                        action='store',
+                        help='Password to use when connecting to host')
+
+    parser.add_argument('-S', '--disable_ssl_verification',
+                        required=False,
+                        action='store_true',
+                        help='Disable ssl host certificate verification')
+
+    parser.add_argument('-map', '--map',
+                        help='comma separated list of old=new port group names, each a name or switch/port group')
+    parser.add_argument('-map_file', '--map_file',
+                        help='JSON file containing a dictionary of old port group name -> new port group name')
+    parser.add_argument('-max_in_flight', '--max_in_flight',
+                        type=int,
+                        default=16,
+                        help='maximum number of ReconfigVM tasks outstanding at once')
+    parser.add_argument('-dry_run', '--dry_run',
+                        action='store_true',
+                        help='only report the VMs and NICs that would be changed')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    mapping = parse_mapping(args.map, args.map_file)
+    if not mapping:
+        print("No port group mapping supplied.  Use -map and/or -map_file.")
+        return 1
+
+    try:
+        si = SmartConnectNoSSL(host=args.host,
+                               user=args.user,
+                               pwd=args.password,
+                               port=args.port)
+        atexit.register(Disconnect, si)
+    except:
+        print("Unable to connect to %s" % args.host)
+        return 1
+
+    try:
+        report = remap_vm_networks(si, mapping, args.max_in_flight, args.dry_run)
+    except Exception as e:
+        print(e)
+        return 1
+
+    print_throughput_report(report)
+
+    if report["failed"]:
+        return 1
+    return 0
+
+
+def parse_mapping(map_string, map_file):
+    """
+    Build the old -> new port group dictionary from the -map string and/or the -map_file JSON file
+    """
+    mapping = dict()
+
+    if map_file:
+        with open(map_file) as f:
+            mapping.update(json.load(f))
+
+    if map_string:
+        for pair in map_string.split(","):
+            old, new = pair.split("=", 1)
+            mapping[old.strip()] = new.strip()
+
+    return mapping
+
+
+def get_network_index(si):
+    """
+    Read every network in one pass per network type.
+    Returns a dictionary of network name -> list of (network, portgroup key, switch uuid), one for each network that
+    goes by that name.  Distributed port groups are under their own name and under "switch/port group".  Standard
+    networks have no key or switch uuid.
+    """
+    switches = dict((dvs, (props.get("uuid"), props.get("name")))
+                    for dvs, props in collect_properties(si, vim.DistributedVirtualSwitch, ["uuid", "name"]))
+
+    index = dict()
+
+    for network, props in collect_properties(si, vim.Network, ["name"]):
+        if not isinstance(network, vim.dvs.DistributedVirtualPortgroup):
+            index.setdefault(props["name"], []).append((network, None, None))
+
+    for portgroup, props in collect_properties(si, vim.dvs.DistributedVirtualPortgroup,
+                                               ["name", "key", "config.distributedVirtualSwitch"]):
+        switch_uuid, switch_name = switches.get(props["config.distributedVirtualSwitch"], (None, None))
+        entry = (portgroup, props["key"], switch_uuid)
+        index.setdefault(props["name"], []).append(entry)
+        index.setdefault("%s/%s" % (switch_name, props["name"]), []).append(entry)
+
+    return index
+
+
+def check_mapping(mapping, index):
+    """
+    Raise an Exception if a new port group in mapping doesn't exist, or if any name in it is used by more than one
+    network
+    """
+    missing = [name for name in mapping.values() if name not in index]
+    if missing:
+        raise Exception("Target port group(s) not found: %s" % ", ".join(missing))
+
+    ambiguous = sorted(set(name for pair in mapping.items() for name in pair if len(index.get(name, [])) > 1))
+    if ambiguous:
+        raise Exception("More than one network is called %s, name them as switch/port group instead" %
+                        ", ".join(ambiguous))
+
+
+def nic_network_names(device, port_names):
+    """
+    Names the network a virtual NIC is currently connected to goes by, switch/port group first, empty if they can't
+    be worked out
+    """
+    backing = device.backing
+
+    if isinstance(backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo):
+        return port_names.get((backing.port.switchUuid, backing.port.portgroupKey), [])
+
+    if isinstance(backing, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo):
+        return [backing.deviceName]
+
+    return []
+
+
+def build_nic_backing(target):
+    """
+    Backing for a virtual NIC that connects it to the given network index entry
+    """
+    network, portgroup_key, switch_uuid = target
+
+    if portgroup_key is None:
+        backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+        backing.network = network
+        backing.deviceName = network.name
+        return backing
+
+    backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+    backing.port = vim.dvs.PortConnection()
+    backing.port.portgroupKey = portgroup_key
+    backing.port.switchUuid = switch_uuid
+    return backing
+
+
+def find_affected_vms(si, mapping, index):
+    """
+    Find every VM with at least one NIC on an old port group, using a single property fetch over all VMs.
+    Returns a list of (vm, vm name, ConfigSpec) with one spec per VM covering all of its NICs.
+    """
+    port_names = dict()
+    for name, entries in index.items():
+        for network, key, uuid in entries:
+            if key is not None:
+                port_names.setdefault((uuid, key), []).append(name)
+    for names in port_names.values():
+        names.sort(key=lambda name: "/" not in name)
+    affected = []
+
+    for vm, props in collect_properties(si, vim.VirtualMachine, ["name", "config.hardware.device"]):
+        device_change = []
+
+        for device in props.get("config.hardware.device") or []:
+            if not isinstance(device, vim.vm.device.VirtualEthernetCard):
+                continue
+
+            current = next((name for name in nic_network_names(device, port_names) if name in mapping), None)
+            if current is None:
+                continue
+
+            nicspec = vim.vm.device.VirtualDeviceSpec()
+            nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+            nicspec.device = device
+            nicspec.device.backing = build_nic_backing(index[mapping[current]][0])
+            device_change.append(nicspec)
+
+        if device_change:
+            affected.append((vm, props["name"], vim.vm.ConfigSpec(deviceChange=device_change)))
+
+    return affected
+
+
+def remap_vm_networks(si, mapping, max_in_flight=16, dry_run=False):
+    """
+    Move every VM NIC on an old port group in mapping to the matching new port group.
+    Returns a report dictionary used by print_throughput_report()
+    """
+    start = time.time()
+
+    index = get_network_index(si)
+    check_mapping(mapping, index)
+
+    affected = find_affected_vms(si, mapping, index)
+    discovery_seconds = time.time() - start
+
+    report = {"vms": len(affected),
+              "nics": sum(len(spec.deviceChange) for vm, name, spec in affected),
+              "discovery_seconds": discovery_seconds,
+              "reconfig_seconds": 0.0,
+              "results": [],
+              "failed": []}
+
+    print("Found %d VMs with %d NICs to remap in %.1f seconds" % (report["vms"], report["nics"], discovery_seconds))
+
+    if dry_run:
+        for vm, name, spec in affected:
+            print("Would remap %d NIC(s) on %s" % (len(spec.deviceChange), name))
+        return report
+
+    jobs = [(name, lambda vm=vm, spec=spec: vm.ReconfigVM_Task(spec)) for vm, name, spec in affected]
+
+    reconfig_start = time.time()
+    results = run_tasks_bounded(si, jobs, max_in_flight)
+    report["reconfig_seconds"] = time.time() - reconfig_start
+    report["results"] = results
+
+    for name, state, error, seconds in results:
+        if state == vim.TaskInfo.State.error:
+            msg = error.msg if isinstance(error, vmodl.MethodFault) else str(error)
+            report["failed"].append((name, msg))
+            print("Failed to remap", name + ":", msg)
+
+    return report
+
+
+def print_throughput_report(report):
+    durations = [seconds for name, state, error, seconds in report["results"]]
+    elapsed = report["reconfig_seconds"]
+
+    print("")
+    print("VM network remap summary")
+    print("------------------------")
+    print("VMs affected:        %d" % report["vms"])
+    print("NICs remapped:       %d" % report["nics"])
+    print("VMs failed:          %d" % len(report["failed"]))
+    print("Discovery time:      %.1f s" % report["discovery_seconds"])
+    print("Reconfigure time:    %.1f s" % elapsed)
+
+    if durations:
+        print("VMs per second:      %.2f" % (len(durations) / elapsed if elapsed else 0.0))
+        print("Task time mean/max:  %.1f s / %.1f s" % (sum(durations) / len(durations), max(durations)))
+
+
+if __name__ == "__main__":
+    exit(main())
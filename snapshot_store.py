@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+
+"""
+Inventory snapshot store for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Captures the vSphere and NSX objects the scripts work with into an indexed SQLite file, so audits, pre-flight checks
+and before/after comparisons are queries against the file instead of walks of the live inventory:
+
+    vSphere  clusters, hosts, distributed switches, port groups (distributed and standard), datastores and VMs of the
+             datacenter, one bulk PropertyCollector read per kind
+    NSX      what nsx_export.py exports: virtualwires, controllers, IP pool allocations, host prep status and DFW
+             rules, streamed straight into the file
+
+Both sides are read at the same time and written in one transaction.  Each object is a row of (snapshot, source,
+kind, object ID, name, parent, data) with data the rest of the object as JSON with sorted keys, so comparing two
+snapshots is a join on (kind, object ID) and a comparison of data.  Objects are indexed by name and by parent within
+each snapshot.
+
+With -label (or none, which labels the snapshot with the time) and a vCenter and/or NSX Manager to read from, a
+snapshot is captured.  -list, -diff and -find query the file and touch nothing else.
+
+Arguments
+---------
+-db [SQLite file the snapshots are kept in]
+-label [label of the snapshot to capture, or to -find in, defaults to the time it is taken / the latest snapshot]
+-s [vCenter to capture from]
+-o [vCenter port, defaults to 443]
+-u [vCenter user]
+-p [vCenter password]
+-d [datacenter to capture, defaults to the first]
+-nsx_manager_address [FQDN or IP of NSX Manager to capture from, optionally with :port]
+-nsx_manager_username [NSX admin account]
+-nsx_manager_password [password of the NSX admin account]
+-nsx_objects [comma separated kinds of NSX object to capture, defaults to all that nsx_export.py knows]
+-max_in_flight [most NSX pages or pools fetched at the same time, defaults to 8]
+-nsx_request_timeout [seconds to wait for each NSX Manager request, defaults to 120]
+-list [list the snapshots in the file]
+-diff [two snapshot labels, old and new, to print what was added, removed and changed between them]
+-find [a kind and a name, e.g. -find host esxi-001.hci.local, to print the matching objects]
+
+Example with parameters:
+python3 ./snapshot_store.py -db inventory.db -label before -s vcenter.vmwpc.local -u administrator@vsphere.local -p NetApp123! -nsx_manager_address nsxmanager1.vmwpc.local -nsx_manager_username admin -nsx_manager_password NetApp123!NetApp123!
+python3 ./snapshot_store.py -db inventory.db -diff before after
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+import tracing
+
+from nsx_client import NSXClient
+from nsx_export import EXPORTERS
+from preflight import connect_vcenter, find_datacenter
+from vsphere_util import collect_properties
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL UNIQUE,
+    taken REAL NOT NULL,
+    vcenter TEXT,
+    nsx_manager TEXT,
+    seconds REAL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    snapshot INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    name TEXT,
+    parent TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (snapshot, kind, object_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS objects_by_name ON objects (snapshot, kind, name);
+CREATE INDEX IF NOT EXISTS objects_by_parent ON objects (snapshot, kind, parent);
+"""
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to capture and compare snapshots of the vSphere and NSX inventory')
+
+    parser.add_argument('-db', '--db',
+                        required=True,
+                        help='SQLite file the snapshots are kept in')
+    parser.add_argument('-label', '--label',
+                        help='label of the snapshot to capture, or to -find in')
+    parser.add_argument('-s', '--host',
+                        help='vCenter to capture from')
+    parser.add_argument('-o', '--port',
+                        type=int,
+                        default=443,
+                        help='vCenter port')
+    parser.add_argument('-u', '--user',
+                        help='vCenter user')
+    parser.add_argument('-p', '--password',
+                        help='vCenter password')
+    parser.add_argument('-d', '--datacenter',
+                        help='Name of datacenter to capture. Defaults to first.')
+    parser.add_argument('-nsx_manager_address', '--nsx_manager_address',
+                        help='FQDN or IP of NSX Manager to capture from')
+    parser.add_argument('-nsx_manager_username', '--nsx_manager_username',
+                        help='An account in the NSX manager database that has admin rights')
+    parser.add_argument('-nsx_manager_password', '--nsx_manager_password',
+                        help='Password for the aforementioned NSX admin account')
+    parser.add_argument('-nsx_objects', '--nsx_objects',
+                        default=",".join(EXPORTERS),
+                        help='comma separated kinds of NSX object to capture: ' + ", ".join(EXPORTERS))
+    parser.add_argument('-max_in_flight', '--max_in_flight',
+                        type=int,
+                        default=8,
+                        help='most NSX pages or pools fetched at the same time')
+    parser.add_argument('-nsx_request_timeout', '--nsx_request_timeout',
+                        type=float,
+                        default=120,
+                        help='seconds to wait for each NSX Manager request')
+    parser.add_argument('-list', '--list',
+                        action='store_true',
+                        help='list the snapshots in the file')
+    parser.add_argument('-diff', '--diff',
+                        nargs=2,
+                        metavar=('OLD', 'NEW'),
+                        help='print what was added, removed and changed between two snapshots')
+    parser.add_argument('-find', '--find',
+                        nargs=2,
+                        metavar=('KIND', 'NAME'),
+                        help='print the objects of a kind with a name')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    store = SnapshotStore(args.db)
+    si = nsx = None
+    try:
+        if args.list:
+            for label, taken, vcenter, nsx_manager, seconds, objects in store.snapshots():
+                print("%s  taken %s in %.1f s, %d object(s) from %s" % (
+                    label, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(taken)), seconds or 0, objects,
+                    " and ".join(source for source in (vcenter, nsx_manager) if source) or "nowhere"))
+        elif args.diff:
+            changes = store.diff(*args.diff)
+            for change, kind, object_id, name, fields in changes:
+                print("%s %s %s (%s)" % ({"added": "+", "removed": "-", "changed": "~"}[change], kind, name,
+                                         object_id))
+                for field, old, new in fields:
+                    print("    %s: %s -> %s" % (field, json.dumps(old), json.dumps(new)))
+            print("%d change(s) from %s to %s" % (len(changes), args.diff[0], args.diff[1]))
+        elif args.find:
+            found = store.find(args.label, *args.find)
+            for object_id, parent, data in found:
+                print("%s %s (%s)%s: %s" % (args.find[0], args.find[1], object_id,
+                                            " in " + parent if parent else "", json.dumps(data)))
+            if not found:
+                print("No %s called %s" % tuple(args.find))
+                return 1
+        else:
+            if not args.host and not args.nsx_manager_address:
+                print("Nothing to capture from, give a vCenter (-s, -u, -p) and/or an NSX Manager "
+                      "(-nsx_manager_address, -nsx_manager_username, -nsx_manager_password)")
+                return 1
+            dc = None
+            if args.host:
+                si = connect_vcenter(args.host, args.user, args.password, args.port)
+                dc = find_datacenter(si, args.datacenter)
+            if args.nsx_manager_address:
+                nsx = NSXClient(args.nsx_manager_address, args.nsx_manager_username, args.nsx_manager_password,
+                                pool_size=max(1, args.max_in_flight), timeout=args.nsx_request_timeout)
+            label = args.label or time.strftime("%Y-%m-%d %H:%M:%S")
+            counts, seconds = store.capture(label, si, dc, nsx, [kind for kind in args.nsx_objects.split(",") if kind],
+                                            max_in_flight=args.max_in_flight, vcenter=args.host)
+            for kind, count in counts.items():
+                print("  %-16s %d" % (kind, count))
+            print("Snapshot %s: %d object(s) captured in %.1f s" % (label, sum(counts.values()), seconds))
+    except Exception as e:
+        print(e)
+        return 1
+    finally:
+        if nsx is not None:
+            nsx.close()
+        store.close()
+
+    return 0
+
+
+''' reading the vSphere inventory '''
+
+
+def moid(obj):
+    return getattr(obj, "_moId", None) if obj is not None else None
+
+
+def host_data(props):
+    vmks = []
+    for vnic in props.get("config.network.vnic") or []:
+        spec = vnic.spec
+        port = getattr(spec, "distributedVirtualPort", None)
+        vmks.append(OrderedDict([("device", vnic.device),
+                                 ("ip", getattr(getattr(spec, "ip", None), "ipAddress", None)),
+                                 ("portgroup", vnic.portgroup or None),
+                                 ("portgroupKey", getattr(port, "portgroupKey", None))]))
+    return {"connectionState": str(props.get("runtime.connectionState") or "") or None,
+            "inMaintenanceMode": props.get("runtime.inMaintenanceMode"),
+            "switches": sorted(proxy.dvsName for proxy in props.get("config.network.proxySwitch") or []),
+            "vmks": vmks}
+
+
+def vm_data(props):
+    networks = []
+    for device in props.get("config.hardware.device") or []:
+        if isinstance(device, vim.vm.device.VirtualEthernetCard):
+            port = getattr(device.backing, "port", None)
+            networks.append(port.portgroupKey if port is not None else getattr(device.backing, "deviceName", None))
+    return {"powerState": str(props.get("runtime.powerState") or "") or None,
+            "networks": networks,
+            "datastores": sorted(moid(datastore) for datastore in props.get("datastore") or [])}
+
+
+def portgroup_data(props):
+    port_config = props.get("config.defaultPortConfig")
+    return {"key": props.get("key"),
+            "vlan": getattr(getattr(port_config, "vlan", None), "vlanId", None),
+            "uplink": bool(props.get("config.uplink"))}
+
+
+''' each kind of vSphere object: (kind, vim type, property paths, function of (object, properties) returning the
+    parent's ID and the data kept) '''
+VSPHERE_KINDS = [
+    ("cluster", vim.ClusterComputeResource, ["name", "host", "datastore"],
+     lambda obj, props: (None, {"hosts": [moid(host) for host in props.get("host") or []],
+                                "datastores": sorted(moid(ds) for ds in props.get("datastore") or [])})),
+    ("host", vim.HostSystem, ["name", "runtime.connectionState", "runtime.inMaintenanceMode",
+                              "config.network.proxySwitch", "config.network.vnic"],
+     lambda obj, props: (None, host_data(props))),
+    ("switch", vim.DistributedVirtualSwitch, ["name", "uuid", "config.host"],
+     lambda obj, props: (None, {"uuid": props.get("uuid"),
+                                "hosts": sorted(moid(member.config.host)
+                                                for member in props.get("config.host") or [])})),
+    ("portgroup", vim.dvs.DistributedVirtualPortgroup, ["name", "key", "config.distributedVirtualSwitch",
+                                                        "config.defaultPortConfig", "config.uplink"],
+     lambda obj, props: (moid(props.get("config.distributedVirtualSwitch")), portgroup_data(props))),
+    ("network", vim.Network, ["name"],
+     lambda obj, props: (None, {})),
+    ("datastore", vim.Datastore, ["name", "summary.type", "summary.capacity", "summary.freeSpace",
+                                  "summary.accessible"],
+     lambda obj, props: (None, {"type": props.get("summary.type"), "capacity": props.get("summary.capacity"),
+                                "freeSpace": props.get("summary.freeSpace"),
+                                "accessible": props.get("summary.accessible")})),
+    ("vm", vim.VirtualMachine, ["name", "runtime.host", "runtime.powerState", "config.hardware.device", "datastore"],
+     lambda obj, props: (moid(props.get("runtime.host")), vm_data(props))),
+]
+
+
+def vsphere_rows(si, dc):
+    """
+    Read every kind of VSPHERE_KINDS in dc, one bulk read per kind.
+    Returns a list of (kind, object ID, name, parent ID, data)
+    """
+    rows, cluster_of = [], dict()
+    for kind, vim_type, path_set, describe in VSPHERE_KINDS:
+        for obj, props in collect_properties(si, vim_type, path_set, dc):
+            ''' a distributed port group is a network too, it is only kept as a port group '''
+            if kind == "network" and isinstance(obj, vim.dvs.DistributedVirtualPortgroup):
+                continue
+            parent, data = describe(obj, props)
+            if kind == "cluster":
+                cluster_of.update((host, moid(obj)) for host in data["hosts"])
+            elif kind == "host":
+                parent = cluster_of.get(moid(obj))
+            rows.append((kind, moid(obj), props.get("name"), parent, data))
+    return rows
+
+
+''' reading NSX: how each kind of nsx_export.py record is keyed, a function of the record returning (object ID, name,
+    parent ID) '''
+NSX_KEYS = {
+    "virtualwire": lambda r: (r.get("objectId"), r.get("name"), r.get("vdnScopeId")),
+    "controller": lambda r: (r.get("id"), r.get("name"), None),
+    "ip_allocation": lambda r: ("%s/%s" % (r.get("poolId"), r.get("ipAddress")), r.get("ipAddress"), r.get("poolId")),
+    "host_prep": lambda r: ("%s/%s" % (r.get("host"), r.get("featureId")), r.get("host"), r.get("cluster")),
+    "dfw_rule": lambda r: (r.get("id"), r.get("name"), r.get("sectionId")),
+}
+
+
+def nsx_rows(nsx, kinds, max_in_flight=8):
+    """
+    Yield (kind, object ID, name, parent ID, record) for every NSX object of the nsx_export.py kinds given, as it is
+    read
+    """
+    for kind in kinds:
+        if kind not in EXPORTERS:
+            raise Exception("Unknown NSX object kind %s, choose from %s" % (kind, ", ".join(EXPORTERS)))
+    for kind in kinds:
+        for record_kind, record in EXPORTERS[kind](nsx, None, 1000, max_in_flight):
+            object_id, name, parent = NSX_KEYS[record_kind](record)
+            yield record_kind, object_id, name, parent, record
+
+
+class SnapshotStore(object):
+    """
+    SQLite file of labelled inventory snapshots
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def capture(self, label, si=None, dc=None, nsx=None, nsx_kinds=tuple(EXPORTERS), max_in_flight=8,
+                vcenter=None):
+        """
+        Capture a snapshot called label of dc (if si is given) and of NSX Manager (if nsx is given).  The vSphere
+        inventory is read in the background while NSX objects are written as they arrive, then everything is committed
+        together, so a capture that fails leaves nothing behind.
+        Returns (OrderedDict of kind to number of objects captured, seconds taken)
+        """
+        if self.db.execute("SELECT 1 FROM snapshots WHERE label = ?", (label,)).fetchone():
+            raise Exception("There is already a snapshot called %s in %s" % (label, self.path))
+
+        start = time.time()
+        counts = OrderedDict()
+
+        def insert(source, rows):
+            for kind, object_id, name, parent, data in rows:
+                counts[kind] = counts.get(kind, 0) + 1
+                yield (snapshot, source, kind, object_id, name, parent, json.dumps(data, sort_keys=True))
+
+        with ThreadPoolExecutor(max_workers=1) as executor, self.db:
+            vsphere = executor.submit(tracing.wrap(vsphere_rows), si, dc) if si is not None else None
+            snapshot = self.db.execute("INSERT INTO snapshots (label, taken, vcenter, nsx_manager) VALUES (?, ?, ?, ?)",
+                                       (label, start, vcenter if si is not None else None,
+                                        nsx.address if nsx is not None else None)).lastrowid
+            ''' the same object can turn up twice when it moves between pages during a walk, the last one read wins '''
+            sql = "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)"
+            if nsx is not None:
+                self.db.executemany(sql, insert("nsx", nsx_rows(nsx, nsx_kinds, max_in_flight)))
+            if vsphere is not None:
+                self.db.executemany(sql, insert("vsphere", vsphere.result()))
+            seconds = time.time() - start
+            self.db.execute("UPDATE snapshots SET seconds = ? WHERE id = ?", (seconds, snapshot))
+
+        return counts, seconds
+
+    def snapshots(self):
+        """
+        Returns a list of (label, time taken, vCenter, NSX Manager, seconds the capture took, number of objects), oldest
+        first
+        """
+        return self.db.execute("SELECT label, taken, vcenter, nsx_manager, seconds, "
+                               "(SELECT COUNT(*) FROM objects WHERE snapshot = snapshots.id) "
+                               "FROM snapshots ORDER BY taken, id").fetchall()
+
+    def snapshot_id(self, label=None):
+        ''' the ID of the snapshot called label, or of the latest one if label is None '''
+        if label is None:
+            row = self.db.execute("SELECT id FROM snapshots ORDER BY taken DESC, id DESC LIMIT 1").fetchone()
+        else:
+            row = self.db.execute("SELECT id FROM snapshots WHERE label = ?", (label,)).fetchone()
+        if row is None:
+            raise Exception("There is no snapshot %sin %s" % ("called %s " % label if label else "", self.path))
+        return row[0]
+
+    def find(self, label, kind, name):
+        """
+        Returns a list of (object ID, parent ID, data) of the objects of kind called name in the snapshot called label,
+        or the latest snapshot if label is None
+        """
+        return [(object_id, parent, json.loads(data)) for object_id, parent, data in self.db.execute(
+            "SELECT object_id, parent, data FROM objects WHERE snapshot = ? AND kind = ? AND name = ? "
+            "ORDER BY object_id", (self.snapshot_id(label), kind, name))]
+
+    def children(self, label, kind, parent):
+        """
+        Returns a list of (object ID, name, data) of the objects of kind whose parent is the object ID parent, e.g. the
+        hosts of a cluster or the rules of a DFW section
+        """
+        return [(object_id, name, json.loads(data)) for object_id, name, data in self.db.execute(
+            "SELECT object_id, name, data FROM objects WHERE snapshot = ? AND kind = ? AND parent = ? "
+            "ORDER BY object_id", (self.snapshot_id(label), kind, parent))]
+
+    def diff(self, old, new):
+        """
+        Compare the snapshots called old and new, object by object on (kind, object ID).
+        Returns a list of ("added", "removed" or "changed", kind, object ID, name, list of (field, old value, new
+        value)), sorted by kind and name.  Only changed objects have fields, added and removed ones have an empty list
+        """
+        old_id, new_id = self.snapshot_id(old), self.snapshot_id(new)
+        changes = []
+
+        for change, a, b in (("added", new_id, old_id), ("removed", old_id, new_id)):
+            for kind, object_id, name in self.db.execute(
+                    "SELECT a.kind, a.object_id, a.name FROM objects a LEFT JOIN objects b "
+                    "ON b.snapshot = ? AND b.kind = a.kind AND b.object_id = a.object_id "
+                    "WHERE a.snapshot = ? AND b.object_id IS NULL", (b, a)):
+                changes.append((change, kind, object_id, name, []))
+
+        for kind, object_id, name, old_name, old_parent, new_parent, old_data, new_data in self.db.execute(
+                "SELECT n.kind, n.object_id, n.name, o.name, o.parent, n.parent, o.data, n.data "
+                "FROM objects n JOIN objects o ON o.snapshot = ? AND o.kind = n.kind AND o.object_id = n.object_id "
+                "WHERE n.snapshot = ? AND (o.data != n.data OR o.name IS NOT n.name OR o.parent IS NOT n.parent)",
+                (old_id, new_id)):
+            old_fields = dict(json.loads(old_data), name=old_name, parent=old_parent)
+            new_fields = dict(json.loads(new_data), name=name, parent=new_parent)
+            fields = [(field, old_fields.get(field), new_fields.get(field))
+                      for field in sorted(set(old_fields) | set(new_fields))
+                      if old_fields.get(field) != new_fields.get(field)]
+            changes.append(("changed", kind, object_id, name, fields))
+
+        return sorted(changes, key=lambda change: (change[1], change[3] or "", change[2]))
+
+
+if __name__ == "__main__":
+    exit(main())
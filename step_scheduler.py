@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+Dependency-graph step scheduler for configure_nsx_manager.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+A configuration run is a set of named steps, each listing the steps it needs to have finished first.  Every step whose
+requirements are met is started straight away on a worker pool, so steps that don't depend on each other run side by
+side and the whole run takes as long as its longest chain of dependent steps rather than the sum of all of them.
+
+Each step's function is called with a dictionary of the results of the steps that have finished so far, and its return
+value becomes its own result.  A step fails by raising.  The steps that need a failed step are not started, everything
+else carries on.
+
+The steps to run can be narrowed down with an only list and a skip list.  A step that isn't run counts as done for the
+steps that need it, so those have to be able to cope without its result.
+"""
+
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import tracing
+
+
+class Step(object):
+    """
+    A named step, the function that does it and the names of the steps it needs first
+    """
+    def __init__(self, name, function, requires=()):
+        self.name = name
+        self.function = function
+        self.requires = list(requires)
+
+
+def check_steps(steps):
+    """
+    Make sure step names are unique, every requirement is a known step and there are no cycles.
+    Raises an Exception describing the first problem found
+    """
+    names = [step.name for step in steps]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise Exception("Duplicate step name(s): " + ", ".join(duplicates))
+
+    by_name = dict((step.name, step) for step in steps)
+    for step in steps:
+        unknown = [name for name in step.requires if name not in by_name]
+        if unknown:
+            raise Exception("Step " + step.name + " requires unknown step(s): " + ", ".join(unknown))
+
+    ''' depth first search, a step met again while it is still on the path closes a cycle '''
+    visiting, visited = [], set()
+
+    def visit(name):
+        if name in visiting:
+            raise Exception("Steps depend on each other in a cycle: " +
+                            " -> ".join(visiting[visiting.index(name):] + [name]))
+        if name in visited:
+            return
+        visiting.append(name)
+        for required in by_name[name].requires:
+            visit(required)
+        visiting.pop()
+        visited.add(name)
+
+    for step in steps:
+        visit(step.name)
+
+
+def select_steps(steps, only=None, skip=None):
+    """
+    Pick the steps to run, all of them unless narrowed down by the only and skip lists of step names.
+    Raises an Exception naming any step in either list that doesn't exist.
+    Returns the list of step names to run, in the order the steps were given
+    """
+    names = [step.name for step in steps]
+    unknown = [name for name in list(only or []) + list(skip or []) if name not in names]
+    if unknown:
+        raise Exception("Unknown step(s): " + ", ".join(unknown) + ".  Steps are: " + ", ".join(names))
+
+    return [name for name in names if (not only or name in only) and name not in (skip or [])]
+
+
+def run_steps(steps, only=None, skip=None, max_workers=4):
+    """
+    Run steps, each as soon as the steps it requires have finished, up to max_workers at a time.
+    Returns an OrderedDict of step name to (state, seconds, result or error) where state is one of "done", "failed",
+    "blocked" (a step it needs failed) or "skipped" (not selected)
+    """
+    check_steps(steps)
+    selected = select_steps(steps, only, skip)
+    by_name = OrderedDict((step.name, step) for step in steps)
+
+    outcome = OrderedDict((step.name, ("skipped", 0.0, None)) for step in steps)
+    finished = set(name for name in by_name if name not in selected)
+    failed = set()
+    pending = list(selected)
+    results = dict()
+    running = dict()
+
+    def timed(step):
+        start = time.time()
+        try:
+            with tracing.phase(step.name):
+                return step.function(results), time.time() - start
+        except Exception as e:
+            e.seconds = time.time() - start
+            raise
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                requires = by_name[name].requires
+                if any(required in failed for required in requires):
+                    pending.remove(name)
+                    failed.add(name)
+                    blocked_by = [required for required in requires if required in failed]
+                    outcome[name] = ("blocked", 0.0, "needs " + ", ".join(blocked_by))
+                    print("[" + name + "] not started, it needs " + ", ".join(blocked_by))
+                elif all(required in finished for required in requires):
+                    pending.remove(name)
+                    print("[" + name + "] started")
+                    running[executor.submit(tracing.wrap(timed), by_name[name])] = name
+
+            if not running:
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    result, seconds = future.result()
+                    results[name] = result
+                    finished.add(name)
+                    outcome[name] = ("done", seconds, result)
+                    print("[" + name + "] done in %.1f s" % seconds)
+                else:
+                    seconds = getattr(error, "seconds", 0.0)
+                    failed.add(name)
+                    outcome[name] = ("failed", seconds, str(error))
+                    print("[" + name + "] FAILED after %.1f s: %s" % (seconds, error))
+
+    return outcome
+
+
+def critical_path(steps, outcome):
+    """
+    The chain of dependent steps that took longest, by the step times in outcome.  Steps that didn't run are left out.
+    Returns (seconds, list of step names)
+    """
+    by_name = dict((step.name, step) for step in steps)
+    longest = dict()
+
+    def chain(name):
+        if name not in longest:
+            before = max([chain(required) for required in by_name[name].requires] or [(0.0, [])])
+            ran = outcome[name][0] in ("done", "failed")
+            longest[name] = (before[0] + outcome[name][1], before[1] + ([name] if ran else []))
+        return longest[name]
+
+    return max([chain(step.name) for step in steps] or [(0.0, [])])
+
+
+def print_summary(steps, outcome, seconds):
+    """
+    Print how long each step took, the critical path and the wall time of the whole run
+    """
+    print("")
+    print("%-24s %-8s %9s" % ("step", "state", "seconds"))
+    for name, (state, step_seconds, _) in outcome.items():
+        print("%-24s %-8s %9.1f" % (name, state, step_seconds))
+
+    path_seconds, path = critical_path(steps, outcome)
+    print("")
+    print("Critical path: %s (%.1f s)" % (" -> ".join(path), path_seconds))
+    print("Wall time %.1f s, the steps took %.1f s between them" % (
+        seconds, sum(step_seconds for _, step_seconds, _ in outcome.values())))
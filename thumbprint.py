@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+TLS certificate thumbprints for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+NSX Manager wants the SHA-1 thumbprint of the Lookup Service certificate and the SHA-256 thumbprint of the vCenter
+certificate when it is registered.  Each endpoint's certificate is fetched with a single TLS handshake and every digest
+is worked out from that one copy.  Slow links get a configurable timeout and retries, and an endpoint that still can't
+be reached raises instead of quietly handing NSX a thumbprint of "not found".
+
+Thumbprints can be cached, in memory or in a JSON file, for a time to live so runs against a fleet of vCenters don't
+fetch the same certificate over and over.  probe_thumbprints() fetches many endpoints at the same time.
+
+Run on its own it prints the thumbprints of the endpoints given.
+
+Arguments
+---------
+endpoints [one or more host or host:port, the port defaults to 443]
+-timeout [seconds to wait for each handshake, defaults to 10]
+-retries [extra attempts after a failed handshake, defaults to 2]
+-cache_file [JSON file to keep thumbprints in between runs]
+-cache_ttl [seconds a cached thumbprint is good for, defaults to 3600]
+-max_parallel [endpoints to probe at the same time, defaults to 16]
+
+Example with parameters:
+python3 ./thumbprint.py vcsa1.vmwpc.local psc1.vmwpc.local:443 -timeout 5 -cache_file thumbprints.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHMS = ["sha1", "sha256"]
+
+
+def setup_args():
+    parser = argparse.ArgumentParser(
+        description='Arguments needed to print TLS certificate thumbprints')
+
+    parser.add_argument('endpoints',
+                        nargs='+',
+                        help='host or host:port, the port defaults to 443')
+    parser.add_argument('-timeout', '--timeout',
+                        type=float,
+                        default=10,
+                        help='seconds to wait for each handshake')
+    parser.add_argument('-retries', '--retries',
+                        type=int,
+                        default=2,
+                        help='extra attempts after a failed handshake')
+    parser.add_argument('-cache_file', '--cache_file',
+                        help='JSON file to keep thumbprints in between runs')
+    parser.add_argument('-cache_ttl', '--cache_ttl',
+                        type=float,
+                        default=3600,
+                        help='seconds a cached thumbprint is good for')
+    parser.add_argument('-max_parallel', '--max_parallel',
+                        type=int,
+                        default=16,
+                        help='endpoints to probe at the same time')
+
+    return (parser.parse_args())
+
+
+def main():
+    args = setup_args()
+
+    cache = ThumbprintCache(args.cache_file, args.cache_ttl)
+    results = probe_thumbprints(args.endpoints, args.timeout, args.retries, cache, args.max_parallel)
+
+    failed = False
+    for endpoint, result in results.items():
+        if isinstance(result, Exception):
+            print("%s: %s" % (endpoint, result))
+            failed = True
+        else:
+            for algorithm in ALGORITHMS:
+                print("%s %-6s %s" % (endpoint, algorithm, result[algorithm]))
+
+    return 1 if failed else 0
+
+
+def split_endpoint(endpoint, default_port=443):
+    """
+    Split host, host:port or [IPv6]:port.
+    Returns (host, port)
+    """
+    if endpoint.startswith("["):
+        host, _, rest = endpoint[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else default_port
+    if endpoint.count(":") == 1:
+        host, port = endpoint.split(":")
+        return host, int(port)
+    return endpoint, default_port
+
+
+def endpoint_key(host, port):
+    """
+    host:port, with IPv6 addresses in brackets so the key splits back the same way
+    """
+    return ("[%s]:%d" if ":" in host else "%s:%d") % (host, port)
+
+
+def format_thumbprint(der, algorithm):
+    """
+    The colon separated upper case hex digest of a DER certificate, the way vSphere and NSX show thumbprints
+    """
+    digest = hashlib.new(algorithm, der).hexdigest()
+    return ':'.join(digest[i:i + 2] for i in range(0, len(digest), 2)).upper()
+
+
+def fetch_certificate(host, port=443, timeout=10, retries=2):
+    """
+    Fetch the DER certificate host presents on port.  The certificate isn't verified, only its thumbprint matters.
+    Raises an Exception with the last error once every attempt has failed
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(min(2 ** attempt, 10))
+        try:
+            with socket.create_connection((host, port), timeout) as sock:
+                with context.wrap_socket(sock, server_hostname=host) as tls:
+                    return tls.getpeercert(True)
+        except (OSError, ssl.SSLError) as e:
+            error = e
+
+    raise Exception("Could not get the certificate of %s after %d attempt(s): %s" % (endpoint_key(host, port),
+                                                                                      retries + 1, error))
+
+
+class ThumbprintCache(object):
+    """
+    Thumbprints by host:port, each good for ttl seconds.  Kept in path as JSON if a path is given.
+    """
+    def __init__(self, path=None, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = dict()
+        self.fetching = dict()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print("Ignoring unreadable thumbprint cache " + path)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry
+
+    def fetch_lock(self, key):
+        ''' held while key is fetched, so callers asking for the same endpoint at the same time share one handshake '''
+        with self.lock:
+            return self.fetching.setdefault(key, threading.Lock())
+
+    def put(self, key, thumbprints):
+        with self.lock:
+            self.entries[key] = thumbprints
+            if self.path:
+                ''' write the whole file aside and move it over the old one, so a crash never leaves half a file '''
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(self.entries, f, indent=1, sort_keys=True)
+                os.replace(self.path + ".tmp", self.path)
+
+
+def get_thumbprints(endpoint, timeout=10, retries=2, cache=None):
+    """
+    The thumbprints of endpoint's certificate, from cache if it has them.
+    Returns a dictionary of sha1, sha256 and fetched (when the certificate was fetched)
+    """
+    host, port = split_endpoint(endpoint)
+    key = endpoint_key(host, port)
+
+    if cache is None:
+        return fetch_thumbprints(host, port, timeout, retries)
+
+    with cache.fetch_lock(key):
+        thumbprints = cache.get(key)
+        if thumbprints is None:
+            thumbprints = fetch_thumbprints(host, port, timeout, retries)
+            cache.put(key, thumbprints)
+    return thumbprints
+
+
+def fetch_thumbprints(host, port=443, timeout=10, retries=2):
+    der = fetch_certificate(host, port, timeout, retries)
+    thumbprints = dict((algorithm, format_thumbprint(der, algorithm)) for algorithm in ALGORITHMS)
+    thumbprints["fetched"] = time.time()
+    return thumbprints
+
+
+def probe_thumbprints(endpoints, timeout=10, retries=2, cache=None, max_parallel=16):
+    """
+    Get the thumbprints of every endpoint at the same time, each distinct endpoint only once.
+    Returns a dictionary of endpoint to its thumbprints, or to the Exception if they couldn't be had
+    """
+    keys = dict((endpoint, endpoint_key(*split_endpoint(endpoint))) for endpoint in endpoints)
+    unique = list(dict.fromkeys(keys.values()))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(unique)))) as executor:
+        futures = dict((key, executor.submit(get_thumbprints, key, timeout, retries, cache)) for key in unique)
+
+    return dict((endpoint, futures[key].exception() or futures[key].result()) for endpoint, key in keys.items())
+
+
+if __name__ == "__main__":
+    exit(main())
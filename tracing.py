@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+"""
+Per-call tracing for the pyNSXdeploy scripts
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+With tracing started (the scripts' -trace option), every vSphere method call and property read, every vSphere task,
+every NSX Manager request and every fixed sleep or polling wait is recorded as a span inside the phase of the run it
+belongs to, and written to a JSON lines trace file as it finishes:
+
+    {"id": 12, "parent": 3, "phase": "prepare_vxlan", "kind": "nsx", "operation": "GET /api/2.0/nwfabric/status",
+     "target": "nsxmanager1", "thread": "ThreadPoolExecutor-0_1", "start": 1700000000.1, "status": 200,
+     "bytes_out": 0, "bytes_in": 512, "seconds": 0.042}
+
+kind is one of phase, vsphere (a method call or property read, operation is Type.method or read Type.property),
+task (a vSphere task from the call that started it until a task state check saw it finish), nsx (operation is the
+method and the path with IDs and the query string left out, so requests for different objects add up together), upload
+(a disk of the NSX Manager OVA) and sleep.  When the run ends summary() prints where the wall clock time went, phase by
+phase and operation by operation.
+
+Nothing is recorded while tracing is off, and every hook then costs no more than a check of the module's tracer.
+vSphere calls are traced by wrapping the SOAP stub of the session (trace_vsphere(), which preflight.connect_vcenter()
+calls), NSX requests by NSXClient itself.  Work handed to a thread pool keeps its phase when the function submitted is
+wrapped with wrap().
+"""
+
+import contextlib
+import itertools
+import json
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+
+''' the tracer of the run, None while tracing is off '''
+tracer = None
+
+''' the kinds of span the summary has a column for, when the run had any '''
+KINDS = ["vsphere", "task", "nsx", "upload", "sleep"]
+
+''' path segments that are IDs, replaced by * in NSX operations.  API versions like 2.0 are kept '''
+ID_SEGMENT = re.compile(r"^(?!\d+\.\d+$).*\d")
+
+
+class Tracer(object):
+    """
+    Writes finished spans to a JSON lines file and keeps the running totals summary() prints
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, "w")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.started = time.time()
+        ''' (kind, operation) -> [count, seconds, slowest, errors, bytes] '''
+        self.operations = dict()
+        ''' phase -> [wall seconds, dictionary of kind -> [count, seconds]] '''
+        self.phases = OrderedDict()
+        ''' task ID -> span of a task that has been started and not yet seen to finish '''
+        self.tasks = dict()
+
+    def stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    def open(self, kind, operation, target=None, parent=None, **fields):
+        parent = parent or self.current()
+        phase = operation if kind == "phase" else parent["phase"] if parent else None
+        span = OrderedDict([("id", next(self.ids)), ("parent", parent["id"] if parent else None), ("phase", phase),
+                            ("kind", kind), ("operation", operation), ("target", target),
+                            ("thread", threading.current_thread().name), ("start", time.time())])
+        span.update(fields)
+        if kind == "phase":
+            with self.lock:
+                self.phases.setdefault(phase, [0.0, dict()])
+        return span
+
+    def close(self, span, seconds):
+        span["seconds"] = round(seconds, 6)
+        failed = "error" in span
+        line = json.dumps(span, default=str)
+
+        with self.lock:
+            self.fh.write(line + "\n")
+            kind, phase = span["kind"], span["phase"]
+            if kind == "phase":
+                self.phases[phase][0] += seconds
+                return
+            totals = self.operations.setdefault((kind, span["operation"]), [0, 0.0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += 1 if failed else 0
+            totals[4] += (span.get("bytes_out") or 0) + (span.get("bytes_in") or 0)
+            by_kind = self.phases.setdefault(phase, [0.0, dict()])[1].setdefault(kind, [0, 0.0])
+            by_kind[0] += 1
+            by_kind[1] += seconds
+
+    @contextlib.contextmanager
+    def span(self, kind, operation, target=None, **fields):
+        span = self.open(kind, operation, target, **fields)
+        stack = self.stack()
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            ''' not pop(): a generator holding a span open may be left by its caller while other spans are open '''
+            if span in stack:
+                stack.remove(span)
+            self.close(span, time.perf_counter() - start)
+
+    def flush(self):
+        with self.lock:
+            self.fh.flush()
+
+    def stop(self):
+        with self.lock:
+            self.fh.close()
+
+
+def start(path):
+    """
+    Start tracing to the JSON lines file at path, replacing what is there
+    """
+    global tracer
+    tracer = Tracer(path)
+    return tracer
+
+
+def stop(show_summary=True):
+    """
+    Stop tracing, printing the summary tables first unless show_summary is False
+    """
+    global tracer
+    if tracer is None:
+        return
+    if show_summary:
+        summary()
+    tracer.stop()
+    print("Trace written to " + tracer.path)
+    tracer = None
+
+
+def span(kind, operation, target=None, **fields):
+    """
+    Context manager timing one operation as a span of the current phase.  Gives the span, a dictionary that can have
+    fields such as status or bytes_in added before it ends.  Raising inside it records the error
+    """
+    if tracer is None:
+        return contextlib.nullcontext(dict())
+    return tracer.span(kind, operation, target, **fields)
+
+
+def phase(name):
+    ''' context manager for a phase of a run, the spans inside it add up to it in the summary '''
+    return span("phase", name)
+
+
+def wrap(function):
+    """
+    function, made to run inside the span that is current where wrap() is called, so work submitted to a thread pool
+    stays in its phase
+    """
+    if tracer is None:
+        return function
+    parent = tracer.current()
+    if parent is None:
+        return function
+
+    def wrapped(*args, **kwargs):
+        stack = tracer.stack() if tracer is not None else []
+        stack.append(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.remove(parent)
+
+    return wrapped
+
+
+def sleep(seconds, reason, target=None):
+    ''' time.sleep(), traced as a sleep span so fixed waits show up in the summary '''
+    with span("sleep", reason, target):
+        time.sleep(seconds)
+
+
+def nsx_operation(method, path):
+    ''' method and path with IDs and the query string left out, e.g. GET /api/2.0/vdn/scopes/*/virtualwires '''
+    return "%s %s" % (method, "/".join("*" if ID_SEGMENT.match(segment) else segment
+                                       for segment in path.split("?")[0].split("/")))
+
+
+def nsx_span(method, path, target, body=None):
+    ''' span() for one NSX Manager request, the caller adds status and bytes_in '''
+    if tracer is None:
+        return contextlib.nullcontext(dict())
+    return tracer.span("nsx", nsx_operation(method, path), target, bytes_out=len(body) if body else 0)
+
+
+''' vSphere '''
+
+
+def type_name(mo):
+    return type(mo).__name__.split(".")[-1]
+
+
+def trace_vsphere(si):
+    """
+    Trace every method call and property read made through si by wrapping its SOAP stub, which every managed object
+    of the session shares.  A call made while another vSphere call is being traced on the same thread (pyVmomi reads a
+    property with a PropertyCollector call) counts as part of it.  Tasks started are remembered until task_states()
+    sees them finish.  Does nothing if tracing is off or si has no stub.
+    Returns si
+    """
+    stub = getattr(si, "_stub", None)
+    if tracer is None or stub is None or getattr(stub, "traced", False):
+        return si
+
+    def traced(invoke, describe):
+        def call(mo, info, *args, **kwargs):
+            current = tracer.current() if tracer is not None else None
+            if tracer is None or (current is not None and current["kind"] == "vsphere"):
+                return invoke(mo, info, *args, **kwargs)
+            with tracer.span("vsphere", describe(mo, info), getattr(mo, "_moId", None)) as call_span:
+                tracer.local.bytes_out = None
+                result = invoke(mo, info, *args, **kwargs)
+                if tracer.local.bytes_out is not None:
+                    call_span["bytes_out"] = tracer.local.bytes_out
+                task = getattr(result, "_moId", None)
+                if isinstance(task, str) and task.startswith("task-"):
+                    with tracer.lock:
+                        tracer.tasks[task] = tracer.open("task", call_span["operation"], call_span["target"],
+                                                         parent=current, task=task)
+                return result
+        return call
+
+    stub.InvokeMethod = traced(stub.InvokeMethod,
+                               lambda mo, info: "%s.%s" % (type_name(mo), getattr(info, "wsdlName", None) or info.name))
+    stub.InvokeAccessor = traced(stub.InvokeAccessor, lambda mo, info: "read %s.%s" % (type_name(mo), info.name))
+
+    ''' pyVmomi serializes each request before sending it, which gives the size of what goes out '''
+    serialize = getattr(stub, "SerializeRequest", None)
+    if serialize is not None:
+        def serialize_request(*args, **kwargs):
+            request = serialize(*args, **kwargs)
+            if tracer is not None:
+                tracer.local.bytes_out = len(request)
+            return request
+        stub.SerializeRequest = serialize_request
+
+    stub.traced = True
+    return si
+
+
+def task_states(states):
+    """
+    Record the tasks in states, a dictionary of task -> (state, error) from a task state check, that have finished
+    since they were started, as task spans from start to now
+    """
+    if tracer is None:
+        return
+    now = time.time()
+    for task, (state, error) in states.items():
+        if str(state) not in ("success", "error"):
+            continue
+        with tracer.lock:
+            task_span = tracer.tasks.pop(getattr(task, "_moId", None), None)
+        if task_span is None:
+            continue
+        task_span["status"] = str(state)
+        if error is not None:
+            task_span["error"] = "%s: %s" % (type(error).__name__, getattr(error, "msg", None) or error)
+        tracer.close(task_span, now - task_span["start"])
+
+
+''' summary '''
+
+
+def summary(top=15):
+    """
+    Print where the wall clock time of the run went: each phase with its own wall time and the time its vSphere
+    calls, tasks, NSX requests and sleeps took between them (overlapping calls each count in full), then the top
+    operations by total time
+    """
+    if tracer is None:
+        return
+    tracer.flush()
+    with tracer.lock:
+        phases = [(name, wall, dict(by_kind)) for name, (wall, by_kind) in tracer.phases.items()]
+        operations = sorted(tracer.operations.items(), key=lambda item: -item[1][1])
+
+    kinds = [kind for kind in KINDS if any(kind in by_kind for _, _, by_kind in phases)]
+    print("")
+    print("%-28s %9s" % ("phase", "wall s") + "".join(" %8s %9s" % (kind, "s") for kind in kinds))
+    for name, wall, by_kind in phases:
+        print("%-28s %9.2f" % (name or "(outside any phase)", wall) +
+              "".join(" %8d %9.2f" % tuple(by_kind.get(kind, (0, 0.0))) for kind in kinds))
+
+    print("")
+    print("%-8s %-60s %7s %9s %9s %9s %6s %10s" % ("kind", "operation", "count", "total s", "mean ms", "max ms",
+                                                   "errors", "bytes"))
+    for (kind, operation), (count, seconds, slowest, errors, size) in operations[:top]:
+        print("%-8s %-60s %7d %9.2f %9.1f %9.1f %6d %10d" % (kind, operation[:60], count, seconds,
+                                                             1000 * seconds / count, 1000 * slowest, errors, size))
+    print("")
+    print("Run took %.1f s, %d operation(s) traced" % (time.time() - tracer.started,
+                                                       sum(totals[0] for _, totals in operations)))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Checkpoint journal for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Every completed step of a migration is appended to the journal as one JSON line of (phase, target, step) plus any
+detail needed to carry on later, e.g. the VLAN IDs read from the source port groups before they were renamed.  Each
+entry is flushed and fsync'd before the next step starts, so after a crash the journal is an accurate record of what
+finished.  With -resume, configure_vds.py reads the journal back, checks each journaled step against the live
+inventory and carries on from where the run stopped.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class Journal(object):
+    """
+    Append-only journal of completed (phase, target, step) entries
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        ''' a torn line from a crash mid-write, the step it describes never finished '''
+                        continue
+                    self.entries[(entry["phase"], entry["target"], entry["step"])] = entry
+
+        self.fh = open(path, "a")
+
+        ''' start on a fresh line if the last write was torn '''
+        if self.fh.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.fh.write("\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        self.fh.close()
+
+    def done(self, phase, target, step):
+        return (phase, target, step) in self.entries
+
+    def detail(self, phase, target, step):
+        return self.entries[(phase, target, step)].get("detail", {})
+
+    def details(self, step):
+        ''' Returns a list of (target, detail) for every entry of the given step, whatever its phase '''
+        return [(entry["target"], entry.get("detail", {})) for (_, _, entry_step), entry in self.entries.items()
+                if entry_step == step]
+
+    def record(self, phase, target, step, **detail):
+        """
+        Append a completed step and make sure it is on disk before returning
+        """
+        entry = {"time": time.time(), "phase": phase, "target": target, "step": step}
+        if detail:
+            entry["detail"] = detail
+
+        with self.lock:
+            self.fh.write(json.dumps(entry, sort_keys=True) + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.entries[(phase, target, step)] = entry
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Per-host network migration planner for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+The planner looks at where a host's uplinks and vmks are today, works out where they need to end up, and splits the
+move into as few stages as possible.  Each stage is applied with a single HostNetworkSystem.UpdateNetworkConfig call
+that carries the pnic backing of every switch it touches plus the vmk moves, so the host goes from NDE layout to the
+split layout in two calls instead of four passes of ReconfigureDvs / UpdateNetworkConfig per host.
+
+Stage 1 ("split") moves one uplink onto each new switch while the old switch keeps the rest, then moves every vmk that
+can already be serviced by the new switch.  Stage 2 ("finish") moves the remaining uplinks and vmks.  At no point is a
+vmk left on a switch with no uplinks, so management connectivity is never dropped.
+"""
+
+from collections import OrderedDict
+
+from pyVmomi import vim
+
+
+''' Ordered uplinks for each new switch, in the same order as the uplink port names the switch is created with '''
+TARGET_UPLINKS = {
+    "NetApp HCI Management": ["vmnic2", "vmnic3"],
+    "NetApp HCI Storage": ["vmnic5", "vmnic1"],
+    "NetApp HCI Compute": ["vmnic0", "vmnic4"],
+}
+
+''' vmk -> (switch, port group, vmnic the port group is pinned to or None) '''
+TARGET_VMKS = {
+    "vmk0": ("NetApp HCI Management", "Management Network", None),
+    "vmk1": ("NetApp HCI Storage", "iSCSI-A", "vmnic5"),
+    "vmk2": ("NetApp HCI Storage", "iSCSI-B", "vmnic1"),
+    "vmk3": ("NetApp HCI Compute", "vMotion", None),
+}
+
+STAGE_NAMES = ["split", "finish"]
+
+
+def switch_set_layout(suffix=""):
+    """
+    Target layout for one set of new switches.  When more than one source switch is being split, each set of new
+    switches and port groups carries the source switch's suffix, e.g. "NetApp HCI Storage 02" / "iSCSI-A 02".
+    Returns (target uplinks, target vmks) in the same form as TARGET_UPLINKS / TARGET_VMKS
+    """
+    target_uplinks = dict((dvswitchname + suffix, list(pnics)) for dvswitchname, pnics in TARGET_UPLINKS.items())
+    target_vmks = dict((vmk, (dvswitchname + suffix, portgroupname + suffix, pin))
+                       for vmk, (dvswitchname, portgroupname, pin) in TARGET_VMKS.items())
+    return target_uplinks, target_vmks
+
+
+def uplink_port_name(dvswitchname, pnic):
+    """
+    Uplink port name used on the new switches, e.g. NetApp_HCI_Storage_vmnic5
+    """
+    return dvswitchname.replace(" ", "_") + "_" + pnic
+
+
+def read_host_network_state(host):
+    """
+    Read the current uplinks and vmk placement of a host.
+    Returns a dictionary with
+        pnics   - dvs name -> list of vmnics backing that switch on this host
+        uplinks - dvs name -> dict of uplink port name -> uplink port key
+        vmks    - vmk device -> (dvs name, port group key), dvs name is None for a standard switch
+    """
+    network = host.config.network
+    return network_state(network.proxySwitch, network.vnic)
+
+
+def network_state(proxy_switches, vnics):
+    """
+    Build the host state used by the planner from a host's config.network.proxySwitch and config.network.vnic,
+    see read_host_network_state()
+    """
+    uuid_to_name = dict()
+    state = {"pnics": dict(), "uplinks": dict(), "vmks": dict()}
+
+    for proxy in proxy_switches:
+        uuid_to_name[proxy.dvsUuid] = proxy.dvsName
+        state["pnics"][proxy.dvsName] = [spec.pnicDevice for spec in proxy.spec.backing.pnicSpec]
+        state["uplinks"][proxy.dvsName] = dict((port.value, port.key) for port in proxy.uplinkPort)
+
+    for vnic in vnics:
+        port = vnic.spec.distributedVirtualPort
+        if port is None:
+            state["vmks"][vnic.device] = (None, vnic.portgroup)
+        else:
+            state["vmks"][vnic.device] = (uuid_to_name.get(port.switchUuid), port.portgroupKey)
+
+    return state
+
+
+def plan_host_migration(state, source_dvswitchname, target_uplinks=TARGET_UPLINKS, target_vmks=TARGET_VMKS):
+    """
+    Work out the stages needed to take a host from its current state to the target layout.
+
+    Returns a list of (stage name, pnics, vmks) where pnics is the full desired backing of every switch that changes
+    in that stage and vmks is a dictionary of vmk -> (switch, port group) to move.  Stages with nothing to do are
+    left out, so a host that is already migrated gets an empty plan.
+    """
+    current_pnics = dict((name, list(pnics)) for name, pnics in state["pnics"].items())
+    current_vmks = dict((vmk, placement[0]) for vmk, placement in state["vmks"].items())
+    moving = set(pnic for pnics in target_uplinks.values() for pnic in pnics)
+
+    ''' stage 1: one uplink per new switch, preferring the vmnic a pinned vmk needs '''
+    split_pnics = dict()
+    for dvswitchname, pnics in target_uplinks.items():
+        pinned = [pin for switch, portgroup, pin in target_vmks.values() if switch == dvswitchname and pin]
+        first = pinned[0] if pinned else pnics[-1]
+        present = current_pnics.get(dvswitchname, [])
+        split_pnics[dvswitchname] = [pnic for pnic in pnics if pnic in present or pnic == first]
+
+    split_pnics[source_dvswitchname] = [pnic for pnic in current_pnics.get(source_dvswitchname, [])
+                                        if not any(pnic in pnics for name, pnics in split_pnics.items()
+                                                   if name != source_dvswitchname)]
+
+    split_vmks = dict()
+    for vmk, (dvswitchname, portgroup, pin) in target_vmks.items():
+        if vmk not in current_vmks or current_vmks[vmk] == dvswitchname:
+            continue
+        if pin is None or pin in split_pnics[dvswitchname]:
+            split_vmks[vmk] = (dvswitchname, portgroup)
+
+    ''' make sure nothing is stranded on a switch without uplinks after stage 1 '''
+    for vmk, dvswitchname in current_vmks.items():
+        placed_on = split_vmks[vmk][0] if vmk in split_vmks else dvswitchname
+        if placed_on in split_pnics and not split_pnics[placed_on]:
+            raise Exception("Planned migration would leave %s on %s with no uplinks" % (vmk, placed_on))
+
+    ''' stage 2: everything else '''
+    finish_pnics = dict((dvswitchname, list(pnics)) for dvswitchname, pnics in target_uplinks.items())
+    finish_pnics[source_dvswitchname] = [pnic for pnic in current_pnics.get(source_dvswitchname, [])
+                                         if pnic not in moving]
+
+    finish_vmks = dict()
+    for vmk, (dvswitchname, portgroup, pin) in target_vmks.items():
+        if vmk in current_vmks and current_vmks[vmk] != dvswitchname and vmk not in split_vmks:
+            finish_vmks[vmk] = (dvswitchname, portgroup)
+
+    stages = []
+    after_split = dict(current_pnics)
+    after_split.update(split_pnics)
+
+    for name, pnics, vmks, before in ((STAGE_NAMES[0], split_pnics, split_vmks, current_pnics),
+                                      (STAGE_NAMES[1], finish_pnics, finish_vmks, after_split)):
+        ''' the old switch goes first so its uplinks are released before the new switches claim them '''
+        order = [source_dvswitchname] + [dvswitchname for dvswitchname in pnics if dvswitchname != source_dvswitchname]
+        changed = OrderedDict((dvswitchname, pnics[dvswitchname]) for dvswitchname in order
+                              if sorted(pnics[dvswitchname]) != sorted(before.get(dvswitchname, [])))
+        if changed or vmks:
+            stages.append((name, changed, vmks))
+
+    return stages
+
+
+def build_network_config(state, stage, dvswitches, portgroups):
+    """
+    Turn one planned stage into a HostNetworkSystem NetworkConfig.
+    dvswitches is a dictionary of dvs name -> DVS object, portgroups a dictionary of port group name -> port group.
+    """
+    stage_name, pnics, vmks = stage
+    config = vim.host.NetworkConfig()
+
+    for dvswitchname, backing in pnics.items():
+        uplinks = state["uplinks"].get(dvswitchname, {})
+
+        proxy_config = vim.host.HostProxySwitch.Config()
+        proxy_config.changeOperation = "edit"
+        proxy_config.uuid = dvswitches[dvswitchname].uuid
+        proxy_config.spec = vim.host.HostProxySwitch.Specification()
+        proxy_config.spec.backing = vim.dvs.HostMember.PnicBacking()
+
+        for pnic in backing:
+            pnic_spec = vim.dvs.HostMember.PnicSpec(pnicDevice=pnic)
+            uplink_key = uplinks.get(uplink_port_name(dvswitchname, pnic))
+            if uplink_key is not None:
+                pnic_spec.uplinkPortKey = uplink_key
+            proxy_config.spec.backing.pnicSpec.append(pnic_spec)
+
+        config.proxySwitch.append(proxy_config)
+
+    for vmk, (dvswitchname, portgroupname) in sorted(vmks.items()):
+        vnic_config = vim.host.VirtualNic.Config()
+        vnic_config.changeOperation = "edit"
+        vnic_config.device = vmk
+        vnic_config.portgroup = ""
+        vnic_config.spec = vim.host.VirtualNic.Specification()
+        vnic_config.spec.distributedVirtualPort = vim.dvs.PortConnection()
+        vnic_config.spec.distributedVirtualPort.switchUuid = dvswitches[dvswitchname].uuid
+        vnic_config.spec.distributedVirtualPort.portgroupKey = portgroups[portgroupname].key
+        config.vnic.append(vnic_config)
+
+    return config
+
+
+def apply_host_stage(host, stage, dvswitches, portgroups):
+    """
+    Apply one planned stage to a host with a single UpdateNetworkConfig call.
+    The host state is re-read first so the uplink port keys are current.
+    """
+    state = read_host_network_state(host)
+    config = build_network_config(state, stage, dvswitches, portgroups)
+    host.configManager.networkSystem.UpdateNetworkConfig(config, "modify")
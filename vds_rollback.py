@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+"""
+Rollback engine for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Before anything is changed, configure_vds.py writes a snapshot of the original layout to a JSON file: every host's pnic
+backing and uplink port keys per switch, where each vmk is connected, every VM NIC backing on those hosts and the
+names of the port groups on the source switches.  With -rollback the snapshot is played back in reverse order of the
+migration:
+
+    1. "rejoin"  - each new switch gives all but one of its uplinks back to the source switch and every vmk moves back
+    2. the VMs are moved back to their original port groups, while both sets of switches still have uplinks
+    3. "restore" - the last uplinks go back, with their original uplink port keys
+    4. the new switches are removed and the source port groups get their original names back
+
+Only the switches the journal records configure_vds.py as having created are removed, switches made some other way
+are left alone whatever hosts they have.
+
+Each host stage is a single UpdateNetworkConfig call and the hosts are done in parallel.  VM NICs are put back with one
+ReconfigVM task per VM, tracked together with a bounded number in flight.
+"""
+
+import json
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+import tracing
+
+from vsphere_util import collect_properties, run_tasks_bounded, wait_for_tasks
+
+
+HOST_PROPERTIES = ["name", "config.network.proxySwitch", "config.network.vnic"]
+
+VM_PROPERTIES = ["name", "runtime.host", "config.hardware.device"]
+
+
+def vnic_placement(vnic):
+    ''' Where a vmk is connected, in a form that can go into the snapshot file '''
+    port = vnic.spec.distributedVirtualPort
+    if port is None:
+        return {"portgroup": vnic.portgroup}
+    return {"switchUuid": port.switchUuid, "portgroupKey": port.portgroupKey}
+
+
+def nic_placement(device):
+    ''' Where a VM NIC is connected, in a form that can go into the snapshot file '''
+    backing = device.backing
+    if isinstance(backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo):
+        return {"switchUuid": backing.port.switchUuid, "portgroupKey": backing.port.portgroupKey}
+    if isinstance(backing, vim.vm.device.VirtualEthernetCard.NetworkBackingInfo):
+        return {"network": backing.deviceName}
+    return None
+
+
+def proxy_backing(proxy_switches):
+    ''' dvs uuid -> {"name", "pnics": [[pnic, uplink port key]]} for a host's config.network.proxySwitch '''
+    return dict((proxy.dvsUuid, {"name": proxy.dvsName,
+                                 "pnics": [[spec.pnicDevice, spec.uplinkPortKey]
+                                           for spec in proxy.spec.backing.pnicSpec]})
+                for proxy in proxy_switches)
+
+
+def take_rollback_snapshot(si, clusters, source_dvswitches):
+    """
+    Record the original layout of every host in the clusters, the VMs running on them and the port group names of the
+    source switches.  Hosts and VMs are read with one batched property read each.
+    Returns a dictionary that can be written with save_snapshot()
+    """
+    hosts = set(host for cluster in clusters for host in cluster.host)
+    snapshot = {"taken": time.time(), "hosts": dict(), "vms": dict(), "switches": dict()}
+
+    for host, props in collect_properties(si, vim.HostSystem, HOST_PROPERTIES):
+        if host not in hosts:
+            continue
+        snapshot["hosts"][host._moId] = {
+            "name": props["name"],
+            "switches": proxy_backing(props.get("config.network.proxySwitch") or []),
+            "vmks": dict((vnic.device, vnic_placement(vnic)) for vnic in props.get("config.network.vnic") or []),
+        }
+
+    for vm, props in collect_properties(si, vim.VirtualMachine, VM_PROPERTIES):
+        if props.get("runtime.host") not in hosts:
+            continue
+        nics = dict()
+        for device in props.get("config.hardware.device") or []:
+            if isinstance(device, vim.vm.device.VirtualEthernetCard):
+                nics[str(device.key)] = nic_placement(device)
+        if nics:
+            snapshot["vms"][vm._moId] = {"name": props["name"], "nics": nics}
+
+    for dvswitch in source_dvswitches:
+        snapshot["switches"][dvswitch.uuid] = {
+            "moId": dvswitch._moId,
+            "name": dvswitch.name,
+            "portgroups": dict((portgroup.key, portgroup.name) for portgroup in dvswitch.portgroup),
+        }
+
+    return snapshot
+
+
+def save_snapshot(snapshot, path):
+    with open(path, "w") as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+
+
+def load_snapshot(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def plan_host_rollback(saved, proxy_switches, vnics):
+    """
+    Work out the stages needed to put a host back to its snapshot.
+
+    Returns a list of (stage name, pnics, vmks) where pnics is an OrderedDict of dvs uuid -> list of
+    [pnic, uplink port key] for every switch that changes, switches giving up uplinks first, and vmks a dictionary of
+    vmk -> snapshot placement.  A host that is already in its original layout gets an empty plan.
+    """
+    current = proxy_backing(proxy_switches)
+    current_pnics = dict((uuid, [pnic for pnic, key in switch["pnics"]]) for uuid, switch in current.items())
+    current_keys = dict((pnic, key) for switch in current.values() for pnic, key in switch["pnics"])
+
+    final = dict((uuid, [pnic for pnic, key in switch["pnics"]]) for uuid, switch in saved["switches"].items())
+    final_keys = dict((pnic, key) for switch in saved["switches"].values() for pnic, key in switch["pnics"])
+    for uuid in current:
+        final.setdefault(uuid, [])
+
+    ''' rejoin: every switch keeps at least one of its current uplinks, the rest go where the snapshot had them '''
+    kept = dict()
+    for uuid, pnics in current_pnics.items():
+        staying = [pnic for pnic in pnics if pnic in final[uuid]]
+        leaving = [pnic for pnic in pnics if pnic not in final[uuid]]
+        kept[uuid] = staying or leaving[-1:]
+
+    held = set(pnic for pnics in kept.values() for pnic in pnics)
+    rejoin = dict()
+    for uuid, pnics in final.items():
+        rejoin[uuid] = [pnic for pnic in pnics if pnic in kept.get(uuid, []) or pnic not in held]
+    for uuid, pnics in kept.items():
+        rejoin[uuid] = rejoin[uuid] + [pnic for pnic in pnics if pnic not in rejoin[uuid]]
+
+    saved_vmks = saved["vmks"]
+    moves = dict((vnic.device, saved_vmks[vnic.device]) for vnic in vnics
+                 if vnic.device in saved_vmks and vnic_placement(vnic) != saved_vmks[vnic.device])
+
+    rejoin_vmks = dict()
+    for vmk, placement in moves.items():
+        uuid = placement.get("switchUuid")
+        if uuid is None or rejoin.get(uuid):
+            rejoin_vmks[vmk] = placement
+    restore_vmks = dict((vmk, placement) for vmk, placement in moves.items() if vmk not in rejoin_vmks)
+
+    stages = []
+    before = current_pnics
+    for name, pnics, vmks in (("rejoin", rejoin, rejoin_vmks), ("restore", final, restore_vmks)):
+        changed = [uuid for uuid in pnics if sorted(pnics[uuid]) != sorted(before.get(uuid, []))]
+        ''' switches giving up uplinks go first so they are released before another switch claims them '''
+        changed.sort(key=lambda uuid: len(pnics[uuid]) >= len(before.get(uuid, [])))
+        backing = OrderedDict((uuid, [[pnic, final_keys.get(pnic) if uuid in saved["switches"]
+                                       else current_keys.get(pnic)] for pnic in pnics[uuid]])
+                              for uuid in changed)
+        if backing or vmks:
+            stages.append((name, backing, vmks))
+        before = pnics
+
+    return stages
+
+
+def build_rollback_config(stage):
+    ''' Turn one rollback stage into a HostNetworkSystem NetworkConfig '''
+    stage_name, pnics, vmks = stage
+    config = vim.host.NetworkConfig()
+
+    for uuid, backing in pnics.items():
+        proxy_config = vim.host.HostProxySwitch.Config()
+        proxy_config.changeOperation = "edit"
+        proxy_config.uuid = uuid
+        proxy_config.spec = vim.host.HostProxySwitch.Specification()
+        proxy_config.spec.backing = vim.dvs.HostMember.PnicBacking()
+
+        for pnic, uplink_key in backing:
+            pnic_spec = vim.dvs.HostMember.PnicSpec(pnicDevice=pnic)
+            if uplink_key is not None:
+                pnic_spec.uplinkPortKey = uplink_key
+            proxy_config.spec.backing.pnicSpec.append(pnic_spec)
+
+        config.proxySwitch.append(proxy_config)
+
+    for vmk, placement in sorted(vmks.items()):
+        vnic_config = vim.host.VirtualNic.Config()
+        vnic_config.changeOperation = "edit"
+        vnic_config.device = vmk
+        vnic_config.spec = vim.host.VirtualNic.Specification()
+        if "portgroup" in placement:
+            vnic_config.portgroup = placement["portgroup"]
+        else:
+            vnic_config.portgroup = ""
+            vnic_config.spec.distributedVirtualPort = vim.dvs.PortConnection()
+            vnic_config.spec.distributedVirtualPort.switchUuid = placement["switchUuid"]
+            vnic_config.spec.distributedVirtualPort.portgroupKey = placement["portgroupKey"]
+        config.vnic.append(vnic_config)
+
+    return config
+
+
+def rollback_hosts(si, snapshot, stage_name, max_parallel_ops=8):
+    """
+    Plan every host in the snapshot from its live state and apply the named stage to all of them in parallel.
+    Returns a list of (host name, error or None, seconds)
+    """
+    wanted = snapshot["hosts"]
+    work = []
+
+    for host, props in collect_properties(si, vim.HostSystem, HOST_PROPERTIES):
+        if host._moId not in wanted:
+            continue
+        for stage in plan_host_rollback(wanted[host._moId], props.get("config.network.proxySwitch") or [],
+                                        props.get("config.network.vnic") or []):
+            if stage[0] == stage_name:
+                work.append((host, props["name"], stage))
+
+    def apply(host, stage):
+        start = time.time()
+        host.configManager.networkSystem.UpdateNetworkConfig(build_rollback_config(stage), "modify")
+        return time.time() - start
+
+    results = []
+    if not work:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_parallel_ops, len(work))) as executor:
+        futures = [(name, executor.submit(tracing.wrap(apply), host, stage)) for host, name, stage in work]
+
+    for name, future in futures:
+        error = future.exception()
+        results.append((name, error, 0 if error else future.result()))
+        if error:
+            print("Failed to roll back (" + stage_name + ") host " + name + ": " + str(error))
+        else:
+            print("Rolled back (" + stage_name + ") host " + name)
+
+    return results
+
+
+def rollback_vms(si, snapshot, max_in_flight=8):
+    """
+    Put every VM NIC in the snapshot back on its original network, one ReconfigVM task per VM.
+    Returns the run_tasks_bounded() results
+    """
+    networks = dict((props["name"], network) for network, props in collect_properties(si, vim.Network, ["name"]))
+    jobs = []
+
+    for vm, props in collect_properties(si, vim.VirtualMachine, ["name", "config.hardware.device"]):
+        saved = snapshot["vms"].get(vm._moId)
+        if saved is None:
+            continue
+
+        device_change = []
+        for device in props.get("config.hardware.device") or []:
+            placement = saved["nics"].get(str(device.key))
+            if placement is None or nic_placement(device) == placement:
+                continue
+
+            if "network" in placement:
+                backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+                backing.network = networks.get(placement["network"])
+                backing.deviceName = placement["network"]
+            else:
+                backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+                backing.port = vim.dvs.PortConnection()
+                backing.port.switchUuid = placement["switchUuid"]
+                backing.port.portgroupKey = placement["portgroupKey"]
+
+            nicspec = vim.vm.device.VirtualDeviceSpec()
+            nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+            nicspec.device = device
+            nicspec.device.backing = backing
+            device_change.append(nicspec)
+
+        if device_change:
+            spec = vim.vm.ConfigSpec(deviceChange=device_change)
+            jobs.append((props["name"], lambda vm=vm, spec=spec: vm.ReconfigVM_Task(spec)))
+
+    results = run_tasks_bounded(si, jobs, max_in_flight)
+
+    for name, state, error, seconds in results:
+        if state == vim.TaskInfo.State.error:
+            print("Failed to move " + name + " back: " + str(error))
+        else:
+            print("Moved " + name + " back to its original network")
+
+    return results
+
+
+def remove_new_switches(si, snapshot, created_switches):
+    """
+    Destroy the switches the migration created, created_switches being their UUIDs as journaled by configure_vds.py.
+    A switch the snapshot hosts were on before the migration, or that has a host outside the snapshot, is left alone
+    """
+    original = set(uuid for host in snapshot["hosts"].values() for uuid in host["switches"])
+    hosts = set(snapshot["hosts"])
+    created = set(created_switches) - original
+    tasks = []
+
+    for dvswitch, props in collect_properties(si, vim.DistributedVirtualSwitch, ["name", "uuid", "config.host"]):
+        if props["uuid"] not in created:
+            continue
+        members = [member.config.host._moId for member in props.get("config.host") or []]
+        others = [member for member in members if member not in hosts]
+        if others:
+            print("Leaving " + props["name"] + " in place, it has hosts the snapshot doesn't: " + ", ".join(others))
+            continue
+        print("Removing " + props["name"])
+        tasks.append(dvswitch.Destroy_Task())
+
+    wait_for_tasks(si, tasks)
+
+
+def restore_portgroup_names(si, snapshot):
+    ''' Give the port groups on the source switches their original names back '''
+    names = dict((key, name) for switch in snapshot["switches"].values()
+                 for key, name in switch["portgroups"].items())
+    tasks = []
+
+    for portgroup, props in collect_properties(si, vim.dvs.DistributedVirtualPortgroup, ["name", "key"]):
+        original = names.get(props["key"])
+        if original is not None and original != props["name"]:
+            print("Renaming portgroup " + props["name"] + " back to " + original)
+            tasks.append(portgroup.Rename(original))
+
+    wait_for_tasks(si, tasks)
+
+
+def rollback(si, snapshot, max_parallel_ops=8, created_switches=()):
+    """
+    Put the hosts, VMs and source switches in the snapshot back to their original layout, and remove the switches in
+    created_switches (UUIDs) that the migration made.
+    Raises an Exception if a source switch no longer exists or a host or VM could not be rolled back.
+    """
+    start = time.time()
+
+    existing = set(props["uuid"] for dvswitch, props in collect_properties(si, vim.DistributedVirtualSwitch, ["uuid"]))
+    for uuid, switch in snapshot["switches"].items():
+        if uuid not in existing:
+            raise Exception("Source switch " + switch["name"] + " has been removed, the snapshot can't be restored")
+
+    failed = [name for name, error, seconds in rollback_hosts(si, snapshot, "rejoin", max_parallel_ops) if error]
+    if failed:
+        raise Exception("Rollback stopped, hosts failed to rejoin the source switch: " + ", ".join(failed))
+
+    failed = [name for name, state, error, seconds in rollback_vms(si, snapshot, max_parallel_ops)
+              if state == vim.TaskInfo.State.error]
+    if failed:
+        raise Exception("Rollback stopped, VMs failed to move back: " + ", ".join(failed))
+
+    failed = [name for name, error, seconds in rollback_hosts(si, snapshot, "restore", max_parallel_ops) if error]
+    if failed:
+        raise Exception("Rollback stopped, hosts failed to restore their uplinks: " + ", ".join(failed))
+
+    remove_new_switches(si, snapshot, created_switches)
+    restore_portgroup_names(si, snapshot)
+
+    print("Rollback complete in %.1f seconds" % (time.time() - start))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""
+vSphere specs for the switches, port groups and VM NICs configure_vds.py sets up
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+There is one builder per kind of object, used both by the step by step split in configure_vds.py and by the
+desired-state reconcile in vds_state.py, so the two set the same objects up the same way.
+"""
+
+from pyVmomi import vim
+
+from vds_planner import uplink_port_name
+
+
+def dvswitch_create_spec(dvswitchname, pnics, hosts, mtu=9000, max_ports=60000, version="6.5.0"):
+    """
+    CreateSpec for a new switch with hosts added and one uplink per vmnic in pnics, named after the switch and vmnic
+    """
+    dvs_create_spec = vim.DistributedVirtualSwitch.CreateSpec()
+    dvs_config_spec = vim.VmwareDistributedVirtualSwitch.ConfigSpec()
+    dvs_config_spec.name = dvswitchname
+    dvs_config_spec.maxMtu = mtu
+    dvs_config_spec.maxPorts = max_ports
+    dvs_config_spec.uplinkPortPolicy = vim.DistributedVirtualSwitch.NameArrayUplinkPortPolicy()
+
+    ''' uplinks are named after the switch and vmnic, e.g. NetApp_HCI_Storage_vmnic5 '''
+    dvs_config_spec.uplinkPortPolicy.uplinkPortName = [uplink_port_name(dvswitchname, pnic) for pnic in pnics]
+
+    for host in hosts:
+        dvs_host_config = vim.dvs.HostMember.ConfigSpec()
+        dvs_host_config.operation = vim.ConfigSpecOperation.add
+        dvs_host_config.host = host
+        dvs_config_spec.host.append(dvs_host_config)
+
+    dvs_create_spec.configSpec = dvs_config_spec
+    dvs_create_spec.productInfo = vim.dvs.ProductSpec(version=version)
+
+    return dvs_create_spec
+
+
+def portgroup_config_spec(portgroupname, vlanid, dvswitchname=None, teaming=None, active_uplinks=(), ports=32):
+    """
+    ConfigSpec for an early binding port group on VLAN vlanid that refuses promiscuous mode, forged transmits and MAC
+    changes.  teaming is the uplink teaming policy, e.g. loadbalance_loadbased, and active_uplinks the vmnics of
+    dvswitchname it keeps active, with no standby.  Without teaming the switch's default is used
+    """
+    dv_pg_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
+    dv_pg_spec.name = portgroupname
+    dv_pg_spec.numPorts = ports
+    dv_pg_spec.type = vim.dvs.DistributedVirtualPortgroup.PortgroupType.earlyBinding
+
+    dv_pg_spec.defaultPortConfig = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
+    dv_pg_spec.defaultPortConfig.vlan = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec()
+    dv_pg_spec.defaultPortConfig.vlan.vlanId = vlanid
+    dv_pg_spec.defaultPortConfig.vlan.inherited = False
+
+    dv_pg_spec.defaultPortConfig.securityPolicy = vim.dvs.VmwareDistributedVirtualSwitch.SecurityPolicy()
+    dv_pg_spec.defaultPortConfig.securityPolicy.allowPromiscuous = vim.BoolPolicy(value=False)
+    dv_pg_spec.defaultPortConfig.securityPolicy.forgedTransmits = vim.BoolPolicy(value=False)
+    dv_pg_spec.defaultPortConfig.securityPolicy.macChanges = vim.BoolPolicy(value=False)
+    dv_pg_spec.defaultPortConfig.securityPolicy.inherited = False
+
+    if teaming:
+        teaming_policy = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortTeamingPolicy()
+        teaming_policy.policy = vim.StringPolicy(value=teaming)
+        if active_uplinks:
+            teaming_policy.uplinkPortOrder = vim.dvs.VmwareDistributedVirtualSwitch.UplinkPortOrderPolicy()
+            teaming_policy.uplinkPortOrder.activeUplinkPort = [uplink_port_name(dvswitchname, pnic)
+                                                               for pnic in active_uplinks]
+            teaming_policy.uplinkPortOrder.standbyUplinkPort = []
+        dv_pg_spec.defaultPortConfig.uplinkTeamingPolicy = teaming_policy
+
+    return dv_pg_spec
+
+
+def portgroup_teaming(port_config):
+    """
+    Returns (teaming policy, active uplink port names) of a port group's defaultPortConfig, None and [] if not set
+    """
+    teaming_policy = getattr(port_config, "uplinkTeamingPolicy", None)
+    policy = getattr(getattr(teaming_policy, "policy", None), "value", None)
+    order = getattr(teaming_policy, "uplinkPortOrder", None)
+    return policy, list(getattr(order, "activeUplinkPort", None) or [])
+
+
+def vm_nic_config_spec(vm, portgroup_key, switch_uuid):
+    """
+    ConfigSpec moving every NIC of vm onto a port group, connected and with wake on LAN, in one reconfigure
+    """
+    device_change = []
+
+    for device in vm.config.hardware.device:
+        if isinstance(device, vim.vm.device.VirtualEthernetCard):
+            nicspec = vim.vm.device.VirtualDeviceSpec()
+            nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+            nicspec.device = device
+            nicspec.device.wakeOnLanEnabled = True
+
+            dvs_port_connection = vim.dvs.PortConnection()
+            dvs_port_connection.portgroupKey = portgroup_key
+            dvs_port_connection.switchUuid = switch_uuid
+            nicspec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+            nicspec.device.backing.port = dvs_port_connection
+
+            nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+            nicspec.device.connectable.connected = True
+            nicspec.device.connectable.startConnected = True
+            nicspec.device.connectable.allowGuestControl = True
+            device_change.append(nicspec)
+
+    return vim.vm.ConfigSpec(deviceChange=device_change)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+"""
+Desired-state VDS layout and diff engine for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+The layout configure_vds.py builds (switch names, uplinks, port groups and where their VLAN IDs come from, vmk and C&C
+VM placement) can be described in a JSON or YAML state file, see vds_layout.json for the NDE default.  The state file
+is compared against one bulk snapshot of the inventory and only the missing pieces are turned into an ordered change
+set, so re-running after a partial failure picks up where things stopped and a run against a finished environment is
+a no-op.
+
+State file format
+-----------------
+source_switch         name of the switch being split
+clusters              optional list of cluster names, defaults to every host on the source switch
+switches              switch name -> {uplinks: [vmnics], mtu, max_ports, version}
+portgroups            port group name -> {switch, vlan or vlan_from, teaming, active_uplinks, ports}
+vmks                  vmk device -> port group name
+vms                   VM name -> port group name
+remove_source_switch  remove the source switch once nothing is left on it
+"""
+
+import json
+
+from itertools import groupby
+
+from pyVmomi import vim
+
+from vds_planner import network_state, plan_host_migration, build_network_config, uplink_port_name, STAGE_NAMES
+from vds_specs import dvswitch_create_spec, portgroup_config_spec, portgroup_teaming, vm_nic_config_spec
+from vsphere_util import collect_properties, wait_for_tasks
+
+
+''' Order the change set is applied in.  Changes of the same kind are submitted together '''
+CHANGE_ORDER = ["rename_portgroup", "create_switch", "add_switch_hosts", "rename_uplink_portgroup",
+                "create_portgroup", "update_portgroup", "migrate_host_" + STAGE_NAMES[0], "move_vm",
+                "migrate_host_" + STAGE_NAMES[1], "delete_switch"]
+
+
+def load_desired_state(path):
+    """
+    Load and validate a desired-state file.  YAML files need PyYAML, JSON files need nothing extra.
+    """
+    with open(path) as f:
+        if path.endswith(".yaml") or path.endswith(".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise Exception("PyYAML is needed to read the YAML state file %s" % path)
+            desired = yaml.safe_load(f)
+        else:
+            desired = json.load(f)
+
+    problems = validate_desired_state(desired)
+    if problems:
+        raise Exception("Invalid state file %s:\n  %s" % (path, "\n  ".join(problems)))
+
+    return desired
+
+
+def validate_desired_state(desired):
+    """
+    Returns a list of problems with a desired state, empty if there are none
+    """
+    problems = []
+
+    for key in ["source_switch", "switches", "portgroups"]:
+        if key not in desired:
+            problems.append("missing " + key)
+    if problems:
+        return problems
+
+    for switchname, switch in desired["switches"].items():
+        if not switch.get("uplinks"):
+            problems.append("switch %s has no uplinks" % switchname)
+
+    for portgroupname, portgroup in desired["portgroups"].items():
+        switch = desired["switches"].get(portgroup.get("switch"))
+        if switch is None:
+            problems.append("port group %s is on unknown switch %s" % (portgroupname, portgroup.get("switch")))
+            continue
+        if "vlan" not in portgroup and "vlan_from" not in portgroup:
+            problems.append("port group %s needs vlan or vlan_from" % portgroupname)
+        for pnic in portgroup.get("active_uplinks", []):
+            if pnic not in switch["uplinks"]:
+                problems.append("port group %s uses %s which is not an uplink of %s" %
+                                (portgroupname, pnic, portgroup["switch"]))
+
+    for section in ["vmks", "vms"]:
+        for name, portgroupname in desired.get(section, {}).items():
+            if portgroupname not in desired["portgroups"]:
+                problems.append("%s is mapped to unknown port group %s" % (name, portgroupname))
+
+    return problems
+
+
+def desired_layout(desired):
+    """
+    Planner layout for a desired state, returns (target uplinks, target vmks).
+    A vmk is pinned to a vmnic when its port group uses explicit failover with a single active uplink.
+    """
+    target_uplinks = dict((switchname, list(switch["uplinks"])) for switchname, switch in desired["switches"].items())
+    target_vmks = dict()
+
+    for vmk, portgroupname in desired.get("vmks", {}).items():
+        portgroup = desired["portgroups"][portgroupname]
+        active = portgroup.get("active_uplinks", [])
+        pin = active[0] if portgroup.get("teaming") == "failover_explicit" and len(active) == 1 else None
+        target_vmks[vmk] = (portgroup["switch"], portgroupname, pin)
+
+    return target_uplinks, target_vmks
+
+
+def take_snapshot(si):
+    """
+    Read everything the diff engine needs in a handful of bulk PropertyCollector calls.
+    """
+    snapshot = {"switches": dict(), "portgroups": dict(), "hosts": dict(), "vms": dict()}
+
+    clusters = dict((cluster, props.get("name"))
+                    for cluster, props in collect_properties(si, vim.ClusterComputeResource, ["name"]))
+
+    switch_names = dict()
+    for dvswitch, props in collect_properties(si, vim.DistributedVirtualSwitch,
+                                              ["name", "uuid", "config.host", "config.uplinkPortgroup"]):
+        switch_names[dvswitch] = props["name"]
+        snapshot["switches"][props["name"]] = {
+            "obj": dvswitch,
+            "uuid": props.get("uuid"),
+            "hosts": set(member.config.host for member in props.get("config.host") or []),
+            "uplink_portgroups": list(props.get("config.uplinkPortgroup") or []),
+        }
+
+    portgroup_names = dict()
+    for portgroup, props in collect_properties(si, vim.dvs.DistributedVirtualPortgroup,
+                                               ["name", "key", "config.distributedVirtualSwitch",
+                                                "config.defaultPortConfig"]):
+        port_config = props.get("config.defaultPortConfig")
+        vlan = getattr(getattr(port_config, "vlan", None), "vlanId", None)
+        teaming, active_uplinks = portgroup_teaming(port_config)
+        portgroup_names[portgroup] = props["name"]
+        snapshot["portgroups"][props["name"]] = {
+            "obj": portgroup,
+            "key": props["key"],
+            "switch": switch_names.get(props.get("config.distributedVirtualSwitch")),
+            "vlan": vlan,
+            "teaming": teaming,
+            "active_uplinks": active_uplinks,
+        }
+
+    for switch in snapshot["switches"].values():
+        switch["uplink_portgroup_names"] = [portgroup_names.get(pg) for pg in switch["uplink_portgroups"]]
+
+    for host, props in collect_properties(si, vim.HostSystem, ["name", "parent", "config.network.proxySwitch",
+                                                              "config.network.vnic"]):
+        snapshot["hosts"][props["name"]] = {
+            "obj": host,
+            "cluster": clusters.get(props.get("parent")),
+            "state": network_state(props.get("config.network.proxySwitch") or [],
+                                   props.get("config.network.vnic") or []),
+        }
+
+    portgroup_by_key = dict((portgroup["key"], (name, portgroup["switch"]))
+                            for name, portgroup in snapshot["portgroups"].items())
+
+    for vm, props in collect_properties(si, vim.VirtualMachine, ["name", "config.hardware.device"]):
+        networks = []
+        for device in props.get("config.hardware.device") or []:
+            if isinstance(device, vim.vm.device.VirtualEthernetCard):
+                port = getattr(device.backing, "port", None)
+                networks.append(portgroup_by_key.get(port.portgroupKey) if port is not None else (None, None))
+        snapshot["vms"][props["name"]] = {"obj": vm, "networks": networks}
+
+    return snapshot
+
+
+def hosts_in_scope(desired, snapshot):
+    """
+    Names of the hosts the desired state applies to
+    """
+    if desired.get("clusters"):
+        return sorted(name for name, host in snapshot["hosts"].items() if host["cluster"] in desired["clusters"])
+
+    source = snapshot["switches"].get(desired["source_switch"])
+    if source is None:
+        ''' source switch already removed, every host on the new switches is in scope '''
+        members = set()
+        for switchname in desired["switches"]:
+            if switchname in snapshot["switches"]:
+                members |= snapshot["switches"][switchname]["hosts"]
+    else:
+        members = source["hosts"]
+
+    return sorted(name for name, host in snapshot["hosts"].items() if host["obj"] in members)
+
+
+def resolve_vlan(portgroupname, portgroup, desired, snapshot):
+    """
+    VLAN ID for a desired port group: explicit vlan, or copied from the source port group named by vlan_from (which
+    may already have been renamed to <name>_1), or from the desired port group itself if it already exists.
+    """
+    if "vlan" in portgroup:
+        return portgroup["vlan"]
+
+    source_switch = desired["source_switch"]
+    for candidate in [portgroup["vlan_from"], portgroup["vlan_from"] + "_1"]:
+        current = snapshot["portgroups"].get(candidate)
+        if current is not None and current["switch"] == source_switch:
+            return current["vlan"]
+
+    existing = snapshot["portgroups"].get(portgroupname)
+    if existing is not None and existing["switch"] == portgroup["switch"]:
+        return existing["vlan"]
+
+    raise Exception("Unable to find the VLAN ID for %s, %s does not exist on %s" %
+                    (portgroupname, portgroup["vlan_from"], source_switch))
+
+
+def diff_state(desired, snapshot):
+    """
+    Compare a desired state with an inventory snapshot.
+    Returns the ordered change set, a list of (action, name, detail)
+    """
+    changes = []
+    source_switch = desired["source_switch"]
+    scope = hosts_in_scope(desired, snapshot)
+    target_uplinks, target_vmks = desired_layout(desired)
+
+    ''' port groups whose name is taken on another switch are renamed out of the way first, as a port group can't be
+    moved between switches.  On the source switch that is <name>_1, where resolve_vlan() looks for it, anywhere else
+    the first free <name>_<n> '''
+    taken = set(snapshot["portgroups"])
+    for portgroupname, portgroup in desired["portgroups"].items():
+        current = snapshot["portgroups"].get(portgroupname)
+        if current is not None and current["switch"] != portgroup["switch"]:
+            n = 1
+            while current["switch"] != source_switch and portgroupname + "_%d" % n in taken:
+                n += 1
+            taken.add(portgroupname + "_%d" % n)
+            changes.append(("rename_portgroup", portgroupname, portgroupname + "_%d" % n))
+
+    for switchname, switch in desired["switches"].items():
+        current = snapshot["switches"].get(switchname)
+        if current is None:
+            changes.append(("create_switch", switchname, scope))
+            changes.append(("rename_uplink_portgroup", switchname, switchname + " Uplinks"))
+            continue
+
+        missing = [name for name in scope if snapshot["hosts"][name]["obj"] not in current["hosts"]]
+        if missing:
+            changes.append(("add_switch_hosts", switchname, missing))
+
+        if switchname + " Uplinks" not in current["uplink_portgroup_names"]:
+            changes.append(("rename_uplink_portgroup", switchname, switchname + " Uplinks"))
+
+    for portgroupname, portgroup in desired["portgroups"].items():
+        vlan = resolve_vlan(portgroupname, portgroup, desired, snapshot)
+        current = snapshot["portgroups"].get(portgroupname)
+        if current is None or current["switch"] != portgroup["switch"]:
+            changes.append(("create_portgroup", portgroupname, vlan))
+        elif current["vlan"] != vlan or not teaming_matches(portgroup, current):
+            changes.append(("update_portgroup", portgroupname, vlan))
+
+    for hostname in scope:
+        for stage in plan_host_migration(snapshot["hosts"][hostname]["state"], source_switch,
+                                         target_uplinks, target_vmks):
+            changes.append(("migrate_host_" + stage[0], hostname, stage))
+
+    for vmname, portgroupname in desired.get("vms", {}).items():
+        vm = snapshot["vms"].get(vmname)
+        target = (portgroupname, desired["portgroups"][portgroupname]["switch"])
+        if vm is not None and any(network != target for network in vm["networks"]):
+            changes.append(("move_vm", vmname, portgroupname))
+
+    if desired.get("remove_source_switch") and source_switch in snapshot["switches"]:
+        members = snapshot["switches"][source_switch]["hosts"]
+        in_scope = set(snapshot["hosts"][name]["obj"] for name in scope)
+        if members <= in_scope:
+            changes.append(("delete_switch", source_switch, None))
+
+    changes.sort(key=lambda change: CHANGE_ORDER.index(change[0]))
+    return changes
+
+
+def teaming_matches(portgroup, current):
+    """
+    True if a port group in the snapshot has the teaming policy and active uplinks a desired port group asks for.
+    Either one left out of the desired port group isn't checked
+    """
+    if portgroup.get("teaming") and current["teaming"] != portgroup["teaming"]:
+        return False
+    if portgroup.get("teaming") and portgroup.get("active_uplinks"):
+        active = [uplink_port_name(portgroup["switch"], pnic) for pnic in portgroup["active_uplinks"]]
+        if current["active_uplinks"] != active:
+            return False
+    return True
+
+
+def describe_change(change):
+    action, name, detail = change
+
+    if action in ("create_switch", "add_switch_hosts"):
+        return "%s %s (%d hosts)" % (action, name, len(detail))
+    if action.startswith("migrate_host_"):
+        vmks = ", ".join(sorted(detail[2].keys())) or "no vmks"
+        return "%s %s: uplinks on %s, %s" % (action, name, ", ".join(detail[1].keys()), vmks)
+    if detail is None:
+        return "%s %s" % (action, name)
+    return "%s %s -> %s" % (action, name, detail)
+
+
+def portgroup_spec(portgroupname, desired, vlan):
+    portgroup = desired["portgroups"][portgroupname]
+    return portgroup_config_spec(portgroupname, vlan, portgroup["switch"], portgroup.get("teaming"),
+                                 portgroup.get("active_uplinks", []), portgroup.get("ports", 32))
+
+
+def apply_changes(si, dc, desired, snapshot, changes, on_change=None):
+    """
+    Apply an ordered change set.  Consecutive changes of the same kind that are independent of each other (renames,
+    switch and port group creation, VM moves) are submitted together and waited on as a group.  Host migrations are
+    applied one host at a time.  on_change(change) is called after each change completes, if given.
+    """
+    switches = dict((name, switch["obj"]) for name, switch in snapshot["switches"].items())
+    portgroups = dict((name, portgroup["obj"]) for name, portgroup in snapshot["portgroups"].items())
+    hosts = dict((name, host["obj"]) for name, host in snapshot["hosts"].items())
+
+    for action, group in groupby(changes, key=lambda change: change[0]):
+        group = list(group)
+        tasks = []
+
+        for change in group:
+            print("Applying " + describe_change(change))
+            name, detail = change[1], change[2]
+
+            if action == "rename_portgroup":
+                tasks.append(portgroups[name].Rename(detail))
+
+            elif action == "create_switch":
+                switch = desired["switches"][name]
+                spec = dvswitch_create_spec(name, switch["uplinks"], [hosts[hostname] for hostname in detail],
+                                            switch.get("mtu", 9000), switch.get("max_ports", 60000),
+                                            switch.get("version", "6.5.0"))
+                tasks.append(dc.networkFolder.CreateDVS_Task(spec))
+
+            elif action == "add_switch_hosts":
+                spec = vim.DistributedVirtualSwitch.ConfigSpec()
+                spec.configVersion = switches[name].config.configVersion
+                for hostname in detail:
+                    spec.host.append(vim.dvs.HostMember.ConfigSpec(operation=vim.ConfigSpecOperation.add,
+                                                                   host=hosts[hostname]))
+                tasks.append(switches[name].ReconfigureDvs_Task(spec))
+
+            elif action == "rename_uplink_portgroup":
+                tasks.append(switches[name].config.uplinkPortgroup[0].Rename(detail))
+
+            elif action == "create_portgroup":
+                tasks.append(switches[desired["portgroups"][name]["switch"]].AddDVPortgroup_Task(
+                    [portgroup_spec(name, desired, detail)]))
+
+            elif action == "update_portgroup":
+                spec = portgroup_spec(name, desired, detail)
+                spec.configVersion = portgroups[name].config.configVersion
+                tasks.append(portgroups[name].ReconfigureDVPortgroup_Task(spec))
+
+            elif action.startswith("migrate_host_"):
+                host = hosts[name]
+                state = network_state(host.config.network.proxySwitch, host.config.network.vnic)
+                config = build_network_config(state, detail, switches, portgroups)
+                host.configManager.networkSystem.UpdateNetworkConfig(config, "modify")
+
+            elif action == "move_vm":
+                portgroup = portgroups[detail]
+                switch_uuid = switches[desired["portgroups"][detail]["switch"]].uuid
+                vm = snapshot["vms"][name]["obj"]
+                tasks.append(vm.ReconfigVM_Task(vm_nic_config_spec(vm, portgroup.key, switch_uuid)))
+
+            elif action == "delete_switch":
+                tasks.append(switches[name].Destroy_Task())
+
+            ''' host migrations are synchronous, everything else completes when its task does '''
+            if action.startswith("migrate_host_") and on_change is not None:
+                on_change(change)
+
+        wait_for_tasks(si, tasks)
+
+        if not action.startswith("migrate_host_") and on_change is not None:
+            for change in group:
+                on_change(change)
+
+        ''' pick up newly created objects by name for the changes that follow '''
+        if action == "create_switch":
+            for change, task in zip(group, tasks):
+                switches[change[1]] = task.info.result
+        if action == "create_portgroup":
+            for switch in set(switches[desired["portgroups"][change[1]]["switch"]] for change in group):
+                for portgroup in switch.portgroup:
+                    portgroups[portgroup.name] = portgroup
+
+    return len(changes)
+
+
+def reconcile(si, dc, desired, dry_run=False):
+    """
+    Snapshot, diff and apply a desired state.  Returns the change set that was (or with dry_run, would be) applied.
+    """
+    snapshot = take_snapshot(si)
+    changes = diff_state(desired, snapshot)
+
+    if not changes:
+        print("Inventory already matches the desired state, nothing to do.")
+        return changes
+
+    print("%d change(s) needed:" % len(changes))
+    for change in changes:
+        print("  " + describe_change(change))
+
+    if not dry_run:
+        apply_changes(si, dc, desired, snapshot, changes)
+
+    return changes
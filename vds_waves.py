@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Rolling-wave scheduler for configure_vds.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Hosts are migrated in waves rather than one at a time or all at once.  A single canary host goes first, then waves of
+1, 2, 4, 8... hosts, so throughput grows as confidence grows.  Every host in a wave is migrated in parallel.  After
+each wave the health gates are checked for the hosts in that wave:
+
+    - the host is still connected to vCenter
+    - vmk0 is reachable, i.e. it still has its IP address and vCenter still manages the host through it
+    - no iSCSI paths were lost compared with before the migration
+
+All the gates are read for every host in the wave with one batched PropertyCollector read per pass, not by polling the
+hosts one by one.  A host that has just had its vmks moved can take a little while to settle, so the gates are
+re-checked until they pass or the gate timeout runs out.  A wave that fails its gates stops the rollout.
+"""
+
+import contextlib
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+import tracing
+
+from vsphere_util import collect_properties
+
+
+HEALTH_PROPERTIES = ["name", "runtime.connectionState", "config.network.vnic", "config.storageDevice.hostBusAdapter",
+                     "config.storageDevice.multipathInfo"]
+
+LIVE_PATH_STATES = ["active", "standby"]
+
+
+def plan_waves(hosts, max_wave_size=None):
+    """
+    Split a list of hosts into a canary wave of one host followed by waves of 1, 2, 4, 8... hosts, no wave larger
+    than max_wave_size if given.
+    Returns a list of lists of hosts
+    """
+    remaining = list(hosts)
+    waves = []
+    size = 1
+
+    if remaining:
+        waves.append(remaining[:1])
+        remaining = remaining[1:]
+
+    while remaining:
+        if max_wave_size:
+            size = min(size, max_wave_size)
+        waves.append(remaining[:size])
+        remaining = remaining[size:]
+        size *= 2
+
+    return waves
+
+
+def host_health(props):
+    """
+    Work out the health gate values for one host from its HEALTH_PROPERTIES.
+    Returns a dictionary of connected, vmk0 IP address (or None) and live / dead iSCSI path counts
+    """
+    vmk0_ip = None
+    for vnic in props.get("config.network.vnic") or []:
+        if vnic.device == "vmk0" and vnic.spec.ip is not None:
+            vmk0_ip = vnic.spec.ip.ipAddress or None
+
+    iscsi_adapters = set(hba.key for hba in props.get("config.storageDevice.hostBusAdapter") or []
+                         if isinstance(hba, vim.host.InternetScsiHba))
+
+    live = 0
+    dead = 0
+    multipath = props.get("config.storageDevice.multipathInfo")
+    for lun in (multipath.lun if multipath is not None else []):
+        for path in lun.path:
+            if path.adapter not in iscsi_adapters:
+                continue
+            if path.state in LIVE_PATH_STATES:
+                live += 1
+            else:
+                dead += 1
+
+    return {"connected": props.get("runtime.connectionState") == vim.HostSystem.ConnectionState.connected,
+            "vmk0": vmk0_ip,
+            "iscsi_live": live,
+            "iscsi_dead": dead}
+
+
+def read_health(si, hosts, container=None, limiter=None):
+    """
+    Read the health gates of the given hosts in one batched property read over container (e.g. their cluster), holding
+    a slot of limiter (a semaphore shared with other vCenter operations) if one is given.
+    Returns a dictionary of host -> host_health()
+    """
+    wanted = set(hosts)
+    with limiter or contextlib.nullcontext():
+        return dict((host, host_health(props))
+                    for host, props in collect_properties(si, vim.HostSystem, HEALTH_PROPERTIES, container)
+                    if host in wanted)
+
+
+def gate_problems(health, baseline):
+    """
+    Compare the health of each host with its baseline from before the wave.
+    Returns a dictionary of host -> list of problems, empty if every gate passed
+    """
+    problems = dict()
+
+    for host, before in baseline.items():
+        now = health.get(host)
+        found = []
+
+        if now is None or not now["connected"]:
+            found.append("not connected to vCenter")
+        else:
+            if now["vmk0"] is None:
+                found.append("vmk0 is not reachable")
+            if now["iscsi_live"] < before["iscsi_live"]:
+                found.append("iSCSI paths down, %d of %d live" % (now["iscsi_live"], before["iscsi_live"]))
+
+        if found:
+            problems[host] = found
+
+    return problems
+
+
+def wait_for_health(si, baseline, container=None, gate_timeout=300, poll_interval=10, limiter=None):
+    """
+    Re-check the health gates of the hosts in baseline until they all pass or gate_timeout seconds have gone by.
+    Returns the problems from the last check, empty if every gate passed
+    """
+    deadline = time.time() + gate_timeout
+
+    while True:
+        problems = gate_problems(read_health(si, list(baseline), container, limiter), baseline)
+        if not problems or time.time() >= deadline:
+            return problems
+        tracing.sleep(poll_interval, "wait for health gates")
+
+
+def run_waves(si, hosts, apply, container=None, max_wave_size=None, gate_timeout=300, prefix="", limiter=None):
+    """
+    Call apply(host) for every host, wave by wave, checking the health gates after each wave.  The health reads hold
+    a slot of limiter if one is given.
+    Raises an Exception and stops the rollout if a host fails to migrate or a wave fails its health gates.
+    """
+    if not hosts:
+        return
+
+    baseline = read_health(si, hosts, container, limiter)
+
+    unhealthy = [host.name for host in hosts if not baseline.get(host, {}).get("connected")]
+    if unhealthy:
+        raise Exception(prefix + "Host(s) not connected before the migration started: " + ", ".join(unhealthy))
+
+    for number, wave in enumerate(plan_waves(hosts, max_wave_size)):
+        if number == 0:
+            print(prefix + "Wave 0 (canary): " + wave[0].name)
+        else:
+            print(prefix + "Wave " + str(number) + ": " + ", ".join(host.name for host in wave))
+
+        with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+            futures = [(host, executor.submit(tracing.wrap(apply), host)) for host in wave]
+
+        failed = []
+        for host, future in futures:
+            if future.exception() is not None:
+                failed.append(host.name + ": " + str(future.exception()))
+        if failed:
+            raise Exception(prefix + "Wave " + str(number) + " failed, stopping the rollout.  " + "; ".join(failed))
+
+        problems = wait_for_health(si, dict((host, baseline[host]) for host in wave), container, gate_timeout,
+                                   limiter=limiter)
+        if problems:
+            raise Exception(prefix + "Wave " + str(number) + " failed its health gates, stopping the rollout.  " +
+                            "; ".join(host.name + ": " + ", ".join(found) for host, found in problems.items()))
+
+        print(prefix + "Wave " + str(number) + " healthy")
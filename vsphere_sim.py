@@ -0,0 +1,778 @@
+#!/usr/bin/env python3
+
+"""
+Offline vSphere API simulator for pyNSXdeploy
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+An in-process stand-in for the parts of pyVmomi that configure_vds.py and its helper modules use, so the scripts can
+be run and timed without a vCenter.  install() puts fake pyVmomi and pyvim.connect modules in sys.modules.  After that
+the scripts import and run as usual, and SmartConnectNoSSL() hands back the simulated inventory.
+
+The simulated inventory is a datacenter with one cluster of hosts laid out the way NDE leaves a 6 cable setup.  There
+is one "NetApp HCI VDS" with vmnic0-5, vmk0-3 and the NDE port groups, iSCSI paths on vmhba64, the C&C VMs and
+optionally some guest VMs per host.
+
+Every API call is counted and costs a configurable round trip latency, just as it would against a real vCenter.  That
+includes each property read of a managed object, which pyVmomi turns into a RetrieveProperties call.  Tasks make their
+change when they are submitted and report success once the configurable task duration has passed.  Like vCenter, the
+simulator refuses changes that would break a host, such as a vmnic claimed by two switches, a vmk left on a switch with
+no uplinks, or removing a switch or port group that is still in use.
+"""
+
+import copy
+import itertools
+import sys
+import threading
+import time
+import types
+
+from collections import Counter
+
+
+class DataObject(object):
+    """
+    Base of the simulated data objects.  Array properties start out as empty lists, anything unset reads as None.
+    """
+    _arrays = ()
+
+    def __init__(self, **kwargs):
+        for name in self._arrays:
+            setattr(self, name, [])
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return None
+
+
+def data_type(name, arrays=(), base=DataObject):
+    return type(name, (base,), {"_arrays": tuple(arrays)})
+
+
+def enum(*values):
+    return types.SimpleNamespace(**dict((value, value) for value in values))
+
+
+class MethodFault(Exception):
+    def __init__(self, msg=""):
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+
+class ManagedObject(object):
+    """
+    Base of the simulated managed objects.  Property reads go through the simulator so they are counted, cost a round
+    trip and hand back a copy, as they would from pyVmomi.
+    """
+    def __init__(self, sim, moid, **props):
+        self._sim = sim
+        self._moId = moid
+        self._props = props
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._sim.read(self, name)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "'%s:%s'" % (getattr(type(self), "_wsdl", "vim." + type(self).__name__), self._moId)
+
+    def _get(self, name):
+        return self._props.get(name)
+
+
+''' vmodl '''
+
+vmodl = types.SimpleNamespace()
+vmodl.MethodFault = MethodFault
+vmodl.DynamicProperty = data_type("DynamicProperty")
+vmodl.query = types.SimpleNamespace()
+
+
+MethodInfo = data_type("MethodInfo")
+PropertyInfo = data_type("PropertyInfo")
+
+
+class SoapStub(object):
+    """
+    Where every simulated API call and property read goes, as they go through the SoapStubAdapter of a pyVmomi session,
+    so they can be counted, made to cost a round trip and wrapped (see tracing.trace_vsphere()) the same way
+    """
+    def __init__(self, sim):
+        self.sim = sim
+
+    def InvokeMethod(self, mo, info, answer=None):
+        with self.sim.lock:
+            self.sim.calls[info.name] += 1
+        if self.sim.latency:
+            time.sleep(self.sim.latency)
+        return answer() if answer is not None else None
+
+    def InvokeAccessor(self, mo, info):
+        self.InvokeMethod(mo, MethodInfo(name="PropertyRead", wsdlName="PropertyRead"))
+        with self.sim.lock:
+            return copy.deepcopy(mo._get(info.name))
+
+
+class PropertyCollector(ManagedObject):
+
+    def RetrieveContents(self, specSet):
+        self._sim.call("RetrieveContents", self)
+        return [obj_content for spec in specSet for obj_content in self._sim.retrieve(spec)]
+
+    def RetrievePropertiesEx(self, specSet, options=None):
+        self._sim.call("RetrievePropertiesEx", self)
+        objects = [obj_content for spec in specSet for obj_content in self._sim.retrieve(spec)]
+        page_size = options.maxObjects if options is not None and options.maxObjects else len(objects) or 1
+        return self._sim.page(objects, page_size)
+
+    def ContinueRetrievePropertiesEx(self, token):
+        self._sim.call("ContinueRetrievePropertiesEx", self)
+        objects, page_size = self._sim.pages.pop(token)
+        return self._sim.page(objects, page_size)
+
+
+PropertyCollector.ObjectSpec = data_type("ObjectSpec", ["selectSet"])
+PropertyCollector.PropertySpec = data_type("PropertySpec", ["pathSet"])
+PropertyCollector.FilterSpec = data_type("FilterSpec", ["objectSet", "propSet"])
+PropertyCollector.TraversalSpec = data_type("TraversalSpec", ["selectSet"])
+PropertyCollector.RetrieveOptions = data_type("RetrieveOptions")
+PropertyCollector.ObjectContent = data_type("ObjectContent", ["propSet"])
+PropertyCollector.RetrieveResult = data_type("RetrieveResult", ["objects"])
+vmodl.query.PropertyCollector = PropertyCollector
+
+
+''' vim managed objects '''
+
+vim = types.SimpleNamespace()
+vim.fault = types.SimpleNamespace(DuplicateName=type("DuplicateName", (MethodFault,), {}),
+                                  ResourceInUse=type("ResourceInUse", (MethodFault,), {}),
+                                  NotFound=type("NotFound", (MethodFault,), {}),
+                                  InvalidLogin=type("InvalidLogin", (MethodFault,), {}),
+                                  PlatformConfigFault=type("PlatformConfigFault", (MethodFault,), {}))
+
+
+class Task(ManagedObject):
+
+    def _get(self, name):
+        if name == "info":
+            info = self._props["info"]
+            if info.state == "running" and time.time() >= self._props["finish"]:
+                info.state = "error" if info.error is not None else "success"
+            return info
+        return ManagedObject._get(self, name)
+
+
+Task.Info = data_type("TaskInfo")
+vim.Task = Task
+vim.TaskInfo = types.SimpleNamespace(State=enum("queued", "running", "success", "error"))
+
+
+class ManagedEntity(ManagedObject):
+
+    def Rename(self, newName):
+        return self._sim.submit("Rename", self._sim.rename, self, newName)
+
+    Rename_Task = Rename
+
+    def Destroy_Task(self):
+        return self._sim.submit("Destroy_Task", self._sim.destroy, self)
+
+
+class Folder(ManagedEntity):
+
+    def CreateDVS_Task(self, spec):
+        return self._sim.submit("CreateDVS_Task", self._sim.create_dvs, self, spec)
+
+
+class Datacenter(ManagedEntity):
+    pass
+
+
+class ClusterComputeResource(ManagedEntity):
+    pass
+
+
+class HostSystem(ManagedEntity):
+    ConnectionState = enum("connected", "notResponding", "disconnected")
+
+
+class HostNetworkSystem(ManagedObject):
+
+    def UpdateNetworkConfig(self, config, changeMode):
+        self._sim.call("UpdateNetworkConfig", self)
+        self._sim.update_network_config(self._props["host"], config)
+        return vim.host.NetworkConfig.Result()
+
+
+class VirtualMachine(ManagedEntity):
+
+    def ReconfigVM_Task(self, spec):
+        return self._sim.submit("ReconfigVM_Task", self._sim.reconfigure_vm, self, spec)
+
+
+class Network(ManagedEntity):
+    pass
+
+
+class DistributedVirtualPortgroup(Network):
+    _wsdl = "vim.dvs.DistributedVirtualPortgroup"
+
+    def ReconfigureDVPortgroup_Task(self, spec):
+        return self._sim.submit("ReconfigureDVPortgroup_Task", self._sim.reconfigure_portgroup, self, spec)
+
+
+class DistributedVirtualSwitch(ManagedEntity):
+
+    def AddDVPortgroup_Task(self, spec):
+        return self._sim.submit("AddDVPortgroup_Task", self._sim.add_portgroups, self, spec)
+
+    def ReconfigureDvs_Task(self, spec):
+        return self._sim.submit("ReconfigureDvs_Task", self._sim.reconfigure_dvs, self, spec)
+
+
+class VmwareDistributedVirtualSwitch(DistributedVirtualSwitch):
+    _wsdl = "vim.dvs.VmwareDistributedVirtualSwitch"
+
+
+class Datastore(ManagedEntity):
+    pass
+
+
+class ResourcePool(ManagedEntity):
+    pass
+
+
+class LicenseManager(ManagedObject):
+
+    def AddLicense(self, licenseKey, labels=None):
+        self._sim.call("AddLicense", self)
+        with self._sim.lock:
+            self._props["licenses"].append(licenseKey)
+        return vim.LicenseManager.LicenseInfo(licenseKey=licenseKey)
+
+
+class LicenseAssignmentManager(ManagedObject):
+
+    def QueryAssignedLicenses(self, entityId=None):
+        self._sim.call("QueryAssignedLicenses", self)
+        with self._sim.lock:
+            return [vim.LicenseAssignmentManager.LicenseAssignment(entityId=entity, assignedLicense=key)
+                    for entity, key in self._props["assigned"].items()]
+
+    def UpdateAssignedLicense(self, entity, licenseKey, entityDisplayName=None):
+        self._sim.call("UpdateAssignedLicense", self)
+        with self._sim.lock:
+            self._props["assigned"][entity] = licenseKey
+        return vim.LicenseManager.LicenseInfo(licenseKey=licenseKey)
+
+
+class ContainerView(ManagedObject):
+
+    def Destroy(self):
+        self._sim.call("DestroyView", self)
+
+
+class ViewManager(ManagedObject):
+
+    def CreateContainerView(self, container, type, recursive):
+        self._sim.call("CreateContainerView", self)
+        return self._sim.container_view(container, type)
+
+
+vim.Folder = Folder
+vim.Datacenter = Datacenter
+vim.ClusterComputeResource = ClusterComputeResource
+vim.HostSystem = HostSystem
+vim.HostNetworkSystem = HostNetworkSystem
+vim.VirtualMachine = VirtualMachine
+vim.Network = Network
+vim.DistributedVirtualPortgroup = DistributedVirtualPortgroup
+vim.DistributedVirtualSwitch = DistributedVirtualSwitch
+vim.VmwareDistributedVirtualSwitch = VmwareDistributedVirtualSwitch
+vim.Datastore = Datastore
+vim.ResourcePool = ResourcePool
+vim.LicenseManager = LicenseManager
+vim.LicenseAssignmentManager = LicenseAssignmentManager
+vim.view = types.SimpleNamespace(ContainerView=ContainerView, ViewManager=ViewManager)
+vim.ServiceInstanceContent = data_type("ServiceInstanceContent")
+
+
+''' vim data objects '''
+
+vim.ConfigSpecOperation = enum("add", "edit", "remove")
+vim.BoolPolicy = data_type("BoolPolicy")
+vim.StringPolicy = data_type("StringPolicy")
+vim.KeyValue = data_type("KeyValue")
+LicenseManager.LicenseInfo = data_type("LicenseManagerLicenseInfo")
+LicenseAssignmentManager.LicenseAssignment = data_type("LicenseAssignmentManagerLicenseAssignment")
+
+DistributedVirtualSwitch.CreateSpec = data_type("DVSCreateSpec")
+DistributedVirtualSwitch.ConfigSpec = data_type("DVSConfigSpec", ["host"])
+DistributedVirtualSwitch.ConfigInfo = data_type("DVSConfigInfo", ["host", "uplinkPortgroup"])
+DistributedVirtualSwitch.NameArrayUplinkPortPolicy = data_type("DVSNameArrayUplinkPortPolicy", ["uplinkPortName"])
+VmwareDistributedVirtualSwitch.ConfigSpec = data_type("VMwareDVSConfigSpec", ["host"],
+                                                      DistributedVirtualSwitch.ConfigSpec)
+
+DistributedVirtualPortgroup.ConfigSpec = data_type("DVPortgroupConfigSpec")
+DistributedVirtualPortgroup.ConfigInfo = data_type("DVPortgroupConfigInfo")
+DistributedVirtualPortgroup.PortgroupType = enum("earlyBinding", "lateBinding", "ephemeral")
+
+vim.dvs = types.SimpleNamespace()
+vim.dvs.DistributedVirtualPortgroup = DistributedVirtualPortgroup
+vim.dvs.PortConnection = data_type("DistributedVirtualSwitchPortConnection")
+vim.dvs.ProductSpec = data_type("DistributedVirtualSwitchProductSpec")
+vim.dvs.HostMember = types.SimpleNamespace(
+    ConfigSpec=data_type("DistributedVirtualSwitchHostMemberConfigSpec"),
+    ConfigInfo=data_type("DistributedVirtualSwitchHostMemberConfigInfo"),
+    PnicBacking=data_type("DistributedVirtualSwitchHostMemberPnicBacking", ["pnicSpec"]),
+    PnicSpec=data_type("DistributedVirtualSwitchHostMemberPnicSpec"),
+    Member=data_type("DistributedVirtualSwitchHostMember"))
+vim.dvs.VmwareDistributedVirtualSwitch = types.SimpleNamespace(
+    VmwarePortConfigPolicy=data_type("VMwareDVSPortSetting"),
+    SecurityPolicy=data_type("DVSSecurityPolicy"),
+    VlanIdSpec=data_type("VmwareDistributedVirtualSwitchVlanIdSpec"),
+    UplinkPortTeamingPolicy=data_type("VmwareUplinkPortTeamingPolicy"),
+    UplinkPortOrderPolicy=data_type("VMwareUplinkPortOrderPolicy", ["activeUplinkPort", "standbyUplinkPort"]))
+
+HostBusAdapter = data_type("HostHostBusAdapter")
+vim.host = types.SimpleNamespace()
+vim.host.NetworkConfig = data_type("HostNetworkConfig", ["proxySwitch", "vnic", "portgroup", "vswitch"])
+vim.host.NetworkConfig.Result = data_type("HostNetworkConfigResult")
+vim.host.NetworkInfo = data_type("HostNetworkInfo", ["proxySwitch", "vnic"])
+vim.host.HostProxySwitch = data_type("HostProxySwitch", ["uplinkPort"])
+vim.host.HostProxySwitch.Config = data_type("HostProxySwitchConfig")
+vim.host.HostProxySwitch.Specification = data_type("HostProxySwitchSpec")
+vim.host.VirtualNic = data_type("HostVirtualNic")
+vim.host.VirtualNic.Config = data_type("HostVirtualNicConfig")
+vim.host.VirtualNic.Specification = data_type("HostVirtualNicSpec")
+vim.host.IpConfig = data_type("HostIpConfig")
+vim.host.HostBusAdapter = HostBusAdapter
+vim.host.InternetScsiHba = data_type("HostInternetScsiHba", base=HostBusAdapter)
+vim.host.MultipathInfo = data_type("HostMultipathInfo", ["lun"])
+vim.host.MultipathInfo.LogicalUnit = data_type("HostMultipathInfoLogicalUnit", ["path"])
+vim.host.MultipathInfo.Path = data_type("HostMultipathInfoPath")
+vim.host.ConfigInfo = data_type("HostConfigInfo")
+vim.host.StorageDeviceInfo = data_type("HostStorageDeviceInfo", ["hostBusAdapter"])
+vim.host.RuntimeInfo = data_type("HostRuntimeInfo")
+vim.host.ConfigManager = data_type("HostConfigManager")
+
+VirtualDevice = data_type("VirtualDevice")
+VirtualDevice.ConnectInfo = data_type("VirtualDeviceConnectInfo")
+VirtualEthernetCard = data_type("VirtualEthernetCard", base=VirtualDevice)
+VirtualEthernetCard.DistributedVirtualPortBackingInfo = data_type(
+    "VirtualEthernetCardDistributedVirtualPortBackingInfo")
+VirtualEthernetCard.NetworkBackingInfo = data_type("VirtualEthernetCardNetworkBackingInfo")
+VirtualDeviceSpec = data_type("VirtualDeviceSpec")
+VirtualDeviceSpec.Operation = enum("add", "edit", "remove")
+
+vim.vm = types.SimpleNamespace()
+vim.vm.ConfigSpec = data_type("VirtualMachineConfigSpec", ["deviceChange"])
+vim.vm.ConfigInfo = data_type("VirtualMachineConfigInfo")
+vim.vm.VirtualHardware = data_type("VirtualHardware", ["device"])
+vim.vm.RuntimeInfo = data_type("VirtualMachineRuntimeInfo")
+vim.vm.device = types.SimpleNamespace(VirtualDevice=VirtualDevice,
+                                      VirtualEthernetCard=VirtualEthernetCard,
+                                      VirtualVmxnet3=data_type("VirtualVmxnet3", base=VirtualEthernetCard),
+                                      VirtualDeviceSpec=VirtualDeviceSpec)
+
+
+''' NDE layout the inventory is built with '''
+
+NDE_SWITCH = "NetApp HCI VDS"
+
+NDE_PORTGROUP_VLANS = [("VM_Network", 0), ("HCI_Internal_vCenter_Network", 0), ("HCI_Internal_OTS_Network", 0),
+                       ("HCI_Internal_mNode_Network", 0), ("vMotion", 3000), ("Management Network", 0),
+                       ("iSCSI-A", 3001), ("iSCSI-B", 3001), ("vCenter_Recovery_PG", 0)]
+
+NDE_VMKS = [("vmk0", "Management Network"), ("vmk1", "iSCSI-A"), ("vmk2", "iSCSI-B"), ("vmk3", "vMotion")]
+
+NDE_PNICS = ["vmnic0", "vmnic1", "vmnic2", "vmnic3", "vmnic4", "vmnic5"]
+
+CNC_VMS = [("NetApp-Management-Node", "HCI_Internal_mNode_Network"),
+           ("vCenter-Server-Appliance", "HCI_Internal_vCenter_Network"),
+           ("File Services powered by ONTAP-01", "HCI_Internal_OTS_Network")]
+
+
+class Simulator(object):
+    """
+    Simulated vCenter with an NDE style inventory of one cluster of num_hosts hosts.
+    latency is the round trip cost of every API call in seconds, task_seconds how long each task takes to finish.
+    """
+    def __init__(self, num_hosts=4, latency=0.002, task_seconds=0.05, vms_per_host=0, luns=4,
+                 datacenter="NetApp-HCI-Datacenter-01", cluster="NetApp-HCI-Cluster-01"):
+        self.latency = latency
+        self.task_seconds = task_seconds
+        self.password = None
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.objects = []
+        self.pages = dict()
+        self.ids = itertools.count(1)
+        self.stub = SoapStub(self)
+
+        self.property_collector = PropertyCollector(self, "propertyCollector")
+        self.content = vim.ServiceInstanceContent(rootFolder=self.mo(Folder, "group-d", name="Datacenters"),
+                                                  viewManager=ViewManager(self, "ViewManager"),
+                                                  propertyCollector=self.property_collector,
+                                                  licenseManager=LicenseManager(
+                                                      self, "LicenseManager", licenses=[],
+                                                      licenseAssignmentManager=LicenseAssignmentManager(
+                                                          self, "LicenseAssignmentManager", assigned=dict())))
+
+        network_folder = self.mo(Folder, "group-n", name="network", childEntity=[])
+        host_folder = self.mo(Folder, "group-h", name="host", childEntity=[])
+        datastores = [self.mo(Datastore, "datastore-", name="NetApp-HCI-Datastore-%02d" % (n + 1)) for n in range(2)]
+        dc = self.mo(Datacenter, "datacenter-", name=datacenter, networkFolder=network_folder, hostFolder=host_folder,
+                     datastore=datastores)
+        self.content.rootFolder._props["childEntity"] = [dc]
+        self.network_folder = network_folder
+
+        source = self.new_dvs(NDE_SWITCH, ["NetApp HCI Uplink %d" % (i + 1) for i in range(len(NDE_PNICS))],
+                              "NetApp HCI Uplinks")
+        for name, vlan in NDE_PORTGROUP_VLANS:
+            self.new_portgroup(source, name, vlan)
+        portgroups = dict((pg._props["name"], pg) for pg in source._props["portgroup"])
+
+        hosts = []
+        for i in range(num_hosts):
+            host = self.mo(HostSystem, "host-", name="esxi-%03d.hci.local" % (i + 1))
+            host._props["configManager"] = vim.host.ConfigManager(
+                networkSystem=HostNetworkSystem(self, "networkSystem-%d" % i, host=host))
+            host._props["runtime"] = vim.host.RuntimeInfo(connectionState="connected")
+
+            hba = vim.host.InternetScsiHba(key="key-vim.host.InternetScsiHba-vmhba64", device="vmhba64")
+            multipath = vim.host.MultipathInfo(lun=[
+                vim.host.MultipathInfo.LogicalUnit(path=[vim.host.MultipathInfo.Path(adapter=hba.key, state="active")
+                                                         for path in range(2)])
+                for lun in range(luns)])
+
+            host._props["config"] = vim.host.ConfigInfo(
+                network=vim.host.NetworkInfo(),
+                storageDevice=vim.host.StorageDeviceInfo(hostBusAdapter=[hba], multipathInfo=multipath))
+            self.join_dvs(source, host)
+
+            proxy = self.proxy(host, source)
+            proxy.spec.backing.pnicSpec = [vim.dvs.HostMember.PnicSpec(pnicDevice=pnic, uplinkPortKey=port.key)
+                                           for pnic, port in zip(NDE_PNICS, proxy.uplinkPort)]
+
+            for n, (vmk, portgroupname) in enumerate(NDE_VMKS):
+                pg = portgroups[portgroupname]
+                host._props["config"].network.vnic.append(vim.host.VirtualNic(
+                    device=vmk, portgroup="",
+                    spec=vim.host.VirtualNic.Specification(
+                        ip=vim.host.IpConfig(ipAddress="10.%d.%d.%d" % (n, i // 250, i % 250 + 1)),
+                        distributedVirtualPort=vim.dvs.PortConnection(switchUuid=source._props["uuid"],
+                                                                      portgroupKey=pg._props["key"]))))
+            hosts.append(host)
+
+        cluster_mo = self.mo(ClusterComputeResource, "domain-c", name=cluster, host=hosts, datastore=datastores,
+                             resourcePool=self.mo(ResourcePool, "resgroup-", name="Resources"))
+        host_folder._props["childEntity"].append(cluster_mo)
+
+        vms = [(name, portgroupname, hosts[0]) for name, portgroupname in CNC_VMS if hosts]
+        for host in hosts:
+            for n in range(vms_per_host):
+                vms.append(("%s-vm%02d" % (host._props["name"].split(".")[0], n + 1), "VM_Network", host))
+
+        for name, portgroupname, host in vms:
+            pg = portgroups[portgroupname]
+            nic = vim.vm.device.VirtualVmxnet3(key=4000, backing=VirtualEthernetCard.DistributedVirtualPortBackingInfo(
+                port=vim.dvs.PortConnection(switchUuid=source._props["uuid"], portgroupKey=pg._props["key"])))
+            self.mo(VirtualMachine, "vm-", name=name,
+                    runtime=vim.vm.RuntimeInfo(host=host),
+                    config=vim.vm.ConfigInfo(hardware=vim.vm.VirtualHardware(device=[nic])))
+
+    ''' plumbing '''
+
+    def mo(self, cls, prefix, **props):
+        obj = cls(self, "%s%d" % (prefix, next(self.ids)), **props)
+        self.objects.append(obj)
+        return obj
+
+    def call(self, name, obj=None, answer=None):
+        ''' One API call on obj, made through the stub like pyVmomi makes them.  answer works out what it returns '''
+        return self.stub.InvokeMethod(obj, MethodInfo(name=name, wsdlName=name), answer)
+
+    def read(self, obj, name):
+        return self.stub.InvokeAccessor(obj, PropertyInfo(name=name))
+
+    def service_instance(self):
+        sim = self
+
+        class ServiceInstance(object):
+            content = self.content
+            _stub = self.stub
+
+            def RetrieveContent(self):
+                sim.call("RetrieveServiceContent", self)
+                return sim.content
+
+        return ServiceInstance()
+
+    def submit(self, name, action, *args):
+        """
+        Start a task.  The change is made straight away, the task reports success (or the fault the change raised)
+        once task_seconds have gone by.
+        """
+        def start():
+            info = Task.Info(state="running", result=None, error=None, descriptionId=name)
+            try:
+                with self.lock:
+                    info.result = action(*args)
+            except MethodFault as e:
+                info.error = e
+            return self.mo(Task, "task-", info=info, finish=time.time() + self.task_seconds)
+
+        return self.call(name, args[0] if args else None, start)
+
+    def resolve(self, obj, path):
+        ''' Read a property path from the inventory without a round trip, for the PropertyCollector '''
+        parts = path.split(".")
+        value = obj._get(parts[0])
+        for part in parts[1:]:
+            if value is None:
+                return None
+            value = getattr(value, part)
+        return copy.deepcopy(value)
+
+    def retrieve(self, spec):
+        contents = []
+        with self.lock:
+            for obj_spec in spec.objectSet:
+                if isinstance(obj_spec.obj, ContainerView):
+                    objects = obj_spec.obj._props["view"]
+                else:
+                    objects = [obj_spec.obj]
+
+                for obj in objects:
+                    for prop_spec in spec.propSet:
+                        if not isinstance(obj, prop_spec.type):
+                            continue
+                        obj_content = PropertyCollector.ObjectContent(obj=obj)
+                        for path in prop_spec.pathSet:
+                            value = self.resolve(obj, path)
+                            if value is not None:
+                                obj_content.propSet.append(vmodl.DynamicProperty(name=path, val=value))
+                        contents.append(obj_content)
+        return contents
+
+    def page(self, objects, page_size):
+        result = PropertyCollector.RetrieveResult(objects=objects[:page_size])
+        if len(objects) > page_size:
+            result.token = "token-%d" % next(self.ids)
+            self.pages[result.token] = (objects[page_size:], page_size)
+        return result
+
+    def container_view(self, container, vimtypes):
+        with self.lock:
+            if isinstance(container, ClusterComputeResource):
+                hosts = container._props["host"]
+                scope = hosts + [vm for vm in self.objects
+                                 if isinstance(vm, VirtualMachine) and vm._props["runtime"].host in hosts]
+            else:
+                scope = self.objects
+            view = [obj for obj in scope if isinstance(obj, tuple(vimtypes))]
+        return ContainerView(self, "session[%d]" % next(self.ids), view=view)
+
+    ''' inventory '''
+
+    def find(self, cls, **props):
+        return [obj for obj in self.objects
+                if isinstance(obj, cls) and all(obj._props.get(k) == v for k, v in props.items())]
+
+    def new_dvs(self, name, uplink_names, uplink_portgroup=None):
+        if self.find(Network, name=name) or self.find(DistributedVirtualSwitch, name=name):
+            raise vim.fault.DuplicateName("The name '%s' already exists." % name)
+
+        dvs = self.mo(VmwareDistributedVirtualSwitch, "dvs-", name=name, portgroup=[],
+                      uuid="50 2a 7c 00 00 00 00 00-00 00 00 00 00 00 %04x" % next(self.ids),
+                      config=DistributedVirtualSwitch.ConfigInfo(name=name))
+        dvs._props["uplink_names"] = list(uplink_names)
+        uplinks = self.new_portgroup(dvs, uplink_portgroup or "%s-DVUplinks-%d" % (name, next(self.ids)), 0,
+                                     uplink=True)
+        dvs._props["config"].uplinkPortgroup = [uplinks]
+        self.network_folder._props["childEntity"].append(dvs)
+        return dvs
+
+    def new_portgroup(self, dvs, name, vlan, uplink=False):
+        if self.find(Network, name=name):
+            raise vim.fault.DuplicateName("The name '%s' already exists." % name)
+
+        port_config = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy(
+            vlan=vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec(vlanId=vlan, inherited=False))
+        pg = self.mo(DistributedVirtualPortgroup, "dvportgroup-", name=name,
+                     config=DistributedVirtualPortgroup.ConfigInfo(name=name, distributedVirtualSwitch=dvs,
+                                                                   defaultPortConfig=port_config,
+                                                                   uplink=uplink))
+        pg._props["key"] = pg._moId
+        dvs._props["portgroup"].append(pg)
+        return pg
+
+    def join_dvs(self, dvs, host):
+        uplinks = [vim.KeyValue(key=str(n + 100), value=name) for n, name in enumerate(dvs._props["uplink_names"])]
+        host._props["config"].network.proxySwitch.append(vim.host.HostProxySwitch(
+            dvsUuid=dvs._props["uuid"], dvsName=dvs._props["name"], uplinkPort=uplinks,
+            spec=vim.host.HostProxySwitch.Specification(backing=vim.dvs.HostMember.PnicBacking())))
+        dvs._props["config"].host.append(vim.dvs.HostMember.Member(
+            config=vim.dvs.HostMember.ConfigInfo(host=host)))
+
+    def proxy(self, host, dvs):
+        for proxy in host._props["config"].network.proxySwitch:
+            if proxy.dvsUuid == dvs._props["uuid"]:
+                return proxy
+        return None
+
+    def in_use(self, portgroups):
+        keys = set(pg._props["key"] for pg in portgroups)
+        for host in self.find(HostSystem):
+            for vnic in host._props["config"].network.vnic:
+                port = vnic.spec.distributedVirtualPort
+                if port is not None and port.portgroupKey in keys:
+                    return "%s on %s" % (vnic.device, host._props["name"])
+        for vm in self.find(VirtualMachine):
+            for device in vm._props["config"].hardware.device:
+                port = getattr(device.backing, "port", None)
+                if port is not None and port.portgroupKey in keys:
+                    return vm._props["name"]
+        return None
+
+    ''' task and method implementations '''
+
+    def rename(self, obj, name):
+        if obj._props.get("name") != name and (self.find(Network, name=name) if isinstance(obj, Network) else
+                                               self.find(type(obj), name=name)):
+            raise vim.fault.DuplicateName("The name '%s' already exists." % name)
+        obj._props["name"] = name
+
+    def destroy(self, obj):
+        if isinstance(obj, DistributedVirtualSwitch):
+            user = self.in_use(obj._props["portgroup"])
+            if user is not None:
+                raise vim.fault.ResourceInUse("%s is still in use by %s" % (obj._props["name"], user))
+            for host in self.find(HostSystem):
+                network = host._props["config"].network
+                network.proxySwitch = [proxy for proxy in network.proxySwitch if proxy.dvsUuid != obj._props["uuid"]]
+            for pg in obj._props["portgroup"]:
+                self.objects.remove(pg)
+            self.network_folder._props["childEntity"].remove(obj)
+        elif isinstance(obj, DistributedVirtualPortgroup):
+            user = self.in_use([obj])
+            if user is not None:
+                raise vim.fault.ResourceInUse("%s is still in use by %s" % (obj._props["name"], user))
+            obj._props["config"].distributedVirtualSwitch._props["portgroup"].remove(obj)
+        self.objects.remove(obj)
+
+    def create_dvs(self, folder, spec):
+        config = spec.configSpec
+        dvs = self.new_dvs(config.name, config.uplinkPortPolicy.uplinkPortName)
+        for member in config.host:
+            self.join_dvs(dvs, member.host)
+        return dvs
+
+    def reconfigure_dvs(self, dvs, spec):
+        if spec.name is not None:
+            self.rename(dvs, spec.name)
+        if spec.uplinkPortPolicy is not None:
+            dvs._props["uplink_names"] = list(spec.uplinkPortPolicy.uplinkPortName)
+        for member in spec.host:
+            if member.operation == "add" and self.proxy(member.host, dvs) is None:
+                self.join_dvs(dvs, member.host)
+
+    def add_portgroups(self, dvs, specs):
+        for spec in specs:
+            pg = self.new_portgroup(dvs, spec.name, spec.defaultPortConfig.vlan.vlanId)
+            pg._props["config"].defaultPortConfig = spec.defaultPortConfig
+
+    def reconfigure_portgroup(self, pg, spec):
+        if spec.name is not None:
+            self.rename(pg, spec.name)
+        if spec.defaultPortConfig is not None:
+            pg._props["config"].defaultPortConfig = spec.defaultPortConfig
+
+    def reconfigure_vm(self, vm, spec):
+        devices = vm._props["config"].hardware.device
+        for change in spec.deviceChange:
+            for n, device in enumerate(devices):
+                if device.key == change.device.key:
+                    devices[n] = copy.deepcopy(change.device)
+
+    def update_network_config(self, host, config):
+        """
+        Apply the proxy switch and vnic edits of a NetworkConfig, refusing anything a real host would refuse
+        """
+        with self.lock:
+            network = host._props["config"].network
+            proxies = dict((proxy.dvsUuid, proxy) for proxy in network.proxySwitch)
+            backing = dict((uuid, list(proxy.spec.backing.pnicSpec)) for uuid, proxy in proxies.items())
+
+            for proxy_config in config.proxySwitch:
+                proxy = proxies.get(proxy_config.uuid)
+                if proxy is None:
+                    raise vim.fault.NotFound("Host is not a member of switch " + str(proxy_config.uuid))
+
+                free = [port.key for port in proxy.uplinkPort]
+                specs = []
+                for pnic_spec in proxy_config.spec.backing.pnicSpec:
+                    for uuid, other in backing.items():
+                        if uuid != proxy_config.uuid and any(spec.pnicDevice == pnic_spec.pnicDevice for spec in other):
+                            raise vim.fault.PlatformConfigFault("%s is still in use by %s on %s" % (
+                                pnic_spec.pnicDevice, proxies[uuid].dvsName, host._props["name"]))
+                    key = pnic_spec.uplinkPortKey
+                    if key is None or key not in free:
+                        if not free:
+                            raise vim.fault.PlatformConfigFault("No free uplink port for " + pnic_spec.pnicDevice)
+                        key = free[0]
+                    free.remove(key)
+                    specs.append(vim.dvs.HostMember.PnicSpec(pnicDevice=pnic_spec.pnicDevice, uplinkPortKey=key))
+                backing[proxy_config.uuid] = specs
+
+            ports = dict((vnic.device, vnic.spec.distributedVirtualPort) for vnic in network.vnic)
+            for vnic_config in config.vnic:
+                if vnic_config.device not in ports:
+                    raise vim.fault.NotFound("No vnic " + vnic_config.device + " on " + host._props["name"])
+                ports[vnic_config.device] = vnic_config.spec.distributedVirtualPort
+
+            for vmk, port in ports.items():
+                if port is not None and not backing.get(port.switchUuid):
+                    raise vim.fault.PlatformConfigFault("%s would be left on %s with no uplinks" % (
+                        vmk, proxies[port.switchUuid].dvsName if port.switchUuid in proxies else port.switchUuid))
+
+            for uuid, specs in backing.items():
+                proxies[uuid].spec.backing.pnicSpec = specs
+            for vnic in network.vnic:
+                if ports[vnic.device] is not vnic.spec.distributedVirtualPort:
+                    vnic.spec.distributedVirtualPort = copy.deepcopy(ports[vnic.device])
+                    vnic.portgroup = ""
+
+
+def install(sim):
+    """
+    Put fake pyVmomi and pyvim.connect modules in sys.modules so that the scripts talk to sim.  Must be called before
+    the scripts are imported.
+    """
+    py_vmomi = types.ModuleType("pyVmomi")
+    py_vmomi.vim = vim
+    py_vmomi.vmodl = vmodl
+
+    connect = types.ModuleType("pyvim.connect")
+    def smart_connect(**kwargs):
+        if install.sim.password is not None and kwargs.get("pwd") != install.sim.password:
+            raise vim.fault.InvalidLogin("Cannot complete login due to an incorrect user name or password.")
+        return install.sim.service_instance()
+
+    connect.SmartConnect = connect.SmartConnectNoSSL = smart_connect
+    connect.Disconnect = lambda si: None
+
+    pyvim = types.ModuleType("pyvim")
+    pyvim.connect = connect
+
+    sys.modules["pyVmomi"] = py_vmomi
+    sys.modules["pyvim"] = pyvim
+    sys.modules["pyvim.connect"] = connect
+    install.sim = sim
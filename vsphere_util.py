@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""
+Shared vSphere helpers for the pyNSXdeploy scripts
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+Task tracking and inventory reads go through the PropertyCollector so that any number of outstanding tasks or
+inventory objects can be read with a single round trip instead of touching properties one object at a time.
+"""
+
+import time
+
+from collections import OrderedDict, deque
+
+from pyVmomi import vim, vmodl
+
+import tracing
+
+
+def get_task_states(si, tasks):
+    """
+    Read info.state and info.error for a list of tasks in one PropertyCollector call.
+    Returns a dictionary of task -> (state, error)
+    """
+    if not tasks:
+        return {}
+
+    property_collector = si.content.propertyCollector
+
+    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks]
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task,
+                                                               pathSet=['info.state', 'info.error'],
+                                                               all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[property_spec])
+
+    states = dict()
+    for obj_content in property_collector.RetrieveContents([filter_spec]):
+        props = dict((prop.name, prop.val) for prop in obj_content.propSet)
+        states[obj_content.obj] = (props.get('info.state'), props.get('info.error'))
+
+    tracing.task_states(states)
+    return states
+
+
+def wait_for_tasks(si, tasks, poll_interval=1):
+    """
+    Wait for every task in the list to finish.  All outstanding tasks are polled together on each pass.
+    Raises the first task error that is found, otherwise returns the list of tasks once they have all succeeded.
+    """
+    pending = list(tasks)
+
+    while pending:
+        states = get_task_states(si, pending)
+        still_pending = []
+
+        for task in pending:
+            state, error = states.get(task, (None, None))
+            if state == vim.TaskInfo.State.success:
+                continue
+            if state == vim.TaskInfo.State.error:
+                raise error
+            still_pending.append(task)
+
+        pending = still_pending
+        if pending:
+            tracing.sleep(poll_interval, "wait for tasks")
+
+    return tasks
+
+
+def run_tasks_bounded(si, jobs, max_in_flight=8, poll_interval=1, limiter=None):
+    """
+    Run a list of (label, start) jobs, where start() submits a vSphere task and returns it, with no more than
+    max_in_flight tasks outstanding at once.  Outstanding tasks are polled together on each pass and new jobs are
+    started as soon as a slot frees up.  limiter, a semaphore shared with other callers, is acquired for each task as
+    well and held until the task has finished, so it caps the tasks running across all of them.
+
+    Returns a list of (label, state, error, seconds) in the order the jobs finished.  A job whose start() raised is
+    recorded as an error with a duration of 0.
+    """
+    queue = deque(jobs)
+    in_flight = dict()
+    results = []
+
+    try:
+        while queue or in_flight:
+            while queue and len(in_flight) < max_in_flight:
+                ''' only wait for a shared slot when none of our own tasks could free one up '''
+                if limiter is not None and not limiter.acquire(blocking=not in_flight):
+                    break
+                label, start = queue.popleft()
+                try:
+                    task = start()
+                except vmodl.MethodFault as e:
+                    if limiter is not None:
+                        limiter.release()
+                    results.append((label, vim.TaskInfo.State.error, e, 0))
+                    continue
+                except BaseException:
+                    if limiter is not None:
+                        limiter.release()
+                    raise
+                in_flight[task] = (label, time.time())
+
+            states = get_task_states(si, list(in_flight))
+
+            for task, (state, error) in states.items():
+                if state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error) and task in in_flight:
+                    label, started = in_flight.pop(task)
+                    if limiter is not None:
+                        limiter.release()
+                    results.append((label, state, error, time.time() - started))
+
+            if in_flight:
+                tracing.sleep(poll_interval, "wait for tasks")
+    finally:
+        if limiter is not None:
+            for _ in in_flight:
+                limiter.release()
+
+    return results
+
+
+def collect_properties(si, obj_type, path_set, container=None, page_size=1000):
+    """
+    Read the given properties of every object of obj_type under container (defaults to the root folder) through a
+    ContainerView, using RetrievePropertiesEx and paging through the results.  obj_type can also be a list of types,
+    which are all read in the same call.
+
+    Returns a list of (object, dict of property path -> value)
+    """
+    content = si.content
+    if container is None:
+        container = content.rootFolder
+    obj_types = list(obj_type) if isinstance(obj_type, (list, tuple)) else [obj_type]
+
+    view = content.viewManager.CreateContainerView(container, obj_types, True)
+
+    try:
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView', path='view', skip=False,
+                                                                     type=vim.view.ContainerView)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
+        property_specs = [vmodl.query.PropertyCollector.PropertySpec(type=t, pathSet=path_set, all=False)
+                          for t in obj_types]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=property_specs)
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+
+        property_collector = content.propertyCollector
+        collected = OrderedDict()
+
+        result = property_collector.RetrievePropertiesEx([filter_spec], options)
+        while result is not None:
+            for obj_content in result.objects:
+                ''' an object that is more than one of the types asked for, a port group is a network too, once '''
+                collected.setdefault(obj_content.obj, dict()).update(
+                    (prop.name, prop.val) for prop in obj_content.propSet)
+            if not result.token:
+                break
+            result = property_collector.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        view.Destroy()
+
+    return list(collected.items())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+VTEP pool capacity planner for configure_nsx_manager.py
+https://github.com/seanhowardnetapp/pyNSXdeploy/
+
+VXLAN prep gives every host in a prepared cluster vmknicCount VTEP vmknics, each with an address from VTEP-Pool.  The
+host counts of all the clusters in -cluster_prep_list are read with a single PropertyCollector call and the addresses
+needed, plus headroom for hosts added later, are checked against the size of the pool before anything slow starts.
+"""
+
+from collections import OrderedDict
+
+from pyVmomi import vim
+
+from ip_ranges import parse_ranges, range_size
+from vsphere_util import collect_properties
+
+
+def cluster_host_counts(si, cluster_names, container=None):
+    """
+    Count the hosts in each named cluster with one batched read.
+    Returns an OrderedDict of cluster name to host count, in the order given.  Raises an Exception naming any cluster
+    that doesn't exist
+    """
+    counts = dict((props["name"], len(props.get("host") or []))
+                  for _, props in collect_properties(si, vim.ClusterComputeResource, ["name", "host"], container))
+
+    missing = [name for name in cluster_names if name not in counts]
+    if missing:
+        raise Exception("Cluster(s) not found: " + ", ".join(missing))
+
+    return OrderedDict((name, counts[name]) for name in cluster_names)
+
+
+def pool_size(ip_ranges):
+    """
+    Count the addresses in a pool spec, each address once however many ranges hold it.  Raises an Exception on a
+    malformed range
+    """
+    return range_size(parse_ranges(ip_ranges))
+
+
+def required_vtep_addresses(host_counts, vmknic_count=2, headroom_percent=20):
+    """
+    Addresses VTEP-Pool needs: vmknic_count for every host, plus headroom_percent percent of that rounded up.  Worked
+    out in integers, so a pool of exactly the size asked for is never refused over a float rounding error.
+    Returns (addresses without headroom, addresses with headroom)
+    """
+    needed = sum(host_counts.values()) * vmknic_count
+    return needed, needed + (needed * headroom_percent + 99) // 100
+
+
+def check_vtep_pool(si, cluster_names, ip_ranges, vmknic_count=2, headroom_percent=20, container=None):
+    """
+    Check that the VTEP ranges hold enough addresses for every host in cluster_names.
+    Returns (host counts by cluster, list of problems, empty if the pool is big enough)
+    """
+    host_counts = cluster_host_counts(si, cluster_names, container)
+    needed, with_headroom = required_vtep_addresses(host_counts, vmknic_count, headroom_percent)
+    available = pool_size(ip_ranges)
+
+    problems = []
+    if available < with_headroom:
+        problems.append("VTEP-Pool has %d addresses but %d host(s) in %s need %d (%d vmknics each) plus %d%% headroom, "
+                        "%d in all" % (available, sum(host_counts.values()), ", ".join(cluster_names), needed,
+                                       vmknic_count, headroom_percent, with_headroom))
+    return host_counts, problems